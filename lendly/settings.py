@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -31,13 +32,14 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    # Før staticfiles, slik at skiutlan sin collectstatic (med størrelsesrapport) brukes
+    'skiutlan',  # Vår skiutlån-app
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'skiutlan',  # Vår skiutlån-app
 ]
 
 MIDDLEWARE = [
@@ -63,6 +65,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'skiutlan.lokasjoner.context_processor',
+                'skiutlan.sok.context_processor',
             ],
         },
     },
@@ -82,6 +86,108 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+#
+# Brukes blant annet til cachede listerader (se skiutlan/hurtigbuffer.py).
+# MAX_ENTRIES må romme to fragmenter per ski-item i de store listene.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'skiutlan',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    }
+}
+
+
+# Økter og meldinger
+# https://docs.djangoproject.com/en/5.1/topics/http/sessions/#configuring-the-session-engine
+#
+# SKIUTLAN_OKTER velger hvor øktene lagres:
+#   db      Djangos standard: én rad i django_session (samme SQLite-fil som utlånene)
+#   cookie  Signert cookie; ingen database-trafikk for økter (anbefalt i produksjon)
+#   cache   I CACHES['default']; krever en delt cache når det er flere prosesser
+# I cookie- og cache-modus legges også meldingene i en cookie, slik at
+# utlån og retur ikke skriver noe annet enn selve utlånet til databasen.
+
+SKIUTLAN_OKTER = os.environ.get('SKIUTLAN_OKTER', 'db')
+
+OKT_MOTORER = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cookie': 'django.contrib.sessions.backends.signed_cookies',
+    'cache': 'django.contrib.sessions.backends.cache',
+}
+SESSION_ENGINE = OKT_MOTORER[SKIUTLAN_OKTER]
+if SKIUTLAN_OKTER != 'db':
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
+# Skiutlån: returnerte utlån eldre enn dette flyttes til arkivtabellen
+# av `manage.py arkiver_utlan` (se skiutlan/arkiv.py)
+
+SKIUTLAN_ARKIV_ALDER_DAGER = 365
+
+
+# Skiutlån: `manage.py komprimer_endringer` sletter gravsteiner i kioskenes
+# endringslogg etter så mange dager; en kiosk som har vært frakoblet lenger,
+# synkroniserer på nytt fra starten (se skiutlan/endringer.py)
+
+SKIUTLAN_GRAVSTEIN_DAGER = 30
+
+
+# Skiutlån: `manage.py ta_sikkerhetskopi` legger komprimerte kopier av
+# databasen her og beholder de nyeste (se skiutlan/sikkerhetskopi.py)
+
+SKIUTLAN_SIKKERHETSKOPI_KATALOG = BASE_DIR / 'sikkerhetskopier'
+SKIUTLAN_SIKKERHETSKOPI_BEHOLD = 14
+
+
+# Skiutlån: hvor mange sekunder nøkkeltallene i /api/statistikk/ kan være
+# gamle før de beregnes på nytt (se skiutlan/statistikk.py)
+
+SKIUTLAN_STATISTIKK_SEKUNDER = 15
+
+
+# Skiutlån: hvor mange millisekunder hurtigsøket i menyen får bruke på
+# databasen før det svarer med det det har (se skiutlan/sokeindeks.py)
+
+SKIUTLAN_HURTIGSOK_MS = 100
+
+
+# Skiutlån: hvor ofte (sekunder) direkteoppdateringen av dashbordet ser
+# etter endringer gjort i andre prosesser, og hvor lenge nettleseren venter
+# før den kobler til igjen (se skiutlan/direkte.py)
+
+SKIUTLAN_DIREKTE_SEKUNDER = 2
+
+
+# Skiutlån: hvor lenge (sekunder) et ski-item, en bruker eller et utlån kan
+# ligge i objektcachen. Endringer gjør objektet ugyldig med en gang i alle
+# prosesser som deler cachen; dette er bare en øvre grense der. Endringer fra
+# en annen prosess med en egen LocMemCache (som denne) ses først når objektet
+# utløper (se hent_objekt i skiutlan/hurtigbuffer.py)
+
+SKIUTLAN_OBJEKT_SEKUNDER = 300
+
+
+# Skiutlån: hvor lenge (timer) svaret på et utlån eller en retur med
+# Idempotency-Key tas vare på, slik at nye forsøk får samme svar. Utløpte
+# nøkler slettes med manage.py rydd_idempotensnokler (se skiutlan/idempotens.py)
+
+SKIUTLAN_IDEMPOTENS_TIMER = 24
+
+
+# Skiutlån: ferdige QR-koder, strekkoder og etiketter lagres her og lages
+# aldri på nytt så lenge innholdet er det samme. Etikettark for mange items
+# lages i så mange prosesser (None er antall kjerner). Se skiutlan/etiketter.py
+
+SKIUTLAN_ETIKETT_KATALOG = BASE_DIR / 'etiketter'
+SKIUTLAN_ETIKETT_PROSESSER = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -120,6 +226,21 @@ STATIC_URL = 'static/'
 STATICFILES_DIRS = [
     BASE_DIR / "static",  # For prosjekt-wide static files
 ]
+STATIC_ROOT = BASE_DIR / 'staticfiles'  # Fylles av collectstatic
+
+# I produksjon får statiske filer hash i navnet og ferdig komprimerte
+# .gz/.br-varianter, og serveres med immutable Cache-Control
+# (se skiutlan/storage.py og skiutlan/middleware.py).
+if not DEBUG:
+    STORAGES = {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+        },
+        'staticfiles': {
+            'BACKEND': 'skiutlan.storage.KomprimertManifestStaticFilesStorage',
+        },
+    }
+    MIDDLEWARE.insert(1, 'skiutlan.middleware.StatiskeFilerMiddleware')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
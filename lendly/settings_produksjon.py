@@ -0,0 +1,205 @@
+"""
+Produksjonsinnstillinger for lendly.
+
+Bygger på settings.py og leser alt som varierer mellom miljøer fra
+miljøvariabler:
+
+    DJANGO_SETTINGS_MODULE=lendly.settings_produksjon
+    DJANGO_SECRET_KEY          Påkrevd
+    DJANGO_ALLOWED_HOSTS       Kommaseparert, f.eks. "utlan.skole.no,localhost"
+    SKIUTLAN_DATABASE          Sti til SQLite-filen (standard BASE_DIR/db.sqlite3)
+    SKIUTLAN_CONN_MAX_AGE      Sekunder en databaseforbindelse gjenbrukes (standard 600)
+    SKIUTLAN_STATIC_ROOT       Der collectstatic legger filene (standard BASE_DIR/staticfiles)
+    SKIUTLAN_OKTER             cookie (standard), cache eller db (se settings.py)
+    SKIUTLAN_CACHE_URL         Delt cache for alle prosessene (se under; standard en katalog
+                               under BASE_DIR/cache)
+    SKIUTLAN_HTTPS             1 hvis siden serveres over HTTPS (sikre cookies, HSTS)
+    SKIUTLAN_SIKKERHETSKOPI_KATALOG  Der ta_sikkerhetskopi legger kopiene
+    SKIUTLAN_ETIKETT_KATALOG   Der ferdige etiketter og koder lagres
+
+Oppstartstid og første forespørsel måles av OppstartBenchmarkTest i
+skiutlan/tests.py.
+"""
+
+import os
+from urllib.parse import urlsplit
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, CACHES, OKT_MOTORER, TEMPLATES
+
+
+def _env(navn, standard=None):
+    verdi = os.environ.get(navn, standard)
+    if verdi is None:
+        raise ImproperlyConfigured(f'Miljøvariabelen {navn} må være satt i produksjon.')
+    return verdi
+
+
+DEBUG = False
+
+SECRET_KEY = _env('DJANGO_SECRET_KEY')
+
+ALLOWED_HOSTS = [vert.strip() for vert in _env('DJANGO_ALLOWED_HOSTS', 'localhost').split(',') if vert.strip()]
+
+
+# Database
+# Forbindelsen gjenbrukes mellom forespørsler (CONN_MAX_AGE) i stedet for å
+# åpnes på nytt hver gang. WAL lar lesere jobbe mens et utlån skrives, og
+# IMMEDIATE tar skrivelåsen ved BEGIN, slik at samtidige utlån venter på
+# hverandre (busy timeout) i stedet for å feile midt i transaksjonen.
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': _env('SKIUTLAN_DATABASE', str(BASE_DIR / 'db.sqlite3')),
+        'CONN_MAX_AGE': int(_env('SKIUTLAN_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    }
+}
+
+
+# Cache
+# Må deles av alle prosessene: WSGI-arbeiderne, ASGI-prosessen og manage.py-
+# kommandoene. Versjonene som ugyldiggjør fragmenter og objekter
+# (hurtigbuffer.py), låsen mot samtidige beregninger (cache.add) og
+# dashbordoversikten (direkte.py) ligger der, og en LocMemCache i hver
+# prosess ville latt de andre vise gamle data til de utløper.
+#
+#   redis://vert:6379/0      Redis (krever pakken redis)
+#   memcached://vert:11211   Memcached (krever pakken pymemcache)
+#   file:///sti/til/katalog  Filer på disk (standard); ingen ekstra pakker, men
+#                            add() er ikke atomisk, så låsen i hent_beregnet
+#                            hindrer ikke alltid at to arbeidere beregner samme
+#                            verdi samtidig. Bruk Redis eller Memcached med
+#                            mange arbeidere.
+#   locmem://                Bare med én prosess (f.eks. én ASGI-prosess uten kommandoer)
+
+CACHE_BACKENDS = {
+    'redis': 'django.core.cache.backends.redis.RedisCache',
+    'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+def _cache(url):
+    deler = urlsplit(url)
+    if deler.scheme not in CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'SKIUTLAN_CACHE_URL må begynne med {", ".join(s + "://" for s in CACHE_BACKENDS)}.')
+    if deler.scheme == 'redis':
+        lokasjon = url
+    elif deler.scheme == 'memcached':
+        lokasjon = deler.netloc
+    elif deler.scheme == 'file':
+        lokasjon = deler.path
+    else:
+        lokasjon = 'skiutlan'
+    return {
+        **CACHES['default'],
+        'BACKEND': CACHE_BACKENDS[deler.scheme],
+        'LOCATION': lokasjon,
+        'OPTIONS': CACHES['default']['OPTIONS'] if deler.scheme in ('file', 'locmem') else {},
+    }
+
+
+CACHES = {
+    'default': _cache(_env('SKIUTLAN_CACHE_URL', f'file://{BASE_DIR / "cache"}')),
+}
+
+
+# Templates
+# Kompilerte templates caches i minnet for hele prosessens levetid.
+
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'context_processors': [
+            prosessor for prosessor in TEMPLATES[0]['OPTIONS']['context_processors']
+            if prosessor != 'django.template.context_processors.debug'
+        ],
+        'loaders': [
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ],
+    },
+}]
+
+
+# Middleware
+# Statiske filer besvares før økt, CSRF og innlogging, som de ikke trenger.
+
+MIDDLEWARE = [
+    'django.middleware.security.SecurityMiddleware',
+    'skiutlan.middleware.StatiskeFilerMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+
+# Økter og meldinger: uten database som standard i produksjon
+
+SKIUTLAN_OKTER = _env('SKIUTLAN_OKTER', 'cookie')
+SESSION_ENGINE = OKT_MOTORER[SKIUTLAN_OKTER]
+if SKIUTLAN_OKTER != 'db':
+    MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
+# Statiske filer (se skiutlan/storage.py og skiutlan/middleware.py)
+
+STATIC_ROOT = _env('SKIUTLAN_STATIC_ROOT', str(BASE_DIR / 'staticfiles'))
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'skiutlan.storage.KomprimertManifestStaticFilesStorage',
+    },
+}
+
+
+# Sikkerhetskopier (se skiutlan/sikkerhetskopi.py)
+
+SKIUTLAN_SIKKERHETSKOPI_KATALOG = _env('SKIUTLAN_SIKKERHETSKOPI_KATALOG', str(BASE_DIR / 'sikkerhetskopier'))
+
+
+# Etiketter (se skiutlan/etiketter.py)
+
+SKIUTLAN_ETIKETT_KATALOG = _env('SKIUTLAN_ETIKETT_KATALOG', str(BASE_DIR / 'etiketter'))
+
+
+# Sikkerhet
+
+if _env('SKIUTLAN_HTTPS', '0') == '1':
+    SESSION_COOKIE_SECURE = True
+    CSRF_COOKIE_SECURE = True
+    SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+    SECURE_HSTS_SECONDS = 60 * 60 * 24 * 30
+
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+}
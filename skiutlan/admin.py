@@ -1,7 +1,11 @@
 
+from collections import Counter
+
 from django.contrib import admin
-from .models import SkiItem, Bruker, Utlan
-from django.utils import timezone
+from django.db import transaction
+from .models import Lokasjon, SkiItem, Bruker, Utlan, UtlanArkiv, UtlanHendelse, LagretSok
+
+from . import hendelser, tjenester
 
 
 # Custom filter for å vise aktive/returnerte utlån
@@ -23,17 +27,69 @@ class AktiveFilter(admin.SimpleListFilter):
         return queryset
 
 
+class SlettUtlanHendelserMixin:
+    """
+    Sletting av en bruker eller et ski-item sletter også utlånene (CASCADE).
+    Registrer 'slettet'-hendelser og oppdater utlånstellerne i samme transaksjon.
+    """
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            tjenester.forbered_sletting(*obj.utlan_set.all())
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            tjenester.forbered_sletting(*Utlan.objects.filter(**{f'{self.utlan_felt}__in': queryset}))
+            super().delete_queryset(request, queryset)
+
+
+class ForsinketFilter(admin.SimpleListFilter):
+    """Filtrerer på antall dager forsinket, via utlan_aktiv_retur_idx."""
+    title = 'Forsinket'
+    parameter_name = 'forsinket'
+
+    def lookups(self, request, model_admin):
+        return [
+            ('0', 'Forsinket'),
+            ('7', 'Mer enn 7 dager'),
+            ('30', 'Mer enn 30 dager'),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() in ('0', '7', '30'):
+            return queryset.forsinket(int(self.value()))
+        return queryset
+
+
+@admin.register(Lokasjon)
+class LokasjonAdmin(admin.ModelAdmin):
+    """
+    Tellerne vedlikeholdes av tjenester.py og signals.py og kan ikke endres her.
+    """
+
+    list_display = ['navn', 'antall_ski_items', 'antall_aktive_utlan', 'antall_ledige']
+    search_fields = ['navn']
+    readonly_fields = ['antall_ski_items', 'antall_aktive_utlan', 'opprettet']
+
+    @admin.display(description='Ledige')
+    def antall_ledige(self, obj):
+        return obj.antall_ledige
+
+
 @admin.register(SkiItem)
-class SkiItemAdmin(admin.ModelAdmin):
+class SkiItemAdmin(SlettUtlanHendelserMixin, admin.ModelAdmin):
+
+    utlan_felt = 'ski_item'
 
     # Hvilke felt som vises i listen over ski-items
-    list_display = ['navn', 'type_ski', 'storrelse', 'tilstand', 'er_ledig']
+    list_display = ['navn', 'type_ski', 'storrelse', 'tilstand', 'lokasjon', 'er_ledig']
 
     # Hvilke felt du kan søke på
     search_fields = ['navn', 'type_ski']
 
     # Hvilke felt du kan filtrere på (høyre side i admin)
-    list_filter = ['type_ski', 'tilstand']
+    list_filter = ['lokasjon', 'type_ski', 'tilstand']
 
     # Felt som ikke kan redigeres
     readonly_fields = ['opprettet', 'oppdatert']
@@ -41,7 +97,7 @@ class SkiItemAdmin(admin.ModelAdmin):
     # Organiser feltene i fieldsets for bedre layout
     fieldsets = (
         ('Grunnleggende informasjon', {
-            'fields': ('navn', 'type_ski', 'storrelse')
+            'fields': ('lokasjon', 'navn', 'type_ski', 'storrelse')
         }),
         ('Status', {
             'fields': ('tilstand',)
@@ -49,13 +105,21 @@ class SkiItemAdmin(admin.ModelAdmin):
         # TODO: Legg til en 'Metadata' seksjon med datoer
     )
 
+    def get_readonly_fields(self, request, obj=None):
+        # Flytting må gå via tjenester.flytt_ski_items(), som oppdaterer tellerne
+        if obj is not None:
+            return [*self.readonly_fields, 'lokasjon']
+        return self.readonly_fields
+
 
 @admin.register(Bruker)
-class BrukerAdmin(admin.ModelAdmin):
+class BrukerAdmin(SlettUtlanHendelserMixin, admin.ModelAdmin):
     """
     Admin-konfigurasjon for Bruker modellen.
     """
 
+    utlan_felt = 'bruker'
+
     list_display = ['fornavn', 'etternavn', 'telefon', 'epost', 'aktive_utlan']
     search_fields = ['fornavn', 'etternavn', 'telefon']
     list_filter = ['registrert']
@@ -76,10 +140,10 @@ class UtlanAdmin(admin.ModelAdmin):
     Admin-konfigurasjon for Utlan modellen.
     """
 
-    list_display = ['bruker', 'ski_item', 'utlant_dato',
-                    'planlagt_retur', 'er_aktivt', 'er_forsinket']
+    list_display = ['bruker', 'ski_item', 'lokasjon', 'utlant_dato',
+                    'planlagt_retur', 'er_aktivt', 'forsinket', 'dager_forsinket', 'lanetid']
     search_fields = ['bruker__fornavn', 'bruker__etternavn', 'ski_item__navn']
-    list_filter = [AktiveFilter, 'utlant_dato', 'planlagt_retur', 'returnert_dato']
+    list_filter = ['lokasjon', AktiveFilter, ForsinketFilter, 'utlant_dato', 'planlagt_retur', 'returnert_dato']
     readonly_fields = ['utlant_dato', 'varighet']
     ordering = ['-utlant_dato']
 
@@ -96,16 +160,113 @@ class UtlanAdmin(admin.ModelAdmin):
     # Custom action for å markere utlån som returnert
     actions = ['marker_som_returnert']
 
+    def get_queryset(self, request):
+        # Forsinkelse og lånetid beregnes i SQL, så kolonnene kan sorteres
+        return super().get_queryset(request).med_tidsberegninger()
+
+    @admin.display(description='Forsinket', boolean=True, ordering='forsinket')
+    def forsinket(self, obj):
+        return obj.forsinket
+
+    @admin.display(description='Dager forsinket', ordering='forsinkelse')
+    def dager_forsinket(self, obj):
+        return obj.dager_forsinket
+
+    @admin.display(description='Lånetid', ordering='lanetid')
+    def lanetid(self, obj):
+        return f'{obj.lanetid.days} d {obj.lanetid.seconds // 3600} t'
+
+    def save_model(self, request, obj, form, change):
+        var_returnert = change and form.initial.get('returnert_dato') is not None
+        # Admin kan overstyre grensen på antall utlån, men telleren må stemme
+        telling = Counter()
+        if change and not var_returnert:
+            telling[form.initial['bruker']] -= 1
+        if obj.returnert_dato is None:
+            telling[obj.bruker_id] += 1
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            type_ = hendelser.type_for_lagring(not change, var_returnert, obj.returnert_dato is not None)
+            hendelser.registrer(type_, obj)
+            tjenester.juster_aktive_utlan(telling)
+            tjenester.juster_lokasjoner({obj.lokasjon_id: sum(telling.values())})
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            tjenester.forbered_sletting(obj)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            tjenester.forbered_sletting(*queryset)
+            super().delete_queryset(request, queryset)
+
     def marker_som_returnert(self, request, queryset):
         """
         Marker valgte utlån som returnert.
         """
-        updated = queryset.update(returnert_dato=timezone.now())
+        # Allerede returnerte utlån skal beholde sin opprinnelige returdato
+        ids = list(queryset.filter(returnert_dato__isnull=True).values_list('id', flat=True))
+        updated = len(tjenester.returner_utlan(ids))
         self.message_user(request, f"{updated} utlån ble markert som returnert.")
 
     marker_som_returnert.short_description = "Marker valgte utlån som returnert"
 
 
+@admin.register(UtlanArkiv)
+class UtlanArkivAdmin(admin.ModelAdmin):
+    """
+    Arkiverte utlån er skrivebeskyttet; de flyttes hit av manage.py arkiver_utlan.
+    """
+
+    list_display = ['id', 'bruker', 'ski_item', 'utlant_dato', 'returnert_dato', 'arkivert']
+    search_fields = ['bruker__fornavn', 'bruker__etternavn', 'ski_item__navn']
+    list_filter = ['utlant_dato', 'arkivert']
+    ordering = ['-utlant_dato']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LagretSok)
+class LagretSokAdmin(admin.ModelAdmin):
+    """
+    Søk lagres fra søkesiden. Her kan de bare gis nytt navn eller slettes;
+    treffene holdes oppdatert av sok.py.
+    """
+
+    list_display = ['navn', 'spesifikasjon', 'oppdatert']
+    search_fields = ['navn']
+    fields = ['navn', 'spesifikasjon', 'opprettet', 'oppdatert']
+    readonly_fields = ['spesifikasjon', 'opprettet', 'oppdatert']
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(UtlanHendelse)
+class UtlanHendelseAdmin(admin.ModelAdmin):
+    """
+    Hendelsesloggen er bare til innsyn; den kan ikke endres eller slettes.
+    """
+
+    list_display = ['id', 'type', 'tidspunkt', 'utlan_id', 'bruker_id', 'ski_item_id', 'returnert_dato']
+    list_filter = ['type', 'tidspunkt']
+    ordering = ['-id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 # TODO for gruppen: Vurder å lage inline-views
 # class UtlanInline(admin.TabularInline):
 #     """Viser utlån direkte i bruker eller ski-item admin."""
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SkiutlanConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'skiutlan'
+
+    def ready(self):
+        # Registrerer signal-mottakerne
+        from . import signals  # noqa: F401
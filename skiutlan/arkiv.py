@@ -0,0 +1,155 @@
+"""
+Arkivering av gamle utlån (hot/cold-splitt).
+
+De fleste spørringene bryr seg bare om aktive utlån eller nylig historikk.
+Returnerte utlån eldre enn settings.SKIUTLAN_ARKIV_ALDER_DAGER flyttes derfor
+fra Utlan til UtlanArkiv i små transaksjoner, og historikkvisningene leser
+arkivet bare når datoområdet de viser går lenger tilbake enn grensen.
+
+Radene slettes fra Utlan uten signalene per rad; det de ville gjort
+(kioskenes endringslogg, søk, cache og dashbord) gjøres én gang per batch.
+For kioskene er et arkivert utlån slettet, og det kommer som en gravstein.
+"""
+
+import heapq
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import direkte, endringer, hurtigbuffer, sok, sokeindeks
+from .models import Utlan, UtlanArkiv
+
+
+def arkiv_grense():
+    """Returnerte utlån med returnert_dato før dette tidspunktet kan arkiveres."""
+    return timezone.now() - timedelta(days=settings.SKIUTLAN_ARKIV_ALDER_DAGER)
+
+
+def trenger_arkiv(dato_fra=None):
+    """
+    Sier om et søk fra og med dato_fra kan treffe arkiverte utlån.
+
+    Et arkivert utlån er returnert før grensen, og dermed også utlånt før den.
+    dato_fra kan være date eller datetime; None betyr "hele historikken".
+    """
+    if dato_fra is None:
+        return True
+    grense = arkiv_grense()
+    if not hasattr(dato_fra, 'hour'):
+        grense = timezone.localtime(grense).date()
+    return dato_fra <= grense
+
+
+def arkiver_batch(grense, etter_id=0, storrelse=500):
+    """
+    Flytter neste batch med arkiverbare utlån i én kort transaksjon.
+
+    Returnerer id-ene som ble flyttet (tom liste når det ikke er flere).
+    Kan trygt kjøres på nytt etter et avbrudd: flyttede rader finnes ikke
+    lenger i Utlan, og en rad som allerede er i arkivet blir ikke duplisert.
+    """
+    with transaction.atomic():
+        utlan = list(
+            Utlan.objects.filter(returnert_dato__lt=grense, id__gt=etter_id)
+            .order_by('id')[:storrelse]
+        )
+        if not utlan:
+            return []
+
+        UtlanArkiv.objects.bulk_create([
+            UtlanArkiv(
+                id=u.id,
+                bruker_id=u.bruker_id,
+                ski_item_id=u.ski_item_id,
+                lokasjon_id=u.lokasjon_id,
+                utlant_dato=u.utlant_dato,
+                planlagt_retur=u.planlagt_retur,
+                returnert_dato=u.returnert_dato,
+                oppdatert=u.oppdatert,
+            )
+            for u in utlan
+        ], ignore_conflicts=True)
+
+        ids = [u.id for u in utlan]
+        # Ingen fremmednøkler peker på Utlan, så ingenting må slettes i kaskade
+        Utlan.objects.filter(id__in=ids)._raw_delete(Utlan.objects.db)
+        endringer.registrer('utlan', ids, slettet=True)
+
+    # Det signals.py ellers gjør per slettet rad
+    hurtigbuffer.bump_versjoner('ski_item', {u.ski_item_id for u in utlan})
+    hurtigbuffer.bump_versjoner('bruker', {u.bruker_id for u in utlan})
+    hurtigbuffer.glem_objekter(Utlan, ids)
+    sok.endret('utlan', ids)
+    sokeindeks.endret('utlan', ids)
+    direkte.endret()
+    return ids
+
+
+def historikk(dato_fra=None, antall=None, **filtre):
+    """
+    Utlån fra både Utlan og UtlanArkiv som matcher filtrene, nyeste først.
+
+    Filtrene må gjelde felt som finnes i begge tabellene (f.eks. bruker_id,
+    ski_item_id). Arkivet leses bare når dato_fra krever det.
+    """
+    live = Utlan.objects.filter(**filtre).select_related('bruker', 'ski_item').order_by('-utlant_dato')
+    arkivert = UtlanArkiv.objects.none()
+    if trenger_arkiv(dato_fra):
+        arkivert = UtlanArkiv.objects.filter(**filtre).select_related('bruker', 'ski_item').order_by('-utlant_dato')
+    if dato_fra is not None:
+        oppslag = 'utlant_dato__gte' if hasattr(dato_fra, 'hour') else 'utlant_dato__date__gte'
+        live = live.filter(**{oppslag: dato_fra})
+        arkivert = arkivert.filter(**{oppslag: dato_fra})
+    if antall is not None:
+        live, arkivert = live[:antall], arkivert[:antall]
+
+    resultat = heapq.merge(live, arkivert, key=lambda u: u.utlant_dato, reverse=True)
+    return list(resultat)[:antall] if antall is not None else list(resultat)
+
+
+_MARKOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def markor(utlan):
+    """Posisjonen rett etter utlan i historikk_side(), som tekst for en URL."""
+    return f'{utlan.utlant_dato.astimezone(dt_timezone.utc).strftime(_MARKOR_FORMAT)}-{utlan.id}'
+
+
+def les_markor(tekst):
+    """(utlant_dato, id) fra markor(), eller None hvis teksten ikke er en gyldig markør."""
+    dato, _, id_ = (tekst or '').partition('-')
+    try:
+        return datetime.strptime(dato, _MARKOR_FORMAT).replace(tzinfo=dt_timezone.utc), int(id_)
+    except ValueError:
+        return None
+
+
+def historikk_side(antall, etter=None, **filtre):
+    """
+    Én side av historikk(), nyeste først: opptil antall utlån etter
+    markøren etter (se markor()), og markøren for neste side eller None.
+
+    Sidene hentes med keyset-paginering på (utlant_dato, id), så siste side
+    for en bruker med hundrevis av utlån koster det samme som den første:
+    hver tabell leser bare antall + 1 rader fra indeksen, uansett hvor
+    langt ut i historikken siden er.
+    """
+    live = Utlan.objects.filter(**filtre)
+    arkivert = UtlanArkiv.objects.filter(**filtre)
+    posisjon = les_markor(etter) if isinstance(etter, str) else etter
+    if posisjon is not None:
+        dato, id_ = posisjon
+        # utlant_dato <= dato kan leses som et område i indeksen; id-en skiller bare like tidspunkter
+        etter_markor = Q(utlant_dato__lte=dato) & ~Q(utlant_dato=dato, id__gte=id_)
+        live, arkivert = live.filter(etter_markor), arkivert.filter(etter_markor)
+
+    sortering = ('-utlant_dato', '-id')
+    live = live.select_related('bruker', 'ski_item').order_by(*sortering)[:antall + 1]
+    arkivert = arkivert.select_related('bruker', 'ski_item').order_by(*sortering)[:antall + 1]
+    side = list(heapq.merge(live, arkivert, key=lambda u: (u.utlant_dato, u.id), reverse=True))[:antall + 1]
+    if len(side) > antall:
+        return side[:antall], markor(side[antall - 1])
+    return side, None
@@ -0,0 +1,285 @@
+"""
+Direkteoppdatering av dashbordet (hjem) med Server-Sent Events.
+
+Skjermene ved skranken holder en EventSource åpen mot hjem_direkte i stedet
+for å laste hele siden på nytt med jevne mellomrom. Hver ASGI-prosess har
+én sentral (_Sentral) som eier oversikten per lokasjon og sender bare det
+som er endret (delta) til alle skjermene som følger den lokasjonen. Hvor
+mange skjermer som er koblet til, påvirker dermed ikke antall spørringer:
+en endring gir én ny beregning per lokasjon, ikke én per skjerm.
+
+Sentralen får vite om endringer på to måter:
+
+- endret() kalles etter commit når utlån eller ski-items endres i samme
+  prosess (signals.py og tjenester.py), og vekker den med en gang.
+- Endringer fra andre prosesser (WSGI-arbeidere, manage.py) fanges opp ved
+  å lese et lite fingeravtrykk hvert SKIUTLAN_DIREKTE_SEKUNDER: siste id i
+  hendelsesloggen og tellerne per lokasjon. Det er to oppslag per prosess,
+  uansett antall skjermer.
+
+Utlån blir forsinket uten at noe lagres, så oversikten beregnes også på
+nytt når neste planlagte retur passeres og når datoen skifter.
+
+Under WSGI kan ikke en strøm holdes åpen uten å binde opp en arbeider.
+Der svarer hjem_direkte med én hel oversikt og retry:, slik at nettleseren
+kobler til igjen (vanlig polling), med oversikten delt via cachen.
+"""
+
+import asyncio
+import json
+import threading
+from datetime import datetime, time, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Count, Min, Q, Sum
+from django.utils import timezone
+
+from . import hurtigbuffer
+from .models import Lokasjon, Utlan, UtlanHendelse
+
+
+# Kommentar som holder forbindelsen åpen gjennom proxyer uten trafikk
+HJERTESLAG_SEKUNDER = 15
+# Antall forsinkede utlån som vises på dashbordet
+ANTALL_FORSINKET = 5
+
+
+# ============================================================================
+# OVERSIKTEN
+# ============================================================================
+
+def tellere(lokasjon_id=None, na=None):
+    """Tallene i kortene på dashbordet for én lokasjon (None for alle)."""
+    na = na or timezone.now()
+    utlan = Utlan.objects.aktive()
+    lokasjon = Lokasjon.objects.all()
+    if lokasjon_id is not None:
+        utlan = utlan.filter(lokasjon_id=lokasjon_id)
+        lokasjon = lokasjon.filter(id=lokasjon_id)
+    antall = utlan.aggregate(
+        aktive=Count('id'), forsinket=Count('id', filter=Q(planlagt_retur__lt=na)),
+        neste_forfall=Min('planlagt_retur', filter=Q(planlagt_retur__gte=na)))
+    # Antall items leses fra tellerne per lokasjon i stedet for å telle
+    # ski-items; et item med aktivt utlån står alltid på utlånets lokasjon
+    totalt = lokasjon.aggregate(items=Sum('antall_ski_items'))['items'] or 0
+    return {
+        'totalt_ski_items': totalt,
+        'ledige_items': totalt - antall['aktive'],
+        'aktive_utlan': antall['aktive'],
+        'antall_forsinket': antall['forsinket'],
+        'neste_forfall': antall['neste_forfall'],
+    }
+
+
+def oversikt(lokasjon_id=None):
+    """Tellerne og de mest forsinkede utlånene, som JSON-vennlige verdier."""
+    na = timezone.now()
+    tall = tellere(lokasjon_id, na)
+    utlan = Utlan.objects.all() if lokasjon_id is None else Utlan.objects.filter(lokasjon_id=lokasjon_id)
+    forsinket = (utlan.forsinket(na=na).mest_forsinket_forst().med_tidsberegninger(na)
+                 .values('id', 'ski_item__navn', 'bruker__fornavn', 'bruker__etternavn', 'planlagt_retur',
+                         'forsinkelse')[:ANTALL_FORSINKET])
+    neste_forfall = tall.pop('neste_forfall')
+    return {
+        **tall,
+        'forsinket': [
+            {
+                'id': u['id'],
+                'navn': u['ski_item__navn'],
+                'bruker': f"{u['bruker__fornavn']} {u['bruker__etternavn']}",
+                'planlagt_retur': timezone.localtime(u['planlagt_retur']).strftime('%d.%m.%Y %H:%M'),
+                'dager': u['forsinkelse'].days,
+            }
+            for u in forsinket
+        ],
+        # Sendes ikke; sier når oversikten må beregnes på nytt selv om ingenting er lagret
+        '_gyldig_til': min(filter(None, [neste_forfall, _midnatt(na)])),
+    }
+
+
+def _midnatt(na):
+    return timezone.make_aware(datetime.combine(timezone.localdate(na) + timedelta(days=1), time.min))
+
+
+def delta(forrige, ny):
+    """Feltene i ny som er forskjellige fra forrige (alle hvis forrige er None)."""
+    return {
+        felt: verdi for felt, verdi in ny.items()
+        if not felt.startswith('_') and (forrige is None or forrige.get(felt) != verdi)
+    }
+
+
+def hendelse(data):
+    """Én SSE-melding med data som JSON."""
+    return f'event: oversikt\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+def retry():
+    """Hvor lenge nettleseren venter før den kobler til igjen."""
+    return f'retry: {settings.SKIUTLAN_DIREKTE_SEKUNDER * 1000}\n\n'
+
+
+def _fingeravtrykk():
+    """Endres når et utlån eller antall items på en lokasjon endres, uansett prosess."""
+    siste = UtlanHendelse.objects.order_by('-id').values_list('id', flat=True).first()
+    return siste, tuple(Lokasjon.objects.order_by('id').values_list('id', 'antall_ski_items', 'antall_aktive_utlan'))
+
+
+def hent_bufret(lokasjon_id=None):
+    """Oversikten delt mellom prosessene via cachen (for WSGI-svaret)."""
+    sekunder = settings.SKIUTLAN_DIREKTE_SEKUNDER
+    return hurtigbuffer.hent_beregnet(
+        f'skiutlan:direkte:{lokasjon_id or "alle"}',
+        lambda: oversikt(lokasjon_id),
+        ttl=sekunder * 10,
+        myk_ttl=sekunder,
+    )
+
+
+# ============================================================================
+# SENTRALEN (én per prosess og event loop)
+# ============================================================================
+
+class _Abonnent:
+    """Én åpen strøm. Endringer som ikke er sendt ennå slås sammen, så en treg skjerm ikke hoper opp meldinger."""
+
+    def __init__(self, lokasjon_id):
+        self.lokasjon_id = lokasjon_id
+        self.ventende = {}
+        self.klar = asyncio.Event()
+
+    def legg_til(self, endring):
+        self.ventende.update(endring)
+        self.klar.set()
+
+    async def neste(self, tidsavbrudd):
+        """De samlede endringene, eller None hvis ingenting skjedde innen tidsavbrudd."""
+        try:
+            await asyncio.wait_for(self.klar.wait(), tidsavbrudd)
+        except asyncio.TimeoutError:
+            return None
+        self.klar.clear()
+        endring, self.ventende = self.ventende, {}
+        return endring
+
+
+class _Sentral:
+    """Oversikten per lokasjon og strømmene som følger den, for én event loop."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.abonnenter = {}
+        self.oversikter = {}
+        self.avtrykk = None
+        self.vekk = asyncio.Event()
+        self.oppgave = None
+        self.beregninger = 0
+
+    async def _beregn(self, lokasjon_id):
+        self.beregninger += 1
+        return await sync_to_async(oversikt)(lokasjon_id)
+
+    async def abonner(self, lokasjon_id):
+        """Registrerer en ny strøm og returnerer (abonnent, hele oversikten)."""
+        abonnent = _Abonnent(lokasjon_id)
+        self.abonnenter.setdefault(lokasjon_id, set()).add(abonnent)
+        if lokasjon_id not in self.oversikter:
+            self.oversikter[lokasjon_id] = await self._beregn(lokasjon_id)
+        if self.oppgave is None:
+            self.oppgave = self.loop.create_task(self._kjor())
+        return abonnent, self.oversikter[lokasjon_id]
+
+    def avslutt(self, abonnent):
+        abonnenter = self.abonnenter.get(abonnent.lokasjon_id, set())
+        abonnenter.discard(abonnent)
+        if not abonnenter:
+            self.abonnenter.pop(abonnent.lokasjon_id, None)
+            self.oversikter.pop(abonnent.lokasjon_id, None)
+        if not self.abonnenter:
+            # La _kjor avslutte med en gang i stedet for ved neste runde
+            self.vekk.set()
+
+    async def _kjor(self):
+        try:
+            while self.abonnenter:
+                try:
+                    await asyncio.wait_for(self.vekk.wait(), settings.SKIUTLAN_DIREKTE_SEKUNDER)
+                except asyncio.TimeoutError:
+                    pass
+                self.vekk.clear()
+                if not self.abonnenter:
+                    break
+                try:
+                    await self._oppdater()
+                except DatabaseError:
+                    # Prøv igjen ved neste runde; strømmene står åpne så lenge
+                    continue
+        finally:
+            self.oppgave = None
+
+    async def _oppdater(self):
+        avtrykk = await sync_to_async(_fingeravtrykk)()
+        endret, self.avtrykk = avtrykk != self.avtrykk, avtrykk
+        na = timezone.now()
+        for lokasjon_id in list(self.abonnenter):
+            forrige = self.oversikter.get(lokasjon_id)
+            if forrige is not None and not endret and na < forrige['_gyldig_til']:
+                continue
+            ny = await self._beregn(lokasjon_id)
+            if lokasjon_id not in self.abonnenter:
+                continue
+            self.oversikter[lokasjon_id] = ny
+            endring = delta(forrige, ny)
+            if endring:
+                for abonnent in self.abonnenter[lokasjon_id]:
+                    abonnent.legg_til(endring)
+
+
+async def strom(lokasjon_id):
+    """
+    Meldingene til én skjerm: hele oversikten, deretter endringene etter
+    hvert som de kommer, og en kommentar hvert HJERTESLAG_SEKUNDER ellers.
+    """
+    s = sentral()
+    abonnent, oversikt = await s.abonner(lokasjon_id)
+    try:
+        yield retry() + hendelse(delta(None, oversikt))
+        while True:
+            endring = await abonnent.neste(HJERTESLAG_SEKUNDER)
+            yield hendelse(endring) if endring else ': hjerteslag\n\n'
+    finally:
+        # Også når skjermen kobler fra
+        s.avslutt(abonnent)
+
+
+_sentraler = {}
+_las = threading.Lock()
+
+
+def sentral():
+    """Sentralen for event loopen som kjører nå."""
+    loop = asyncio.get_running_loop()
+    with _las:
+        if loop not in _sentraler:
+            # Loopene i en ASGI-server lever like lenge som prosessen; i
+            # tester lages en ny per test, og de gamle kan glemmes
+            for gammel in [l for l in _sentraler if l.is_closed()]:
+                del _sentraler[gammel]
+            _sentraler[loop] = _Sentral(loop)
+        return _sentraler[loop]
+
+
+def _vekk_alle():
+    with _las:
+        sentraler = list(_sentraler.values())
+    for s in sentraler:
+        if not s.loop.is_closed():
+            s.loop.call_soon_threadsafe(s.vekk.set)
+
+
+def endret():
+    """Kalles når utlån eller ski-items er endret; sentralene vekkes etter commit."""
+    if _sentraler:
+        transaction.on_commit(_vekk_alle, robust=True)
@@ -0,0 +1,185 @@
+"""
+Endringsstrøm for kioskene (api_endringer), så de kan holde en lokal kopi
+av ski-items, brukere og utlån og synkronisere i små deltaer i stedet for
+å laste ned hele listene på nytt.
+
+Hver endring skrives som en rad i Endring i samme transaksjon som selve
+endringen (signals.py, og tjenester.py der rader endres med UPDATE). id
+er en stigende sekvens (AUTOINCREMENT, så et nummer brukes aldri på nytt),
+og siden SQLite bare har én skriver om gangen, blir radene synlige i
+samme rekkefølge som de får nummer. En kiosk som har lest alt til og med
+nummer N, har dermed fått med seg alle endringer til og med N.
+
+Gjenopprettes databasen fra en sikkerhetskopi, spoles loggen tilbake og
+numrene etter kopien brukes på nytt. Markøren inneholder derfor epoken
+(Endringsepoke), som byttes ved gjenoppretting; en markør fra en annen
+epoke avvises, og kiosken synkroniserer på nytt fra starten.
+
+Kiosken sender markøren fra forrige svar og får objektene som er endret
+etter den, med gjeldende innhold, eller en gravstein (slettet) for
+objekter som er borte. Første synkronisering er uten markør og gir alle
+objektene, side for side; derfor fylles loggen med alle eksisterende
+objekter i migrasjonen som lager den.
+
+Loggen er bare lagt til. komprimer() (manage.py komprimer_endringer)
+sletter radene som har en nyere rad for samme objekt; en kiosk midt i en
+synkronisering får da bare den nyeste. Gravsteiner eldre enn
+settings.SKIUTLAN_GRAVSTEIN_DAGER slettes også, og epoken husker det
+høyeste nummeret som er slettet: en kiosk som ikke har synkronisert siden
+før det, kan ha gått glipp av en sletting og må begynne på nytt.
+
+Arkiverte utlån (arkiv.py) er borte fra Utlan og kommer som gravsteiner.
+"""
+
+import uuid
+
+from datetime import timedelta
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Bruker, Endring, Endringsepoke, SkiItem, Utlan
+
+
+STANDARD_ANTALL = 500
+MAKS_ANTALL = 5000
+
+MODELLER = {
+    'ski_item': SkiItem,
+    'bruker': Bruker,
+    'utlan': Utlan,
+}
+# Feltene kioskene får; tellere som endres ved hvert utlån er ikke med
+FELT = {
+    'ski_item': ['id', 'navn', 'type_ski', 'storrelse', 'tilstand', 'lokasjon_id', 'oppdatert'],
+    'bruker': ['id', 'fornavn', 'etternavn', 'telefon', 'epost', 'oppdatert'],
+    'utlan': ['id', 'bruker_id', 'ski_item_id', 'lokasjon_id', 'utlant_dato', 'planlagt_retur',
+              'returnert_dato', 'oppdatert'],
+}
+TYPE_FOR_MODELL = {modell: type_ for type_, modell in MODELLER.items()}
+
+_MARKOR_PREFIKS = 'e'
+
+
+def registrer(type_, ids, slettet=False):
+    """Registrerer at objektene er endret (eller slettet), med én INSERT."""
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return
+    with transaction.atomic(savepoint=False):
+        Endring.objects.bulk_create([Endring(type=type_, objekt_id=i, slettet=slettet) for i in ids])
+
+
+def gjeldende_epoke():
+    """Endringsepoken markørene gjelder for (én spørring; raden lages første gang)."""
+    return Endringsepoke.objects.get_or_create(pk=1, defaults={'epoke': uuid.uuid4().hex[:12]})[0]
+
+
+def ny_epoke():
+    """Bytter epoke, slik at alle utleverte markører blir ugyldige. Returnerer den nye."""
+    return Endringsepoke.objects.update_or_create(pk=1, defaults={'epoke': uuid.uuid4().hex[:12]})[0]
+
+
+def markor(sekvens, epoke):
+    """Markøren kiosken sender tilbake. Ugjennomsiktig for klienten."""
+    return f'{_MARKOR_PREFIKS}{epoke.epoke}-{sekvens:x}'
+
+
+def les_markor(tekst, epoke):
+    """
+    Sekvensnummeret i markor(), 0 for ingen markør, eller None hvis den er
+    ugyldig, fra en annen epoke eller eldre enn de slettede gravsteinene.
+    """
+    if not tekst:
+        return 0
+    if not tekst.startswith(_MARKOR_PREFIKS):
+        return None
+    markorens_epoke, _, sekvens = tekst[len(_MARKOR_PREFIKS):].partition('-')
+    if markorens_epoke != epoke.epoke:
+        return None
+    try:
+        sekvens = int(sekvens, 16)
+    except ValueError:
+        return None
+    return sekvens if sekvens >= epoke.laveste_sekvens else None
+
+
+def hent(etter=0, antall=STANDARD_ANTALL, epoke=None):
+    """
+    Opptil antall endringer med sekvens etter etter, eldste først, som
+    ({'type', 'id', 'sekvens', 'slettet', 'data'}, ..., markør, flere).
+    epoke er gjeldende_epoke(), hvis kalleren allerede har lest den.
+
+    Én spørring mot loggen og én per type som har endringer. Innholdet er
+    det gjeldende, ikke det objektet hadde ved endringen; en nyere endring
+    kommer uansett senere i strømmen.
+    """
+    rader = list(
+        Endring.objects.filter(id__gt=etter).order_by('id')
+        .values_list('id', 'type', 'objekt_id', 'slettet')[:antall + 1]
+    )
+    flere = len(rader) > antall
+    rader = rader[:antall]
+
+    # Før komprimering kan samme objekt stå flere ganger; bare den siste teller
+    siste = {}
+    for sekvens, type_, objekt_id, slettet in rader:
+        siste.pop((type_, objekt_id), None)
+        siste[type_, objekt_id] = (sekvens, slettet)
+
+    data = {}
+    for type_, modell in MODELLER.items():
+        ids = [objekt_id for (t, objekt_id), (_, slettet) in siste.items() if t == type_ and not slettet]
+        if ids:
+            data[type_] = {rad['id']: rad for rad in modell.objects.filter(id__in=ids).values(*FELT[type_])}
+
+    endringer = []
+    for (type_, objekt_id), (sekvens, slettet) in siste.items():
+        rad = None if slettet else data[type_].get(objekt_id)
+        # Slettet etter at endringen ble lest; gravsteinen kommer senere
+        endringer.append({'type': type_, 'id': objekt_id, 'sekvens': sekvens, 'slettet': rad is None, 'data': rad})
+
+    if epoke is None:
+        epoke = gjeldende_epoke()
+    return endringer, markor(rader[-1][0] if rader else etter, epoke), flere
+
+
+def fyll(apps=django_apps, batch=1000):
+    """
+    Registrerer alle objektene som finnes som endret (brukes av migrasjonen,
+    og der data er lagt inn utenom signalene). Returnerer antall.
+    """
+    logg = apps.get_model('skiutlan', 'Endring')
+    antall = 0
+    for type_, modell in MODELLER.items():
+        ids = apps.get_model('skiutlan', modell.__name__).objects.order_by('id').values_list('id', flat=True)
+        rader = [logg(type=type_, objekt_id=i) for i in ids.iterator()]
+        logg.objects.bulk_create(rader, batch_size=batch)
+        antall += len(rader)
+    return antall
+
+
+def komprimer(gravstein_dager=None):
+    """
+    Sletter endringer som har en nyere endring for samme objekt, og
+    gravsteiner eldre enn gravstein_dager (standard
+    settings.SKIUTLAN_GRAVSTEIN_DAGER). Returnerer (erstattede, gravsteiner).
+    """
+    if gravstein_dager is None:
+        gravstein_dager = settings.SKIUTLAN_GRAVSTEIN_DAGER
+    nyere = Endring.objects.filter(type=OuterRef('type'), objekt_id=OuterRef('objekt_id'), id__gt=OuterRef('id'))
+    erstattet = Endring.objects.filter(Exists(nyere)).delete()[0]
+
+    with transaction.atomic():
+        gamle = Endring.objects.filter(slettet=True, registrert__lt=timezone.now() - timedelta(days=gravstein_dager))
+        siste = gamle.aggregate(siste=Max('id'))['siste']
+        if siste is None:
+            return erstattet, 0
+        # Markører før den siste slettede gravsteinen avvises fra nå av
+        gjeldende_epoke()
+        Endringsepoke.objects.filter(pk=1).update(laveste_sekvens=Greatest('laveste_sekvens', siste))
+        return erstattet, gamle.filter(id__lte=siste).delete()[0]
@@ -0,0 +1,184 @@
+"""
+Etiketter for ski-items: QR-kode og Code 128 med etikettkoden
+(tjenester.ski_item_kode), navnet og typen.
+
+Alt som genereres lagres på disk under settings.SKIUTLAN_ETIKETT_KATALOG,
+med SHA-256 av det som bestemmer innholdet som filnavn (innholdsadressert).
+Samme kode, navn og format gir samme fil, så en etikett som ikke er endret
+genereres aldri på nytt; endres navnet, får etiketten en ny fil.
+Filene skrives til en midlertidig fil og flyttes på plass, så samtidige
+forespørsler aldri ser en halvskrevet fil. Katalogen kan tømmes når som
+helst; det som mangler, lages på nytt. Endres utseendet, økes GENERASJON.
+
+Et etikettark for mange items (ark()) genererer de manglende etikettene i
+en prosesspool (settings.SKIUTLAN_ETIKETT_PROSESSER) og gir arkene
+fortløpende og i rekkefølge mens resten genereres. Generatorfunksjonene
+bruker bare strekkoder.py og får filstien som argument, så prosessene
+trenger ikke Django.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+from pathlib import Path
+
+from django.conf import settings
+
+from . import strekkoder
+
+
+# Økes når etikettene skal se annerledes ut; da får alle nye filnavn
+GENERASJON = 1
+
+# A4-ark med 3 x 8 etiketter på 70 x 37 mm
+PER_ARK = 24
+# Færre manglende etiketter enn dette lages i samme prosess (en pool koster oppstart)
+PARALLELL_FRA = 50
+
+FORMATER = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+
+
+# ============================================================================
+# CACHE PÅ DISK
+# ============================================================================
+
+def _sti(art, deler, endelse):
+    nokkel = hashlib.sha256(
+        json.dumps([GENERASJON, art, deler], ensure_ascii=False).encode('utf-8')).hexdigest()
+    return Path(settings.SKIUTLAN_ETIKETT_KATALOG) / nokkel[:2] / f'{nokkel}.{endelse}'
+
+
+def _skriv(sti, data):
+    sti = Path(sti)
+    sti.parent.mkdir(parents=True, exist_ok=True)
+    fd, midlertidig = tempfile.mkstemp(dir=sti.parent, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fil:
+            fil.write(data)
+        os.replace(midlertidig, sti)
+    except BaseException:
+        os.unlink(midlertidig)
+        raise
+
+
+def _hent(sti, lag):
+    """Innholdet i sti, eller lag() lagret der hvis filen ikke finnes."""
+    try:
+        return sti.read_bytes()
+    except FileNotFoundError:
+        data = lag()
+        _skriv(sti, data)
+        return data
+
+
+# ============================================================================
+# KODER OG ETIKETTER
+# ============================================================================
+
+def qr_kode(kode, format='svg'):
+    """QR-koden for kode som SVG eller PNG (bytes)."""
+    def lag():
+        moduler = strekkoder.qr(kode)
+        return strekkoder.qr_svg(moduler).encode() if format == 'svg' else strekkoder.png(moduler)
+    return _hent(_sti('qr', [kode], format), lag)
+
+
+def strekkode(kode, format='svg'):
+    """Code 128-strekkoden for kode som SVG eller PNG (bytes)."""
+    def lag():
+        bredder = strekkoder.code128(kode)
+        if format == 'svg':
+            return strekkoder.code128_svg(bredder).encode()
+        return strekkoder.png([strekkoder.code128_rad(bredder)] * 20, skala=2, stille_sone=10)
+    return _hent(_sti('code128', [kode], format), lag)
+
+
+def _kort(tekst, lengde):
+    return tekst if len(tekst) <= lengde else tekst[:lengde - 1] + '…'
+
+
+def etikett_svg(kode, navn, undertekst):
+    """
+    Én etikett på 70 x 37 mm (1 enhet er 0,1 mm): QR-koden til venstre,
+    navn, undertekst og strekkode til høyre, og koden i klartekst under.
+    """
+    qr = strekkoder.qr(kode)
+    qr_side = len(qr) + 8
+    bredder = strekkoder.code128(kode)
+    strek_bredde = sum(bredder) + 20
+    strek_sti = strekkoder.svg_sti([strekkoder.code128_rad(bredder)])
+    return (
+        '<svg xmlns="http://www.w3.org/2000/svg" width="70mm" height="37mm" viewBox="0 0 700 370">'
+        '<rect width="700" height="370" fill="#fff"/>'
+        f'<svg x="10" y="20" width="330" height="330" viewBox="-4 -4 {qr_side} {qr_side}" '
+        f'shape-rendering="crispEdges"><path d="{strekkoder.svg_sti(qr)}"/></svg>'
+        '<g font-family="Helvetica, Arial, sans-serif">'
+        f'<text x="345" y="70" font-size="40" font-weight="bold">{escape(_kort(navn, 18))}</text>'
+        f'<text x="345" y="118" font-size="30">{escape(_kort(undertekst, 24))}</text>'
+        '</g>'
+        f'<svg x="340" y="140" width="360" height="160" viewBox="-10 0 {strek_bredde} 1" '
+        f'preserveAspectRatio="none" shape-rendering="crispEdges"><path d="{strek_sti}"/></svg>'
+        f'<text x="520" y="345" font-size="34" font-family="monospace" text-anchor="middle">{escape(kode)}</text>'
+        '</svg>'
+    )
+
+
+def _etikett_sti(kode, navn, undertekst):
+    return _sti('etikett', [kode, navn, undertekst], 'svg')
+
+
+def _lag_etikett(sti, kode, navn, undertekst):
+    """Lager og lagrer én etikett. Kjøres også i prosesspoolen."""
+    svg = etikett_svg(kode, navn, undertekst)
+    _skriv(sti, svg.encode())
+    return svg
+
+
+def etikett(kode, navn, undertekst):
+    """Etiketten som SVG (bytes), fra disken hvis den er laget før."""
+    sti = _etikett_sti(kode, navn, undertekst)
+    return _hent(sti, lambda: etikett_svg(kode, navn, undertekst).encode())
+
+
+def manglende(etiketter):
+    """Indeksene til etikettene [(kode, navn, undertekst)] som ikke er på disken."""
+    return [i for i, e in enumerate(etiketter) if not _etikett_sti(*e).exists()]
+
+
+def ark(etiketter, per_ark=PER_ARK, prosesser=None):
+    """
+    Etikettene [(kode, navn, undertekst)] som SVG-strenger, gruppert i ark
+    på per_ark, i rekkefølge. Manglende etiketter lages i en prosesspool
+    når det er mange nok; hvert ark gis så snart etikettene på det er klare.
+    """
+    prosesser = prosesser or settings.SKIUTLAN_ETIKETT_PROSESSER or os.cpu_count() or 1
+    stier = [_etikett_sti(*e) for e in etiketter]
+    mangler = manglende(etiketter)
+
+    pool = None
+    ventende = {}
+    if prosesser > 1 and len(mangler) >= PARALLELL_FRA:
+        pool = ProcessPoolExecutor(max_workers=prosesser)
+        ventende = {i: pool.submit(_lag_etikett, str(stier[i]), *etiketter[i]) for i in mangler}
+    try:
+        side = []
+        for i, (sti, e) in enumerate(zip(stier, etiketter)):
+            if i in ventende:
+                side.append(ventende.pop(i).result())
+            else:
+                side.append(_hent(sti, lambda: etikett_svg(*e).encode()).decode())
+            if len(side) == per_ark:
+                yield side
+                side = []
+        if side:
+            yield side
+    finally:
+        # Også når klienten avbryter nedlastingen midt i
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -20,8 +20,11 @@ class SkiItemForm(forms.ModelForm):
 
     class Meta:
         model = SkiItem
-        fields = ['navn', 'type_ski', 'storrelse', 'tilstand']
+        fields = ['lokasjon', 'navn', 'type_ski', 'storrelse', 'tilstand']
         widgets = {
+            'lokasjon': forms.Select(attrs={
+                'class': 'form-select'
+            }),
             'navn': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'F.eks. Rossignol Hero Elite'
@@ -38,12 +41,20 @@ class SkiItemForm(forms.ModelForm):
             }),
         }
         labels = {
+            'lokasjon': 'Lokasjon',
             'navn': 'Navn på ski-element',
             'type_ski': 'Type',
             'storrelse': 'Størrelse',
             'tilstand': 'Tilstand',
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Lokasjonen velges når itemet opprettes; senere flyttes det med
+        # tjenester.flytt_ski_items(), som også oppdaterer tellerne
+        if self.instance.pk:
+            del self.fields['lokasjon']
+
     def clean_storrelse(self):
         """Validerer størrelse basert på ski-type."""
         storrelse = self.cleaned_data.get('storrelse')
@@ -147,8 +158,8 @@ class UtlanForm(forms.ModelForm):
             'planlagt_retur': 'Planlagt returdag',
         }
 
-    def __init__(self, *args, **kwargs):
-        """Setter default verdier og filtrerer valg."""
+    def __init__(self, *args, lokasjon_id=None, **kwargs):
+        """Setter default verdier og filtrerer valg (til lokasjon_id hvis gitt)."""
         super().__init__(*args, **kwargs)
 
         # Sett default planlagt_retur til 1 uke frem
@@ -157,14 +168,12 @@ class UtlanForm(forms.ModelForm):
             default_time = default_time.replace(second=0, microsecond=0)
             self.fields['planlagt_retur'].initial = default_time
 
-        # Filtrer ski_items til bare ledige
-        ledige_items = []
-        for item in SkiItem.objects.all():
-            # Sjekk om item er ledig (ingen aktive utlån)
-            if not Utlan.objects.filter(ski_item=item, returnert_dato__isnull=True).exists():
-                ledige_items.append(item.id)
-
-        self.fields['ski_item'].queryset = SkiItem.objects.filter(id__in=ledige_items)
+        # Filtrer ski_items til bare ledige, på skrankens lokasjon
+        ledige_items = SkiItem.objects.exclude(
+            id__in=Utlan.objects.filter(returnert_dato__isnull=True).values('ski_item_id'))
+        if lokasjon_id is not None:
+            ledige_items = ledige_items.filter(lokasjon_id=lokasjon_id)
+        self.fields['ski_item'].queryset = ledige_items
 
         # Sorter brukere alfabetisk
         self.fields['bruker'].queryset = Bruker.objects.order_by('etternavn', 'fornavn')
@@ -205,20 +214,18 @@ class UtlanForm(forms.ModelForm):
         bruker = cleaned_data.get('bruker')
 
         if bruker:
-            # Sjekk om bruker har for mange aktive utlån (maks 3)
-            aktive_utlan_count = Utlan.objects.filter(
-                bruker=bruker,
-                returnert_dato__isnull=True
-            ).count()
+            # Sjekk om bruker har for mange aktive utlån. Dette gir bare en
+            # tidlig feilmelding; grensen håndheves av tjenester.lan_ut().
+            aktive_utlan_count = bruker.antall_aktive_utlan
 
             # Hvis vi redigerer et eksisterende utlån, trekk det fra tellingen
             if self.instance and self.instance.pk:
                 aktive_utlan_count -= 1
 
-            if aktive_utlan_count >= 3:
+            if aktive_utlan_count >= Bruker.MAKS_AKTIVE_UTLAN:
                 raise ValidationError(
-                    f'{bruker.fullt_navn} har allerede 3 aktive utlån. '
-                    'Maksimalt antall utlån er 3 per bruker.'
+                    f'{bruker.fullt_navn} har allerede {Bruker.MAKS_AKTIVE_UTLAN} aktive utlån. '
+                    f'Maksimalt antall utlån er {Bruker.MAKS_AKTIVE_UTLAN} per bruker.'
                 )
 
         return cleaned_data
@@ -0,0 +1,40 @@
+"""
+Skriving til hendelsesloggen (UtlanHendelse).
+
+Alle endringer av utlån i views.py og admin.py registreres her, i samme
+transaksjon som selve endringen, slik at loggen og Utlan-tabellen aldri
+kommer i utakt. Loggen gjør det billig å svare på "hva har endret seg
+siden X", og er kilden til projeksjonene i projeksjoner.py.
+"""
+
+from django.db import transaction
+
+from .models import UtlanHendelse
+
+
+def _hendelse(type_, utlan):
+    return UtlanHendelse(
+        type=type_,
+        utlan_id=utlan.id,
+        bruker_id=utlan.bruker_id,
+        ski_item_id=utlan.ski_item_id,
+        utlant_dato=utlan.utlant_dato,
+        planlagt_retur=utlan.planlagt_retur,
+        returnert_dato=utlan.returnert_dato,
+    )
+
+
+def registrer(type_, *utlan):
+    """Registrerer en hendelse av gitt type for hvert av utlånene."""
+    if not transaction.get_connection().in_atomic_block:
+        raise RuntimeError('Utlånshendelser må registreres i samme transaksjon som endringen.')
+    UtlanHendelse.objects.bulk_create([_hendelse(type_, u) for u in utlan])
+
+
+def type_for_lagring(opprettet, var_returnert, er_returnert):
+    """Velger hendelsestype for et utlån som er lagret."""
+    if opprettet:
+        return 'utlant'
+    if er_returnert and not var_returnert:
+        return 'returnert'
+    return 'endret'
@@ -0,0 +1,233 @@
+"""
+Hurtigbuffer (cache) for skiutlån-systemet.
+
+Template-fragmenter for listerader caches med en nøkkel som inneholder en
+versjon per objekt. Versjonene bumpes av signaler (se signals.py) når et
+utlån opprettes, returneres eller endres, slik at bare de berørte radene
+rendres på nytt.
+
+Verdier som er dyre å beregne og som tåler å være litt gamle (statistikken
+til veggskjermene) hentes med hent_beregnet(), som beregner på nytt i bare
+én forespørsel om gangen.
+
+Enkeltobjekter (SkiItem, Bruker, Utlan) slås opp etter primærnøkkel med
+hent_objekt(), som leser gjennom cachen. Objektet lagres sammen med
+versjonen det ble lest under, og versjonen bumpes av glem_objekter() når
+raden lagres eller slettes (signals.py, og tjenester.py der rader endres
+med UPDATE). Der raden må være helt fersk, f.eks. før den lagres på nytt,
+brukes fersk=True eller ferske_objekter().
+
+Versjonene virker bare på tvers av prosesser (WSGI-arbeidere, manage.py)
+når cachen er delt (SKIUTLAN_CACHE_URL i settings_produksjon.py). Med en
+cache per prosess ser de andre prosessene ikke bumpene og viser gamle
+objekter og fragmenter til de utløper; se delt().
+"""
+
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+
+def _versjon_nokkel(navnerom, objekt_id):
+    return f'skiutlan:versjon:{navnerom}:{objekt_id}'
+
+
+def _ny_versjon():
+    # Tidsbasert slik at en versjon aldri gjenbrukes etter at nøkkelen er
+    # kastet ut av cachen (ellers kunne gamle fragmenter bli gyldige igjen)
+    return time.time_ns()
+
+
+def hent_versjoner(navnerom, objekt_ids):
+    """
+    Returnerer {objekt_id: versjon} for alle objekt_ids med ett cache-kall.
+
+    Objekter uten versjon får en ny, som lagres med en gang.
+    """
+    nokler = {_versjon_nokkel(navnerom, objekt_id): objekt_id for objekt_id in objekt_ids}
+    funnet = cache.get_many(nokler.keys())
+
+    mangler = {nokkel: _ny_versjon() for nokkel in nokler if nokkel not in funnet}
+    if mangler:
+        cache.set_many(mangler, timeout=None)
+        funnet.update(mangler)
+
+    return {objekt_id: funnet[nokkel] for nokkel, objekt_id in nokler.items()}
+
+
+def bump_versjoner(navnerom, objekt_ids):
+    """Gir objektene en ny versjon, slik at cachede fragmenter blir ugyldige."""
+    versjon = _ny_versjon()
+    cache.set_many(
+        {_versjon_nokkel(navnerom, objekt_id): versjon for objekt_id in objekt_ids},
+        timeout=None,
+    )
+
+
+def bump_versjon(navnerom, objekt_id):
+    bump_versjoner(navnerom, [objekt_id])
+
+
+# Beregnede verdier (f.eks. statistikk) med myk utløpstid og single-flight
+
+def _las_nokkel(nokkel):
+    return f'{nokkel}:beregnes'
+
+
+def _ta_las(nokkel, las_ttl):
+    """Et unikt merke hvis låsen ble tatt, ellers None."""
+    merke = uuid.uuid4().hex
+    return merke if cache.add(_las_nokkel(nokkel), merke, timeout=las_ttl) else None
+
+
+def _beregn_og_lagre(nokkel, beregn, ttl, merke):
+    try:
+        verdi = beregn()
+        cache.set(nokkel, (time.time(), verdi), timeout=ttl)
+    finally:
+        # Varte beregningen lenger enn las_ttl, kan låsen nå tilhøre en
+        # annen; da skal den ikke slippes herfra
+        if cache.get(_las_nokkel(nokkel)) == merke:
+            cache.delete(_las_nokkel(nokkel))
+    return verdi
+
+
+def hent_beregnet(nokkel, beregn, ttl, myk_ttl, vent=5.0, las_ttl=30):
+    """
+    Henter en verdi som er dyr å beregne fra cachen, og beregner den med
+    beregn() når den mangler eller er foreldet.
+
+    Verdien ligger i cachen i ttl sekunder, men regnes som foreldet etter
+    myk_ttl. Bare én forespørsel om gangen beregner på nytt (den som får
+    låsen med cache.add). add er atomisk i LocMemCache, Redis og Memcached,
+    men ikke i FileBasedCache (standard i settings_produksjon.py): der kan
+    to prosesser som kommer samtidig, i sjeldne tilfeller begge beregne.
+    Det koster en ekstra beregning, men gir ikke feil verdi.
+
+    - Foreldet verdi: de andre får den gamle verdien med en gang.
+    - Ingen verdi: de andre venter på den som beregner, i inntil vent
+      sekunder, før de beregner selv.
+
+    Låsen utløper av seg selv etter las_ttl sekunder hvis prosessen som
+    beregner dør, og slippes bare av den som tok den (et unikt merke).
+    """
+    lagret = cache.get(nokkel)
+    if lagret is not None:
+        beregnet, verdi = lagret
+        merke = None if time.time() - beregnet < myk_ttl else _ta_las(nokkel, las_ttl)
+        if merke is None:
+            return verdi
+        return _beregn_og_lagre(nokkel, beregn, ttl, merke)
+
+    merke = _ta_las(nokkel, las_ttl)
+    if merke is not None:
+        return _beregn_og_lagre(nokkel, beregn, ttl, merke)
+
+    frist = time.monotonic() + vent
+    while time.monotonic() < frist:
+        time.sleep(0.01)
+        lagret = cache.get(nokkel)
+        if lagret is not None:
+            return lagret[1]
+    return beregn()
+
+
+def delt():
+    """Om cachen deles med andre prosesser, slik at bumpene herfra når serveren."""
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+# Objekter etter primærnøkkel (read-through)
+
+_objekt_teller = Counter()
+_ferske = threading.local()
+
+
+def _objekt_navnerom(modell):
+    return f'objekt:{modell._meta.label_lower}'
+
+
+def _objekt_nokkel(navnerom, pk):
+    return f'skiutlan:{navnerom}:{pk}'
+
+
+@contextmanager
+def ferske_objekter():
+    """hent_objekt() går rett til databasen så lenge blokken varer."""
+    _ferske.dybde = getattr(_ferske, 'dybde', 0) + 1
+    try:
+        yield
+    finally:
+        _ferske.dybde -= 1
+
+
+def hent_objekt(modell, pk, fersk=False):
+    """
+    Objektet av modell med primærnøkkel pk, fra cachen hvis versjonen det
+    ble lagret under fortsatt gjelder, ellers fra databasen (og lagret i
+    cachen i SKIUTLAN_OBJEKT_SEKUNDER). Kaster modell.DoesNotExist.
+
+    Versjonen og objektet hentes med ett cache-kall. Et objekt som ble lest
+    rett før en samtidig lagring, lagres under den gamle versjonen og blir
+    dermed aldri brukt.
+    """
+    navn = modell._meta.label_lower
+    if fersk or getattr(_ferske, 'dybde', 0):
+        _objekt_teller[navn, 'forbi'] += 1
+        return modell._default_manager.get(pk=pk)
+
+    navnerom = _objekt_navnerom(modell)
+    versjon_nokkel, objekt_nokkel = _versjon_nokkel(navnerom, pk), _objekt_nokkel(navnerom, pk)
+    funnet = cache.get_many([versjon_nokkel, objekt_nokkel])
+    versjon = funnet.get(versjon_nokkel)
+    lagret = funnet.get(objekt_nokkel)
+    if versjon is not None and lagret is not None and lagret[0] == versjon:
+        _objekt_teller[navn, 'treff'] += 1
+        return lagret[1]
+
+    _objekt_teller[navn, 'bom'] += 1
+    if versjon is None:
+        versjon = hent_versjoner(navnerom, [pk])[pk]
+    objekt = modell._default_manager.get(pk=pk)
+    cache.set(objekt_nokkel, (versjon, objekt), timeout=settings.SKIUTLAN_OBJEKT_SEKUNDER)
+    return objekt
+
+
+def glem_objekter(modell, pks):
+    """
+    Gjør cachede objekter ugyldige. Versjonene bumpes med en gang og på nytt
+    etter commit, slik at en annen forespørsel som leste den gamle raden
+    mellom lagringen og commit ikke blir stående med den.
+    """
+    pks = [pk for pk in pks if pk is not None]
+    if not pks:
+        return
+    navnerom = _objekt_navnerom(modell)
+    bump_versjoner(navnerom, pks)
+    transaction.on_commit(lambda: bump_versjoner(navnerom, pks), robust=True)
+
+
+def objekt_statistikk():
+    """
+    Treff, bom og forbi (fersk) per modell for denne prosessen, og
+    treffraten blant oppslagene som gikk via cachen.
+    """
+    statistikk = {}
+    for (navn, utfall), antall in sorted(_objekt_teller.items()):
+        statistikk.setdefault(navn, {'treff': 0, 'bom': 0, 'forbi': 0})[utfall] = antall
+    for tall in statistikk.values():
+        oppslag = tall['treff'] + tall['bom']
+        tall['treffrate'] = round(tall['treff'] / oppslag, 3) if oppslag else None
+    return statistikk
+
+
+def nullstill_objekt_statistikk():
+    _objekt_teller.clear()
@@ -0,0 +1,158 @@
+"""
+Idempotente utlån og returer med nøkler fra klienten.
+
+Kiosk-klientene på ustabilt nett sender samme POST på nytt når de ikke får
+svar. Sender klienten en nøkkel (headeren Idempotency-Key, eller feltet
+idempotens_nokkel fra skjemaene), kjøres viewet bare første gang; svaret
+lagres i IdempotensNokkel, og senere forsøk med samme nøkkel får det
+lagrede svaret med ett oppslag på primærnøkkelen, før viewet gjør noen
+validering eller spørringer.
+
+Nøkkelen reserveres med en INSERT før viewet kjøres, så to samtidige
+forsøk kan ikke begge låne ut. Det andre får 409 og Retry-After mens det
+første kjører. Feiler viewet (unntak eller 5xx), slettes reservasjonen,
+slik at et nytt forsøk kjøres på nytt.
+
+Sammen med nøkkelen lagres et avtrykk (SHA-256) av metoden og innholdet
+i forespørselen: skjemafeltene eller JSON-en, normalisert. Brukes samme
+nøkkel med et annet innhold eller en annen sti, avvises forespørselen med
+422 i stedet for å få svaret på den første.
+
+Svarene tas vare på i SKIUTLAN_IDEMPOTENS_TIMER timer. Utløpte nøkler
+ignoreres og slettes av manage.py rydd_idempotensnokler.
+"""
+
+import hashlib
+import json
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotensNokkel
+
+
+HEADER = 'Idempotency-Key'
+FELT = 'idempotens_nokkel'
+MAKS_LENGDE = IdempotensNokkel._meta.get_field('nokkel').max_length
+
+
+def ny_nokkel():
+    """En ny nøkkel til et skjema, så et dobbelt innsendt skjema bare lagres én gang."""
+    return uuid.uuid4().hex
+
+
+def _nokkel(request):
+    return request.headers.get(HEADER) or request.POST.get(FELT) or None
+
+
+def _avtrykk(request):
+    """SHA-256 av metoden og innholdet, uavhengig av feltrekkefølge og nøkkelen selv."""
+    if request.content_type == 'application/json':
+        try:
+            innhold = json.dumps(json.loads(request.body), sort_keys=True, ensure_ascii=False)
+        except ValueError:
+            innhold = request.body.decode('utf-8', 'replace')
+    else:
+        innhold = json.dumps(sorted(
+            (felt, request.POST.getlist(felt)) for felt in request.POST
+            if felt not in (FELT, 'csrfmiddlewaretoken')
+        ), ensure_ascii=False)
+    return hashlib.sha256(f'{request.method}\n{innhold}'.encode('utf-8')).hexdigest()
+
+
+def _gjenta(rad):
+    """Det lagrede svaret, uten at viewet kjøres."""
+    respons = HttpResponse(bytes(rad.innhold), status=rad.status, content_type=rad.innholdstype or None)
+    if rad.adresse:
+        respons['Location'] = rad.adresse
+    respons['Idempotent-Replayed'] = 'true'
+    return respons
+
+
+def _avvis(melding, status, **headere):
+    respons = JsonResponse({'error': melding}, status=status)
+    for navn, verdi in headere.items():
+        respons[navn] = verdi
+    return respons
+
+
+def _tidligere(nokkel, sti, avtrykk):
+    """Svaret på et tidligere forsøk med nøkkelen, eller None hvis det ikke finnes."""
+    rad = IdempotensNokkel.objects.filter(nokkel=nokkel).first()
+    if rad is None:
+        return None
+    if rad.utloper <= timezone.now():
+        IdempotensNokkel.objects.filter(nokkel=nokkel, utloper=rad.utloper).delete()
+        return None
+    if rad.sti != sti or rad.avtrykk != avtrykk:
+        return _avvis('Nøkkelen er brukt til en annen forespørsel.', 422)
+    if rad.status is None:
+        return _avvis('En forespørsel med samme nøkkel kjører fortsatt.', 409, **{'Retry-After': '1'})
+    return _gjenta(rad)
+
+
+def _lagre(nokkel, respons):
+    if respons.streaming or respons.status_code >= 500:
+        IdempotensNokkel.objects.filter(nokkel=nokkel).delete()
+        return
+    IdempotensNokkel.objects.filter(nokkel=nokkel).update(
+        status=respons.status_code,
+        innholdstype=respons.get('Content-Type', ''),
+        adresse=respons.get('Location', ''),
+        innhold=respons.content,
+    )
+
+
+def idempotent(view):
+    """
+    Decorator for POST-views som låner ut eller returnerer. Uten nøkkel
+    kjøres viewet som før.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+        nokkel = _nokkel(request)
+        if nokkel is None:
+            return view(request, *args, **kwargs)
+        if len(nokkel) > MAKS_LENGDE or not nokkel.isprintable():
+            return _avvis(f'{HEADER} må være høyst {MAKS_LENGDE} tegn.', 400)
+
+        sti = request.path[:IdempotensNokkel._meta.get_field('sti').max_length]
+        avtrykk = _avtrykk(request)
+        tidligere = _tidligere(nokkel, sti, avtrykk)
+        if tidligere is not None:
+            return tidligere
+
+        utloper = timezone.now() + timedelta(hours=settings.SKIUTLAN_IDEMPOTENS_TIMER)
+        try:
+            with transaction.atomic():
+                IdempotensNokkel.objects.create(nokkel=nokkel, sti=sti, avtrykk=avtrykk, utloper=utloper)
+        except IntegrityError:
+            # Et samtidig forsøk kom først
+            return _tidligere(nokkel, sti, avtrykk) or _avvis('Prøv igjen.', 409, **{'Retry-After': '1'})
+
+        try:
+            respons = view(request, *args, **kwargs)
+        except BaseException:
+            IdempotensNokkel.objects.filter(nokkel=nokkel).delete()
+            raise
+        _lagre(nokkel, respons)
+        return respons
+    return wrapper
+
+
+def rydd(storrelse=1000):
+    """Sletter utløpte nøkler, storrelse om gangen. Returnerer antall slettet."""
+    na = timezone.now()
+    totalt = 0
+    while True:
+        nokler = list(IdempotensNokkel.objects.filter(utloper__lte=na).values_list('nokkel', flat=True)[:storrelse])
+        if not nokler:
+            return totalt
+        totalt += IdempotensNokkel.objects.filter(nokkel__in=nokler).delete()[0]
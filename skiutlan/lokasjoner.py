@@ -0,0 +1,58 @@
+"""
+Valgt lokasjon (utleiested) for skranken.
+
+Lokasjonen velges i menyen og lagres i en cookie. Lister, tellinger og
+utlånsskjemaet viser da bare den lokasjonens items og utlån; uten valgt
+lokasjon vises alt. Valget ligger i en vanlig cookie og ikke i økten, så
+sider som ellers ikke rører økten slipper å lese den fra databasen. Listen
+over lokasjoner endres sjelden og caches, så velgeren i menyen ikke koster
+en spørring per side.
+"""
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Lokasjon
+
+
+COOKIE_NAVN = 'skiutlan_lokasjon'
+_CACHE_NOKKEL = 'skiutlan:lokasjoner'
+
+
+def alle():
+    """[(id, navn), ...] for alle lokasjoner, sortert på navn."""
+    lokasjoner = cache.get(_CACHE_NOKKEL)
+    if lokasjoner is None:
+        lokasjoner = list(Lokasjon.objects.order_by('navn').values_list('id', 'navn'))
+        cache.set(_CACHE_NOKKEL, lokasjoner, timeout=None)
+    return lokasjoner
+
+
+def glem_alle():
+    cache.delete(_CACHE_NOKKEL)
+
+
+def aktiv_lokasjon_id(request):
+    """Id-en til lokasjonen skranken har valgt, eller None for alle."""
+    verdi = request.COOKIES.get(COOKIE_NAVN, '')
+    if not verdi.isdigit():
+        return None
+    lokasjon_id = int(verdi)
+    return lokasjon_id if lokasjon_id in dict(alle()) else None
+
+
+def velg(respons, lokasjon_id):
+    """Lagrer valget på responsen. None (eller en ukjent id) betyr alle lokasjoner."""
+    if lokasjon_id in dict(alle()):
+        respons.set_cookie(COOKIE_NAVN, str(lokasjon_id), max_age=60 * 60 * 24 * 365,
+                           samesite='Lax', secure=settings.SESSION_COOKIE_SECURE)
+    else:
+        respons.delete_cookie(COOKIE_NAVN, samesite='Lax')
+
+
+def context_processor(request):
+    """Gjør lokasjonene og valget tilgjengelig for menyen i base.html."""
+    return {
+        'lokasjoner': alle,
+        'aktiv_lokasjon_id': lambda: aktiv_lokasjon_id(request),
+    }
@@ -0,0 +1,44 @@
+"""
+Flytter gamle, returnerte utlån fra Utlan til UtlanArkiv.
+
+    python manage.py arkiver_utlan [--batch-storrelse 500] [--pause 0.05]
+
+Hver batch flyttes i sin egen korte transaksjon, med en pause mellom
+batchene, slik at skrivelåsen i SQLite aldri holdes lenge og utlån i
+skranken ikke blir stående og vente. Kommandoen kan avbrytes og startes på
+nytt når som helst; den fortsetter der den slapp.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from skiutlan.arkiv import arkiv_grense, arkiver_batch
+
+
+class Command(BaseCommand):
+    help = 'Flytter returnerte utlån eldre enn SKIUTLAN_ARKIV_ALDER_DAGER til arkivtabellen.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-storrelse', type=int, default=500,
+                            help='Antall utlån som flyttes per transaksjon (standard 500).')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Sekunder å vente mellom batchene (standard 0.05).')
+
+    def handle(self, *args, **options):
+        grense = arkiv_grense()
+        siste_id = 0
+        totalt = 0
+
+        while True:
+            ids = arkiver_batch(grense, etter_id=siste_id, storrelse=options['batch_storrelse'])
+            if not ids:
+                break
+            siste_id = ids[-1]
+            totalt += len(ids)
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'Flyttet {len(ids)} utlån (til og med id {siste_id}).')
+            time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Arkiverte {totalt} utlån returnert før {grense:%d.%m.%Y}.'))
@@ -0,0 +1,49 @@
+"""
+Kontrollerer Bruker.antall_aktive_utlan og tellerne på Lokasjon mot de
+faktiske items og aktive utlånene.
+
+    python manage.py avstem_utlanstellere [--bare-sjekk]
+
+Telleren vedlikeholdes i samme transaksjon som utlån og retur, men kan
+komme i utakt hvis utlån endres utenom applikasjonen (f.eks. rett i
+databasen). Kommandoen finner avvikene med én spørring og retter dem. Med
+--bare-sjekk rapporteres avvikene uten å rette, og kommandoen feiler hvis
+det finnes noen (nyttig i overvåking).
+
+De rettede brukerne og lokasjonene gjøres ugyldige i objektcachen. Det når
+serveren bare når cachen er delt (SKIUTLAN_CACHE_URL); ellers må
+applikasjonen startes på nytt for at detaljsidene skal vise de nye tallene
+før SKIUTLAN_OBJEKT_SEKUNDER har gått.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from skiutlan import hurtigbuffer
+from skiutlan.tjenester import avstem_aktive_utlan, avstem_lokasjoner
+
+
+class Command(BaseCommand):
+    help = 'Retter utlånstellerne på brukere og lokasjoner der de avviker fra faktiske tall.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bare-sjekk', action='store_true',
+                            help='Rapporter avvik uten å rette dem.')
+
+    def handle(self, *args, **options):
+        rett = not options['bare_sjekk']
+        avvik = {('Bruker', bruker_id): tall for bruker_id, tall in avstem_aktive_utlan(rett).items()}
+        for felt, rader in avstem_lokasjoner(rett).items():
+            avvik.update({(f'Lokasjon ({felt})', lokasjon_id): tall for lokasjon_id, tall in rader.items()})
+
+        for (hva, pk), (lagret, faktisk) in sorted(avvik.items()):
+            self.stdout.write(f'{hva} {pk}: teller {lagret}, faktisk {faktisk}')
+
+        if not avvik:
+            self.stdout.write(self.style.SUCCESS('Alle utlånstellere stemmer.'))
+        elif options['bare_sjekk']:
+            raise CommandError(f'{len(avvik)} utlånstellere er feil.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rettet {len(avvik)} utlånstellere.'))
+            if not hurtigbuffer.delt():
+                self.stdout.write(self.style.WARNING(
+                    'Cachen deles ikke med serveren; start applikasjonen på nytt for å vise de rettede tallene.'))
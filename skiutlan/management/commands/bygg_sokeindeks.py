@@ -0,0 +1,26 @@
+"""
+Bygger søkeindeksen for hurtigsøket (SokeOrd) på nytt.
+
+    python manage.py bygg_sokeindeks [--batch-storrelse 1000]
+
+Indeksen holdes ellers oppdatert etter hver endring (se
+skiutlan/sokeindeks.py). Kommandoen trengs etter endringer som går utenom
+applikasjonen, f.eks. rett i databasen eller med bulk_create, og etter at
+reglene for hva som indekseres er endret.
+"""
+
+from django.core.management.base import BaseCommand
+
+from skiutlan.sokeindeks import bygg_alle
+
+
+class Command(BaseCommand):
+    help = 'Bygger søkeindeksen for hurtigsøket på nytt.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-storrelse', type=int, default=1000,
+                            help='Antall objekter per oppslag (standard 1000).')
+
+    def handle(self, *args, **options):
+        antall = bygg_alle(batch=options['batch_storrelse'])
+        self.stdout.write(self.style.SUCCESS(f'Søkeindeksen har {antall} ord.'))
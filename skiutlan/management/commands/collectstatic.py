@@ -0,0 +1,37 @@
+"""
+collectstatic med størrelsesrapport.
+
+Utvider Djangos collectstatic: når lagringen er
+KomprimertManifestStaticFilesStorage skrives en tabell med original-,
+gzip- og brotli-størrelse for hver hash-navngitte fil.
+"""
+
+from django.contrib.staticfiles.management.commands.collectstatic import Command as CollectstaticCommand
+
+
+def _kb(antall_bytes):
+    return '-' if antall_bytes is None else f'{antall_bytes / 1024:.1f} kB'
+
+
+class Command(CollectstaticCommand):
+
+    def handle(self, **options):
+        melding = super().handle(**options)
+        rapport = getattr(self.storage, 'storrelsesrapport', None)
+        if rapport and options['verbosity'] >= 1:
+            self.skriv_rapport(rapport)
+        return melding
+
+    def skriv_rapport(self, rapport):
+        bredde = max(len(rad['navn']) for rad in rapport)
+        self.stdout.write('')
+        self.stdout.write(f'{"Fil":<{bredde}}  {"Original":>10}  {"gzip":>10}  {"brotli":>10}')
+        for rad in rapport:
+            self.stdout.write(
+                f'{rad["navn"]:<{bredde}}  {_kb(rad["original"]):>10}  '
+                f'{_kb(rad["gzip"]):>10}  {_kb(rad["brotli"]):>10}')
+
+        totalt = sum(rad['original'] for rad in rapport)
+        overfort = sum(min(v for v in (rad['original'], rad['gzip'], rad['brotli']) if v is not None)
+                       for rad in rapport)
+        self.stdout.write(f'Totalt {_kb(totalt)}, {_kb(overfort)} med beste komprimering.\n')
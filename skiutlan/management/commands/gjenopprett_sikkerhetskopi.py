@@ -0,0 +1,45 @@
+"""
+Gjenoppretter databasen fra en sikkerhetskopi.
+
+    python manage.py gjenopprett_sikkerhetskopi lendly-20250101-020000-000000.sqlite3.gz [--noinput]
+
+Kopien pakkes ut og kontrolleres før noe i databasen endres. Alt som er
+lagret etter at kopien ble tatt, går tapt, så kommandoen ber om bekreftelse
+med mindre --noinput er gitt. Etterpå tømmes cachen. Er den delt
+(SKIUTLAN_CACHE_URL), gjelder det alle prosessene; ellers må applikasjonen
+startes på nytt, slik at ingen prosess viser cachede data fra før
+gjenopprettingen.
+"""
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+
+from skiutlan import hurtigbuffer
+from skiutlan.sikkerhetskopi import SikkerhetskopiFeil, gjenopprett
+
+
+class Command(BaseCommand):
+    help = 'Erstatter databasen med innholdet i en sikkerhetskopi.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fil', help='Sikkerhetskopien (.sqlite3.gz eller .sqlite3).')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='Ikke be om bekreftelse.')
+
+    def handle(self, *args, **options):
+        if options['interactive']:
+            svar = input(f'Alle data i databasen erstattes med innholdet i {options["fil"]}. '
+                         'Skriv "ja" for å fortsette: ')
+            if svar != 'ja':
+                raise CommandError('Gjenoppretting avbrutt.')
+
+        try:
+            gjenopprett(options['fil'])
+        except SikkerhetskopiFeil as feil:
+            raise CommandError(str(feil))
+        cache.clear()
+
+        self.stdout.write(self.style.SUCCESS(f'Gjenopprettet databasen fra {options["fil"]}.'))
+        if not hurtigbuffer.delt():
+            self.stdout.write(self.style.WARNING(
+                'Cachen deles ikke med serveren; start applikasjonen på nytt.'))
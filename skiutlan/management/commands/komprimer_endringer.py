@@ -0,0 +1,29 @@
+"""
+Sletter endringer i endringsloggen som har en nyere endring for samme
+objekt, og gravsteiner eldre enn SKIUTLAN_GRAVSTEIN_DAGER (se
+skiutlan/endringer.py).
+
+    python manage.py komprimer_endringer [--dager 30]
+
+Kioskene merker ingen forskjell: de får bare den nyeste endringen per
+objekt. En kiosk som ikke har synkronisert siden før de slettede
+gravsteinene, får 400 og synkroniserer på nytt fra starten. Kan kjøres
+fra cron, f.eks. om natten.
+"""
+
+from django.core.management.base import BaseCommand
+
+from skiutlan.endringer import komprimer
+
+
+class Command(BaseCommand):
+    help = 'Sletter erstattede endringer og gamle gravsteiner fra endringsloggen.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dager', type=int, default=None,
+                            help='Slett gravsteiner eldre enn så mange dager (standard SKIUTLAN_GRAVSTEIN_DAGER).')
+
+    def handle(self, *args, **options):
+        erstattet, gravsteiner = komprimer(options['dager'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Slettet {erstattet} erstattede endringer og {gravsteiner} gamle gravsteiner.'))
@@ -0,0 +1,42 @@
+"""
+Oppdaterer projeksjonene fra hendelsesloggen (UtlanHendelse).
+
+    python manage.py oppdater_projeksjoner [navn ...] [--fra-start] [--batch-storrelse 1000]
+
+Uten --fra-start behandles bare hendelsene som har kommet siden forrige
+kjøring, så kommandoen er billig å kjøre ofte (f.eks. fra cron). Med
+--fra-start nullstilles lesemodellene og bygges på nytt fra første hendelse,
+f.eks. etter at en projeksjon er endret.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from skiutlan.projeksjoner import PROJEKSJONER, oppdater, spill_av
+
+
+class Command(BaseCommand):
+    help = 'Oppdaterer projeksjonene (lesemodellene) fra hendelsesloggen for utlån.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('navn', nargs='*',
+                            help='Projeksjoner som skal oppdateres (standard: alle).')
+        parser.add_argument('--fra-start', action='store_true',
+                            help='Nullstill og spill av hele hendelsesloggen på nytt.')
+        parser.add_argument('--batch-storrelse', type=int, default=1000,
+                            help='Antall hendelser per transaksjon (standard 1000).')
+
+    def handle(self, *args, **options):
+        kjente = {p.navn: p for p in PROJEKSJONER}
+        ukjente = [navn for navn in options['navn'] if navn not in kjente]
+        if ukjente:
+            raise CommandError(
+                f'Ukjent projeksjon: {", ".join(ukjente)}. Gyldige: {", ".join(kjente)}.')
+
+        valgte = [kjente[navn] for navn in options['navn']] or PROJEKSJONER
+        for projeksjon in valgte:
+            if options['fra_start']:
+                antall = spill_av(projeksjon, options['batch_storrelse'])
+            else:
+                antall = oppdater(projeksjon, options['batch_storrelse'])
+            self.stdout.write(self.style.SUCCESS(
+                f'{projeksjon.navn}: behandlet {antall} hendelser.'))
@@ -0,0 +1,19 @@
+"""
+Sletter utløpte idempotensnøkler (se skiutlan/idempotens.py).
+
+    python manage.py rydd_idempotensnokler
+
+Kan kjøres fra cron så ofte man vil; utløpte nøkler brukes uansett ikke.
+"""
+
+from django.core.management.base import BaseCommand
+
+from skiutlan.idempotens import rydd
+
+
+class Command(BaseCommand):
+    help = 'Sletter idempotensnøkler eldre enn SKIUTLAN_IDEMPOTENS_TIMER.'
+
+    def handle(self, *args, **options):
+        antall = rydd()
+        self.stdout.write(self.style.SUCCESS(f'Slettet {antall} utløpte idempotensnøkler.'))
@@ -0,0 +1,45 @@
+"""
+Tar en komprimert sikkerhetskopi av databasen mens systemet er i bruk.
+
+    python manage.py ta_sikkerhetskopi [--katalog STI] [--behold 14]
+                                       [--sider-per-steg 64] [--pause 0.005]
+
+Kopien tas med SQLites backup-API i små steg, så utlån ikke blokkeres, og
+kontrolleres med PRAGMA integrity_check før den lagres som
+lendly-<tidspunkt>.sqlite3.gz. Bare de nyeste --behold kopiene beholdes.
+Se skiutlan/sikkerhetskopi.py.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from skiutlan.sikkerhetskopi import SikkerhetskopiFeil, ta_sikkerhetskopi
+
+
+class Command(BaseCommand):
+    help = 'Tar en kontrollert, komprimert sikkerhetskopi av databasen og roterer gamle kopier.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--katalog',
+                            help='Hvor kopiene lagres (standard SKIUTLAN_SIKKERHETSKOPI_KATALOG).')
+        parser.add_argument('--behold', type=int,
+                            help='Antall kopier som beholdes (standard SKIUTLAN_SIKKERHETSKOPI_BEHOLD).')
+        parser.add_argument('--sider-per-steg', type=int, default=64,
+                            help='Antall databasesider som kopieres per steg (standard 64).')
+        parser.add_argument('--pause', type=float, default=0.005,
+                            help='Sekunder å vente mellom stegene (standard 0.005).')
+
+    def handle(self, *args, **options):
+        try:
+            kopi = ta_sikkerhetskopi(
+                katalog=options['katalog'], behold=options['behold'],
+                sider_per_steg=options['sider_per_steg'], pause=options['pause'])
+        except SikkerhetskopiFeil as feil:
+            raise CommandError(str(feil))
+
+        if options['verbosity'] >= 2:
+            self.stdout.write(f'{kopi["sider"]} sider kopiert, {kopi["omstarter"]} omstarter.')
+        for sti in kopi['slettet']:
+            self.stdout.write(f'Slettet gammel kopi {sti.name}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Lagret {kopi["sti"]} ({kopi["bytes"] / 1024:.0f} kB, '
+            f'{kopi["komprimert_bytes"] / 1024:.0f} kB komprimert) på {kopi["sekunder"]:.1f} s.'))
@@ -0,0 +1,112 @@
+"""
+Middleware for skiutlån-systemet.
+"""
+
+import mimetypes
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+
+
+class StatiskeFilerMiddleware:
+    """
+    Serverer filer fra STATIC_ROOT i produksjon (DEBUG = False).
+
+    Velger ferdig komprimert variant (.br, deretter .gz) ut fra
+    Accept-Encoding (med q-verdier), og setter et års immutable
+    Cache-Control og en ETag per variant på filer med innholds-hash i
+    navnet. Uhashede filer får kort cache-tid, siden
+    innholdet kan endre seg uten at URL-en gjør det.
+    """
+
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    KORT = 'public, max-age=60'
+
+    # (endelse, Content-Encoding) i prioritert rekkefølge
+    VARIANTER = [('.br', 'br'), ('.gz', 'gzip')]
+
+    def __init__(self, get_response):
+        if settings.DEBUG or not settings.STATIC_ROOT:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.prefiks = '/' + settings.STATIC_URL.lstrip('/')
+        self.rot = str(settings.STATIC_ROOT)
+        # Manifest-lagringen leser staticfiles.json ved oppstart
+        self.hashede = set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path.startswith(self.prefiks):
+            respons = self.server(request, request.path[len(self.prefiks):])
+            if respons is not None:
+                return respons
+        return self.get_response(request)
+
+    def server(self, request, navn):
+        try:
+            sti = safe_join(self.rot, navn)
+        except Exception:  # Forsøk på å gå ut av STATIC_ROOT
+            return None
+        if not os.path.isfile(sti):
+            return None
+
+        hashet = navn in self.hashede
+        godtatt = self.kodinger(request.headers.get('Accept-Encoding', ''))
+        valgt, koding = sti, None
+        for endelse, navn_koding in self.VARIANTER:
+            if self.godtar(godtatt, navn_koding) and os.path.isfile(sti + endelse):
+                valgt, koding = sti + endelse, navn_koding
+                break
+        # Hver variant har sitt eget innhold, og dermed sin egen ETag
+        etag = f'"{os.path.basename(navn)}{"-" + koding if koding else ""}"' if hashet else None
+
+        if etag and self.treffer(request.headers.get('If-None-Match', ''), etag):
+            # Innholdet bak et hash-navn endrer seg aldri
+            respons = HttpResponseNotModified()
+            respons['ETag'] = etag
+            respons['Vary'] = 'Accept-Encoding'
+            respons['Cache-Control'] = self.IMMUTABLE
+            return respons
+
+        innholdstype, _ = mimetypes.guess_type(sti)
+        respons = FileResponse(open(valgt, 'rb'), content_type=innholdstype or 'application/octet-stream')
+        if koding:
+            respons['Content-Encoding'] = koding
+        respons['Vary'] = 'Accept-Encoding'
+        respons['Cache-Control'] = self.IMMUTABLE if hashet else self.KORT
+        if etag:
+            respons['ETag'] = etag
+        return respons
+
+    @staticmethod
+    def kodinger(header):
+        """Accept-Encoding som {koding: q}."""
+        kodinger = {}
+        for del_ in header.split(','):
+            koding, *parametre = [d.strip() for d in del_.split(';')]
+            if not koding:
+                continue
+            q = 1.0
+            for parameter in parametre:
+                navn, _, verdi = parameter.partition('=')
+                if navn.strip().lower() == 'q':
+                    try:
+                        q = float(verdi)
+                    except ValueError:
+                        q = 0.0
+            kodinger[koding.lower()] = q
+        return kodinger
+
+    @staticmethod
+    def godtar(kodinger, koding):
+        """Om klienten godtar koding (q > 0), direkte eller via *."""
+        return kodinger.get(koding, kodinger.get('*', 0.0)) > 0
+
+    @staticmethod
+    def treffer(if_none_match, etag):
+        """Om If-None-Match inneholder etag (svak sammenligning) eller er *."""
+        verdier = [v.strip() for v in if_none_match.split(',')]
+        return '*' in verdier or etag in [v[2:] if v.startswith('W/') else v for v in verdier]
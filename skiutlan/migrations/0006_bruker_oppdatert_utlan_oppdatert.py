@@ -0,0 +1,23 @@
+# Generated by Django 5.1.12 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0005_alter_utlan_planlagt_retur'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bruker',
+            name='oppdatert',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='utlan',
+            name='oppdatert',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
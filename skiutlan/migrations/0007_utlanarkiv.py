@@ -0,0 +1,55 @@
+# Generated by Django 5.1.12 on 2026-10-19 15:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0006_bruker_oppdatert_utlan_oppdatert'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UtlanArkiv',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('utlant_dato', models.DateTimeField()),
+                ('planlagt_retur', models.DateTimeField()),
+                ('returnert_dato', models.DateTimeField()),
+                ('oppdatert', models.DateTimeField()),
+                ('arkivert', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Arkivert utlån',
+                'verbose_name_plural': 'Arkiverte utlån',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['returnert_dato'], name='utlan_returnert_idx'),
+        ),
+        migrations.AddField(
+            model_name='utlanarkiv',
+            name='bruker',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arkiverte_utlan', to='skiutlan.bruker'),
+        ),
+        migrations.AddField(
+            model_name='utlanarkiv',
+            name='ski_item',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='arkiverte_utlan', to='skiutlan.skiitem'),
+        ),
+        migrations.AddIndex(
+            model_name='utlanarkiv',
+            index=models.Index(fields=['ski_item', '-utlant_dato'], name='arkiv_item_dato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='utlanarkiv',
+            index=models.Index(fields=['bruker', '-utlant_dato'], name='arkiv_bruker_dato_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='utlanarkiv',
+            index=models.Index(fields=['utlant_dato'], name='arkiv_dato_idx'),
+        ),
+    ]
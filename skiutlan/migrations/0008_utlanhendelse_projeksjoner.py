@@ -0,0 +1,64 @@
+# Generated by Django 5.1.12 on 2026-10-19 15:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0007_utlanarkiv'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjBrukerTelling',
+            fields=[
+                ('bruker_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('aktive', models.IntegerField(default=0)),
+                ('totalt', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjDagStatistikk',
+            fields=[
+                ('dato', models.DateField(primary_key=True, serialize=False)),
+                ('utlant', models.IntegerField(default=0)),
+                ('returnert', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjeksjonMarkor',
+            fields=[
+                ('navn', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('siste_hendelse_id', models.BigIntegerField(default=0)),
+                ('oppdatert', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProjTilgjengelighet',
+            fields=[
+                ('ski_item_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('aktivt_utlan_id', models.BigIntegerField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UtlanHendelse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('utlant', 'Utlånt'), ('returnert', 'Returnert'), ('endret', 'Endret'), ('slettet', 'Slettet')], max_length=20)),
+                ('tidspunkt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('utlan_id', models.BigIntegerField(db_index=True)),
+                ('bruker_id', models.BigIntegerField()),
+                ('ski_item_id', models.BigIntegerField()),
+                ('utlant_dato', models.DateTimeField()),
+                ('planlagt_retur', models.DateTimeField()),
+                ('returnert_dato', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Utlånshendelse',
+                'verbose_name_plural': 'Utlånshendelser',
+                'ordering': ['id'],
+            },
+        ),
+    ]
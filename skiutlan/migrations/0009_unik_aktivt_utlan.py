@@ -0,0 +1,46 @@
+# Generated by Django 5.1.12 on 2026-10-19 15:45
+
+from django.db import migrations, models
+
+
+def lukk_doble_utlan(apps, schema_editor):
+    """
+    Før constrainten ble fjernet kunne samme item bli lånt ut to ganger.
+    Behold det nyeste aktive utlånet per item, og marker de eldre som
+    returnert da det nye utlånet startet (med hendelse i loggen).
+    """
+    Utlan = apps.get_model('skiutlan', 'Utlan')
+    UtlanHendelse = apps.get_model('skiutlan', 'UtlanHendelse')
+
+    nyeste = {}
+    lukket = []
+    for utlan in Utlan.objects.filter(returnert_dato__isnull=True).order_by('-utlant_dato', '-id'):
+        if utlan.ski_item_id not in nyeste:
+            nyeste[utlan.ski_item_id] = utlan
+            continue
+        utlan.returnert_dato = nyeste[utlan.ski_item_id].utlant_dato
+        lukket.append(utlan)
+
+    Utlan.objects.bulk_update(lukket, ['returnert_dato'])
+    UtlanHendelse.objects.bulk_create([
+        UtlanHendelse(
+            type='returnert', utlan_id=u.id, bruker_id=u.bruker_id, ski_item_id=u.ski_item_id,
+            utlant_dato=u.utlant_dato, planlagt_retur=u.planlagt_retur, returnert_dato=u.returnert_dato,
+        )
+        for u in lukket
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0008_utlanhendelse_projeksjoner'),
+    ]
+
+    operations = [
+        migrations.RunPython(lukk_doble_utlan, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='utlan',
+            constraint=models.UniqueConstraint(condition=models.Q(('returnert_dato__isnull', True)), fields=('ski_item',), name='unique_active_loan_per_item', violation_error_message='Dette ski-itemet er allerede lånt ut.'),
+        ),
+    ]
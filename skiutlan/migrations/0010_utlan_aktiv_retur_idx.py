@@ -0,0 +1,17 @@
+# Generated by Django 5.1.12 on 2026-10-19 15:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0009_unik_aktivt_utlan'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['returnert_dato', 'planlagt_retur'], name='utlan_aktiv_retur_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.12 on 2026-10-19 15:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fyll_tellere(apps, schema_editor):
+    Bruker = apps.get_model('skiutlan', 'Bruker')
+    Utlan = apps.get_model('skiutlan', 'Utlan')
+    aktive = (
+        Utlan.objects.filter(bruker=OuterRef('pk'), returnert_dato__isnull=True)
+        .values('bruker').annotate(antall=Count('id')).values('antall')
+    )
+    Bruker.objects.update(antall_aktive_utlan=Coalesce(Subquery(aktive), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0010_utlan_aktiv_retur_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bruker',
+            name='antall_aktive_utlan',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fyll_tellere, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.1.12 on 2026-10-19 16:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def flytt_til_hovedlager(apps, schema_editor):
+    """
+    Alt som fantes før lokasjonene kom, hører til ett sted: Hovedlager.
+    Utlånene får lokasjonen til itemet, og tellerne fylles.
+    """
+    Lokasjon = apps.get_model('skiutlan', 'Lokasjon')
+    SkiItem = apps.get_model('skiutlan', 'SkiItem')
+    Utlan = apps.get_model('skiutlan', 'Utlan')
+    UtlanArkiv = apps.get_model('skiutlan', 'UtlanArkiv')
+
+    if not SkiItem.objects.exists():
+        return
+    hovedlager, _ = Lokasjon.objects.get_or_create(navn='Hovedlager')
+    SkiItem.objects.update(lokasjon=hovedlager)
+    item_lokasjon = SkiItem.objects.filter(pk=OuterRef('ski_item_id')).values('lokasjon_id')
+    Utlan.objects.update(lokasjon_id=Subquery(item_lokasjon))
+    UtlanArkiv.objects.update(lokasjon_id=Subquery(item_lokasjon))
+
+    items = SkiItem.objects.filter(lokasjon=OuterRef('pk')).values('lokasjon').annotate(antall=Count('id')).values('antall')
+    aktive = (
+        Utlan.objects.filter(lokasjon=OuterRef('pk'), returnert_dato__isnull=True)
+        .values('lokasjon').annotate(antall=Count('id')).values('antall')
+    )
+    Lokasjon.objects.update(
+        antall_ski_items=Coalesce(Subquery(items), 0),
+        antall_aktive_utlan=Coalesce(Subquery(aktive), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0011_bruker_antall_aktive_utlan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Lokasjon',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('navn', models.CharField(max_length=100, unique=True)),
+                ('opprettet', models.DateTimeField(auto_now_add=True)),
+                ('antall_ski_items', models.PositiveIntegerField(default=0, editable=False)),
+                ('antall_aktive_utlan', models.PositiveIntegerField(default=0, editable=False)),
+            ],
+            options={
+                'verbose_name': 'Lokasjon',
+                'verbose_name_plural': 'Lokasjoner',
+                'ordering': ['navn'],
+            },
+        ),
+        migrations.AddField(
+            model_name='skiitem',
+            name='lokasjon',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='skiutlan.lokasjon'),
+        ),
+        migrations.AddField(
+            model_name='utlan',
+            name='lokasjon',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='skiutlan.lokasjon'),
+        ),
+        migrations.AddField(
+            model_name='utlanarkiv',
+            name='lokasjon',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='arkiverte_utlan', to='skiutlan.lokasjon'),
+        ),
+        migrations.RunPython(flytt_til_hovedlager, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='skiitem',
+            name='lokasjon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='skiutlan.lokasjon'),
+        ),
+        migrations.AlterField(
+            model_name='utlan',
+            name='lokasjon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='skiutlan.lokasjon'),
+        ),
+        migrations.AlterField(
+            model_name='utlanarkiv',
+            name='lokasjon',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='arkiverte_utlan', to='skiutlan.lokasjon'),
+        ),
+        migrations.AddIndex(
+            model_name='skiitem',
+            index=models.Index(fields=['lokasjon', 'type_ski', 'storrelse'], name='skiitem_lok_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['lokasjon', 'returnert_dato', 'planlagt_retur'], name='utlan_lok_aktiv_retur_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['lokasjon', '-utlant_dato'], name='utlan_lok_dato_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.12 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0012_lokasjoner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LagretSok',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('navn', models.CharField(max_length=100)),
+                ('spesifikasjon', models.JSONField()),
+                ('nokkel', models.CharField(editable=False, max_length=500, unique=True)),
+                ('ski_item_ids', models.JSONField(default=list, editable=False)),
+                ('bruker_ids', models.JSONField(default=list, editable=False)),
+                ('utlan_ids', models.JSONField(default=list, editable=False)),
+                ('frister', models.JSONField(default=dict, editable=False)),
+                ('opprettet', models.DateTimeField(auto_now_add=True)),
+                ('oppdatert', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Lagret søk',
+                'verbose_name_plural': 'Lagrede søk',
+                'ordering': ['navn'],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.12 on 2026-10-19 16:36
+
+from django.db import migrations, models
+
+
+def bygg_sokeindeks(apps, schema_editor):
+    """Indekserer det som finnes fra før; siden holder signalene indeksen oppdatert."""
+    from skiutlan.sokeindeks import bygg_alle
+    bygg_alle(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0013_lagrede_sok'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SokeOrd',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ord', models.CharField(max_length=50)),
+                ('vekt', models.PositiveSmallIntegerField()),
+                ('type', models.CharField(choices=[('ski_item', 'Ski-item'), ('bruker', 'Bruker'), ('utlan', 'Utlån')], max_length=10)),
+                ('objekt_id', models.BigIntegerField()),
+                ('lokasjon_id', models.BigIntegerField(blank=True, null=True)),
+                ('tittel', models.CharField(max_length=200)),
+                ('undertittel', models.CharField(blank=True, max_length=200)),
+                ('tekst', models.CharField(max_length=500)),
+            ],
+            options={
+                'verbose_name': 'Søkeord',
+                'verbose_name_plural': 'Søkeord',
+                'indexes': [models.Index(fields=['ord'], name='sokeord_ord_idx'), models.Index(fields=['type', 'objekt_id'], name='sokeord_objekt_idx')],
+            },
+        ),
+        migrations.RunPython(bygg_sokeindeks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.12 on 2026-10-19 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0014_sokeindeks'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['bruker', 'utlant_dato'], name='utlan_bruker_dato_idx'),
+        ),
+    ]
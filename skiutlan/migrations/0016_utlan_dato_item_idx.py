@@ -0,0 +1,17 @@
+# Generated by Django 5.1.12 on 2026-10-19 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0015_utlan_bruker_dato_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='utlan',
+            index=models.Index(fields=['utlant_dato', 'lokasjon', 'ski_item'], name='utlan_dato_item_idx'),
+        ),
+    ]
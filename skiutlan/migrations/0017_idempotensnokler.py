@@ -0,0 +1,30 @@
+# Generated by Django 5.1.12 on 2026-10-19 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0016_utlan_dato_item_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotensNokkel',
+            fields=[
+                ('nokkel', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('sti', models.CharField(max_length=200)),
+                ('status', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('innholdstype', models.CharField(blank=True, max_length=100)),
+                ('adresse', models.CharField(blank=True, max_length=500)),
+                ('innhold', models.BinaryField(blank=True, default=b'')),
+                ('utloper', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Idempotensnøkkel',
+                'verbose_name_plural': 'Idempotensnøkler',
+                'indexes': [models.Index(fields=['utloper'], name='idempotens_utloper_idx')],
+            },
+        ),
+    ]
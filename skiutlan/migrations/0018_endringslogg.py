@@ -0,0 +1,34 @@
+# Generated by Django 5.1.12 on 2026-10-19 17:21
+
+from django.db import migrations, models
+
+
+def fyll_endringer(apps, schema_editor):
+    """Alt som finnes fra før er én endring, så kioskenes første synkronisering får alt."""
+    from skiutlan.endringer import fyll
+    fyll(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0017_idempotensnokler'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Endring',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('ski_item', 'Ski-item'), ('bruker', 'Bruker'), ('utlan', 'Utlån')], max_length=10)),
+                ('objekt_id', models.BigIntegerField()),
+                ('slettet', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Endring',
+                'verbose_name_plural': 'Endringer',
+                'indexes': [models.Index(fields=['type', 'objekt_id'], name='endring_objekt_idx')],
+            },
+        ),
+        migrations.RunPython(fyll_endringer, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.12 on 2026-10-19 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0018_endringslogg'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotensnokkel',
+            name='avtrykk',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
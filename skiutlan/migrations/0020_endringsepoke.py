@@ -0,0 +1,24 @@
+# Generated by Django 5.1.12 on 2026-10-19 18:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0019_idempotens_avtrykk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Endringsepoke',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('epoke', models.CharField(max_length=32)),
+            ],
+            options={
+                'verbose_name': 'Endringsepoke',
+                'verbose_name_plural': 'Endringsepoker',
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.12 on 2026-10-19 18:06
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('skiutlan', '0020_endringsepoke'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='endring',
+            name='registrert',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='endringsepoke',
+            name='laveste_sekvens',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -16,11 +16,42 @@ Kjernekrav oppfylt:
 """
 
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from datetime import timedelta
 
 
+class Lokasjon(models.Model):
+    """
+    Et utleiested. Ski-items og utlån hører til én lokasjon, slik at lister
+    og tellinger for ett sted bare leser det stedets rader. Brukere er felles
+    for alle lokasjonene.
+
+    Tellerne vedlikeholdes i samme transaksjon som endringene (se
+    tjenester.py og signals.py), slik at dashbordet for et sted ikke trenger
+    å telle rader. Kontrolleres med manage.py avstem_utlanstellere.
+    """
+
+    navn = models.CharField(max_length=100, unique=True)
+    opprettet = models.DateTimeField(auto_now_add=True)
+
+    antall_ski_items = models.PositiveIntegerField(default=0, editable=False)
+    antall_aktive_utlan = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        verbose_name = "Lokasjon"
+        verbose_name_plural = "Lokasjoner"
+        ordering = ['navn']
+
+    def __str__(self):
+        return self.navn
+
+    @property
+    def antall_ledige(self):
+        return self.antall_ski_items - self.antall_aktive_utlan
+
+
 class SkiItem(models.Model):
     """
     Modell for et skielement som kan lånes ut.
@@ -48,6 +79,9 @@ class SkiItem(models.Model):
         ('staver', 'Skistaver'),
     ]
 
+    # Hvor itemet står. Flyttes med tjenester.flytt_ski_items().
+    lokasjon = models.ForeignKey(Lokasjon, on_delete=models.PROTECT)
+
     # Grunnleggende informasjon om ski-item
     navn = models.CharField(max_length=100, help_text="Navn på ski-elementet")
     type_ski = models.CharField(
@@ -82,6 +116,10 @@ class SkiItem(models.Model):
         verbose_name = "Ski-element"
         verbose_name_plural = "Ski-elementer"
         ordering = ['type_ski', 'storrelse']  # Sorterer automatisk
+        indexes = [
+            # Lister for én lokasjon, i standard sorteringsrekkefølge
+            models.Index(fields=['lokasjon', 'type_ski', 'storrelse'], name='skiitem_lok_type_idx'),
+        ]
 
     def __str__(self):
         return f"{self.get_type_ski_display()} ({self.storrelse}{'EU' if self.type_ski == 'stovler' else 'cm'}) - {self.get_tilstand_display()}"
@@ -122,6 +160,15 @@ class Bruker(models.Model):
 
     # Metadata
     registrert = models.DateTimeField(auto_now_add=True)
+    oppdatert = models.DateTimeField(auto_now=True)
+
+    # Vedlikeholdes i samme transaksjon som utlån og retur (se tjenester.py),
+    # slik at grensen kan håndheves uten å telle utlån. Kontrolleres med
+    # manage.py avstem_utlanstellere.
+    antall_aktive_utlan = models.PositiveIntegerField(default=0, editable=False)
+
+    # Maks antall samtidige utlån per bruker
+    MAKS_AKTIVE_UTLAN = 3
 
     class Meta:
         verbose_name = "Bruker"
@@ -141,7 +188,51 @@ class Bruker(models.Model):
         """
         Returnerer antall aktive utlån for denne brukeren.
         """
-        return self.utlan_set.filter(returnert_dato__isnull=True).count()
+        return self.antall_aktive_utlan
+
+    @property
+    def kan_lane_mer(self):
+        return self.antall_aktive_utlan < self.MAKS_AKTIVE_UTLAN
+
+
+class UtlanQuerySet(models.QuerySet):
+    """Spørringer på utlån der tidsberegningene gjøres i databasen."""
+
+    def med_tidsberegninger(self, na=None):
+        """
+        Annoterer hvert utlån med, beregnet i SQL mot samme tidspunkt na:
+
+        - forsinket: aktivt og planlagt_retur er passert
+        - forsinkelse: hvor lenge siden planlagt_retur (0 hvis ikke forsinket)
+        - lanetid: fra utlant_dato til returnert_dato, eller til na for aktive
+
+        Da kan lister sortere og filtrere på dem uten å laste alle radene.
+        """
+        na = models.Value(na or timezone.now(), output_field=models.DateTimeField())
+        forsinket = models.Q(returnert_dato__isnull=True, planlagt_retur__lt=na)
+        return self.annotate(
+            forsinket=models.ExpressionWrapper(forsinket, output_field=models.BooleanField()),
+            forsinkelse=models.Case(
+                models.When(forsinket, then=models.ExpressionWrapper(
+                    na - models.F('planlagt_retur'), output_field=models.DurationField())),
+                default=models.Value(timedelta(0), output_field=models.DurationField()),
+            ),
+            lanetid=models.ExpressionWrapper(
+                Coalesce('returnert_dato', na) - models.F('utlant_dato'),
+                output_field=models.DurationField()),
+        )
+
+    def aktive(self):
+        return self.filter(returnert_dato__isnull=True)
+
+    def forsinket(self, minst_dager=0, na=None):
+        """Aktive utlån som er minst minst_dager forsinket (bruker utlan_aktiv_retur_idx)."""
+        grense = (na or timezone.now()) - timedelta(days=minst_dager)
+        return self.aktive().filter(planlagt_retur__lt=grense)
+
+    def mest_forsinket_forst(self):
+        """Aktive utlån med eldst planlagt_retur først, lest i indeksrekkefølge."""
+        return self.aktive().order_by('planlagt_retur')
 
 
 class Utlan(models.Model):
@@ -151,13 +242,52 @@ class Utlan(models.Model):
 
     bruker = models.ForeignKey(Bruker, on_delete=models.CASCADE)
     ski_item = models.ForeignKey(SkiItem, on_delete=models.CASCADE)
+    # Stedet utlånet ble gjort, kopiert fra itemet. Blir stående om itemet
+    # senere flyttes, slik at historikken for et sted ikke endrer seg.
+    lokasjon = models.ForeignKey(Lokasjon, on_delete=models.PROTECT)
     utlant_dato = models.DateTimeField(auto_now_add=True)
     planlagt_retur = models.DateTimeField()
     returnert_dato = models.DateTimeField(blank=True, null=True)
+    oppdatert = models.DateTimeField(auto_now=True)
+
+    objects = UtlanQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Brukes av arkiveringen (manage.py arkiver_utlan)
+            models.Index(fields=['returnert_dato'], name='utlan_returnert_idx'),
+            # Forsinkede utlån og "mest forsinket først" (UtlanQuerySet.forsinket):
+            # returnert_dato IS NULL og planlagt_retur i indeksrekkefølge
+            models.Index(fields=['returnert_dato', 'planlagt_retur'], name='utlan_aktiv_retur_idx'),
+            # Det samme, og nyeste utlån, for én lokasjon
+            models.Index(fields=['lokasjon', 'returnert_dato', 'planlagt_retur'], name='utlan_lok_aktiv_retur_idx'),
+            models.Index(fields=['lokasjon', '-utlant_dato'], name='utlan_lok_dato_idx'),
+            # Historikken til én bruker, side for side (arkiv.historikk_side). Stigende,
+            # så indeksen lest baklengs gir både utlant_dato og id synkende
+            models.Index(fields=['bruker', 'utlant_dato'], name='utlan_bruker_dato_idx'),
+            # Utlån i en periode per item (populaere.topp), lest rett fra indeksen
+            models.Index(fields=['utlant_dato', 'lokasjon', 'ski_item'], name='utlan_dato_item_idx'),
+        ]
+        constraints = [
+            # Et ski-item kan bare ha ett aktivt utlån. Databasen håndhever
+            # dette, slik at to samtidige utlån av samme item ikke kan lykkes.
+            models.UniqueConstraint(
+                fields=['ski_item'],
+                condition=models.Q(returnert_dato__isnull=True),
+                name='unique_active_loan_per_item',
+                violation_error_message='Dette ski-itemet er allerede lånt ut.',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.bruker.fornavn} {self.bruker.etternavn} låner {self.ski_item.navn}"
 
+    def save(self, *args, **kwargs):
+        # Et nytt utlån hører til lokasjonen itemet står på
+        if self.lokasjon_id is None and self.ski_item_id is not None:
+            self.lokasjon_id = SkiItem.objects.values_list('lokasjon_id', flat=True).get(id=self.ski_item_id)
+        super().save(*args, **kwargs)
+
     @property
     def er_aktivt(self):
         return self.returnert_dato is None
@@ -165,6 +295,8 @@ class Utlan(models.Model):
     @property
     def er_forsinket(self):
         """Sjekker om utlånet er forsinket."""
+        if 'forsinket' in self.__dict__:  # Beregnet i SQL (med_tidsberegninger)
+            return self.forsinket
         if self.returnert_dato:
             return False
         from django.utils import timezone
@@ -174,8 +306,320 @@ class Utlan(models.Model):
     @property
     def varighet(self):
         """Beregner hvor lenge utlånet har vart."""
+        if 'lanetid' in self.__dict__:  # Beregnet i SQL (med_tidsberegninger)
+            return self.lanetid
         from django.utils import timezone
         if self.returnert_dato:
             return self.returnert_dato - self.utlant_dato
         else:
             return timezone.now() - self.utlant_dato
+
+    @property
+    def dager_forsinket(self):
+        """Hele dager siden planlagt retur (0 hvis ikke forsinket)."""
+        if 'forsinkelse' in self.__dict__:
+            return self.forsinkelse.days
+        if not self.er_forsinket:
+            return 0
+        return (timezone.now() - self.planlagt_retur).days
+
+
+class UtlanArkiv(models.Model):
+    """
+    Returnerte utlån som er flyttet ut av Utlan-tabellen.
+
+    Utlan holdes liten ved at returnerte utlån eldre enn
+    SKIUTLAN_ARKIV_ALDER_DAGER flyttes hit av manage.py arkiver_utlan.
+    Radene beholder id-en de hadde i Utlan, slik at lenker fortsatt virker.
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    bruker = models.ForeignKey(Bruker, on_delete=models.CASCADE, related_name='arkiverte_utlan')
+    ski_item = models.ForeignKey(SkiItem, on_delete=models.CASCADE, related_name='arkiverte_utlan')
+    lokasjon = models.ForeignKey(Lokasjon, on_delete=models.PROTECT, related_name='arkiverte_utlan')
+    utlant_dato = models.DateTimeField()
+    planlagt_retur = models.DateTimeField()
+    returnert_dato = models.DateTimeField()
+    oppdatert = models.DateTimeField()
+    arkivert = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Arkivert utlån"
+        verbose_name_plural = "Arkiverte utlån"
+        indexes = [
+            models.Index(fields=['ski_item', '-utlant_dato'], name='arkiv_item_dato_idx'),
+            models.Index(fields=['bruker', '-utlant_dato'], name='arkiv_bruker_dato_idx'),
+            models.Index(fields=['utlant_dato'], name='arkiv_dato_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.bruker.fornavn} {self.bruker.etternavn} lånte {self.ski_item.navn}"
+
+    # Samme grensesnitt som Utlan, slik at templates kan vise begge
+    er_aktivt = False
+    er_forsinket = False
+    dager_forsinket = 0
+
+    @property
+    def varighet(self):
+        return self.returnert_dato - self.utlant_dato
+
+
+class UtlanHendelse(models.Model):
+    """
+    Append-only logg over alle endringer av utlån.
+
+    Skrives i samme transaksjon som endringen (se hendelser.py). Hver hendelse
+    inneholder hele tilstanden til utlånet etter endringen (før sletting for
+    'slettet'), slik at projeksjoner kan bygges uten å lese Utlan-tabellen.
+    Feltene er vanlige tall i stedet for fremmednøkler, slik at loggen
+    overlever at utlånet, brukeren eller itemet slettes.
+    """
+
+    TYPER = [
+        ('utlant', 'Utlånt'),
+        ('returnert', 'Returnert'),
+        ('endret', 'Endret'),
+        ('slettet', 'Slettet'),
+    ]
+
+    type = models.CharField(max_length=20, choices=TYPER)
+    tidspunkt = models.DateTimeField(default=timezone.now)
+
+    # Tilstanden til utlånet
+    utlan_id = models.BigIntegerField(db_index=True)
+    bruker_id = models.BigIntegerField()
+    ski_item_id = models.BigIntegerField()
+    utlant_dato = models.DateTimeField()
+    planlagt_retur = models.DateTimeField()
+    returnert_dato = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        verbose_name = "Utlånshendelse"
+        verbose_name_plural = "Utlånshendelser"
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.id} {self.get_type_display()} utlån {self.utlan_id}"
+
+    @property
+    def er_aktivt(self):
+        return self.type != 'slettet' and self.returnert_dato is None
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Utlånshendelser kan ikke endres.')
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError('Utlånshendelser kan ikke slettes.')
+
+
+# ============================================================================
+# LAGREDE SØK (se sok.py)
+# ============================================================================
+
+class LagretSok(models.Model):
+    """
+    Et avansert søk skranken bruker ofte, med resultatet lagret som id-lister.
+
+    Listene holdes oppdatert for de radene som endres (sok.endret()), i
+    stedet for at hele søket kjøres på nytt hver gang det vises.
+    """
+
+    navn = models.CharField(max_length=100)
+    # Normaliserte filtre (sok.normaliser); nokkel er den samme som JSON,
+    # slik at samme søk ikke lagres to ganger
+    spesifikasjon = models.JSONField()
+    nokkel = models.CharField(max_length=500, unique=True, editable=False)
+
+    ski_item_ids = models.JSONField(default=list, editable=False)
+    bruker_ids = models.JSONField(default=list, editable=False)
+    utlan_ids = models.JSONField(default=list, editable=False)
+    # Bare for søk etter forsinkede utlån: {utlan_id: planlagt_retur (epoch)}.
+    # utlan_ids har da alle aktive treff, og et utlån er et treff når fristen
+    # er passert.
+    frister = models.JSONField(default=dict, editable=False)
+
+    opprettet = models.DateTimeField(auto_now_add=True)
+    oppdatert = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Lagret søk"
+        verbose_name_plural = "Lagrede søk"
+        ordering = ['navn']
+
+    def __str__(self):
+        return self.navn
+
+
+class SokeOrd(models.Model):
+    """
+    Ett søkeord i hurtigsøket, med det som trengs for å vise treffet.
+
+    Hvert ski-item, hver bruker og hvert aktive utlån har én rad per ord
+    (se sokeindeks.py). Ordene er små bokstaver, så et prefikssøk er et
+    intervall i indeksen på ord.
+    """
+
+    TYPER = [
+        ('ski_item', 'Ski-item'),
+        ('bruker', 'Bruker'),
+        ('utlan', 'Utlån'),
+    ]
+
+    # Identifikatorer (telefon) før navn, og navn før resten
+    VEKT_ID = 0
+    VEKT_NAVN = 1
+    VEKT_ANNET = 2
+
+    ord = models.CharField(max_length=50)
+    vekt = models.PositiveSmallIntegerField()
+
+    type = models.CharField(max_length=10, choices=TYPER)
+    objekt_id = models.BigIntegerField()
+    # Uten fremmednøkler, som projeksjonene: radene byttes ut i sin helhet
+    lokasjon_id = models.BigIntegerField(blank=True, null=True)
+    tittel = models.CharField(max_length=200)
+    undertittel = models.CharField(max_length=200, blank=True)
+    # Alle ordene til objektet, for søk med flere ord
+    tekst = models.CharField(max_length=500)
+
+    class Meta:
+        verbose_name = "Søkeord"
+        verbose_name_plural = "Søkeord"
+        indexes = [
+            models.Index(fields=['ord'], name='sokeord_ord_idx'),
+            models.Index(fields=['type', 'objekt_id'], name='sokeord_objekt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ord} → {self.type} {self.objekt_id}"
+
+
+# ============================================================================
+# IDEMPOTENSNØKLER (se idempotens.py)
+# ============================================================================
+
+class IdempotensNokkel(models.Model):
+    """
+    Svaret på en POST med Idempotency-Key. Et nytt forsøk med samme nøkkel
+    får det lagrede svaret i stedet for å låne ut eller returnere på nytt.
+    """
+
+    nokkel = models.CharField(max_length=100, primary_key=True)
+    sti = models.CharField(max_length=200)
+    # SHA-256 av metoden og innholdet (se idempotens._avtrykk)
+    avtrykk = models.CharField(max_length=64, blank=True)
+    # None mens den første forespørselen med nøkkelen fortsatt kjører
+    status = models.PositiveSmallIntegerField(blank=True, null=True)
+    innholdstype = models.CharField(max_length=100, blank=True)
+    adresse = models.CharField(max_length=500, blank=True)
+    innhold = models.BinaryField(blank=True, default=b'')
+    utloper = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Idempotensnøkkel"
+        verbose_name_plural = "Idempotensnøkler"
+        indexes = [
+            models.Index(fields=['utloper'], name='idempotens_utloper_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.nokkel} ({self.sti})"
+
+
+# ============================================================================
+# ENDRINGSLOGG FOR KIOSKENE (se endringer.py)
+# ============================================================================
+
+class Endring(models.Model):
+    """
+    Et ski-item, en bruker eller et utlån som er opprettet, endret eller
+    slettet. id er sekvensnummeret kioskene synkroniserer etter; eldre rader
+    for samme objekt kan slettes (endringer.komprimer()).
+    """
+
+    TYPER = [
+        ('ski_item', 'Ski-item'),
+        ('bruker', 'Bruker'),
+        ('utlan', 'Utlån'),
+    ]
+
+    type = models.CharField(max_length=10, choices=TYPER)
+    objekt_id = models.BigIntegerField()
+    # Gravstein: objektet finnes ikke lenger
+    slettet = models.BooleanField(default=False)
+    # Gravsteiner eldre enn SKIUTLAN_GRAVSTEIN_DAGER slettes av komprimer()
+    registrert = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Endring"
+        verbose_name_plural = "Endringer"
+        indexes = [
+            models.Index(fields=['type', 'objekt_id'], name='endring_objekt_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id}: {self.type} {self.objekt_id}{' (slettet)' if self.slettet else ''}"
+
+
+class Endringsepoke(models.Model):
+    """
+    Én rad som sier hvilken utgave av endringsloggen markørene gjelder for.
+
+    Gjenopprettes databasen fra en sikkerhetskopi, spoles loggen (og
+    sekvensen) tilbake, og numrene brukes på nytt. Epoken byttes da
+    (endringer.ny_epoke()), slik at kioskene synkroniserer på nytt fra
+    starten i stedet for å hoppe over endringer. Det samme gjelder en markør
+    fra før de eldste slettede gravsteinene.
+    """
+
+    epoke = models.CharField(max_length=32)
+    # Gravsteinene til og med dette nummeret er slettet; eldre markører avvises
+    laveste_sekvens = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Endringsepoke"
+        verbose_name_plural = "Endringsepoker"
+
+    def __str__(self):
+        return self.epoke
+
+
+# ============================================================================
+# PROJEKSJONER (lesemodeller bygget fra UtlanHendelse, se projeksjoner.py)
+# ============================================================================
+
+class ProjeksjonMarkor(models.Model):
+    """Siste hendelse hver projeksjon har behandlet."""
+
+    navn = models.CharField(max_length=50, primary_key=True)
+    siste_hendelse_id = models.BigIntegerField(default=0)
+    oppdatert = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.navn} @ {self.siste_hendelse_id}"
+
+
+class ProjTilgjengelighet(models.Model):
+    """Aktivt utlån per ski-item. Items uten rad (eller uten utlån) er ledige."""
+
+    ski_item_id = models.BigIntegerField(primary_key=True)
+    aktivt_utlan_id = models.BigIntegerField(blank=True, null=True)
+
+
+class ProjBrukerTelling(models.Model):
+    """Antall aktive og totale utlån per bruker."""
+
+    bruker_id = models.BigIntegerField(primary_key=True)
+    aktive = models.IntegerField(default=0)
+    totalt = models.IntegerField(default=0)
+
+
+class ProjDagStatistikk(models.Model):
+    """Antall utlån og returer per dag."""
+
+    dato = models.DateField(primary_key=True)
+    utlant = models.IntegerField(default=0)
+    returnert = models.IntegerField(default=0)
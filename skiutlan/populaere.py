@@ -0,0 +1,105 @@
+"""
+Mest utlånte items og størrelser per type (rapport_populaere), til
+planlegging av innkjøp.
+
+Rangeringen gjøres i databasen med RANK() OVER (PARTITION BY type_ski ...)
+i én spørring, slik at bare de K øverste plassene per type kommer tilbake,
+uansett hvor mange utlån perioden har. Utlånene telles først per item
+(GROUP BY ski_item_id), og først deretter slås itemene opp, så arbeidet
+er én gjennomgang av utlånene i perioden pluss ett oppslag per item som
+er lånt ut. Arkivet leses bare når perioden går lenger tilbake enn
+arkivgrensen (se arkiv.py).
+
+Like mange utlån gir lik plass, så en type kan få flere enn K rader.
+"""
+
+from datetime import date, datetime, time
+
+from django.db import connection
+from django.utils import timezone
+
+from .arkiv import trenger_arkiv
+from .models import SkiItem, Utlan, UtlanArkiv
+
+
+# Sesongen regnes fra 1. oktober til 1. oktober året etter
+SESONG_START_MANED = 10
+
+STANDARD_K = 5
+MAKS_K = 50
+
+
+def sesong(dag=None):
+    """(fra, til) for sesongen dag hører til, som datoer (til er eksklusiv)."""
+    dag = dag or timezone.localdate()
+    ar = dag.year if dag.month >= SESONG_START_MANED else dag.year - 1
+    return date(ar, SESONG_START_MANED, 1), date(ar + 1, SESONG_START_MANED, 1)
+
+
+def _tidspunkt(dag):
+    return connection.ops.adapt_datetimefield_value(timezone.make_aware(datetime.combine(dag, time.min)))
+
+
+def topp(fra, til, k=STANDARD_K, lokasjon_id=None):
+    """
+    De k mest utlånte items og størrelsene per type for utlån gjort fra og
+    med dagen fra til (men ikke med) dagen til, eventuelt bare på én lokasjon.
+
+    Returnerer [{'type_ski', 'navn', 'enhet', 'items': [...], 'storrelser': [...]}]
+    i samme rekkefølge som SkiItem.SKI_TYPES, for typene som har utlån.
+    Hvert item er {'plass', 'id', 'navn', 'storrelse', 'antall'} og hver
+    størrelse {'plass', 'storrelse', 'antall'}.
+    """
+    tabeller = [Utlan._meta.db_table]
+    if trenger_arkiv(fra):
+        tabeller.append(UtlanArkiv._meta.db_table)
+    filter_sql = 'utlant_dato >= %s AND utlant_dato < %s'
+    filter_parametre = [_tidspunkt(fra), _tidspunkt(til)]
+    if lokasjon_id is not None:
+        filter_sql += ' AND lokasjon_id = %s'
+        filter_parametre.append(lokasjon_id)
+
+    utlan_sql = ' UNION ALL '.join(
+        f'SELECT ski_item_id FROM {connection.ops.quote_name(tabell)} WHERE {filter_sql}'
+        for tabell in tabeller
+    )
+    items = connection.ops.quote_name(SkiItem._meta.db_table)
+    sql = f'''
+        WITH utlan AS ({utlan_sql}),
+        per_item AS (
+            SELECT i.type_ski, i.id, i.navn, i.storrelse, t.antall
+            FROM (SELECT ski_item_id, COUNT(*) AS antall FROM utlan GROUP BY ski_item_id) t
+            JOIN {items} i ON i.id = t.ski_item_id
+        ),
+        items AS (
+            SELECT type_ski, id, navn, storrelse, antall,
+                   RANK() OVER (PARTITION BY type_ski ORDER BY antall DESC) AS plass
+            FROM per_item
+        ),
+        storrelser AS (
+            SELECT type_ski, storrelse, SUM(antall) AS antall,
+                   RANK() OVER (PARTITION BY type_ski ORDER BY SUM(antall) DESC) AS plass
+            FROM per_item GROUP BY type_ski, storrelse
+        )
+        SELECT 'items', type_ski, plass, id, navn, storrelse, antall FROM items WHERE plass <= %s
+        UNION ALL
+        SELECT 'storrelser', type_ski, plass, NULL, NULL, storrelse, antall FROM storrelser WHERE plass <= %s
+        ORDER BY 2, 1, 3, 6, 5
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, filter_parametre * len(tabeller) + [k, k])
+        rader = cursor.fetchall()
+
+    per_type = {}
+    for art, type_ski, plass, item_id, navn, storrelse, antall in rader:
+        grupper = per_type.setdefault(type_ski, {'items': [], 'storrelser': []})
+        if art == 'items':
+            grupper['items'].append(
+                {'plass': plass, 'id': item_id, 'navn': navn, 'storrelse': storrelse, 'antall': antall})
+        else:
+            grupper['storrelser'].append({'plass': plass, 'storrelse': storrelse, 'antall': antall})
+
+    return [
+        {'type_ski': type_ski, 'navn': navn, 'enhet': 'EU' if type_ski == 'stovler' else 'cm', **per_type[type_ski]}
+        for type_ski, navn in SkiItem.SKI_TYPES if type_ski in per_type
+    ]
@@ -0,0 +1,145 @@
+"""
+Prognose for ledige ski-items fremover i tid.
+
+Et utlånt item regnes som ledig igjen fra planlagt_retur. I stedet for å
+telle ledige items med én spørring per tidspunkt hentes de aktive utlånenes
+planlagte returer sortert (i indeksrekkefølge), og antall ledige regnes ut
+med én gjennomgang av endepunktene (sweep line). En hel tidslinje koster
+dermed to spørringer uansett hvor mange tidspunkter den dekker: antall items
+i utvalget og de planlagte returene.
+
+Forsinkede utlån vet vi ikke når kommer tilbake; de regnes som utlånt i hele
+perioden. Systemet har ingen reservasjoner ennå. Kommer de, legges de inn
+som endepunkter med -1 ved start og +1 ved slutt, uten andre endringer.
+"""
+
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import SkiItem, Utlan
+
+
+# Tidspunktet på dagen prognosen i rapporter viser (når utleien åpner)
+APNINGSTID = time(9)
+
+
+def _utvalg(type_ski=None, storrelse_fra=None, storrelse_til=None, lokasjon_id=None):
+    """Filtre på SkiItem for et utvalg; storrelsene er inklusive (cm)."""
+    filtre = {}
+    if type_ski:
+        filtre['type_ski'] = type_ski
+    if storrelse_fra is not None:
+        filtre['storrelse__gte'] = storrelse_fra
+    if storrelse_til is not None:
+        filtre['storrelse__lte'] = storrelse_til
+    if lokasjon_id is not None:
+        filtre['lokasjon_id'] = lokasjon_id
+    return filtre
+
+
+def _returer(filtre):
+    """Spørring for (type_ski, planlagt_retur) for aktive utlån i utvalget, sortert på retur."""
+    utlan = Utlan.objects.aktive().filter(**{f'ski_item__{felt}': verdi for felt, verdi in filtre.items()
+                                            if felt != 'lokasjon_id'})
+    if 'lokasjon_id' in filtre:
+        # Et utlånt item kan ikke flyttes, så utlånets lokasjon er itemets
+        utlan = utlan.filter(lokasjon_id=filtre['lokasjon_id'])
+    return utlan.order_by('planlagt_retur').values_list('ski_item__type_ski', 'planlagt_retur')
+
+
+def sveip(ledige, endringer, tidspunkter):
+    """
+    Antall ledige ved hvert av tidspunkter (sortert stigende).
+
+    ledige er antallet før første endring, og endringer er [(tid, endring)]
+    sortert på tid. En endring gjelder fra og med sitt tidspunkt.
+    """
+    resultat = []
+    i = 0
+    for tidspunkt in tidspunkter:
+        while i < len(endringer) and endringer[i][0] <= tidspunkt:
+            ledige += endringer[i][1]
+            i += 1
+        resultat.append(ledige)
+    return resultat
+
+
+def tidslinje(fra, til, **utvalg):
+    """
+    Antall ledige items i utvalget (se _utvalg) mellom fra og til.
+
+    Returnerer en dict med totalt, utlant og forsinket (nå), og punkter:
+    [(tidspunkt, ledige), ...] der første punkt er fra og hvert neste er et
+    tidspunkt i (fra, til] der antallet endres. Et fra i fortiden gir
+    antallet nå i første punkt.
+    """
+    na = timezone.now()
+    filtre = _utvalg(**utvalg)
+    totalt = SkiItem.objects.filter(**filtre).count()
+    returer = [retur for _, retur in _returer(filtre)]
+
+    forsinket = bisect_right(returer, na)
+    ledige = totalt - len(returer)
+    # Forsinkede utlån gir ingen endring; de andre blir ledige ved planlagt retur
+    endringer = [(retur, 1) for retur in returer[forsinket:]]
+
+    start = max(fra, na)
+    ledige_ved_start = sveip(ledige, endringer, [start])[0]
+    punkter = [(fra, ledige_ved_start)]
+    for retur, endring in endringer:
+        if retur <= start:
+            continue
+        if retur > til:
+            break
+        if punkter[-1][0] == retur:
+            punkter[-1] = (retur, punkter[-1][1] + endring)
+        else:
+            punkter.append((retur, punkter[-1][1] + endring))
+
+    return {
+        'totalt': totalt,
+        'utlant': len(returer),
+        'forsinket': forsinket,
+        'punkter': punkter,
+    }
+
+
+def ledige_ved(punkter, tidspunkt):
+    """Antall ledige ved tidspunkt ut fra punktene i en tidslinje (None før første punkt)."""
+    indeks = bisect_right([t for t, _ in punkter], tidspunkt)
+    return punkter[indeks - 1][1] if indeks else None
+
+
+def daglig_prognose(dager=14, klokkeslett=APNINGSTID, **utvalg):
+    """
+    Ledige items per skitype ved klokkeslett hver dag de neste dagene.
+
+    Returnerer (datoer, {type_ski: [ledige per dato]}) med to spørringer for
+    alle typene til sammen.
+    """
+    na = timezone.now()
+    idag = timezone.localdate(na)
+    datoer = [idag + timedelta(days=i) for i in range(dager)]
+    tidspunkter = [
+        max(na, timezone.make_aware(datetime.combine(dato, klokkeslett))) for dato in datoer
+    ]
+
+    filtre = _utvalg(**utvalg)
+    totalt = dict(
+        SkiItem.objects.filter(**filtre).order_by().values_list('type_ski').annotate(antall=Count('id'))
+    )
+    endringer = defaultdict(list)
+    utlant = defaultdict(int)
+    for type_ski, retur in _returer(filtre):
+        utlant[type_ski] += 1
+        if retur > na:
+            endringer[type_ski].append((retur, 1))
+
+    return datoer, {
+        type_ski: sveip(antall - utlant[type_ski], endringer[type_ski], tidspunkter)
+        for type_ski, antall in totalt.items()
+    }
@@ -0,0 +1,179 @@
+"""
+Projeksjoner: lesemodeller som bygges inkrementelt fra hendelsesloggen.
+
+Hver projeksjon har en lagret markør (ProjeksjonMarkor) med id-en til siste
+behandlede hendelse. oppdater() leser bare hendelsene etter markøren, og
+skriver lesemodellen og den nye markøren i samme transaksjon, slik at hver
+hendelse telles nøyaktig én gang. spill_av() nullstiller lesemodellen og
+bygger den på nytt fra første hendelse.
+
+Hendelsene inneholder hele tilstanden til utlånet. En projeksjon beskriver
+derfor bare hvilket bidrag én tilstand gir (bidrag()); ved en ny hendelse
+trekkes bidraget fra forrige tilstand av samme utlån fra, og bidraget fra
+den nye tilstanden legges til.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from .models import (
+    UtlanHendelse, ProjeksjonMarkor,
+    ProjTilgjengelighet, ProjBrukerTelling, ProjDagStatistikk,
+)
+
+
+class Projeksjon:
+    """Baseklasse. Underklasser setter navn og modell og implementerer bidrag()."""
+
+    navn = None
+    modell = None
+
+    def bidrag(self, tilstand, fortegn, endringer):
+        """
+        Legger bidraget fra én utlånstilstand (en UtlanHendelse) til i
+        endringer, med fortegn +1 (ny tilstand) eller -1 (forrige tilstand).
+        """
+        raise NotImplementedError
+
+    def ny_endringer(self):
+        return Counter()
+
+    def lagre(self, endringer):
+        """Skriver de akkumulerte endringene for en batch til lesemodellen."""
+        raise NotImplementedError
+
+    def nullstill(self):
+        self.modell.objects.all().delete()
+
+
+class TellerProjeksjon(Projeksjon):
+    """
+    Projeksjon der lesemodellen er tellere. endringer er en Counter med
+    (nøkkel, felt) -> delta, som skrives med F()-uttrykk.
+    """
+
+    nokkelfelt = None
+
+    def lagre(self, endringer):
+        per_nokkel = {}
+        for (nokkel, felt), delta in endringer.items():
+            if delta:
+                per_nokkel.setdefault(nokkel, {})[felt] = delta
+
+        for nokkel, deltaer in per_nokkel.items():
+            oppdatert = self.modell.objects.filter(**{self.nokkelfelt: nokkel}).update(
+                **{felt: F(felt) + delta for felt, delta in deltaer.items()})
+            if not oppdatert:
+                self.modell.objects.create(**{self.nokkelfelt: nokkel}, **deltaer)
+
+
+class TilgjengelighetProjeksjon(Projeksjon):
+    """Hvilket utlån (om noe) hvert ski-item er utlånt i nå."""
+
+    navn = 'tilgjengelighet'
+    modell = ProjTilgjengelighet
+
+    def ny_endringer(self):
+        # Operasjonene må utføres i rekkefølge, så her brukes en liste
+        return []
+
+    def bidrag(self, tilstand, fortegn, endringer):
+        if tilstand.er_aktivt:
+            endringer.append((fortegn, tilstand.ski_item_id, tilstand.utlan_id))
+
+    def lagre(self, endringer):
+        for fortegn, ski_item_id, utlan_id in endringer:
+            if fortegn > 0:
+                ProjTilgjengelighet.objects.update_or_create(
+                    ski_item_id=ski_item_id, defaults={'aktivt_utlan_id': utlan_id})
+            else:
+                # Fjern bare hvis det fortsatt er dette utlånet som er registrert
+                ProjTilgjengelighet.objects.filter(
+                    ski_item_id=ski_item_id, aktivt_utlan_id=utlan_id).update(aktivt_utlan_id=None)
+
+
+class BrukerTellingProjeksjon(TellerProjeksjon):
+    """Aktive og totale utlån per bruker."""
+
+    navn = 'bruker_telling'
+    modell = ProjBrukerTelling
+    nokkelfelt = 'bruker_id'
+
+    def bidrag(self, tilstand, fortegn, endringer):
+        if tilstand.type == 'slettet':
+            return
+        endringer[(tilstand.bruker_id, 'totalt')] += fortegn
+        if tilstand.er_aktivt:
+            endringer[(tilstand.bruker_id, 'aktive')] += fortegn
+
+
+class DagStatistikkProjeksjon(TellerProjeksjon):
+    """Antall utlån og returer per dag (lokal tid)."""
+
+    navn = 'dag_statistikk'
+    modell = ProjDagStatistikk
+    nokkelfelt = 'dato'
+
+    def bidrag(self, tilstand, fortegn, endringer):
+        if tilstand.type == 'slettet':
+            return
+        endringer[(timezone.localdate(tilstand.utlant_dato), 'utlant')] += fortegn
+        if tilstand.returnert_dato:
+            endringer[(timezone.localdate(tilstand.returnert_dato), 'returnert')] += fortegn
+
+
+PROJEKSJONER = [
+    TilgjengelighetProjeksjon(),
+    BrukerTellingProjeksjon(),
+    DagStatistikkProjeksjon(),
+]
+
+
+def _forrige_tilstander(utlan_ids, til_og_med):
+    """Siste hendelse per utlån med id <= til_og_med, i én spørring."""
+    siste_ids = (
+        UtlanHendelse.objects.filter(utlan_id__in=utlan_ids, id__lte=til_og_med)
+        .values('utlan_id').annotate(siste=Max('id')).values('siste')
+    )
+    return {h.utlan_id: h for h in UtlanHendelse.objects.filter(id__in=siste_ids)}
+
+
+def oppdater(projeksjon, batch_storrelse=1000):
+    """
+    Behandler alle nye hendelser for projeksjonen. Returnerer antall hendelser.
+
+    Hver batch (lesemodell + markør) lagres i én transaksjon.
+    """
+    behandlet = 0
+    while True:
+        with transaction.atomic():
+            markor, _ = ProjeksjonMarkor.objects.select_for_update().get_or_create(navn=projeksjon.navn)
+            hendelser = list(
+                UtlanHendelse.objects.filter(id__gt=markor.siste_hendelse_id).order_by('id')[:batch_storrelse]
+            )
+            if not hendelser:
+                return behandlet
+
+            forrige = _forrige_tilstander({h.utlan_id for h in hendelser}, markor.siste_hendelse_id)
+            endringer = projeksjon.ny_endringer()
+            for hendelse in hendelser:
+                if hendelse.utlan_id in forrige:
+                    projeksjon.bidrag(forrige[hendelse.utlan_id], -1, endringer)
+                projeksjon.bidrag(hendelse, +1, endringer)
+                forrige[hendelse.utlan_id] = hendelse
+            projeksjon.lagre(endringer)
+
+            markor.siste_hendelse_id = hendelser[-1].id
+            markor.save()
+        behandlet += len(hendelser)
+
+
+def spill_av(projeksjon, batch_storrelse=1000):
+    """Bygger projeksjonen på nytt fra første hendelse."""
+    with transaction.atomic():
+        projeksjon.nullstill()
+        ProjeksjonMarkor.objects.update_or_create(navn=projeksjon.navn, defaults={'siste_hendelse_id': 0})
+    return oppdater(projeksjon, batch_storrelse)
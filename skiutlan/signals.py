@@ -0,0 +1,95 @@
+"""
+Signaler for skiutlån-systemet.
+
+Holder avledede data (som cachede template-fragmenter) i synk når
+modellene endres. Kobles til i SkiutlanConfig.ready().
+"""
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import direkte, endringer, hurtigbuffer, lokasjoner, sok, sokeindeks
+from .models import Bruker, LagretSok, Lokasjon, SkiItem, Utlan
+
+
+@receiver(post_save, sender=Utlan)
+@receiver(post_delete, sender=Utlan)
+def utlan_endret(sender, instance, **kwargs):
+    """Et utlån er opprettet, returnert, endret eller slettet."""
+    hurtigbuffer.bump_versjon('ski_item', instance.ski_item_id)
+    hurtigbuffer.bump_versjon('bruker', instance.bruker_id)
+
+
+@receiver(post_save, sender=Bruker)
+def bruker_endret(sender, instance, **kwargs):
+    """Navn og telefon vises i utlånsradene."""
+    hurtigbuffer.bump_versjon('bruker', instance.id)
+
+
+@receiver(post_save, sender=SkiItem)
+@receiver(post_delete, sender=SkiItem)
+@receiver(post_save, sender=Bruker)
+@receiver(post_delete, sender=Bruker)
+@receiver(post_save, sender=Utlan)
+@receiver(post_delete, sender=Utlan)
+def objekt_endret(sender, instance, **kwargs):
+    """Objektcachen (hurtigbuffer.hent_objekt) leser raden på nytt."""
+    hurtigbuffer.glem_objekter(sender, [instance.pk])
+
+
+@receiver(post_save, sender=SkiItem)
+@receiver(post_delete, sender=SkiItem)
+def ski_item_lagt_til_eller_slettet(sender, instance, created=False, **kwargs):
+    """Holder Lokasjon.antall_ski_items oppdatert. Flytting gjøres i tjenester.py."""
+    endring = 1 if created else -1 if kwargs['signal'] is post_delete else 0
+    if endring:
+        Lokasjon.objects.filter(id=instance.lokasjon_id).update(
+            antall_ski_items=F('antall_ski_items') + endring)
+
+
+@receiver(post_save, sender=Lokasjon)
+@receiver(post_delete, sender=Lokasjon)
+def lokasjon_endret(sender, instance, **kwargs):
+    """Lokasjonsvelgeren i menyen leser en cachet liste."""
+    lokasjoner.glem_alle()
+
+
+@receiver(post_save, sender=SkiItem)
+@receiver(post_delete, sender=SkiItem)
+@receiver(post_save, sender=Bruker)
+@receiver(post_delete, sender=Bruker)
+@receiver(post_save, sender=Utlan)
+@receiver(post_delete, sender=Utlan)
+def rad_endret_for_sok(sender, instance, **kwargs):
+    """Lagrede søk og hurtigsøket oppdateres for raden etter commit (se sok.py og sokeindeks.py)."""
+    navn = {SkiItem: 'ski_items', Bruker: 'brukere', Utlan: 'utlan'}[sender]
+    sok.endret(navn, [instance.pk])
+    sokeindeks.endret(navn, [instance.pk])
+
+
+@receiver(post_save, sender=SkiItem)
+@receiver(post_delete, sender=SkiItem)
+@receiver(post_save, sender=Bruker)
+@receiver(post_delete, sender=Bruker)
+@receiver(post_save, sender=Utlan)
+@receiver(post_delete, sender=Utlan)
+def rad_endret_for_kiosker(sender, instance, **kwargs):
+    """Endringsloggen kioskene synkroniserer etter, i samme transaksjon (se endringer.py)."""
+    endringer.registrer(endringer.TYPE_FOR_MODELL[sender], [instance.pk], slettet=kwargs['signal'] is post_delete)
+
+
+@receiver(post_save, sender=SkiItem)
+@receiver(post_delete, sender=SkiItem)
+@receiver(post_save, sender=Utlan)
+@receiver(post_delete, sender=Utlan)
+def rad_endret_for_dashbord(sender, instance, **kwargs):
+    """Åpne dashbord i denne prosessen oppdateres etter commit (se direkte.py)."""
+    direkte.endret()
+
+
+@receiver(post_save, sender=LagretSok)
+@receiver(post_delete, sender=LagretSok)
+def lagret_sok_endret(sender, instance, **kwargs):
+    """Menyen viser antall treff fra en cachet liste."""
+    sok.glem_meny()
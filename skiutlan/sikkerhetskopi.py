@@ -0,0 +1,182 @@
+"""
+Sikkerhetskopi av SQLite-databasen mens systemet er i bruk.
+
+Å kopiere db.sqlite3 med cp mens noen skriver kan gi en ødelagt kopi.
+Kopien tas derfor med SQLites backup-API, som leser databasen side for side
+i en konsistent tilstand. Kopieringen skjer i små steg (sider_per_steg) med
+en pause mellom hvert steg; leselåsen holdes bare under selve steget, så
+utlån i skranken slipper til mellom stegene i stedet for å vente på hele
+kopien.
+
+Skriver en annen forbindelse til databasen mellom to steg, starter SQLite
+kopien på nytt. Er det mye trafikk, blir en stegvis kopi derfor aldri
+ferdig; etter maks_omstarter omstarter kopieres resten i ett steg. Med WAL
+(som i produksjon) stenger ikke en leser ute skrivere, så ett steg
+blokkerer ikke utlån der heller.
+
+Kopien kontrolleres med PRAGMA integrity_check før den komprimeres (gzip,
+i biter, uten å lese hele filen inn i minnet), og bare de nyeste
+settings.SKIUTLAN_SIKKERHETSKOPI_BEHOLD kopiene beholdes.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from . import endringer
+from .models import Utlan
+
+
+FILPREFIKS = 'lendly-'
+FILENDELSE = '.sqlite3.gz'
+BITSTORRELSE = 1024 * 1024
+
+
+class SikkerhetskopiFeil(Exception):
+    """Kopien kunne ikke tas, kontrolleres eller gjenopprettes."""
+
+
+def _raa_forbindelse():
+    connection.ensure_connection()
+    return connection.connection
+
+
+def kontroller(sti):
+    """Kjører PRAGMA integrity_check på en (ukomprimert) databasefil."""
+    db = sqlite3.connect(sti)
+    try:
+        resultat = [rad[0] for rad in db.execute('PRAGMA integrity_check')]
+        tabeller = {rad[0] for rad in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except sqlite3.DatabaseError as feil:
+        raise SikkerhetskopiFeil(f'{sti} kan ikke leses som en SQLite-database: {feil}') from None
+    finally:
+        db.close()
+    if resultat != ['ok']:
+        raise SikkerhetskopiFeil(f'Integritetssjekken feilet for {sti}: {"; ".join(resultat[:5])}')
+    if Utlan._meta.db_table not in tabeller:
+        raise SikkerhetskopiFeil(f'{sti} ser ikke ut til å være en lendly-database.')
+
+
+class _ForMangeOmstarter(Exception):
+    pass
+
+
+def kopier(mal, sider_per_steg=64, pause=0.005, maks_omstarter=3):
+    """
+    Kopierer databasen til filen mal med backup-API-et, i steg på
+    sider_per_steg sider og med pause sekunder mellom stegene.
+
+    Returnerer (antall sider, antall omstarter). Starter kopien på nytt
+    mer enn maks_omstarter ganger, tas resten i ett steg.
+    """
+    tilstand = {'sider': 0, 'igjen': None, 'omstarter': 0}
+
+    def fremdrift(status, igjen, totalt):
+        if tilstand['igjen'] is not None and igjen > tilstand['igjen']:
+            tilstand['omstarter'] += 1
+            if tilstand['omstarter'] > maks_omstarter:
+                raise _ForMangeOmstarter
+        tilstand['igjen'] = igjen
+        tilstand['sider'] = totalt
+        if pause:
+            time.sleep(pause)
+
+    db = sqlite3.connect(mal)
+    try:
+        try:
+            _raa_forbindelse().backup(db, pages=sider_per_steg, progress=fremdrift)
+        except _ForMangeOmstarter:
+            _raa_forbindelse().backup(db)
+    finally:
+        db.close()
+    return tilstand['sider'], tilstand['omstarter']
+
+
+def komprimer(kilde, mal):
+    """Gzip-komprimerer kilde til mal i biter. Skriver til en midlertidig fil først."""
+    midlertidig = f'{mal}.tmp'
+    with open(kilde, 'rb') as inn, gzip.open(midlertidig, 'wb', compresslevel=6) as ut:
+        shutil.copyfileobj(inn, ut, BITSTORRELSE)
+    os.replace(midlertidig, mal)
+
+
+def roter(katalog, behold):
+    """Sletter alle unntatt de behold nyeste kopiene. Returnerer de slettede."""
+    filer = sorted(Path(katalog).glob(f'{FILPREFIKS}*{FILENDELSE}'), reverse=True)
+    slettet = filer[behold:]
+    for sti in slettet:
+        sti.unlink()
+    return slettet
+
+
+def ta_sikkerhetskopi(katalog=None, sider_per_steg=64, pause=0.005, behold=None, maks_omstarter=3):
+    """
+    Tar en kontrollert, komprimert kopi av databasen i katalog og roterer
+    gamle kopier. Returnerer en dict med sti, størrelser og tidsbruk.
+    """
+    katalog = Path(katalog or settings.SKIUTLAN_SIKKERHETSKOPI_KATALOG)
+    behold = settings.SKIUTLAN_SIKKERHETSKOPI_BEHOLD if behold is None else behold
+    katalog.mkdir(parents=True, exist_ok=True)
+    mal = katalog / f'{FILPREFIKS}{timezone.localtime():%Y%m%d-%H%M%S-%f}{FILENDELSE}'
+
+    start = time.perf_counter()
+    # Den ukomprimerte kopien legges i samme katalog, ikke i /tmp, som kan
+    # være for liten
+    with tempfile.TemporaryDirectory(dir=katalog) as arbeid:
+        ukomprimert = os.path.join(arbeid, 'kopi.sqlite3')
+        sider, omstarter = kopier(ukomprimert, sider_per_steg, pause, maks_omstarter)
+        kopiert = time.perf_counter()
+        kontroller(ukomprimert)
+        storrelse = os.path.getsize(ukomprimert)
+        komprimer(ukomprimert, mal)
+
+    return {
+        'sti': mal,
+        'sider': sider,
+        'omstarter': omstarter,
+        'bytes': storrelse,
+        'komprimert_bytes': mal.stat().st_size,
+        'kopiering_sekunder': kopiert - start,
+        'sekunder': time.perf_counter() - start,
+        'slettet': roter(katalog, behold),
+    }
+
+
+def gjenopprett(sti):
+    """
+    Erstatter innholdet i databasen med kopien i sti (.sqlite3.gz eller
+    ukomprimert). Kopien pakkes ut og kontrolleres før noe skrives, og
+    skrives så inn i ett steg med backup-API-et, slik at andre forbindelser
+    aldri ser en halvveis gjenopprettet database.
+
+    Endringsloggen er spolt tilbake til kopien, så endringsepoken byttes
+    etterpå; kioskene synkroniserer da på nytt fra starten.
+    """
+    sti = Path(sti)
+    if not sti.exists():
+        raise SikkerhetskopiFeil(f'Fant ikke {sti}.')
+
+    with tempfile.TemporaryDirectory(dir=sti.parent) as arbeid:
+        ukomprimert = os.path.join(arbeid, 'gjenopprett.sqlite3')
+        apne = gzip.open if sti.name.endswith('.gz') else open
+        try:
+            with apne(sti, 'rb') as inn, open(ukomprimert, 'wb') as ut:
+                shutil.copyfileobj(inn, ut, BITSTORRELSE)
+        except (OSError, EOFError) as feil:
+            raise SikkerhetskopiFeil(f'Kunne ikke pakke ut {sti}: {feil}') from None
+        kontroller(ukomprimert)
+
+        kilde = sqlite3.connect(ukomprimert)
+        try:
+            kilde.backup(_raa_forbindelse())
+        finally:
+            kilde.close()
+    endringer.ny_epoke()
@@ -0,0 +1,368 @@
+"""
+Avansert søk og lagrede søk.
+
+Parametrene til avansert_sok normaliseres til en spesifikasjon
+(normaliser()), og filtrene lages fra den samme spesifikasjonen både for
+søkesiden og for lagrede søk, slik at et lagret søk gir det samme som søket.
+
+Et lagret søk (LagretSok) har treffene sine som id-lister. Når ski-items,
+brukere eller utlån endres, kalles endret() med id-ene. Etter commit
+evalueres bare de radene mot alle lagrede søk, med én spørring per modell,
+og listene justeres; hele søket kjøres bare når det lagres eller oppdateres
+manuelt. Antall treff i menyen leses fra cachen.
+
+Utlån som er flyttet til arkivet (arkiv.py) beholder id-en sin og er
+fortsatt treff, som i avansert_sok. arkiver_utlan sletter dem fra Utlan,
+og da evalueres de på nytt mot UtlanArkiv i stedet for å fjernes.
+
+Søk etter forsinkede utlån avhenger av klokka: et utlån blir forsinket uten
+at noe endres. Slike søk lagrer alle aktive treff med planlagt retur
+(LagretSok.frister), og det telles hvilke som er forsinket når søket vises.
+"""
+
+import json
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date
+from functools import reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import Bruker, LagretSok, SkiItem, Utlan, UtlanArkiv
+
+
+UTLAN_STATUSER = ('aktive', 'returnerte', 'forsinket')
+_CACHE_NOKKEL = 'skiutlan:lagrede_sok'
+
+
+# ============================================================================
+# SPESIFIKASJON OG FILTRE
+# ============================================================================
+
+def normaliser(data, lokasjon_id=None):
+    """
+    Gjør søkeparametrene (f.eks. request.GET) om til en spesifikasjon med
+    bare gyldige, ikke-tomme filtre. Søketeksten får enkle mellomrom og
+    datoene ISO-format; ugyldige verdier utelates.
+    """
+    spesifikasjon = {}
+    tekst = ' '.join(data.get('sok_tekst', '').split())[:100]
+    if tekst:
+        spesifikasjon['sok_tekst'] = tekst
+    if data.get('ski_type') in dict(SkiItem.SKI_TYPES):
+        spesifikasjon['ski_type'] = data['ski_type']
+    if data.get('tilstand') in dict(SkiItem._meta.get_field('tilstand').choices):
+        spesifikasjon['tilstand'] = data['tilstand']
+    if data.get('utlan_status') in UTLAN_STATUSER:
+        spesifikasjon['utlan_status'] = data['utlan_status']
+    for felt in ('dato_fra', 'dato_til'):
+        try:
+            dato = parse_date(data.get(felt) or '')
+        except ValueError:
+            dato = None
+        if dato is not None:
+            spesifikasjon[felt] = dato.isoformat()
+    if lokasjon_id is not None:
+        spesifikasjon['lokasjon'] = lokasjon_id
+    return spesifikasjon
+
+
+def nokkel(spesifikasjon):
+    return json.dumps(spesifikasjon, sort_keys=True, ensure_ascii=False)
+
+
+def _tekst(felter, tekst):
+    q = Q()
+    for felt in felter:
+        q |= Q(**{f'{felt}__icontains': tekst})
+    return q
+
+
+def ski_item_filter(spesifikasjon):
+    q = Q()
+    if 'sok_tekst' in spesifikasjon:
+        q &= _tekst(['navn', 'type_ski'], spesifikasjon['sok_tekst'])
+    if 'ski_type' in spesifikasjon:
+        q &= Q(type_ski=spesifikasjon['ski_type'])
+    if 'tilstand' in spesifikasjon:
+        q &= Q(tilstand=spesifikasjon['tilstand'])
+    if 'lokasjon' in spesifikasjon:
+        q &= Q(lokasjon_id=spesifikasjon['lokasjon'])
+    return q
+
+
+def bruker_filter(spesifikasjon):
+    return _tekst(['fornavn', 'etternavn', 'telefon', 'epost'], spesifikasjon.get('sok_tekst', ''))
+
+
+def utlan_filter(spesifikasjon):
+    """Filtrene for utlån, uten status (gjelder også UtlanArkiv)."""
+    q = Q()
+    if 'sok_tekst' in spesifikasjon:
+        q &= _tekst(['bruker__fornavn', 'bruker__etternavn', 'ski_item__navn'], spesifikasjon['sok_tekst'])
+    if 'ski_type' in spesifikasjon:
+        q &= Q(ski_item__type_ski=spesifikasjon['ski_type'])
+    if 'dato_fra' in spesifikasjon:
+        q &= Q(utlant_dato__date__gte=date.fromisoformat(spesifikasjon['dato_fra']))
+    if 'dato_til' in spesifikasjon:
+        q &= Q(utlant_dato__date__lte=date.fromisoformat(spesifikasjon['dato_til']))
+    if 'lokasjon' in spesifikasjon:
+        q &= Q(lokasjon_id=spesifikasjon['lokasjon'])
+    return q
+
+
+def _status_filter(spesifikasjon):
+    """Status uten klokkeslett: forsinkede utlån lagres som aktive med frist."""
+    status = spesifikasjon.get('utlan_status')
+    if status in ('aktive', 'forsinket'):
+        return Q(returnert_dato__isnull=True)
+    if status == 'returnerte':
+        return Q(returnert_dato__isnull=False)
+    return Q()
+
+
+# Resultattypene i et lagret søk: (modell, filter, felt på LagretSok)
+TYPER = {
+    'ski_items': (SkiItem, ski_item_filter, 'ski_item_ids'),
+    'brukere': (Bruker, bruker_filter, 'bruker_ids'),
+    'utlan': (Utlan, lambda s: utlan_filter(s) & _status_filter(s), 'utlan_ids'),
+}
+
+
+def _kan_vaere_arkivert(spesifikasjon):
+    """Arkivet har bare returnerte utlån."""
+    return spesifikasjon.get('utlan_status') not in ('aktive', 'forsinket')
+
+
+def treff_typer(spesifikasjon):
+    """
+    Resultattypene filtrene gjelder. Et søk etter forsinkede alpinski gir
+    utlån, ikke alle alpinski; brukere søkes bare med søketekst.
+    """
+    typer = set()
+    if spesifikasjon.keys() & {'sok_tekst', 'utlan_status', 'dato_fra', 'dato_til'}:
+        typer.add('utlan')
+    if spesifikasjon.keys() & {'sok_tekst', 'tilstand'} or ('ski_type' in spesifikasjon and not typer):
+        typer.add('ski_items')
+    if 'sok_tekst' in spesifikasjon:
+        typer.add('brukere')
+    return typer
+
+
+def _er_forsinket_sok(spesifikasjon):
+    return spesifikasjon.get('utlan_status') == 'forsinket'
+
+
+# ============================================================================
+# LAGREDE SØK
+# ============================================================================
+
+def beregn(lagret):
+    """Kjører hele søket og lagrer treffene (én spørring per resultattype)."""
+    spesifikasjon = lagret.spesifikasjon
+    typer = treff_typer(spesifikasjon)
+    for navn, (modell, filter_, felt) in TYPER.items():
+        treff = modell.objects.filter(filter_(spesifikasjon)) if navn in typer else modell.objects.none()
+        if navn == 'utlan':
+            rader = list(treff.order_by('id').values_list('id', 'planlagt_retur'))
+            if navn in typer and _kan_vaere_arkivert(spesifikasjon):
+                rader += UtlanArkiv.objects.filter(filter_(spesifikasjon)).values_list('id', 'planlagt_retur')
+                rader.sort()
+            setattr(lagret, felt, [utlan_id for utlan_id, _ in rader])
+            lagret.frister = (
+                {str(utlan_id): retur.timestamp() for utlan_id, retur in rader}
+                if _er_forsinket_sok(spesifikasjon) else {}
+            )
+        else:
+            setattr(lagret, felt, list(treff.order_by('id').values_list('id', flat=True)))
+    lagret.save()
+    return lagret
+
+
+def lagre(navn, spesifikasjon):
+    """
+    Lagrer et søk og beregner treffene. Finnes samme søk fra før, returneres
+    det i stedet. Returnerer (lagret søk, opprettet).
+    """
+    lagret, opprettet = LagretSok.objects.get_or_create(
+        nokkel=nokkel(spesifikasjon), defaults={'navn': navn, 'spesifikasjon': spesifikasjon})
+    if opprettet:
+        beregn(lagret)
+    return lagret, opprettet
+
+
+def _flagg(q):
+    return ExpressionWrapper(q, output_field=BooleanField()) if q else Value(True)
+
+
+def _rader(modell, grunnlag, filter_, sokene, med_frist):
+    """(id, [planlagt_retur,] treff i hvert søk) for radene i grunnlag."""
+    return list(modell.objects.filter(grunnlag).annotate(**{
+        f'sok_{s.id}': _flagg(filter_(s.spesifikasjon)) for s in sokene
+    }).values_list('id', *(['planlagt_retur'] if med_frist else []), *[f'sok_{s.id}' for s in sokene]))
+
+
+def oppdater(endringer):
+    """
+    Justerer treffene i alle lagrede søk for radene som er endret.
+
+    endringer er {'ski_items'|'brukere'|'utlan': id-er}. Hver endret rad
+    evalueres mot alle søkene i én spørring per modell; rader som ikke
+    finnes lenger fjernes. Utlån som mangler i Utlan, og utlånene til endrede
+    brukere og items, evalueres også mot arkivet (én spørring til, og bare
+    når noe kan ligge der). Returnerer søkene som ble endret.
+    """
+    alle_sok = list(LagretSok.objects.all())
+    if not alle_sok:
+        return []
+    endringer = {navn: set(ids) for navn, ids in endringer.items() if ids}
+
+    grunnlag = {navn: Q(id__in=ids) for navn, ids in endringer.items()}
+    # Utlån treffes også på navnet til bruker og item og typen til itemet,
+    # så utlånene deres må evalueres på nytt når de endres
+    utlan_sok = [s for s in alle_sok if 'utlan' in treff_typer(s.spesifikasjon)]
+    relasjoner = []
+    if endringer.get('ski_items') and any(s.spesifikasjon.keys() & {'sok_tekst', 'ski_type'} for s in utlan_sok):
+        relasjoner.append(Q(ski_item_id__in=endringer['ski_items']))
+    if endringer.get('brukere') and any('sok_tekst' in s.spesifikasjon for s in utlan_sok):
+        relasjoner.append(Q(bruker_id__in=endringer['brukere']))
+    for q in relasjoner:
+        grunnlag['utlan'] = grunnlag.get('utlan', Q()) | q
+
+    endret = set()
+    for navn, (modell, filter_, felt) in TYPER.items():
+        relevante = [s for s in alle_sok if navn in treff_typer(s.spesifikasjon)]
+        if not relevante or navn not in grunnlag:
+            continue
+        kandidater = set(endringer.get(navn, ()))
+
+        rader = _rader(modell, grunnlag[navn], filter_, relevante, navn == 'utlan')
+        if navn == 'utlan' and any(_kan_vaere_arkivert(s.spesifikasjon) for s in relevante):
+            # Slettet fra Utlan: kan være arkivert (samme id)
+            mangler = kandidater - {rad[0] for rad in rader}
+            arkiv_grunnlag = ([Q(id__in=mangler)] if mangler else []) + relasjoner
+            if arkiv_grunnlag:
+                rader += _rader(UtlanArkiv, reduce(or_, arkiv_grunnlag), filter_, relevante, True)
+
+        treff = defaultdict(set)
+        frister = {}
+        for rad in rader:
+            kandidater.add(rad[0])
+            flagg = rad[2:] if navn == 'utlan' else rad[1:]
+            if navn == 'utlan':
+                frister[str(rad[0])] = rad[1].timestamp()
+            for s, er_treff in zip(relevante, flagg):
+                if er_treff:
+                    treff[s.id].add(rad[0])
+
+        for s in relevante:
+            for_endring = set(getattr(s, felt))
+            etter = (for_endring - kandidater) | treff[s.id]
+            if navn == 'utlan' and _er_forsinket_sok(s.spesifikasjon):
+                nye_frister = {k: v for k, v in s.frister.items() if int(k) not in kandidater}
+                nye_frister.update({str(i): frister[str(i)] for i in treff[s.id]})
+                if nye_frister != s.frister:
+                    s.frister = nye_frister
+                    endret.add(s)
+            if etter != for_endring:
+                setattr(s, felt, sorted(etter))
+                endret.add(s)
+
+    for s in endret:
+        s.save(update_fields=['ski_item_ids', 'bruker_ids', 'utlan_ids', 'frister', 'oppdatert'])
+    return list(endret)
+
+
+_ventende = threading.local()
+
+
+def _oppdater_ventende():
+    endringer = getattr(_ventende, 'endringer', None)
+    _ventende.endringer = None
+    if endringer:
+        with transaction.atomic():
+            oppdater(endringer)
+
+
+def endret(navn, ids):
+    """
+    Registrerer at rader av en resultattype ('ski_items', 'brukere' eller
+    'utlan') er opprettet, endret eller slettet.
+
+    Kalles fra signals.py, og fra tjenester.py der rader endres med UPDATE.
+    De lagrede søkene oppdateres etter commit, samlet for hele
+    transaksjonen, slik at utlånet ikke venter på dem. Om det finnes lagrede
+    søk, avgjøres av databasen i oppdater(), ikke av menyen i cachen, som kan
+    være gammel i en annen prosess.
+    """
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return
+    if getattr(_ventende, 'endringer', None) is None:
+        _ventende.endringer = defaultdict(set)
+    _ventende.endringer[navn].update(ids)
+    # Det første kallet etter commit tar med alt som er samlet opp. Id-er fra
+    # en transaksjon som ble rullet tilbake blir med i neste oppdatering, som
+    # bare evaluerer dem på nytt mot databasen.
+    transaction.on_commit(_oppdater_ventende, robust=True)
+
+
+# ============================================================================
+# MENYEN
+# ============================================================================
+
+def meny():
+    """
+    De lagrede søkene med det som trengs for å telle treff, fra cachen:
+    [{'id', 'navn', 'spesifikasjon', 'faste', 'frister'}]. faste er antall
+    treff som ikke avhenger av klokka, frister er sorterte planlagte returer
+    for søk etter forsinkede utlån.
+    """
+    sokene = cache.get(_CACHE_NOKKEL)
+    if sokene is None:
+        sokene = []
+        for s in LagretSok.objects.all():
+            forsinket = _er_forsinket_sok(s.spesifikasjon)
+            sokene.append({
+                'id': s.id,
+                'navn': s.navn,
+                'spesifikasjon': s.spesifikasjon,
+                'faste': len(s.ski_item_ids) + len(s.bruker_ids) + (0 if forsinket else len(s.utlan_ids)),
+                'frister': sorted(s.frister.values()),
+            })
+        cache.set(_CACHE_NOKKEL, sokene, timeout=None)
+    return sokene
+
+
+def glem_meny():
+    cache.delete(_CACHE_NOKKEL)
+    transaction.on_commit(lambda: cache.delete(_CACHE_NOKKEL))
+
+
+def antall_treff(oppforing, na=None):
+    """Antall treff for en oppføring fra meny() akkurat nå."""
+    na = (na or timezone.now()).timestamp()
+    return oppforing['faste'] + bisect_left(oppforing['frister'], na)
+
+
+def forsinkede_utlan_ids(lagret, na=None):
+    """Utlånene i et søk etter forsinkede utlån som er forsinket nå, mest forsinket først."""
+    na = (na or timezone.now()).timestamp()
+    return [int(i) for i, frist in sorted(lagret.frister.items(), key=lambda par: par[1]) if frist < na]
+
+
+def i_menyen(na=None):
+    """[(id, navn, antall treff)] slik menyen viser dem nå, fra cachen."""
+    na = na or timezone.now()
+    return [(s['id'], s['navn'], antall_treff(s, na)) for s in meny()]
+
+
+def context_processor(request):
+    """Lagrede søk med antall treff til menyen i base.html."""
+    return {'lagrede_sok': i_menyen}
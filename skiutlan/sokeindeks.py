@@ -0,0 +1,293 @@
+"""
+Hurtigsøket i menyen: én søkeindeks over ski-items, brukere og aktive utlån.
+
+Indeksen er tabellen SokeOrd, med én rad per ord per objekt. Ordene lagres
+med små bokstaver, så et prefikssøk er et intervall i indeksen på ord
+(ord >= 'fje' AND ord < 'fje\\U0010ffff'), og radene har tittel og
+undertittel, så treffene vises uten å hente objektene. Et søk er dermed én
+spørring (to for en etikettkode) uansett hvor mange tabeller det dekker.
+
+Treffene rangeres slik: etikettkode eller id først, så ord som er lik
+søket, så telefonnumre, så navn, så resten. Søk med flere ord slår opp det
+lengste ordet i indeksen og krever at de andre er prefiks av et av ordene
+til objektet (SokeOrd.tekst).
+
+Indeksen holdes oppdatert av endret(), som signals.py og tjenester.py
+kaller med de samme navnene som sok.endret(). Radene byttes ut etter
+commit, samlet per transaksjon. Hele indeksen bygges på nytt med
+manage.py bygg_sokeindeks.
+
+Søket har en tidsfrist (settings.SKIUTLAN_HURTIGSOK_MS). På SQLite avbrytes
+spørringen når fristen er ute, og svaret merkes som ufullstendig i stedet
+for at søkeboksen venter.
+"""
+
+import contextlib
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps as django_apps
+from django.db import OperationalError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import tjenester
+from .models import SokeOrd
+
+
+# Navnene endret() tar imot (som i sok.py) og typene i SokeOrd
+TYPER = {
+    'ski_items': 'ski_item',
+    'brukere': 'bruker',
+    'utlan': 'utlan',
+}
+
+MIN_LENGDE = 2
+# Rader som hentes fra indeksen før rangering; holder søket raskt for korte prefiks
+KANDIDATER = 200
+# Maks treff per type i svaret
+GRENSE = 5
+# Hvor mange SQLite-instruksjoner det går mellom hver sjekk av fristen
+_FRIST_STEG = 200
+_SLUTT = '\U0010ffff'
+
+
+# ============================================================================
+# ORD
+# ============================================================================
+
+def ordene(*tekster):
+    """Ordene i tekstene, med små bokstaver, uten duplikater."""
+    resultat = []
+    for tekst in tekster:
+        for ord_ in re.findall(r'\w+', (tekst or '').lower()):
+            ord_ = ord_[:50]
+            if ord_ not in resultat:
+                resultat.append(ord_)
+    return resultat
+
+
+def telefonord(telefon):
+    """Telefonnummeret som sifre, med og uten landkode: ['4798000000', '98000000']."""
+    sifre = re.sub(r'\D', '', telefon or '')
+    if not sifre:
+        return []
+    if len(sifre) == 10 and sifre.startswith('47'):
+        return [sifre, sifre[2:]]
+    return [sifre]
+
+
+def sokeord(sporring):
+    """Ordene i et søk. Et søk som bare består av sifre og tegnsetting er ett telefonord."""
+    sporring = (sporring or '').strip()
+    if re.fullmatch(r'[\d\s+\-()]+', sporring):
+        return [re.sub(r'\D', '', sporring)]
+    return ordene(sporring)
+
+
+# ============================================================================
+# INDEKSERING
+# ============================================================================
+
+def _dokumenter(type_, ids, apps):
+    """
+    [(objekt_id, lokasjon_id, tittel, undertittel, [(ord, vekt)])] for
+    objektene som skal være i indeksen. Tar apps, slik at migreringen kan
+    bygge indeksen med de historiske modellene.
+    """
+    if type_ == 'ski_item':
+        SkiItem = apps.get_model('skiutlan', 'SkiItem')
+        for item in SkiItem.objects.filter(id__in=ids):
+            yield (
+                item.id, item.lokasjon_id, item.navn,
+                f'{item.get_type_ski_display()}, {item.storrelse} cm',
+                [(o, SokeOrd.VEKT_NAVN) for o in ordene(item.navn)]
+                + [(o, SokeOrd.VEKT_ANNET) for o in ordene(item.get_type_ski_display())],
+            )
+    elif type_ == 'bruker':
+        Bruker = apps.get_model('skiutlan', 'Bruker')
+        for bruker in Bruker.objects.filter(id__in=ids):
+            yield (
+                bruker.id, None, f'{bruker.fornavn} {bruker.etternavn}', bruker.telefon,
+                [(o, SokeOrd.VEKT_ID) for o in telefonord(bruker.telefon)]
+                + [(o, SokeOrd.VEKT_NAVN) for o in ordene(bruker.fornavn, bruker.etternavn)]
+                + [(o, SokeOrd.VEKT_ANNET) for o in ordene((bruker.epost or '').split('@')[0])],
+            )
+    else:
+        Utlan = apps.get_model('skiutlan', 'Utlan')
+        aktive = Utlan.objects.filter(id__in=ids, returnert_dato__isnull=True).select_related('bruker', 'ski_item')
+        for utlan in aktive:
+            bruker = utlan.bruker
+            retur = timezone.localtime(utlan.planlagt_retur)
+            yield (
+                utlan.id, utlan.lokasjon_id, f'{utlan.ski_item.navn} – {bruker.fornavn} {bruker.etternavn}',
+                f'Retur {retur:%d.%m. %H:%M}',
+                [(o, SokeOrd.VEKT_ID) for o in telefonord(bruker.telefon)]
+                + [(o, SokeOrd.VEKT_NAVN) for o in ordene(utlan.ski_item.navn, bruker.fornavn, bruker.etternavn)],
+            )
+
+
+def _bygg(type_, ids, apps):
+    """Bytter ut radene for objektene; objekter som ikke skal være med, fjernes."""
+    SokeOrdModell = apps.get_model('skiutlan', 'SokeOrd')
+    rader = []
+    for objekt_id, lokasjon_id, tittel, undertittel, ord_vekter in _dokumenter(type_, ids, apps):
+        vekter = {}
+        for ord_, vekt in ord_vekter:
+            vekter[ord_] = min(vekt, vekter.get(ord_, vekt))
+        tekst = ' '.join(vekter)[:500]
+        rader.extend(
+            SokeOrdModell(ord=ord_, vekt=vekt, type=type_, objekt_id=objekt_id, lokasjon_id=lokasjon_id,
+                          tittel=tittel[:200], undertittel=undertittel[:200], tekst=tekst)
+            for ord_, vekt in vekter.items()
+        )
+    SokeOrdModell.objects.filter(type=type_, objekt_id__in=ids).delete()
+    SokeOrdModell.objects.bulk_create(rader)
+    return len(rader)
+
+
+def oppdater(endringer, apps=django_apps):
+    """
+    Bygger radene på nytt for objektene som er endret.
+
+    endringer er {'ski_items'|'brukere'|'utlan': id-er}. Navn på items og
+    brukere står også i tittelen til de aktive utlånene deres, så de
+    bygges på nytt sammen med dem.
+    """
+    endringer = {TYPER[navn]: set(ids) for navn, ids in endringer.items() if ids}
+    if 'ski_item' in endringer or 'bruker' in endringer:
+        Utlan = apps.get_model('skiutlan', 'Utlan')
+        pavirket = Q(ski_item_id__in=endringer.get('ski_item', ())) | Q(bruker_id__in=endringer.get('bruker', ()))
+        endringer.setdefault('utlan', set()).update(
+            Utlan.objects.filter(pavirket, returnert_dato__isnull=True).values_list('id', flat=True))
+    with transaction.atomic():
+        for type_, ids in endringer.items():
+            _bygg(type_, list(ids), apps)
+
+
+def bygg_alle(apps=django_apps, batch=1000):
+    """Bygger hele indeksen på nytt. Returnerer antall rader."""
+    modeller = {'ski_item': 'SkiItem', 'bruker': 'Bruker', 'utlan': 'Utlan'}
+    antall = 0
+    with transaction.atomic():
+        apps.get_model('skiutlan', 'SokeOrd').objects.all().delete()
+        for type_, modell in modeller.items():
+            objekter = apps.get_model('skiutlan', modell).objects.order_by('id')
+            if type_ == 'utlan':
+                objekter = objekter.filter(returnert_dato__isnull=True)
+            ids = list(objekter.values_list('id', flat=True))
+            for start in range(0, len(ids), batch):
+                antall += _bygg(type_, ids[start:start + batch], apps)
+    return antall
+
+
+_ventende = threading.local()
+
+
+def _oppdater_ventende():
+    endringer = getattr(_ventende, 'endringer', None)
+    _ventende.endringer = None
+    if endringer:
+        oppdater(endringer)
+
+
+def endret(navn, ids):
+    """
+    Registrerer at rader av en type ('ski_items', 'brukere' eller 'utlan')
+    er opprettet, endret eller slettet. Indeksen oppdateres etter commit,
+    samlet for hele transaksjonen.
+    """
+    ids = [i for i in ids if i is not None]
+    if not ids:
+        return
+    if getattr(_ventende, 'endringer', None) is None:
+        _ventende.endringer = defaultdict(set)
+    _ventende.endringer[navn].update(ids)
+    transaction.on_commit(_oppdater_ventende, robust=True)
+
+
+# ============================================================================
+# SØK
+# ============================================================================
+
+@contextlib.contextmanager
+def tidsfrist(ms):
+    """
+    Avbryter SQLite-spørringer som kjører lenger enn ms millisekunder fra
+    nå; de kaster da OperationalError. Gir en funksjon som sier om fristen
+    er ute. Med ms=None, eller på andre databaser, avbrytes ingenting.
+    """
+    if ms is None or connection.vendor != 'sqlite':
+        yield lambda: False
+        return
+    frist = time.perf_counter() + ms / 1000
+
+    def utlopt():
+        return time.perf_counter() > frist
+
+    connection.ensure_connection()
+    connection.connection.set_progress_handler(lambda: 1 if utlopt() else 0, _FRIST_STEG)
+    try:
+        yield utlopt
+    finally:
+        connection.connection.set_progress_handler(None, 0)
+
+
+def finn(sporring, lokasjon_id=None, grense=GRENSE, budsjett_ms=None):
+    """
+    Søker i indeksen. Returnerer {'grupper': [(type, [treff])], 'ufullstendig': bool},
+    der treffene er dicts med type, id, tittel og undertittel. Gruppene er
+    sortert etter beste treff. Med lokasjon_id tas bare items og utlån fra
+    den lokasjonen med; brukere hører ikke til en lokasjon.
+    """
+    ord_ = sokeord(sporring)
+    item_id = tjenester.tolk_kode(sporring) if ord_ else None
+    oppslag = max(ord_, key=len, default='')
+    if len(oppslag) < MIN_LENGDE and item_id is None:
+        return {'grupper': [], 'ufullstendig': False}
+    andre = [o for o in ord_ if o != oppslag]
+
+    felter = ('ord', 'vekt', 'type', 'objekt_id', 'tittel', 'undertittel', 'tekst')
+    indeks = SokeOrd.objects.all()
+    if lokasjon_id is not None:
+        indeks = indeks.filter(Q(lokasjon_id__isnull=True) | Q(lokasjon_id=lokasjon_id))
+
+    rader = []
+    ufullstendig = False
+    with tidsfrist(budsjett_ms) as utlopt:
+        try:
+            if item_id is not None:
+                rader += [(-1, rad) for rad in indeks.filter(type='ski_item', objekt_id=item_id)
+                          .values_list(*felter)[:1]]
+            if len(oppslag) >= MIN_LENGDE:
+                # Sortert på ord går spørringen i indeksrekkefølge, uten sortering,
+                # og ord som er lik søket kommer først
+                rader += [(None, rad) for rad in indeks.filter(ord__gte=oppslag, ord__lt=oppslag + _SLUTT)
+                          .order_by('ord').values_list(*felter)[:KANDIDATER]]
+        except OperationalError:
+            if not utlopt():
+                raise
+            ufullstendig = True
+
+    beste = {}
+    for rang, (ord_treff, vekt, type_, objekt_id, tittel, undertittel, tekst) in rader:
+        if rang is None:
+            if andre and not all(any(o.startswith(a) for o in tekst.split()) for a in andre):
+                continue
+            rang = (ord_treff != oppslag, vekt, len(ord_treff))
+        else:
+            rang = (rang,)
+        nokkel = (type_, objekt_id)
+        if nokkel not in beste or rang < beste[nokkel][0]:
+            beste[nokkel] = (rang, {'type': type_, 'id': objekt_id, 'tittel': tittel, 'undertittel': undertittel})
+
+    grupper = defaultdict(list)
+    for rang, treff in sorted(beste.values(), key=lambda par: (par[0], par[1]['tittel'])):
+        grupper[treff['type']].append(treff)
+    return {
+        # dict beholder rekkefølgen, så gruppen med beste treff kommer først
+        'grupper': [(type_, treffene[:grense]) for type_, treffene in grupper.items()],
+        'ufullstendig': ufullstendig,
+    }
@@ -0,0 +1,114 @@
+"""
+Nøkkeltall for dashbord og veggskjermer (api_statistikk).
+
+Tallene beregnes med tre aggregerte spørringer og caches med myk utløpstid
+(se hurtigbuffer.hent_beregnet), slik at mange skjermer som spør samtidig
+fører til én ny beregning, ikke én per skjerm. Hvor gamle tallene kan være
+styres av settings.SKIUTLAN_STATISTIKK_SEKUNDER.
+
+for_bruker() gir statistikken for én bruker (bruker_statistikk).
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Q, Sum
+from django.utils import timezone
+
+from . import hurtigbuffer
+from .models import SkiItem, Utlan, UtlanArkiv
+
+
+def beregn(lokasjon_id=None):
+    """Nøkkeltallene for én lokasjon (None for alle), rett fra databasen."""
+    na = timezone.now()
+    idag = timezone.make_aware(datetime.combine(timezone.localdate(na), time.min))
+    items = SkiItem.objects.all()
+    utlan = Utlan.objects.all()
+    if lokasjon_id is not None:
+        items = items.filter(lokasjon_id=lokasjon_id)
+        utlan = utlan.filter(lokasjon_id=lokasjon_id)
+
+    # Items med aktivt utlån står på utlånets lokasjon, så antall utlånte
+    # per type kan telles fra utlånene
+    per_type = {
+        type_ski: {'totalt': 0, 'ledige': 0} for type_ski, _ in SkiItem.SKI_TYPES
+    }
+    for type_ski, antall in items.order_by().values_list('type_ski').annotate(antall=Count('id')):
+        per_type[type_ski] = {'totalt': antall, 'ledige': antall}
+    for type_ski, antall in (utlan.aktive().order_by().values_list('ski_item__type_ski')
+                             .annotate(antall=Count('id'))):
+        per_type[type_ski]['ledige'] -= antall
+
+    tall = utlan.aggregate(
+        aktive=Count('id', filter=Q(returnert_dato__isnull=True)),
+        forsinket=Count('id', filter=Q(returnert_dato__isnull=True, planlagt_retur__lt=na)),
+        utlant_idag=Count('id', filter=Q(utlant_dato__gte=idag)),
+        returnert_idag=Count('id', filter=Q(returnert_dato__gte=idag)),
+    )
+    totalt = sum(rad['totalt'] for rad in per_type.values())
+
+    return {
+        'beregnet': na.isoformat(),
+        'lokasjon_id': lokasjon_id,
+        'ski_items': totalt,
+        'ledige': totalt - tall['aktive'],
+        'per_type': per_type,
+        **tall,
+    }
+
+
+def hent(lokasjon_id=None):
+    """Nøkkeltallene fra cachen; beregnes på nytt når de er eldre enn SKIUTLAN_STATISTIKK_SEKUNDER."""
+    sekunder = settings.SKIUTLAN_STATISTIKK_SEKUNDER
+    return hurtigbuffer.hent_beregnet(
+        f'skiutlan:statistikk:{lokasjon_id or "alle"}',
+        lambda: beregn(lokasjon_id),
+        ttl=sekunder * 20,
+        myk_ttl=sekunder,
+    )
+
+
+def for_bruker(bruker_id, na=None):
+    """
+    Statistikk for alle utlånene til en bruker, også de arkiverte: antall,
+    gjennomsnittlig lånetid for returnerte utlån, hvor mange som er eller
+    ble levert for sent, og typene brukeren låner mest.
+
+    Alt regnes ut med én gruppert spørring per tabell (GROUP BY type_ski),
+    så tiden avhenger ikke av hvor mange utlån brukeren har hatt.
+    """
+    na = na or timezone.now()
+    returnert = Q(returnert_dato__isnull=False)
+    for_sent = Q(returnert_dato__gt=F('planlagt_retur')) | Q(returnert_dato__isnull=True, planlagt_retur__lt=na)
+    lanetid = ExpressionWrapper(F('returnert_dato') - F('utlant_dato'), output_field=DurationField())
+
+    per_type = {}
+    for modell in (Utlan, UtlanArkiv):
+        rader = (modell.objects.filter(bruker_id=bruker_id).order_by().values('ski_item__type_ski')
+                 .annotate(antall=Count('id'), returnert=Count('id', filter=returnert),
+                           forsinket=Count('id', filter=for_sent), lanetid=Sum(lanetid, filter=returnert)))
+        for rad in rader:
+            sum_ = per_type.setdefault(rad['ski_item__type_ski'], {
+                'antall': 0, 'returnert': 0, 'forsinket': 0, 'lanetid': timedelta(0)})
+            for felt in ('antall', 'returnert', 'forsinket'):
+                sum_[felt] += rad[felt]
+            sum_['lanetid'] += rad['lanetid'] or timedelta(0)
+
+    navn = dict(SkiItem.SKI_TYPES)
+    rekkefolge = {type_ski: i for i, type_ski in enumerate(navn)}
+    returnerte = sum(t['returnert'] for t in per_type.values())
+    lanetid_totalt = sum((t['lanetid'] for t in per_type.values()), timedelta(0))
+    return {
+        'antall': sum(t['antall'] for t in per_type.values()),
+        'aktive': sum(t['antall'] - t['returnert'] for t in per_type.values()),
+        'forsinket': sum(t['forsinket'] for t in per_type.values()),
+        'snitt_lanetid': lanetid_totalt / returnerte if returnerte else None,
+        'snitt_dager': round(lanetid_totalt.total_seconds() / returnerte / 86400, 1) if returnerte else None,
+        # Mest lånt først; ved likt antall i samme rekkefølge som SKI_TYPES
+        'favoritter': sorted(
+            ({'type_ski': type_ski, 'navn': navn.get(type_ski, type_ski), 'antall': t['antall']}
+             for type_ski, t in per_type.items()),
+            key=lambda t: (-t['antall'], rekkefolge.get(t['type_ski'], len(rekkefolge))),
+        ),
+    }
@@ -0,0 +1,73 @@
+"""
+Static-fil-lagring for produksjon.
+
+KomprimertManifestStaticFilesStorage bygger videre på Djangos
+ManifestStaticFilesStorage (filnavn med innholds-hash, f.eks.
+css/base.3f2a9c1d.css) og lager i tillegg ferdig komprimerte varianter
+(.gz og, hvis brotli er installert, .br) av alle hash-navngitte filer når
+collectstatic kjøres. StatiskeFilerMiddleware (middleware.py) serverer så
+den minste varianten klienten støtter, med immutable Cache-Control.
+"""
+
+import gzip
+import os
+from functools import cache
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+
+@cache
+def _brotli():
+    """
+    Importerer brotli første gang det trengs. Lagringen lastes ved oppstart
+    av hver prosess (StatiskeFilerMiddleware), men brotli trengs bare av
+    collectstatic.
+    """
+    try:
+        import brotli
+    except ImportError:  # Valgfri avhengighet; uten den lages bare .gz
+        return None
+    return brotli
+
+
+# Filtyper som lønner seg å komprimere (bilder og fonter er allerede komprimert)
+KOMPRIMERBARE_ENDELSER = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.xml'}
+
+# Små filer blir ofte ikke mindre av komprimering
+MIN_STORRELSE = 256
+
+
+class KomprimertManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Manifest-lagring med gzip/brotli-komprimering ved collectstatic."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        self.storrelsesrapport = []
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+
+        for original, hashet in sorted(self.hashed_files.items()):
+            self.storrelsesrapport.append(self.komprimer(original, hashet))
+
+    def komprimer(self, original, hashet):
+        """Skriver .gz/.br ved siden av den hash-navngitte filen."""
+        rad = {'navn': hashet, 'original': self.size(hashet), 'gzip': None, 'brotli': None}
+        if os.path.splitext(hashet)[1] not in KOMPRIMERBARE_ENDELSER or rad['original'] < MIN_STORRELSE:
+            return rad
+
+        with self.open(hashet) as fil:
+            innhold = fil.read()
+
+        varianter = {'gzip': ('.gz', gzip.compress(innhold, compresslevel=9, mtime=0))}
+        brotli = _brotli()
+        if brotli is not None:
+            varianter['brotli'] = ('.br', brotli.compress(innhold, quality=11))
+
+        for navn, (endelse, komprimert) in varianter.items():
+            # Drop varianten hvis den ikke sparer noe
+            if len(komprimert) >= len(innhold):
+                continue
+            with open(self.path(hashet + endelse), 'wb') as fil:
+                fil.write(komprimert)
+            rad[navn] = len(komprimert)
+        return rad
@@ -0,0 +1,459 @@
+"""
+QR-koder og Code 128-strekkoder i ren Python, som SVG eller PNG.
+
+Etikettene trenger bare korte koder (SKI-000123), så QR-koden støtter
+versjon 1-10 med feilretting M, i alfanumerisk modus eller byte-modus
+(UTF-8). Det rekker til 122 byte. Code 128 bruker kodesett B, og bytter
+til C for lange sifferrekker (to sifre per tegn).
+
+Modulen bruker ikke Django, slik at etiketter.py kan generere i egne
+prosesser uten å sette opp Django der.
+"""
+
+import struct
+import zlib
+
+
+# ============================================================================
+# QR-KODE
+# ============================================================================
+
+ALFANUMERISK = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:'
+
+# Per versjon (1-10) med feilretting M: (feilrettingsord per blokk,
+# [(antall blokker, dataord per blokk)])
+_BLOKKER_M = {
+    1: (10, [(1, 16)]),
+    2: (16, [(1, 28)]),
+    3: (26, [(1, 44)]),
+    4: (18, [(2, 32)]),
+    5: (24, [(2, 43)]),
+    6: (16, [(4, 27)]),
+    7: (18, [(4, 31)]),
+    8: (22, [(2, 38), (2, 39)]),
+    9: (22, [(3, 36), (2, 37)]),
+    10: (26, [(4, 43), (1, 44)]),
+}
+_JUSTERING = {
+    1: [], 2: [6, 18], 3: [6, 22], 4: [6, 26], 5: [6, 30],
+    6: [6, 34], 7: [6, 22, 38], 8: [6, 24, 42], 9: [6, 26, 46], 10: [6, 28, 50],
+}
+# Formatbitene for feilretting M er 00
+_NIVA_M = 0
+
+_MASKER = [
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+]
+
+
+def _gf_gang(x, y):
+    """Multiplikasjon i GF(256) med polynomet 0x11D."""
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(grad):
+    resultat = [0] * (grad - 1) + [1]
+    rot = 1
+    for _ in range(grad):
+        for j in range(grad):
+            resultat[j] = _gf_gang(resultat[j], rot)
+            if j + 1 < grad:
+                resultat[j] ^= resultat[j + 1]
+        rot = _gf_gang(rot, 0x02)
+    return resultat
+
+
+def feilretting(data, antall):
+    """Reed-Solomon-feilrettingsordene for en blokk med dataord."""
+    divisor = _rs_divisor(antall)
+    resultat = [0] * antall
+    for byte in data:
+        faktor = byte ^ resultat.pop(0)
+        resultat.append(0)
+        for i, koeffisient in enumerate(divisor):
+            resultat[i] ^= _gf_gang(koeffisient, faktor)
+    return resultat
+
+
+def _bits(verdi, antall):
+    return [(verdi >> i) & 1 for i in reversed(range(antall))]
+
+
+def dataord(tekst, versjon=None):
+    """
+    (versjon, dataord) for teksten: minste versjon den får plass i (eller
+    versjon), med modus, lengde, data og utfylling. Kaster ValueError hvis
+    teksten er for lang.
+    """
+    if all(tegn in ALFANUMERISK for tegn in tekst):
+        modus, data = 0b0010, []
+        for i in range(0, len(tekst) - 1, 2):
+            data += _bits(ALFANUMERISK.index(tekst[i]) * 45 + ALFANUMERISK.index(tekst[i + 1]), 11)
+        if len(tekst) % 2:
+            data += _bits(ALFANUMERISK.index(tekst[-1]), 6)
+        lengde, lengdebits = len(tekst), (9, 11)
+    else:
+        modus, byter = 0b0100, tekst.encode('utf-8')
+        data = [bit for byte in byter for bit in _bits(byte, 8)]
+        lengde, lengdebits = len(byter), (8, 16)
+
+    for kandidat in ([versjon] if versjon else sorted(_BLOKKER_M)):
+        ec, grupper = _BLOKKER_M[kandidat]
+        kapasitet = sum(antall * ord_ for antall, ord_ in grupper) * 8
+        bits = _bits(modus, 4) + _bits(lengde, lengdebits[kandidat >= 10]) + data
+        if len(bits) <= kapasitet:
+            break
+    else:
+        raise ValueError(f'For lang tekst for QR-kode: {len(tekst)} tegn')
+
+    bits += [0] * min(4, kapasitet - len(bits))
+    bits += [0] * (-len(bits) % 8)
+    ord_ = [int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    for i in range(kapasitet // 8 - len(ord_)):
+        ord_.append(0xEC if i % 2 == 0 else 0x11)
+    return kandidat, ord_
+
+
+def kodeord(versjon, data):
+    """Dataordene delt i blokker med feilretting, flettet slik de plasseres i symbolet."""
+    ec, grupper = _BLOKKER_M[versjon]
+    blokker = []
+    start = 0
+    for antall, lengde in grupper:
+        for _ in range(antall):
+            blokker.append(data[start:start + lengde])
+            start += lengde
+    resultat = []
+    for i in range(max(len(b) for b in blokker)):
+        resultat += [b[i] for b in blokker if i < len(b)]
+    feil = [feilretting(b, ec) for b in blokker]
+    for i in range(ec):
+        resultat += [f[i] for f in feil]
+    return resultat
+
+
+def formatbits(maske, niva=_NIVA_M):
+    """De 15 formatbitene (feilrettingsnivå og maske, med BCH-kode)."""
+    data = niva << 3 | maske
+    rest = data
+    for _ in range(10):
+        rest = (rest << 1) ^ ((rest >> 9) * 0x537)
+    return (data << 10 | rest) ^ 0x5412
+
+
+def versjonsbits(versjon):
+    """De 18 versjonsbitene for versjon 7 og høyere."""
+    rest = versjon
+    for _ in range(12):
+        rest = (rest << 1) ^ ((rest >> 11) * 0x1F25)
+    return versjon << 12 | rest
+
+
+class _Symbol:
+    """Modulene i et QR-symbol under oppbygging; moduler[y][x], True er mørk."""
+
+    def __init__(self, versjon):
+        self.versjon = versjon
+        self.storrelse = versjon * 4 + 17
+        self.moduler = [[False] * self.storrelse for _ in range(self.storrelse)]
+        self.funksjon = [[False] * self.storrelse for _ in range(self.storrelse)]
+
+    def sett(self, x, y, mork):
+        self.moduler[y][x] = mork
+        self.funksjon[y][x] = True
+
+    def tegn_funksjonsmonstre(self):
+        n = self.storrelse
+        for i in range(n):
+            self.sett(6, i, i % 2 == 0)
+            self.sett(i, 6, i % 2 == 0)
+        for x, y in ((3, 3), (n - 4, 3), (3, n - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    if 0 <= x + dx < n and 0 <= y + dy < n:
+                        self.sett(x + dx, y + dy, max(abs(dx), abs(dy)) not in (2, 4))
+        posisjoner = _JUSTERING[self.versjon]
+        siste = len(posisjoner) - 1
+        for i, x in enumerate(posisjoner):
+            for j, y in enumerate(posisjoner):
+                if (i, j) in ((0, 0), (0, siste), (siste, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.sett(x + dx, y + dy, max(abs(dx), abs(dy)) != 1)
+        self.tegn_format(0)
+        if self.versjon >= 7:
+            bits = versjonsbits(self.versjon)
+            for i in range(18):
+                bit = (bits >> i) & 1 == 1
+                a, b = n - 11 + i % 3, i // 3
+                self.sett(a, b, bit)
+                self.sett(b, a, bit)
+
+    def tegn_format(self, maske):
+        n = self.storrelse
+        bits = formatbits(maske)
+
+        def bit(i):
+            return (bits >> i) & 1 == 1
+
+        for i in range(6):
+            self.sett(8, i, bit(i))
+        self.sett(8, 7, bit(6))
+        self.sett(8, 8, bit(7))
+        self.sett(7, 8, bit(8))
+        for i in range(9, 15):
+            self.sett(14 - i, 8, bit(i))
+        for i in range(8):
+            self.sett(n - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.sett(8, n - 15 + i, bit(i))
+        self.sett(8, n - 8, True)
+
+    def plasser(self, kodeord):
+        """Legger kodeordene i sikksakk nedenfra og opp, to kolonner om gangen."""
+        n = self.storrelse
+        i = 0
+        hoyre = n - 1
+        while hoyre >= 1:
+            if hoyre == 6:
+                hoyre = 5
+            for vertikal in range(n):
+                for j in range(2):
+                    x = hoyre - j
+                    opp = (hoyre + 1) & 2 == 0
+                    y = n - 1 - vertikal if opp else vertikal
+                    if not self.funksjon[y][x] and i < len(kodeord) * 8:
+                        self.moduler[y][x] = (kodeord[i >> 3] >> (7 - (i & 7))) & 1 == 1
+                        i += 1
+            hoyre -= 2
+
+    def masker(self, maske):
+        monster = _MASKER[maske]
+        for y in range(self.storrelse):
+            rad, funksjon = self.moduler[y], self.funksjon[y]
+            for x in range(self.storrelse):
+                if not funksjon[x] and monster(x, y):
+                    rad[x] = not rad[x]
+
+
+def _straff(moduler):
+    """Straffepoengene (regel 1-4 i standarden) som avgjør hvilken maske som velges."""
+    n = len(moduler)
+    poeng = 0
+    kolonner = [[moduler[y][x] for y in range(n)] for x in range(n)]
+    for linje in moduler + kolonner:
+        lengde = 1
+        for i in range(1, n + 1):
+            if i < n and linje[i] == linje[i - 1]:
+                lengde += 1
+                continue
+            if lengde >= 5:
+                poeng += lengde - 2
+            lengde = 1
+        # 1:1:3:1:1 med fire lyse moduler foran eller bak; utenfor symbolet er lyst
+        tekst = '0000' + ''.join('1' if m else '0' for m in linje) + '0000'
+        start = tekst.find('1011101')
+        while start != -1:
+            if tekst[start - 4:start] == '0000' or tekst[start + 7:start + 11] == '0000':
+                poeng += 40
+            start = tekst.find('1011101', start + 1)
+    for y in range(n - 1):
+        for x in range(n - 1):
+            if moduler[y][x] == moduler[y][x + 1] == moduler[y + 1][x] == moduler[y + 1][x + 1]:
+                poeng += 3
+    morke = sum(sum(rad) for rad in moduler)
+    poeng += abs(morke * 20 - n * n * 10) // (n * n) * 10
+    return poeng
+
+
+def qr(tekst, maske=None):
+    """
+    QR-koden for teksten som en liste med rader (True er mørk), uten stille
+    sone. Uten maske velges masken med lavest straff, som i standarden.
+    """
+    versjon, data = dataord(tekst)
+    ord_ = kodeord(versjon, data)
+
+    beste = None
+    for kandidat in ([maske] if maske is not None else range(8)):
+        symbol = _Symbol(versjon)
+        symbol.tegn_funksjonsmonstre()
+        symbol.plasser(ord_)
+        symbol.masker(kandidat)
+        symbol.tegn_format(kandidat)
+        if maske is not None:
+            return symbol.moduler
+        poeng = _straff(symbol.moduler)
+        if beste is None or poeng < beste[0]:
+            beste = (poeng, symbol.moduler)
+    return beste[1]
+
+
+# ============================================================================
+# CODE 128
+# ============================================================================
+
+# Bredden på strek, mellomrom, strek, ... for symbolverdi 0-106 (106 er stopp)
+_CODE128 = (
+    '212222 222122 222221 121223 121322 131222 122213 122312 132212 221213 '
+    '221312 231212 112232 122132 122231 113222 123122 123221 223211 221132 '
+    '221231 213212 223112 312131 311222 321122 321221 312212 322112 322211 '
+    '212123 212321 232121 111323 131123 131321 112313 132113 132311 211313 '
+    '231113 231311 112133 112331 132131 113123 113321 133121 313121 211331 '
+    '231131 213113 213311 213131 311123 311321 331121 312113 312311 332111 '
+    '314111 221411 431111 111224 111422 121124 121421 141122 141221 112214 '
+    '112412 122114 122411 142112 142211 241211 221114 413111 241112 134111 '
+    '111242 121142 121241 114212 124112 124211 411212 421112 421211 212141 '
+    '214121 412121 111143 111341 131141 114113 114311 411113 411311 113141 '
+    '114131 311141 411131 211412 211214 211232 2331112'
+).split()
+
+_START_B, _START_C = 104, 105
+_TIL_B, _TIL_C = 100, 99
+_STOPP = 106
+
+
+def code128_verdier(tekst):
+    """
+    Symbolverdiene for teksten, med start og kontrollsiffer, uten stopp.
+    Sifferrekker på minst fire tegn i starten eller slutten, eller seks
+    ellers, kodes i kodesett C. Kaster ValueError for tegn utenfor ASCII 32-126.
+    """
+    if any(not 32 <= ord(tegn) <= 126 for tegn in tekst):
+        raise ValueError(f'Code 128 B støtter bare ASCII 32-126: {tekst!r}')
+    verdier = []
+    kodesett = None
+
+    def bytt(til):
+        nonlocal kodesett
+        if kodesett != til:
+            if kodesett is None:
+                verdier.append(_START_B if til == 'B' else _START_C)
+            else:
+                verdier.append(_TIL_B if til == 'B' else _TIL_C)
+            kodesett = til
+
+    i = 0
+    while i < len(tekst):
+        sifre = 0
+        while i + sifre < len(tekst) and tekst[i + sifre].isdigit():
+            sifre += 1
+        kant = i == 0 or i + sifre == len(tekst)
+        if sifre >= 6 or (sifre >= 4 and kant):
+            if sifre % 2:
+                bytt('B')
+                verdier.append(ord(tekst[i]) - 32)
+                i += 1
+                sifre -= 1
+            bytt('C')
+            for j in range(i, i + sifre, 2):
+                verdier.append(int(tekst[j:j + 2]))
+            i += sifre
+        else:
+            bytt('B')
+            verdier.append(ord(tekst[i]) - 32)
+            i += 1
+    if kodesett is None:
+        bytt('B')
+    verdier.append((verdier[0] + sum(i * v for i, v in enumerate(verdier[1:], start=1))) % 103)
+    return verdier
+
+
+def code128(tekst):
+    """Strekkoden som bredder (strek, mellomrom, strek, ...) i moduler, uten stille sone."""
+    return [int(b) for verdi in code128_verdier(tekst) + [_STOPP] for b in _CODE128[verdi]]
+
+
+def code128_rad(bredder):
+    """Bredder som én rad med moduler (True er strek)."""
+    return [i % 2 == 0 for i, bredde in enumerate(bredder) for _ in range(bredde)]
+
+
+# ============================================================================
+# SVG OG PNG
+# ============================================================================
+
+def svg_sti(moduler):
+    """SVG-stien for de mørke modulene, med sammenhengende moduler i en rad slått sammen."""
+    deler = []
+    for y, rad in enumerate(moduler):
+        x = 0
+        while x < len(rad):
+            if not rad[x]:
+                x += 1
+                continue
+            start = x
+            while x < len(rad) and rad[x]:
+                x += 1
+            deler.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+    return ''.join(deler)
+
+
+def qr_svg(moduler, stille_sone=4):
+    """QR-koden som et frittstående SVG-dokument (skalerbart, 1 enhet per modul)."""
+    side = len(moduler) + 2 * stille_sone
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="-{stille_sone} -{stille_sone} {side} {side}" '
+        f'shape-rendering="crispEdges"><rect x="-{stille_sone}" y="-{stille_sone}" width="{side}" '
+        f'height="{side}" fill="#fff"/><path d="{svg_sti(moduler)}" fill="#000"/></svg>'
+    )
+
+
+def code128_svg(bredder, hoyde=40, stille_sone=10):
+    """Strekkoden som et frittstående SVG-dokument (1 enhet per modul)."""
+    bredde = sum(bredder) + 2 * stille_sone
+    sti = svg_sti([code128_rad(bredder)]).replace('v1h', f'v{hoyde}h')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="-{stille_sone} 0 {bredde} {hoyde}" '
+        f'shape-rendering="crispEdges" preserveAspectRatio="none"><rect x="-{stille_sone}" y="0" '
+        f'width="{bredde}" height="{hoyde}" fill="#fff"/><path d="{sti}" fill="#000"/></svg>'
+    )
+
+
+def _png_del(type_, data):
+    del_ = type_ + data
+    return struct.pack('>I', len(data)) + del_ + struct.pack('>I', zlib.crc32(del_) & 0xFFFFFFFF)
+
+
+def png(moduler, skala=8, stille_sone=4):
+    """
+    Modulene som PNG i svart-hvitt (1 bit per piksel), skala piksler per
+    modul. For strekkoder gis code128_rad() gjentatt i ønsket høyde.
+    """
+    bredde = (len(moduler[0]) + 2 * stille_sone) * skala
+    hoyde = (len(moduler) + 2 * stille_sone) * skala
+    hvit_rad = b'\x00' + b'\xff' * ((bredde + 7) // 8)
+    rader = [hvit_rad] * (stille_sone * skala)
+    for rad in moduler:
+        piksler = [False] * (stille_sone * skala)
+        for mork in rad:
+            piksler += [mork] * skala
+        piksler += [False] * (bredde - len(piksler))
+        # 1 er hvit i gråtoner med 1 bit
+        byter = bytearray()
+        for i in range(0, bredde, 8):
+            verdi = 0
+            for j, mork in enumerate(piksler[i:i + 8]):
+                if not mork:
+                    verdi |= 0x80 >> j
+            byter.append(verdi | ((1 << (8 - min(8, bredde - i))) - 1))
+        rader += [b'\x00' + bytes(byter)] * skala
+    rader += [hvit_rad] * (stille_sone * skala)
+    return (
+        b'\x89PNG\r\n\x1a\n'
+        + _png_del(b'IHDR', struct.pack('>IIBBBBB', bredde, hoyde, 1, 0, 0, 0, 0))
+        + _png_del(b'IDAT', zlib.compress(b''.join(rader), 9))
+        + _png_del(b'IEND', b'')
+    )
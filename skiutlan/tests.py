@@ -1,3 +1,3490 @@
-from django.test import TestCase
+"""
+Tester for skiutlån-systemet.
 
-# Create your tests here.
+Testene er samlet i denne filen og kjøres med:
+
+    python manage.py test skiutlan
+
+Benchmark-testene seeder et stort datasett i test-databasen (SQLite, helt
+offline) og måler hver visning. Resultatene lagres som JSON slik at de kan
+sammenlignes mellom commits. Oppførselen styres med miljøvariabler:
+
+    SKIUTLAN_BENCH_SKALA     Multiplikator for datasettets størrelse (standard 1)
+    SKIUTLAN_BENCH_GJENTAK   Antall målinger per visning (standard 5)
+    SKIUTLAN_BENCH_KATALOG   Hvor JSON-resultatene lagres (standard ./benchmark)
+    SKIUTLAN_BENCH_BASELINE  JSON-fil fra en tidligere kjøring å sammenligne mot
+    SKIUTLAN_BENCH_TERSKEL   Tillatt relativ økning i p95-latens (standard 0.5)
+    SKIUTLAN_BENCH_OPPSTART  Maks sekunder for manage.py check og første forespørsel (standard 5)
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F, Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from . import urls as skiutlan_urls
+from . import (
+    arkiv, direkte, endringer, etiketter, hurtigbuffer, lokasjoner, populaere, prognose, projeksjoner, sok,
+    sokeindeks, statistikk, strekkoder, tjenester, views,
+)
+from .models import (
+    Endring, IdempotensNokkel, LagretSok, Lokasjon, SokeOrd, SkiItem, Bruker, Utlan, UtlanArkiv, UtlanHendelse,
+    ProjeksjonMarkor, ProjTilgjengelighet, ProjBrukerTelling, ProjDagStatistikk,
+)
+
+
+# ============================================================================
+# HJELPEFUNKSJONER FOR BENCHMARKS
+# ============================================================================
+
+BENCH_SKALA = float(os.environ.get('SKIUTLAN_BENCH_SKALA', '1'))
+BENCH_GJENTAK = int(os.environ.get('SKIUTLAN_BENCH_GJENTAK', '5'))
+BENCH_KATALOG = Path(os.environ.get('SKIUTLAN_BENCH_KATALOG', settings.BASE_DIR / 'benchmark'))
+BENCH_BASELINE = os.environ.get('SKIUTLAN_BENCH_BASELINE', '')
+BENCH_TERSKEL = float(os.environ.get('SKIUTLAN_BENCH_TERSKEL', '0.5'))
+BENCH_OPPSTART = float(os.environ.get('SKIUTLAN_BENCH_OPPSTART', '5'))
+
+# Latensøkninger under dette regnes som støy, uansett relativ terskel
+BENCH_STOY_MS = 5.0
+
+
+def persentil(verdier, p):
+    """Returnerer p-persentilen (0-100) med nearest-rank-metoden."""
+    if not verdier:
+        return 0.0
+    sortert = sorted(verdier)
+    indeks = max(0, math.ceil(p / 100 * len(sortert)) - 1)
+    return sortert[indeks]
+
+
+def lagre_benchmark(navn, data):
+    """Skriver benchmark-resultater til BENCH_KATALOG/<navn>.json."""
+    BENCH_KATALOG.mkdir(parents=True, exist_ok=True)
+    sti = BENCH_KATALOG / f'{navn}.json'
+    with open(sti, 'w', encoding='utf-8') as fil:
+        json.dump(data, fil, indent=2, ensure_ascii=False, sort_keys=True)
+    return sti
+
+
+def testlokasjon():
+    """Lokasjonen testene legger items på når lokasjon ikke er poenget."""
+    return Lokasjon.objects.get_or_create(navn='Testlager')[0]
+
+
+def seed_datasett(antall_items, antall_brukere, antall_utlan, antall_lokasjoner=1):
+    """
+    Fyller databasen med et realistisk datasett.
+
+    Hvert item har maks ett aktivt utlån; omtrent hvert fjerde item er utlånt,
+    og en del av de aktive utlånene er forsinket. Itemene fordeles likt på
+    antall_lokasjoner lokasjoner.
+    """
+    na = timezone.now()
+    typer = [verdi for verdi, _ in SkiItem.SKI_TYPES]
+    tilstander = ['utmerket', 'god', 'slitt', 'reparasjon']
+
+    if antall_lokasjoner == 1:
+        lokasjon_ids = [testlokasjon().id]
+    else:
+        Lokasjon.objects.bulk_create([Lokasjon(navn=f'Utleie {i:02d}') for i in range(antall_lokasjoner)])
+        lokasjon_ids = list(Lokasjon.objects.filter(navn__startswith='Utleie ').order_by('id').values_list('id', flat=True))
+
+    SkiItem.objects.bulk_create([
+        SkiItem(
+            lokasjon_id=lokasjon_ids[i % len(lokasjon_ids)],
+            navn=f'Testski {i}',
+            type_ski=typer[i % len(typer)],
+            storrelse=20 + (i * 7) % 180,
+            tilstand=tilstander[i % len(tilstander)],
+        )
+        for i in range(antall_items)
+    ])
+    Bruker.objects.bulk_create([
+        Bruker(
+            fornavn=f'Fornavn{i}',
+            etternavn=f'Etternavn{i}',
+            telefon=f'+47{40000000 + i}',
+            epost=f'bruker{i}@example.com' if i % 2 else None,
+        )
+        for i in range(antall_brukere)
+    ])
+    item_lokasjon = dict(SkiItem.objects.values_list('id', 'lokasjon_id'))
+    item_ids = sorted(item_lokasjon)
+    bruker_ids = list(Bruker.objects.order_by('id').values_list('id', flat=True))
+
+    utlan = []
+    for i in range(antall_utlan):
+        utlant = na - timedelta(days=(antall_utlan - i) % 400 + 1, hours=i % 24)
+        utlan.append(Utlan(
+            bruker_id=bruker_ids[i % len(bruker_ids)],
+            ski_item_id=item_ids[i % len(item_ids)],
+            lokasjon_id=item_lokasjon[item_ids[i % len(item_ids)]],
+            planlagt_retur=utlant + timedelta(days=7),
+            returnert_dato=utlant + timedelta(days=i % 9),
+        ))
+    # Siste utlån for hvert fjerde item er fortsatt aktivt
+    aktive = {}
+    for u in utlan:
+        if u.ski_item_id % 4 == 0:
+            aktive[u.ski_item_id] = u
+    for indeks, u in enumerate(aktive.values()):
+        u.returnert_dato = None
+        # Annenhver aktive er forsinket, resten skal leveres i fremtiden
+        u.planlagt_retur = na - timedelta(days=indeks % 5 + 1) if indeks % 2 else na + timedelta(days=3)
+
+    Utlan.objects.bulk_create(utlan, batch_size=500)
+    # utlant_dato er auto_now_add; sett realistiske datoer i etterkant
+    lagret = list(Utlan.objects.order_by('id'))
+    for original, u in zip(utlan, lagret):
+        u.utlant_dato = original.planlagt_retur - timedelta(days=7)
+    Utlan.objects.bulk_update(lagret, ['utlant_dato'], batch_size=500)
+    # bulk_create går utenom tjenester.py og signalene; fyll tellerne i etterkant
+    tjenester.avstem_aktive_utlan()
+    tjenester.avstem_lokasjoner()
+    sokeindeks.bygg_alle()
+
+    return {
+        'ski_items': antall_items,
+        'brukere': antall_brukere,
+        'utlan': antall_utlan,
+        'aktive_utlan': len(aktive),
+    }
+
+
+@contextlib.contextmanager
+def stille():
+    """Demper DEBUG-utskrifter fra views under målinger."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# ============================================================================
+# VISNINGS-BENCHMARK MED SPØRRINGSBUDSJETT
+# ============================================================================
+
+# Maksimalt antall SQL-spørringer per visning. Verdien er enten et tall eller
+# en funksjon av datasettets størrelse for visninger som (foreløpig) gjør én
+# eller flere spørringer per rad. Alle URL-er i skiutlan/urls.py og alle
+# admin-changelists må ha et budsjett.
+SPORRINGSBUDSJETT = {
+    'skiutlan:hjem': 4,
+    'skiutlan:hjem_direkte': 3,
+    'skiutlan:ski_item_liste': 1,
+    'skiutlan:ski_item_detalj': 5,
+    'skiutlan:ski_item_opprett': 1,
+    'skiutlan:ski_item_rediger': 0,
+    'skiutlan:ski_item_slett': 1,
+    'skiutlan:ski_item_flytt': 11,
+    'skiutlan:etikett_ark': 1,
+    'skiutlan:ski_item_qr': 1,
+    'skiutlan:bruker_liste': 1,
+    'skiutlan:bruker_detalj': 4,
+    'skiutlan:bruker_opprett': 0,
+    'skiutlan:bruker_rediger': 0,
+    'skiutlan:bruker_slett': 1,
+    'skiutlan:bruker_statistikk': 2,
+    'skiutlan:utlan_liste': 1,
+    'skiutlan:utlan_detalj': 3,
+    'skiutlan:utlan_opprett': lambda d: 3 + d['ski_items'],
+    'skiutlan:utlan_opprett_for_item': lambda d: 4 + d['ski_items'],
+    'skiutlan:utlan_marker_returnert': 2,
+    'skiutlan:avansert_sok': 43,
+    'skiutlan:lagret_sok': 0,
+    'skiutlan:lagret_sok_detalj': 3,
+    'skiutlan:lagret_sok_oppdater': 5,
+    'skiutlan:lagret_sok_slett': 2,
+    'skiutlan:hurtig_sok': 1,
+    'skiutlan:rapporter': 6,
+    'skiutlan:rapport_populaere': 1,
+    'skiutlan:velg_lokasjon': 0,
+    'skiutlan:api_ski_item_tilgjengelighet': 1,
+    'skiutlan:api_sok_brukere': 1,
+    'skiutlan:api_tilgjengelighet': 2,
+    'skiutlan:api_statistikk': 0,
+    'skiutlan:api_objektcache': 0,
+    'skiutlan:api_skann_retur': 7,
+    'skiutlan:api_innsjekk': 8,
+    'skiutlan:api_endringer': 5,
+    'skiutlan:qr_kode': 1,
+    'admin:skiutlan_skiitem_changelist': 106,
+    'admin:skiutlan_bruker_changelist': 5,
+    'admin:skiutlan_utlan_changelist': 6,
+    'admin:skiutlan_utlanarkiv_changelist': 5,
+    'admin:skiutlan_utlanhendelse_changelist': 5,
+    'admin:skiutlan_lokasjon_changelist': 5,
+    'admin:skiutlan_lagretsok_changelist': 5,
+}
+
+# Ekstra query-parametre slik at visningene gjør reelt arbeid
+SCENARIO_PARAMETRE = {
+    'skiutlan:avansert_sok': {'sok_tekst': 'Testski 1', 'utlan_status': 'aktive'},
+    'skiutlan:api_sok_brukere': {'q': 'Etternavn1'},
+    'skiutlan:hurtig_sok': {'q': 'Testski 1'},
+    'skiutlan:qr_kode': {'format': 'png'},
+    'skiutlan:api_tilgjengelighet': {'type_ski': 'alpinski', 'storrelse_fra': '60', 'storrelse_til': '180'},
+}
+
+
+class VisningsBenchmarkTest(TestCase):
+    """
+    Måler latens og eksakt antall spørringer for alle visninger.
+
+    Feiler hvis en visning overskrider spørringsbudsjettet sitt, eller hvis den
+    har regrediert i forhold til en baseline fra en tidligere kjøring.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        # Etikettene lages på disk; ikke i prosjektets etikettkatalog
+        cls.etikett_katalog = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.etikett_katalog.cleanup)
+        innstillinger = override_settings(SKIUTLAN_ETIKETT_KATALOG=cls.etikett_katalog.name)
+        innstillinger.enable()
+        cls.addClassCleanup(innstillinger.disable)
+        super().setUpClass()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(300 * BENCH_SKALA),
+            antall_brukere=int(200 * BENCH_SKALA),
+            antall_utlan=int(1500 * BENCH_SKALA),
+        )
+        cls.admin_bruker = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'passord')
+
+        cls.ledig_item = SkiItem.objects.exclude(
+            utlan__returnert_dato__isnull=True).first()
+        cls.aktivt_utlan = Utlan.objects.filter(returnert_dato__isnull=True).first()
+        cls.bruker_uten_aktive = Bruker.objects.exclude(
+            utlan__returnert_dato__isnull=True).first()
+        cls.annen_lokasjon = Lokasjon.objects.create(navn='Annen lokasjon')
+        cls.lagret_sok, _ = sok.lagre('Aktive Testski 1', {'sok_tekst': 'Testski 1', 'utlan_status': 'aktive'})
+
+    def url_parametre(self):
+        """Gyldige verdier for path-parametrene i skiutlan/urls.py."""
+        return {
+            'item_id': self.ledig_item.id,
+            'bruker_id': self.bruker_uten_aktive.id,
+            'utlan_id': self.aktivt_utlan.id,
+            'sok_id': self.lagret_sok.id,
+        }
+
+    def maalpunkter(self):
+        """Returnerer (navn, url) for alle app-URL-er og admin-changelists."""
+        parametre = self.url_parametre()
+        punkter = []
+        for monster in skiutlan_urls.urlpatterns:
+            if not isinstance(monster, URLPattern):
+                continue
+            navn = f'{skiutlan_urls.app_name}:{monster.name}'
+            kwargs = {k: parametre[k] for k in monster.pattern.converters}
+            punkter.append((navn, reverse(navn, kwargs=kwargs)))
+
+        for modell in admin.site._registry:
+            if modell._meta.app_label == 'skiutlan':
+                navn = f'admin:skiutlan_{modell._meta.model_name}_changelist'
+                punkter.append((navn, reverse(navn)))
+        return punkter
+
+    def post_data(self, navn):
+        """POST-data for visninger som bare tar imot POST, ellers None."""
+        aktive = Utlan.objects.filter(returnert_dato__isnull=True).order_by('id')
+        if navn == 'skiutlan:api_skann_retur':
+            return {'kode': tjenester.ski_item_kode(self.aktivt_utlan.ski_item_id)}
+        if navn == 'skiutlan:api_innsjekk':
+            koder = [tjenester.ski_item_kode(i) for i in aktive.values_list('ski_item_id', flat=True)[:50]]
+            return {'koder': '\n'.join(koder + ['SKI-999999', 'ugyldig'])}
+        if navn in ('skiutlan:ski_item_flytt', 'skiutlan:velg_lokasjon'):
+            return {'lokasjon': self.annen_lokasjon.id}
+        if navn in ('skiutlan:lagret_sok_oppdater', 'skiutlan:lagret_sok_slett'):
+            return {}
+        return None
+
+    def budsjett_for(self, navn):
+        budsjett = SPORRINGSBUDSJETT[navn]
+        return budsjett(self.datasett) if callable(budsjett) else budsjett
+
+    def maal_visning(self, url, parametre, post_data=None):
+        """
+        Kjører en GET (eller POST, hvis post_data er gitt) mot url flere ganger
+        og returnerer målingene. POST-er rulles tilbake etter hver måling, slik
+        at alle målingene gjør det samme arbeidet.
+        """
+        def kall():
+            if post_data is None:
+                return self.client.get(url, parametre)
+            return self.client.post(url, post_data)
+
+        @contextlib.contextmanager
+        def tilbakerulling():
+            if post_data is None:
+                yield
+                return
+            with transaction.atomic():
+                yield
+                transaction.set_rollback(True)
+
+        # Oppvarming: fyller cacher og template-loadere før målingen
+        with stille(), tilbakerulling():
+            kall()
+
+        tider = []
+        sporringer = []
+        for _ in range(BENCH_GJENTAK):
+            with tilbakerulling():
+                # Loggen er begrenset til 9000 spørringer; tøm den så tellingen blir eksakt
+                connection.queries_log.clear()
+                with stille(), CaptureQueriesContext(connection) as fanget:
+                    start = time.perf_counter()
+                    respons = kall()
+                    tider.append((time.perf_counter() - start) * 1000)
+            # POST-visninger kan svare med en redirect (follow er av, så
+            # målingen gjelder bare selve visningen)
+            self.assertIn(respons.status_code, (200,) if post_data is None else (200, 302), url)
+            sporringer.append(len(fanget.captured_queries))
+
+        return {
+            'url': url,
+            'sporringer': max(sporringer),
+            'p50_ms': round(persentil(tider, 50), 3),
+            'p95_ms': round(persentil(tider, 95), 3),
+            'p99_ms': round(persentil(tider, 99), 3),
+        }
+
+    def test_alle_url_er_har_budsjett(self):
+        """Nye URL-er må deklarere et spørringsbudsjett."""
+        for navn, _ in self.maalpunkter():
+            self.assertIn(navn, SPORRINGSBUDSJETT,
+                          f'{navn} mangler spørringsbudsjett i tests.py')
+
+    def test_visninger_innenfor_budsjett(self):
+        self.client.force_login(self.admin_bruker)
+
+        resultater = {}
+        for navn, url in self.maalpunkter():
+            resultater[navn] = self.maal_visning(
+                url, SCENARIO_PARAMETRE.get(navn, {}), self.post_data(navn))
+            resultater[navn]['budsjett'] = self.budsjett_for(navn)
+
+        lagre_benchmark('visninger', {
+            'datasett': self.datasett,
+            'gjentak': BENCH_GJENTAK,
+            'visninger': resultater,
+        })
+
+        baseline = {}
+        if BENCH_BASELINE:
+            with open(BENCH_BASELINE, encoding='utf-8') as fil:
+                baseline = json.load(fil).get('visninger', {})
+
+        for navn, maaling in resultater.items():
+            with self.subTest(visning=navn):
+                self.assertLessEqual(
+                    maaling['sporringer'], maaling['budsjett'],
+                    f'{navn} brukte {maaling["sporringer"]} spørringer, '
+                    f'budsjettet er {maaling["budsjett"]}')
+
+                forrige = baseline.get(navn)
+                if not forrige:
+                    continue
+                self.assertLessEqual(
+                    maaling['sporringer'], forrige['sporringer'],
+                    f'{navn} har regrediert fra {forrige["sporringer"]} spørringer')
+                grense = max(forrige['p95_ms'] * (1 + BENCH_TERSKEL),
+                             forrige['p95_ms'] + BENCH_STOY_MS)
+                self.assertLessEqual(
+                    maaling['p95_ms'], grense,
+                    f'{navn} p95 {maaling["p95_ms"]} ms er over grensen {grense:.1f} ms')
+
+
+# ============================================================================
+# FRAGMENT-CACHING AV LISTERADER
+# ============================================================================
+
+class FragmentCacheTest(TestCase):
+    """Cachede rader i ski_item_liste, og ugyldiggjøring via signaler."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(2000 * BENCH_SKALA),
+            antall_brukere=int(100 * BENCH_SKALA),
+            antall_utlan=int(4000 * BENCH_SKALA),
+        )
+        cls.item = SkiItem.objects.create(
+            lokasjon=testlokasjon(), navn='Unik testski', type_ski='alpinski', storrelse=170)
+        cls.bruker = Bruker.objects.create(
+            fornavn='Kari', etternavn='Nordmann', telefon='+4799999999')
+
+    def setUp(self):
+        cache.clear()
+
+    def rad_for_item(self, respons):
+        """Returnerer HTML-en for tabellraden til self.item."""
+        innhold = respons.content.decode()
+        start = innhold.index(self.item.navn)
+        return innhold[start:innhold.index('</tr>', start)]
+
+    def test_utlan_og_retur_ugyldiggjor_raden(self):
+        url = reverse('skiutlan:ski_item_liste')
+        self.assertIn('Ledig', self.rad_for_item(self.client.get(url)))
+
+        utlan = Utlan.objects.create(
+            bruker=self.bruker, ski_item=self.item,
+            planlagt_retur=timezone.now() + timedelta(days=2))
+        self.assertIn('Utlånt', self.rad_for_item(self.client.get(url)))
+
+        utlan.returnert_dato = timezone.now()
+        utlan.save()
+        self.assertIn('Ledig', self.rad_for_item(self.client.get(url)))
+
+    def test_utlansrader_folger_databasen_uten_ugyldiggjoring(self):
+        utlan = tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=2))
+        hjem, liste = reverse('skiutlan:hjem'), reverse('skiutlan:utlan_liste')
+        sok = {'sok': self.item.navn}
+
+        def nylig_rad():
+            innhold = self.client.get(hjem).content.decode()
+            start = innhold.index(self.item.navn)
+            return innhold[start:innhold.index('</span>', start)]
+
+        self.assertIn('Aktiv', nylig_rad())
+        self.assertIn('Aktiv', self.rad_for_item(self.client.get(liste, sok)))
+
+        # Som fra en annen prosess: bare UPDATE, ingen signaler og ingen nye versjoner i denne cachen
+        with stille():
+            Utlan.objects.filter(id=utlan.id).update(returnert_dato=timezone.now(), oppdatert=timezone.now())
+            Bruker.objects.filter(id=self.bruker.id).update(fornavn='Karianne', oppdatert=timezone.now())
+        rad = nylig_rad()
+        self.assertIn('Returnert', rad)
+        self.assertIn('Karianne', rad)
+        self.assertIn('Returnert', self.rad_for_item(self.client.get(liste, sok)))
+
+    def test_render_benchmark(self):
+        url = reverse('skiutlan:ski_item_liste')
+
+        with CaptureQueriesContext(connection) as kald_fanget:
+            start = time.perf_counter()
+            self.client.get(url)
+            kald_ms = (time.perf_counter() - start) * 1000
+
+        varme_tider = []
+        for _ in range(BENCH_GJENTAK):
+            with CaptureQueriesContext(connection) as varm_fanget:
+                start = time.perf_counter()
+                self.client.get(url)
+                varme_tider.append((time.perf_counter() - start) * 1000)
+
+        resultat = {
+            'rader': SkiItem.objects.count(),
+            'kald_ms': round(kald_ms, 3),
+            'varm_p50_ms': round(persentil(varme_tider, 50), 3),
+            'varm_p95_ms': round(persentil(varme_tider, 95), 3),
+            'kald_sporringer': len(kald_fanget.captured_queries),
+            'varm_sporringer': len(varm_fanget.captured_queries),
+        }
+        lagre_benchmark('fragment_cache', resultat)
+
+        self.assertEqual(resultat['varm_sporringer'], 1)
+        self.assertLess(resultat['varm_p50_ms'], resultat['kald_ms'])
+
+
+# ============================================================================
+# STATISKE FILER (HASH-NAVN OG FORHÅNDSKOMPRIMERING)
+# ============================================================================
+
+class StatiskPipelineTest(TestCase):
+    """collectstatic med komprimering, og StatiskeFilerMiddleware."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.katalog = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.katalog.cleanup)
+        innstillinger = override_settings(
+            DEBUG=False,
+            STATIC_ROOT=cls.katalog.name,
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+                'staticfiles': {'BACKEND': 'skiutlan.storage.KomprimertManifestStaticFilesStorage'},
+            },
+            MIDDLEWARE=['skiutlan.middleware.StatiskeFilerMiddleware'] + settings.MIDDLEWARE,
+        )
+        innstillinger.enable()
+        cls.addClassCleanup(innstillinger.disable)
+        super().setUpClass()
+
+        cls.utdata = io.StringIO()
+        call_command('collectstatic', interactive=False, stdout=cls.utdata)
+        with open(Path(cls.katalog.name) / 'staticfiles.json', encoding='utf-8') as fil:
+            cls.manifest = json.load(fil)['paths']
+
+    def test_hashede_filer_er_komprimert_og_rapportert(self):
+        hashet = self.manifest['css/skiutlan.css']
+        self.assertNotEqual(hashet, 'css/skiutlan.css')
+        self.assertTrue((Path(self.katalog.name) / f'{hashet}.gz').exists())
+        self.assertIn(hashet, self.utdata.getvalue())
+        self.assertIn('gzip', self.utdata.getvalue())
+
+    def test_base_html_lenker_til_hashede_filer(self):
+        innhold = self.client.get(reverse('skiutlan:hjem')).content.decode()
+        self.assertIn(self.manifest['css/base.css'], innhold)
+        self.assertIn(self.manifest['js/skiutlan.js'], innhold)
+
+    def test_middleware_velger_komprimert_variant(self):
+        hashet = self.manifest['css/skiutlan.css']
+        respons = self.client.get(f'/static/{hashet}', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(respons.status_code, 200)
+        self.assertEqual(respons['Content-Encoding'], 'gzip')
+        self.assertEqual(respons['Content-Type'], 'text/css')
+        self.assertIn('immutable', respons['Cache-Control'])
+
+        respons = self.client.get(f'/static/{hashet}')
+        self.assertFalse(respons.has_header('Content-Encoding'))
+
+        respons = self.client.get('/static/css/skiutlan.css')
+        self.assertNotIn('immutable', respons['Cache-Control'])
+
+        respons = self.client.get(f'/static/{hashet}', HTTP_IF_NONE_MATCH='"x"')
+        self.assertEqual(respons.status_code, 200)
+
+    def test_etag_og_q_verdier_per_variant(self):
+        hashet = self.manifest['css/skiutlan.css']
+        navn = os.path.basename(hashet)
+        url = f'/static/{hashet}'
+        ren = self.client.get(url)
+        gz = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual((ren['ETag'], gz['ETag']), (f'"{navn}"', f'"{navn}-gzip"'))
+
+        # q=0 betyr at kodingen ikke godtas
+        respons = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertFalse(respons.has_header('Content-Encoding'))
+        respons = self.client.get(url, HTTP_ACCEPT_ENCODING='*;q=0.5, br;q=0')
+        self.assertEqual(respons['Content-Encoding'], 'gzip')
+
+        # 304 bare når ETag-en til varianten som ville blitt sendt, er med
+        respons = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=f'"x", W/"{navn}-gzip"')
+        self.assertEqual((respons.status_code, respons['ETag']), (304, f'"{navn}-gzip"'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"{navn}-gzip"').status_code, 200)
+
+
+# ============================================================================
+# BETINGET GET PÅ DETALJSIDER
+# ============================================================================
+
+class BetingetGetTest(TestCase):
+    """ETag/Last-Modified og 304 på ski_item_detalj, bruker_detalj og utlan_detalj."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.item = SkiItem.objects.create(lokasjon=testlokasjon(), navn='Atomic Redster', type_ski='alpinski', storrelse=170)
+        cls.bruker = Bruker.objects.create(fornavn='Ola', etternavn='Nordmann', telefon='+4791234567')
+        cls.utlan = Utlan.objects.create(
+            bruker=cls.bruker, ski_item=cls.item,
+            planlagt_retur=timezone.now() + timedelta(days=3),
+            returnert_dato=timezone.now())
+
+    def urler(self):
+        return [
+            reverse('skiutlan:ski_item_detalj', args=[self.item.id]),
+            reverse('skiutlan:bruker_detalj', args=[self.bruker.id]),
+            reverse('skiutlan:utlan_detalj', args=[self.utlan.id]),
+        ]
+
+    def test_304_uten_templatearbeid(self):
+        # Første svar setter CSRF-cookien, som inngår i ETag-en
+        self.client.get(self.urler()[0])
+        for url in self.urler():
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with self.assertNumQueries(1):
+                    respons = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(respons.status_code, 304)
+
+    def test_endringer_gir_ny_etag(self):
+        etager = [self.client.get(url)['ETag'] for url in self.urler()]
+
+        self.bruker.etternavn = 'Hansen'
+        self.bruker.save()
+
+        for url, etag in zip(self.urler(), etager):
+            with self.subTest(url=url):
+                respons = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(respons.status_code, 200)
+                self.assertContains(respons, 'Hansen')
+
+    def test_ny_lokasjon_eller_csrf_token_gir_ny_side(self):
+        annen = Lokasjon.objects.create(navn='Betinget lager')
+        lokasjoner.glem_alle()
+        self.client.get(self.urler()[0])
+        for i, url in enumerate(self.urler()):
+            with self.subTest(url=url):
+                self.client.cookies.pop(lokasjoner.COOKIE_NAVN, None)
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+                self.client.cookies[lokasjoner.COOKIE_NAVN] = str(annen.id)
+                respons = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(respons.status_code, 200)
+                self.assertContains(respons, f'<option value="{annen.id}" selected>')
+
+                etag = respons['ETag']
+                self.client.cookies[settings.CSRF_COOKIE_NAME] = str(i) * 32
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_ukjent_objekt_gir_404(self):
+        respons = self.client.get(reverse('skiutlan:utlan_detalj', args=[999999]))
+        self.assertEqual(respons.status_code, 404)
+
+
+# ============================================================================
+# ARKIVERING AV GAMLE UTLÅN
+# ============================================================================
+
+@override_settings(SKIUTLAN_ARKIV_ALDER_DAGER=365)
+class ArkivTest(TestCase):
+    """manage.py arkiver_utlan og historikk på tvers av Utlan og UtlanArkiv."""
+
+    @classmethod
+    def setUpTestData(cls):
+        na = timezone.now()
+        cls.item = SkiItem.objects.create(lokasjon=testlokasjon(), navn='Fischer RC4', type_ski='alpinski', storrelse=165)
+        cls.gammel_bruker = Bruker.objects.create(fornavn='Gammel', etternavn='Kunde', telefon='+4790000001')
+        cls.ny_bruker = Bruker.objects.create(fornavn='Ny', etternavn='Kunde', telefon='+4790000002')
+
+        cls.gamle = []
+        for dager in (800, 700, 600):
+            utlan = Utlan.objects.create(
+                bruker=cls.gammel_bruker, ski_item=cls.item,
+                planlagt_retur=na - timedelta(days=dager - 7),
+                returnert_dato=na - timedelta(days=dager - 5))
+            Utlan.objects.filter(id=utlan.id).update(utlant_dato=na - timedelta(days=dager))
+            cls.gamle.append(utlan.id)
+        cls.nytt = Utlan.objects.create(
+            bruker=cls.ny_bruker, ski_item=cls.item,
+            planlagt_retur=na - timedelta(days=3), returnert_dato=na - timedelta(days=4))
+
+    def arkiver(self):
+        call_command('arkiver_utlan', batch_storrelse=2, pause=0, stdout=io.StringIO())
+
+    def test_flytter_bare_gamle_utlan_og_kan_kjores_igjen(self):
+        self.arkiver()
+        self.arkiver()
+        self.assertCountEqual(UtlanArkiv.objects.values_list('id', flat=True), self.gamle)
+        self.assertCountEqual(Utlan.objects.values_list('id', flat=True), [self.nytt.id])
+
+    def test_batch_gir_gravsteiner_uten_signaler_per_rad(self):
+        with CaptureQueriesContext(connection) as fanget:
+            ids = arkiv.arkiver_batch(arkiv.arkiv_grense(), storrelse=10)
+        self.assertCountEqual(ids, self.gamle)
+        # Én INSERT i loggen for hele batchen, ikke én per rad
+        self.assertEqual(sum('INSERT INTO "skiutlan_endring"' in q['sql'] for q in fanget.captured_queries), 1)
+        self.assertCountEqual(Endring.objects.filter(type='utlan', slettet=True).values_list('objekt_id', flat=True), ids)
+
+    def test_historikk_viser_live_og_arkiv(self):
+        self.arkiver()
+        respons = self.client.get(reverse('skiutlan:ski_item_detalj', args=[self.item.id]))
+        self.assertContains(respons, 'Gammel Kunde', count=3)
+        self.assertContains(respons, 'Ny Kunde')
+
+        respons = self.client.get(reverse('skiutlan:bruker_detalj', args=[self.gammel_bruker.id]))
+        self.assertContains(respons, 'Fischer RC4', count=3)
+
+        respons = self.client.get(reverse('skiutlan:utlan_detalj', args=[self.gamle[0]]))
+        self.assertContains(respons, 'Gammel')
+
+    def test_sok_leser_arkivet_bare_ved_behov(self):
+        self.arkiver()
+        url = reverse('skiutlan:avansert_sok')
+
+        respons = self.client.get(url, {'sok_tekst': 'Kunde'})
+        self.assertEqual(len(respons.context['utlan']), 4)
+
+        nylig = (timezone.localdate() - timedelta(days=30)).isoformat()
+        with CaptureQueriesContext(connection) as fanget:
+            respons = self.client.get(url, {'sok_tekst': 'Kunde', 'dato_fra': nylig})
+        self.assertEqual(len(respons.context['utlan']), 1)
+        self.assertFalse(any('utlanarkiv' in q['sql'] for q in fanget.captured_queries))
+
+
+# ============================================================================
+# HENDELSESLOGG OG PROJEKSJONER
+# ============================================================================
+
+def _projeksjonsdata():
+    """Innholdet i alle lesemodellene, for å sammenligne to oppbygginger."""
+    return {
+        'tilgjengelighet': sorted(ProjTilgjengelighet.objects.filter(
+            aktivt_utlan_id__isnull=False).values_list('ski_item_id', 'aktivt_utlan_id')),
+        'bruker_telling': sorted(ProjBrukerTelling.objects.exclude(
+            aktive=0, totalt=0).values_list('bruker_id', 'aktive', 'totalt')),
+        'dag_statistikk': sorted(ProjDagStatistikk.objects.exclude(
+            utlant=0, returnert=0).values_list('dato', 'utlant', 'returnert')),
+    }
+
+
+class HendelseloggTest(TestCase):
+    """UtlanHendelse skrives ved alle endringer, og projeksjonene holder tritt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Hendelseski {i}', type_ski='langrenn', storrelse=180 + i)
+            for i in range(3)
+        ]
+        cls.brukere = [
+            Bruker.objects.create(fornavn=f'Logg{i}', etternavn='Bruker', telefon=f'+4791000{i:03d}')
+            for i in range(2)
+        ]
+        cls.admin_bruker = get_user_model().objects.create_superuser(
+            'admin', 'admin@example.com', 'passord')
+
+    def lan_ut(self, item, bruker):
+        retur = (timezone.localtime() + timedelta(days=3)).strftime('%Y-%m-%dT%H:%M')
+        with stille():
+            self.client.post(reverse('skiutlan:utlan_opprett_for_item', args=[item.id]),
+                             {'bruker': bruker.id, 'planlagt_retur': retur})
+        return Utlan.objects.get(ski_item=item, returnert_dato__isnull=True)
+
+    def oppdater_alle(self, batch_storrelse=1000):
+        return sum(projeksjoner.oppdater(p, batch_storrelse) for p in projeksjoner.PROJEKSJONER)
+
+    def test_hendelser_for_utlan_retur_og_sletting(self):
+        forste = self.lan_ut(self.items[0], self.brukere[0])
+        self.client.post(reverse('skiutlan:utlan_marker_returnert', args=[forste.id]))
+        andre = self.lan_ut(self.items[1], self.brukere[1])
+        forste.refresh_from_db()
+
+        # Admin-handlingen skal ikke overskrive returdatoen til utlån som allerede er returnert
+        self.client.force_login(self.admin_bruker)
+        self.client.post(reverse('admin:skiutlan_utlan_changelist'), {
+            'action': 'marker_som_returnert', '_selected_action': [forste.id, andre.id]})
+        self.assertEqual(Utlan.objects.get(id=forste.id).returnert_dato, forste.returnert_dato)
+
+        self.client.post(reverse('skiutlan:bruker_slett', args=[self.brukere[1].id]))
+
+        self.assertEqual(
+            list(UtlanHendelse.objects.values_list('type', 'utlan_id')),
+            [('utlant', forste.id), ('returnert', forste.id), ('utlant', andre.id),
+             ('returnert', andre.id), ('slettet', andre.id)])
+
+    def test_hendelser_kan_ikke_endres(self):
+        self.lan_ut(self.items[0], self.brukere[0])
+        hendelse = UtlanHendelse.objects.get()
+        with self.assertRaises(ValueError):
+            hendelse.save()
+        with self.assertRaises(ValueError):
+            hendelse.delete()
+
+    def test_inkrementell_oppdatering_gir_samme_resultat_som_avspilling(self):
+        forste = self.lan_ut(self.items[0], self.brukere[0])
+        self.oppdater_alle()
+        self.client.post(reverse('skiutlan:utlan_marker_returnert', args=[forste.id]))
+        andre = self.lan_ut(self.items[0], self.brukere[1])
+        self.lan_ut(self.items[1], self.brukere[0])
+        self.oppdater_alle(batch_storrelse=1)
+        tredje = self.lan_ut(self.items[2], self.brukere[1])
+        self.client.post(reverse('skiutlan:utlan_marker_returnert', args=[tredje.id]))
+        self.client.post(reverse('skiutlan:ski_item_slett', args=[self.items[2].id]))
+        self.oppdater_alle(batch_storrelse=2)
+
+        inkrementelt = _projeksjonsdata()
+        self.assertEqual(inkrementelt['tilgjengelighet'], [
+            (self.items[0].id, andre.id),
+            (self.items[1].id, Utlan.objects.get(ski_item=self.items[1]).id),
+        ])
+        self.assertEqual(inkrementelt['bruker_telling'], [
+            (self.brukere[0].id, 1, 2), (self.brukere[1].id, 1, 1)])
+        self.assertEqual(inkrementelt['dag_statistikk'], [(timezone.localdate(), 3, 1)])
+        self.assertFalse(SkiItem.objects.filter(id=self.items[2].id).exists())
+
+        call_command('oppdater_projeksjoner', fra_start=True, stdout=io.StringIO())
+        self.assertEqual(_projeksjonsdata(), inkrementelt)
+
+    def test_markoren_flyttes_og_hendelser_telles_en_gang(self):
+        self.lan_ut(self.items[0], self.brukere[0])
+        self.lan_ut(self.items[1], self.brukere[0])
+        self.assertEqual(self.oppdater_alle(), 2 * len(projeksjoner.PROJEKSJONER))
+        self.assertEqual(self.oppdater_alle(), 0)
+
+        siste = UtlanHendelse.objects.latest('id').id
+        self.assertEqual(
+            set(ProjeksjonMarkor.objects.values_list('siste_hendelse_id', flat=True)), {siste})
+        self.assertEqual(ProjBrukerTelling.objects.get(bruker_id=self.brukere[0].id).aktive, 2)
+
+
+# ============================================================================
+# SAMTIDIGE UTLÅN
+# ============================================================================
+
+class SamtidigUtlanTest(TransactionTestCase):
+    """
+    Mange tråder låner ut de samme itemene samtidig. Databasen skal slippe
+    gjennom nøyaktig ett utlån per item, og resten skal få en pen feil.
+    """
+
+    ANTALL_ITEMS = 10
+    ANTALL_TRADER = 8
+    FORSOK_PER_TRAD = 40
+
+    def setUp(self):
+        self.item_ids = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Kappløp {i}', type_ski='langrenn', storrelse=190).id
+            for i in range(self.ANTALL_ITEMS)
+        ]
+        self.bruker_ids = [
+            Bruker.objects.create(fornavn=f'Skranke{i}', etternavn='Ansatt', telefon=f'+4792000{i:03d}').id
+            for i in range(self.ANTALL_TRADER)
+        ]
+
+    def arbeider(self, nr, start, resultater):
+        retur = timezone.now() + timedelta(days=2)
+        start.wait()
+        try:
+            for forsok in range(self.FORSOK_PER_TRAD):
+                item_id = self.item_ids[(nr + forsok) % self.ANTALL_ITEMS]
+                while True:
+                    try:
+                        tjenester.lan_ut(item_id, self.bruker_ids[nr], retur)
+                        resultater.append('ok')
+                    except tjenester.UtlanFeil:
+                        # Itemet er utlånt, eller brukeren har nådd grensen
+                        resultater.append('avvist')
+                    except OperationalError:
+                        # SQLite i minnet med delt cache gir "table is locked"
+                        # i stedet for å vente; prøv igjen
+                        time.sleep(0.001)
+                        continue
+                    break
+        finally:
+            connections.close_all()
+
+    def test_ingen_doble_utlan(self):
+        start = threading.Barrier(self.ANTALL_TRADER)
+        resultater = []
+        trader = [
+            threading.Thread(target=self.arbeider, args=(nr, start, resultater))
+            for nr in range(self.ANTALL_TRADER)
+        ]
+        t0 = time.perf_counter()
+        for trad in trader:
+            trad.start()
+        for trad in trader:
+            trad.join()
+        sekunder = time.perf_counter() - t0
+
+        forsok = self.ANTALL_TRADER * self.FORSOK_PER_TRAD
+        self.assertEqual(len(resultater), forsok)
+        self.assertEqual(resultater.count('ok'), self.ANTALL_ITEMS)
+        for item_id in self.item_ids:
+            self.assertEqual(Utlan.objects.filter(ski_item_id=item_id, returnert_dato__isnull=True).count(), 1)
+        self.assertEqual(UtlanHendelse.objects.count(), self.ANTALL_ITEMS)
+
+        lagre_benchmark('samtidige_utlan', {
+            'trader': self.ANTALL_TRADER,
+            'forsok': forsok,
+            'vellykkede': resultater.count('ok'),
+            'avviste': resultater.count('avvist'),
+            'sekunder': round(sekunder, 3),
+            'forsok_per_sekund': round(forsok / sekunder, 1),
+        })
+
+    def test_grensen_holder_ved_samtidige_utlan(self):
+        bruker_id = self.bruker_ids[0]
+        start = threading.Barrier(self.ANTALL_TRADER)
+        resultater = []
+
+        def arbeider(item_id):
+            start.wait()
+            try:
+                while True:
+                    try:
+                        tjenester.lan_ut(item_id, bruker_id, timezone.now() + timedelta(days=1))
+                        resultater.append('ok')
+                    except tjenester.GrenseNadd:
+                        resultater.append('grense')
+                    except OperationalError:
+                        time.sleep(0.001)
+                        continue
+                    break
+            finally:
+                connections.close_all()
+
+        trader = [threading.Thread(target=arbeider, args=(item_id,))
+                  for item_id in self.item_ids[:self.ANTALL_TRADER]]
+        for trad in trader:
+            trad.start()
+        for trad in trader:
+            trad.join()
+
+        self.assertEqual(resultater.count('ok'), Bruker.MAKS_AKTIVE_UTLAN)
+        self.assertEqual(resultater.count('grense'), self.ANTALL_TRADER - Bruker.MAKS_AKTIVE_UTLAN)
+        self.assertEqual(Bruker.objects.get(id=bruker_id).antall_aktive_utlan, Bruker.MAKS_AKTIVE_UTLAN)
+        self.assertEqual(Utlan.objects.filter(bruker_id=bruker_id).count(), Bruker.MAKS_AKTIVE_UTLAN)
+
+    def test_view_gir_vennlig_melding(self):
+        url = reverse('skiutlan:utlan_opprett_for_item', args=[self.item_ids[0]])
+        data = {'bruker': self.bruker_ids[0], 'planlagt_retur': '2030-01-01T12:00'}
+        self.client.post(url, data)
+        respons = self.client.post(url, {**data, 'bruker': self.bruker_ids[1]}, follow=True)
+        self.assertContains(respons, 'er allerede lånt ut til Skranke0 Ansatt')
+        self.assertEqual(Utlan.objects.filter(ski_item_id=self.item_ids[0]).count(), 1)
+
+    def test_ugyldig_bruker_gir_melding(self):
+        url = reverse('skiutlan:utlan_opprett_for_item', args=[self.item_ids[0]])
+        respons = self.client.post(url, {'bruker': 'abc', 'planlagt_retur': '2030-01-01T12:00'}, follow=True)
+        self.assertContains(respons, 'Fant ikke brukeren.')
+        self.assertFalse(Utlan.objects.exists())
+
+
+# ============================================================================
+# RETUR MED SKANNER
+# ============================================================================
+
+class SkannReturTest(TestCase):
+    """api_skann_retur og api_innsjekk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bruker = Bruker.objects.create(fornavn='Skann', etternavn='Kunde', telefon='+4793000000')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Skannski {i}', type_ski='alpinski', storrelse=160)
+            for i in range(4)
+        ]
+        retur = timezone.now() + timedelta(days=1)
+        for item in cls.items[:3]:
+            tjenester.lan_ut(item.id, cls.bruker.id, retur)
+        # Ett av utlånene er forsinket
+        Utlan.objects.filter(ski_item=cls.items[2]).update(planlagt_retur=timezone.now() - timedelta(days=1))
+
+    def test_tolk_kode(self):
+        self.assertEqual(tjenester.tolk_kode('SKI-000042'), 42)
+        self.assertEqual(tjenester.tolk_kode(' ski42 '), 42)
+        self.assertEqual(tjenester.tolk_kode('42'), 42)
+        self.assertIsNone(tjenester.tolk_kode('SKO-42'))
+        self.assertEqual(tjenester.tolk_kode(tjenester.ski_item_kode(7)), 7)
+
+    def test_skann_retur(self):
+        url = reverse('skiutlan:api_skann_retur')
+        kode = tjenester.ski_item_kode(self.items[0].id)
+        respons = self.client.post(url, {'kode': kode})
+        self.assertEqual(respons.status_code, 200)
+        self.assertEqual(respons.json()['status'], 'returnert')
+        self.assertFalse(Utlan.objects.filter(ski_item=self.items[0], returnert_dato__isnull=True).exists())
+        self.assertEqual(UtlanHendelse.objects.filter(type='returnert').count(), 1)
+
+        self.assertEqual(self.client.post(url, {'kode': kode}).status_code, 409)
+        self.assertEqual(self.client.post(url, {'kode': 'SKI-999999'}).status_code, 404)
+        self.assertEqual(self.client.post(url, {'kode': 'tull'}).status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_innsjekk_gir_resultat_per_kode_med_en_update(self):
+        koder = [tjenester.ski_item_kode(item.id) for item in self.items] + [
+            tjenester.ski_item_kode(self.items[1].id), 'SKI-999999', 'tull']
+        with CaptureQueriesContext(connection) as fanget:
+            respons = self.client.post(reverse('skiutlan:api_innsjekk'), {'koder': koder},
+                                       content_type='application/json')
+        self.assertEqual(sum(q['sql'].startswith('UPDATE "skiutlan_utlan"') for q in fanget.captured_queries), 1)
+
+        data = respons.json()
+        self.assertEqual(data['returnert'], 3)
+        self.assertEqual([r['status'] for r in data['resultater']], [
+            'returnert', 'returnert', 'returnert', 'ikke_utlant', 'ikke_utlant', 'ukjent', 'ugyldig'])
+        self.assertEqual([r.get('forsinket') for r in data['resultater'][:3]], [False, False, True])
+        self.assertFalse(Utlan.objects.filter(returnert_dato__isnull=True).exists())
+
+
+# ============================================================================
+# TIDSBEREGNINGER I SQL
+# ============================================================================
+
+class TidsberegningTest(TestCase):
+    """Utlan.objects.med_tidsberegninger() og sortering på forsinkelse."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.na = timezone.now()
+        bruker = Bruker.objects.create(fornavn='Tid', etternavn='Kunde', telefon='+4794000000')
+        cls.utlan = {}
+        # navn: (dager siden utlån, dager til planlagt retur, dager siden retur)
+        for navn, (utlant, retur, returnert) in {
+            'i_tide': (2, 3, None),
+            'litt_sen': (10, -2, None),
+            'veldig_sen': (40, -33, None),
+            'returnert': (20, -13, 15),
+        }.items():
+            item = SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Tid {navn}', type_ski='alpinski', storrelse=150)
+            utlan = Utlan.objects.create(
+                bruker=bruker, ski_item=item, planlagt_retur=cls.na + timedelta(days=retur),
+                returnert_dato=cls.na - timedelta(days=returnert) if returnert else None)
+            Utlan.objects.filter(id=utlan.id).update(utlant_dato=cls.na - timedelta(days=utlant))
+            cls.utlan[navn] = utlan.id
+
+    def test_annotasjoner_stemmer_med_python(self):
+        for utlan in Utlan.objects.med_tidsberegninger(self.na):
+            python = Utlan.objects.get(id=utlan.id)
+            self.assertEqual(utlan.forsinket, python.er_forsinket)
+            self.assertEqual(utlan.dager_forsinket, python.dager_forsinket)
+            self.assertAlmostEqual(utlan.lanetid.total_seconds(), python.varighet.total_seconds(), delta=60)
+
+    def test_sortering_og_filter(self):
+        ids = list(Utlan.objects.forsinket(na=self.na).mest_forsinket_forst().values_list('id', flat=True))
+        self.assertEqual(ids, [self.utlan['veldig_sen'], self.utlan['litt_sen']])
+        self.assertEqual(list(Utlan.objects.forsinket(7, na=self.na).values_list('id', flat=True)),
+                         [self.utlan['veldig_sen']])
+
+        respons = self.client.get(reverse('skiutlan:utlan_liste'), {'sorter': 'forsinket'})
+        self.assertEqual([u.id for u in respons.context['utlan']][:2],
+                         [self.utlan['veldig_sen'], self.utlan['litt_sen']])
+        respons = self.client.get(reverse('skiutlan:utlan_liste'), {'sorter': 'varighet'})
+        self.assertEqual(respons.context['utlan'][0].id, self.utlan['veldig_sen'])
+        self.assertContains(respons, 'Forsinket 33 d')
+
+    def test_forsinket_bruker_indeksen(self):
+        sql, parametre = Utlan.objects.forsinket().mest_forsinket_forst().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametre)
+            plan = ' '.join(str(rad) for rad in cursor.fetchall())
+        self.assertIn('utlan_aktiv_retur_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_admin_sorterer_pa_forsinkelse(self):
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'a@example.com', 'passord'))
+        url = reverse('admin:skiutlan_utlan_changelist')
+        # ?o= tar 1-basert indeks i list_display
+        kolonne = admin.site._registry[Utlan].list_display.index('dager_forsinket') + 1
+        respons = self.client.get(url, {'o': f'-{kolonne}', 'forsinket': '7'})
+        self.assertEqual([u.id for u in respons.context['cl'].result_list], [self.utlan['veldig_sen']])
+
+
+# ============================================================================
+# UTLÅNSTELLER PER BRUKER
+# ============================================================================
+
+class UtlansTellerTest(TestCase):
+    """Bruker.antall_aktive_utlan holdes oppdatert av alle skrivestiene."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bruker = Bruker.objects.create(fornavn='Teller', etternavn='Kunde', telefon='+4795000000')
+        cls.annen = Bruker.objects.create(fornavn='Annen', etternavn='Kunde', telefon='+4795000001')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Tellerski {i}', type_ski='alpinski', storrelse=150)
+            for i in range(5)
+        ]
+        cls.retur = timezone.now() + timedelta(days=2)
+
+    def teller(self, bruker=None):
+        return Bruker.objects.get(id=(bruker or self.bruker).id).antall_aktive_utlan
+
+    def test_utlan_og_retur(self):
+        utlan = [tjenester.lan_ut(item.id, self.bruker.id, self.retur) for item in self.items[:3]]
+        self.assertEqual(self.teller(), 3)
+
+        with self.assertRaises(tjenester.GrenseNadd):
+            tjenester.lan_ut(self.items[3].id, self.bruker.id, self.retur)
+        self.assertEqual(self.teller(), 3)
+
+        tjenester.returner([self.items[0].id])
+        self.client.post(reverse('skiutlan:utlan_marker_returnert', args=[utlan[1].id]))
+        self.assertEqual(self.teller(), 1)
+
+        # Feilet utlån (itemet er opptatt) skal ikke telle
+        with self.assertRaises(tjenester.AlleredeUtlant):
+            tjenester.lan_ut(self.items[2].id, self.annen.id, self.retur)
+        self.assertEqual(self.teller(self.annen), 0)
+
+    def test_admin_endring_og_sletting(self):
+        utlan = tjenester.lan_ut(self.items[0].id, self.bruker.id, self.retur)
+        tjenester.lan_ut(self.items[1].id, self.bruker.id, self.retur)
+        self.client.force_login(get_user_model().objects.create_superuser('admin', 'a@example.com', 'passord'))
+
+        # Flytt utlånet til en annen bruker
+        self.client.post(reverse('admin:skiutlan_utlan_change', args=[utlan.id]), {
+            'bruker': self.annen.id, 'ski_item': self.items[0].id,
+            'planlagt_retur_0': self.retur.strftime('%Y-%m-%d'), 'planlagt_retur_1': '12:00:00',
+        })
+        self.assertEqual((self.teller(), self.teller(self.annen)), (1, 1))
+
+        self.client.post(reverse('admin:skiutlan_skiitem_delete', args=[self.items[1].id]), {'post': 'yes'})
+        self.assertEqual(self.teller(), 0)
+
+        self.client.post(reverse('admin:skiutlan_utlan_changelist'), {
+            'action': 'marker_som_returnert', '_selected_action': [utlan.id]})
+        self.assertEqual(self.teller(self.annen), 0)
+
+    def test_avstemming_retter_avvik(self):
+        tjenester.lan_ut(self.items[0].id, self.bruker.id, self.retur)
+        Bruker.objects.filter(id=self.bruker.id).update(antall_aktive_utlan=3)
+        Utlan.objects.create(bruker=self.annen, ski_item=self.items[1], planlagt_retur=self.retur)
+
+        with self.assertRaises(CommandError):
+            call_command('avstem_utlanstellere', bare_sjekk=True, stdout=io.StringIO())
+        self.assertEqual(self.teller(), 3)
+
+        ut = io.StringIO()
+        call_command('avstem_utlanstellere', stdout=ut)
+        # Utlånet som ble laget utenom tjenester.py mangler også på lokasjonen
+        self.assertIn('Rettet 3', ut.getvalue())
+        # Testene bruker LocMemCache, som serveren ikke ser
+        self.assertIn('start applikasjonen på nytt', ut.getvalue())
+        self.assertEqual((self.teller(), self.teller(self.annen)), (1, 1))
+        self.assertEqual(Lokasjon.objects.get(id=self.items[1].lokasjon_id).antall_aktive_utlan, 2)
+
+    def test_telleren_erstatter_count_sporringer(self):
+        tjenester.lan_ut(self.items[0].id, self.bruker.id, self.retur)
+        respons = self.client.get(reverse('skiutlan:bruker_detalj', args=[self.bruker.id]))
+        self.assertContains(respons, 'Aktive utlån (1)')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.bruker.aktive_utlan, 0)  # Objektet fra setUpTestData er ikke lastet på nytt
+
+
+# ============================================================================
+# ØKTER OG MELDINGER UTEN DATABASE
+# ============================================================================
+
+OKT_OPPSETT = {
+    'db': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+    },
+    'cookie': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.signed_cookies',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+    },
+    'cache': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cache',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+    },
+}
+
+
+class OktBenchmarkTest(TestCase):
+    """
+    Teller database-spørringer mot øktene i en typisk skranke-flyt (logg inn,
+    lån ut, se listen, returner) med hver av SKIUTLAN_OKTER-modusene.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ansatt = get_user_model().objects.create_superuser('skranke', 'skranke@example.com', 'passord')
+        cls.bruker = Bruker.objects.create(fornavn='Økt', etternavn='Kunde', telefon='+4796000000')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Øktski {i}', type_ski='alpinski', storrelse=150)
+            for i in range(3)
+        ]
+
+    def skranke_flyt(self):
+        """Logger inn via admin og låner ut og returnerer alle itemene."""
+        respons = self.client.post(reverse('admin:login'), {
+            'username': 'skranke', 'password': 'passord', 'next': reverse('admin:index')}, follow=True)
+        self.assertEqual(respons.status_code, 200)
+        self.assertTrue(respons.context['user'].is_authenticated)
+
+        for item in self.items:
+            self.client.get(reverse('skiutlan:utlan_opprett_for_item', args=[item.id]))
+            respons = self.client.post(reverse('skiutlan:utlan_opprett_for_item', args=[item.id]), {
+                'bruker': self.bruker.id, 'planlagt_retur': '2030-01-01T12:00'}, follow=True)
+            self.assertContains(respons, 'Utlån opprettet!')
+            utlan = Utlan.objects.get(ski_item=item, returnert_dato__isnull=True)
+            respons = self.client.post(reverse('skiutlan:utlan_marker_returnert', args=[utlan.id]), follow=True)
+            self.assertContains(respons, 'Utlån markert som returnert!')
+
+        respons = self.client.get(reverse('admin:index'))
+        self.assertEqual(respons.status_code, 200)
+
+    def test_okter_uten_database(self):
+        resultater = {}
+        for modus, oppsett in OKT_OPPSETT.items():
+            with self.subTest(modus=modus), override_settings(**oppsett):
+                self.client = self.client_class()
+                cache.clear()
+                with CaptureQueriesContext(connection) as fanget:
+                    self.skranke_flyt()
+                okt = [q['sql'] for q in fanget.captured_queries if 'django_session' in q['sql']]
+                resultater[modus] = {
+                    'sporringer_totalt': len(fanget.captured_queries),
+                    'okt_lesinger': sum(sql.startswith('SELECT') for sql in okt),
+                    'okt_skrivinger': sum(not sql.startswith('SELECT') for sql in okt),
+                }
+
+        lagre_benchmark('okter', {'utlan_per_flyt': len(self.items), 'moduser': resultater})
+
+        self.assertGreater(resultater['db']['okt_skrivinger'], 0)
+        for modus in ('cookie', 'cache'):
+            self.assertEqual(resultater[modus]['okt_lesinger'] + resultater[modus]['okt_skrivinger'], 0)
+            self.assertLess(resultater[modus]['sporringer_totalt'], resultater['db']['sporringer_totalt'])
+
+
+# ============================================================================
+# OPPSTART MED PRODUKSJONSINNSTILLINGER
+# ============================================================================
+
+# Kjøres i en ny prosess: tiden fra Python starter til første svar er sendt
+FORSTE_FORESPORSEL = """
+import time
+start = time.perf_counter()
+import django
+django.setup()
+from django.core.wsgi import get_wsgi_application
+from django.test import RequestFactory
+app = get_wsgi_application()
+klar = time.perf_counter()
+respons = app.get_response(RequestFactory().get('/', HTTP_HOST='localhost'))
+ferdig = time.perf_counter()
+andre = time.perf_counter()
+app.get_response(RequestFactory().get('/', HTTP_HOST='localhost'))
+print(respons.status_code, klar - start, ferdig - klar, time.perf_counter() - andre)
+"""
+
+
+def produksjonsmiljo(katalog):
+    """Miljøvariabler for å kjøre lendly.settings_produksjon med filer i katalog."""
+    return {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': 'lendly.settings_produksjon',
+        'DJANGO_SECRET_KEY': 'benchmark',
+        'SKIUTLAN_DATABASE': str(Path(katalog) / 'db.sqlite3'),
+        'SKIUTLAN_STATIC_ROOT': str(Path(katalog) / 'static'),
+        'SKIUTLAN_SIKKERHETSKOPI_KATALOG': str(Path(katalog) / 'sikkerhetskopier'),
+        'SKIUTLAN_CACHE_URL': f'file://{Path(katalog) / "cache"}',
+    }
+
+
+class OppstartBenchmarkTest(SimpleTestCase):
+    """
+    Måler kald oppstart med lendly.settings_produksjon i nye prosesser, slik
+    en worker som startes på nytt opplever det: manage.py check, og
+    oppsett + første forespørsel mot forsiden.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.katalog = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(cls.katalog.cleanup)
+        cls.miljo = produksjonsmiljo(cls.katalog.name)
+        cls.kjor('migrate', '--noinput')
+        cls.kjor('collectstatic', '--noinput')
+
+    @classmethod
+    def kjor(cls, *argumenter):
+        return subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), *argumenter],
+            cwd=settings.BASE_DIR, env=cls.miljo, capture_output=True, text=True, check=True,
+        )
+
+    def test_cachen_deles_mellom_prosessene(self):
+        les = ('from django.conf import settings; from skiutlan import hurtigbuffer; '
+               'print(settings.CACHES["default"]["BACKEND"], '
+               'hurtigbuffer.hent_versjoner("objekt:skiutlan.bruker", [1]))')
+        for_ = self.kjor('shell', '-c', les).stdout
+        # Som avstem_utlanstellere: en kommando ugyldiggjør, og serveren ser det
+        self.kjor('shell', '-c', 'from skiutlan import hurtigbuffer; from skiutlan.models import Bruker; '
+                                 'hurtigbuffer.glem_objekter(Bruker, [1])')
+        etter = self.kjor('shell', '-c', les).stdout
+        self.assertIn('FileBasedCache', etter)
+        self.assertNotEqual(for_, etter)
+        self.assertEqual(etter, self.kjor('shell', '-c', les).stdout)
+
+    def test_oppstartstid(self):
+        check_tider = []
+        for _ in range(BENCH_GJENTAK):
+            start = time.perf_counter()
+            self.kjor('check', '--deploy', '--fail-level', 'ERROR')
+            check_tider.append(time.perf_counter() - start)
+
+        oppsett, forste, andre = [], [], []
+        for _ in range(BENCH_GJENTAK):
+            utdata = subprocess.run(
+                [sys.executable, '-c', FORSTE_FORESPORSEL],
+                cwd=settings.BASE_DIR, env=self.miljo, capture_output=True, text=True, check=True,
+            ).stdout.split()
+            self.assertEqual(utdata[0], '200')
+            oppsett.append(float(utdata[1]))
+            forste.append(float(utdata[2]))
+            andre.append(float(utdata[3]))
+
+        def ms(tider):
+            return {
+                'median_ms': round(persentil([t * 1000 for t in tider], 50), 1),
+                'p95_ms': round(persentil([t * 1000 for t in tider], 95), 1),
+            }
+
+        lagre_benchmark('oppstart', {
+            'gjentak': BENCH_GJENTAK,
+            'manage_py_check': ms(check_tider),
+            'django_oppsett': ms(oppsett),
+            'forste_foresporsel': ms(forste),
+            'andre_foresporsel': ms(andre),
+        })
+
+        self.assertLess(persentil(check_tider, 50), BENCH_OPPSTART)
+        self.assertLess(persentil([o + f for o, f in zip(oppsett, forste)], 50), BENCH_OPPSTART)
+        # Med cachet template-loader og gjenbrukt forbindelse er andre
+        # forespørsel billigere enn den første
+        self.assertLess(persentil(andre, 50), persentil(forste, 50))
+
+    def test_produksjonsinnstillinger(self):
+        utdata = self.kjor('shell', '-c', (
+            'from django.conf import settings as s; '
+            'print(s.DEBUG, s.DATABASES["default"]["CONN_MAX_AGE"], s.SESSION_ENGINE, '
+            's.TEMPLATES[0]["OPTIONS"]["loaders"][0][0])'
+        )).stdout.splitlines()[-1].split()
+        self.assertEqual(utdata, [
+            'False', '600', 'django.contrib.sessions.backends.signed_cookies',
+            'django.template.loaders.cached.Loader',
+        ])
+
+        miljo = {k: v for k, v in self.miljo.items() if k != 'DJANGO_SECRET_KEY'}
+        feil = subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'check'],
+            cwd=settings.BASE_DIR, env=miljo, capture_output=True, text=True,
+        )
+        self.assertNotEqual(feil.returncode, 0)
+        self.assertIn('DJANGO_SECRET_KEY', feil.stderr)
+
+
+# ============================================================================
+# SIKKERHETSKOPI
+# ============================================================================
+
+class SikkerhetskopiTest(TransactionTestCase):
+    """ta_sikkerhetskopi og gjenopprett_sikkerhetskopi."""
+
+    def setUp(self):
+        katalog = tempfile.TemporaryDirectory()
+        self.addCleanup(katalog.cleanup)
+        self.katalog = Path(katalog.name)
+        self.item = SkiItem.objects.create(lokasjon=testlokasjon(), navn='Åsnes Ingstad', type_ski='langrenn', storrelse=200)
+        self.bruker = Bruker.objects.create(fornavn='Kopi', etternavn='Kunde', telefon='+4797000000')
+
+    def ta_kopi(self, **valg):
+        call_command('ta_sikkerhetskopi', katalog=str(self.katalog), pause=0, stdout=io.StringIO(), **valg)
+        return sorted(self.katalog.glob('lendly-*.sqlite3.gz'))
+
+    def test_kopi_kan_gjenopprettes(self):
+        utlan = tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        kopi, = self.ta_kopi()
+
+        tjenester.returner([self.item.id])
+        SkiItem.objects.create(lokasjon=testlokasjon(), navn='Etter kopien', type_ski='alpinski', storrelse=170)
+        url = reverse('skiutlan:api_endringer')
+        markor = self.client.get(url).json()['markor']
+
+        call_command('gjenopprett_sikkerhetskopi', str(kopi), interactive=False, stdout=io.StringIO())
+        self.assertIsNone(Utlan.objects.get(id=utlan.id).returnert_dato)
+        self.assertEqual(Bruker.objects.get(id=self.bruker.id).antall_aktive_utlan, 1)
+        self.assertFalse(SkiItem.objects.filter(navn='Etter kopien').exists())
+
+        # Sekvensnumrene etter kopien brukes på nytt, så kiosken må begynne på nytt
+        SkiItem.objects.create(lokasjon=testlokasjon(), navn='Etter gjenopprettingen', type_ski='alpinski',
+                               storrelse=170)
+        self.assertEqual(self.client.get(url, {'etter': markor}).status_code, 400)
+        navn = [e['data']['navn'] for e in self.client.get(url).json()['endringer'] if e['type'] == 'ski_item']
+        self.assertEqual(navn, ['Åsnes Ingstad', 'Etter gjenopprettingen'])
+
+    def test_gamle_kopier_roteres(self):
+        for _ in range(3):
+            self.ta_kopi(behold=2)
+        self.assertEqual(len(list(self.katalog.glob('lendly-*'))), 2)
+
+    def test_odelagt_kopi_avvises_for_noe_endres(self):
+        for navn, innhold in (('avkuttet.sqlite3.gz', b'\x1f\x8b\x08\x00'), ('tull.sqlite3', b'ikke sqlite' * 100)):
+            (self.katalog / navn).write_bytes(innhold)
+            with self.subTest(navn), self.assertRaises(CommandError):
+                call_command('gjenopprett_sikkerhetskopi', str(self.katalog / navn),
+                             interactive=False, stdout=io.StringIO())
+        self.assertTrue(SkiItem.objects.filter(id=self.item.id).exists())
+
+
+# Kjøres i en ny prosess med produksjonsinnstillingene (fil-database i WAL):
+# tråder låner ut og returnerer mens manage.py ta_sikkerhetskopi kjører i en
+# egen prosess, slik den gjør fra cron i produksjon
+KOPI_UNDER_UTLAN = """
+import json, re, subprocess, sys, threading, time
+from datetime import timedelta
+import django
+django.setup()
+from django.db import connections
+from django.utils import timezone
+from skiutlan import tjenester
+from skiutlan.models import Bruker, SkiItem
+from skiutlan.tests import seed_datasett, stille, testlokasjon
+
+skala, antall_trader = float(sys.argv[1]), int(sys.argv[2])
+with stille():
+    seed_datasett(int(2000 * skala), int(500 * skala), int(10000 * skala))
+tjenester.returner(SkiItem.objects.values_list('id', flat=True))
+par = [
+    (SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Benchmark {i}', type_ski='alpinski', storrelse=160).id,
+     Bruker.objects.create(fornavn=f'Bench{i}', etternavn='Kunde', telefon=f'+4797100{i:03d}').id)
+    for i in range(antall_trader)
+]
+connections.close_all()
+
+def laan(item_id, bruker_id, klar, stopp, latenser):
+    retur = timezone.now() + timedelta(days=1)
+    klar.wait()
+    try:
+        while not stopp.is_set():
+            start = time.perf_counter()
+            tjenester.lan_ut(item_id, bruker_id, retur)
+            tjenester.returner([item_id])
+            latenser.append((time.perf_counter() - start) * 1000)
+    finally:
+        connections.close_all()
+
+def under_utlan(*argumenter):
+    klar, stopp, latenser = threading.Barrier(antall_trader + 1), threading.Event(), []
+    trader = [threading.Thread(target=laan, args=(*p, klar, stopp, latenser)) for p in par]
+    for trad in trader:
+        trad.start()
+    klar.wait()
+    start = time.perf_counter()
+    utdata = subprocess.run([sys.executable, 'manage.py', *argumenter],
+                            capture_output=True, text=True, check=True).stdout
+    sekunder = time.perf_counter() - start
+    stopp.set()
+    for trad in trader:
+        trad.join()
+    return {'sekunder': sekunder, 'utdata': utdata, 'latenser': latenser}
+
+print(json.dumps({
+    'uten_kopiering': under_utlan('check'),
+    'stegvis_kopiering': under_utlan('ta_sikkerhetskopi', '-v', '2', '--sider-per-steg', '8', '--pause', '0.002'),
+    'samlet_kopiering': under_utlan('ta_sikkerhetskopi', '-v', '2', '--sider-per-steg', '-1', '--pause', '0'),
+}))
+"""
+
+
+class SikkerhetskopiBenchmarkTest(SimpleTestCase):
+    """
+    Måler utlånslatens mens sikkerhetskopien tas, med produksjonsinnstillingene
+    (fil-database i WAL og ekte samtidige forbindelser) i en egen prosess.
+    """
+
+    ANTALL_TRADER = 4
+
+    def test_utlan_under_kopiering(self):
+        with tempfile.TemporaryDirectory() as katalog:
+            miljo = produksjonsmiljo(katalog)
+            subprocess.run(
+                [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'migrate', '--noinput'],
+                cwd=settings.BASE_DIR, env=miljo, capture_output=True, check=True,
+            )
+            resultat = json.loads(subprocess.run(
+                [sys.executable, '-c', KOPI_UNDER_UTLAN, str(BENCH_SKALA), str(self.ANTALL_TRADER)],
+                cwd=settings.BASE_DIR, env=miljo, capture_output=True, text=True, check=True,
+            ).stdout)
+
+        def oppsummer(maling):
+            latenser = maling['latenser']
+            omstarter = re.search(r'(\d+) omstarter', maling['utdata'])
+            return {
+                'kommando_ms': round(maling['sekunder'] * 1000, 1),
+                'omstarter': int(omstarter.group(1)) if omstarter else None,
+                'utlan': len(latenser),
+                'p50_ms': round(persentil(latenser, 50), 2),
+                'p95_ms': round(persentil(latenser, 95), 2),
+                'maks_ms': round(max(latenser, default=0), 2),
+            }
+
+        resultat = {navn: oppsummer(maling) for navn, maling in resultat.items()}
+        lagre_benchmark('sikkerhetskopi', {'trader': self.ANTALL_TRADER, 'utlan_ut_og_inn': resultat})
+
+        for navn, oppsummering in resultat.items():
+            self.assertGreater(oppsummering['utlan'], 0, navn)
+        # Med WAL venter ikke utlån på kopien: p95 holder seg langt under
+        # tiden kommandoen bruker
+        for navn in ('stegvis_kopiering', 'samlet_kopiering'):
+            self.assertLess(resultat[navn]['p95_ms'], resultat[navn]['kommando_ms'])
+
+
+# ============================================================================
+# LOKASJONER
+# ============================================================================
+
+class LokasjonTest(TestCase):
+    """Tellere per lokasjon, flytting av items og visninger for valgt lokasjon."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sentrum = Lokasjon.objects.create(navn='Sentrum')
+        cls.fjellet = Lokasjon.objects.create(navn='Fjellet')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=lokasjon, navn=f'{lokasjon.navn}ski {i}',
+                                   type_ski='alpinski', storrelse=150)
+            for lokasjon in (cls.sentrum, cls.fjellet) for i in range(3)
+        ]
+        cls.bruker = Bruker.objects.create(fornavn='Lok', etternavn='Kunde', telefon='+4796000000')
+        cls.retur = timezone.now() + timedelta(days=2)
+        cls.admin_bruker = get_user_model().objects.create_superuser('admin', 'a@example.com', 'passord')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin_bruker)
+
+    def tellere(self, lokasjon):
+        lokasjon.refresh_from_db()
+        return lokasjon.antall_ski_items, lokasjon.antall_aktive_utlan
+
+    def test_tellere_folger_utlan_og_items(self):
+        self.assertEqual(self.tellere(self.sentrum), (3, 0))
+        utlan = tjenester.lan_ut(self.items[0].id, self.bruker.id, self.retur)
+        self.assertEqual(utlan.lokasjon_id, self.sentrum.id)
+        self.assertEqual(self.tellere(self.sentrum), (3, 1))
+        self.assertEqual(self.tellere(self.fjellet), (3, 0))
+
+        tjenester.returner([self.items[0].id])
+        self.assertEqual(self.tellere(self.sentrum), (3, 0))
+
+        tjenester.lan_ut(self.items[1].id, self.bruker.id, self.retur)
+        self.client.post(reverse('admin:skiutlan_utlan_changelist'), {
+            'action': 'marker_som_returnert', '_selected_action': [Utlan.objects.aktive().get().id]})
+        self.assertEqual(self.tellere(self.sentrum), (3, 0))
+        self.client.post(reverse('skiutlan:ski_item_slett', args=[self.items[1].id]))
+        self.assertEqual(self.tellere(self.sentrum), (2, 0))
+        self.assertEqual(tjenester.avstem_lokasjoner(rett=False), {})
+
+    def test_flytting(self):
+        tjenester.lan_ut(self.items[0].id, self.bruker.id, self.retur)
+        with self.assertRaises(tjenester.FlyttFeil):
+            tjenester.flytt_ski_items([self.items[0].id, self.items[1].id], self.fjellet.id)
+        self.assertEqual(SkiItem.objects.get(id=self.items[1].id).lokasjon_id, self.sentrum.id)
+
+        self.assertEqual(tjenester.flytt_ski_items([self.items[1].id, self.items[3].id], self.fjellet.id), 1)
+        self.assertEqual(self.tellere(self.sentrum), (2, 1))
+        self.assertEqual(self.tellere(self.fjellet), (4, 0))
+
+        respons = self.client.post(reverse('skiutlan:ski_item_flytt', args=[self.items[2].id]),
+                                   {'lokasjon': self.fjellet.id}, follow=True)
+        self.assertContains(respons, 'er flyttet til Fjellet')
+        self.assertEqual(self.tellere(self.fjellet), (5, 0))
+        self.assertEqual(tjenester.avstem_lokasjoner(rett=False), {})
+
+    def test_valgt_lokasjon_begrenser_visningene(self):
+        tjenester.lan_ut(self.items[3].id, self.bruker.id, self.retur)
+        respons = self.client.post(reverse('skiutlan:velg_lokasjon'),
+                                   {'lokasjon': self.sentrum.id, 'neste': reverse('skiutlan:ski_item_liste')})
+        self.assertRedirects(respons, reverse('skiutlan:ski_item_liste'))
+
+        respons = self.client.get(reverse('skiutlan:ski_item_liste'))
+        self.assertContains(respons, 'Sentrumski 0')
+        self.assertNotContains(respons, 'Fjelletski 0')
+        self.assertNotContains(self.client.get(reverse('skiutlan:utlan_liste')), 'Fjelletski 0')
+
+        respons = self.client.get(reverse('skiutlan:hjem'))
+        self.assertEqual((respons.context['totalt_ski_items'], respons.context['aktive_utlan']), (3, 0))
+
+        skjema = self.client.get(reverse('skiutlan:utlan_opprett')).context['form']
+        self.assertEqual(set(skjema.fields['ski_item'].queryset), set(self.items[:3]))
+
+        # Ugyldig valg og eksterne neste-adresser gir alle lokasjoner og forsiden
+        respons = self.client.post(reverse('skiutlan:velg_lokasjon'),
+                                   {'lokasjon': '', 'neste': 'https://example.com/'})
+        self.assertRedirects(respons, reverse('skiutlan:hjem'), fetch_redirect_response=False)
+        respons = self.client.get(reverse('skiutlan:hjem'))
+        self.assertEqual((respons.context['totalt_ski_items'], respons.context['aktive_utlan']), (6, 1))
+
+
+class LokasjonBenchmarkTest(TestCase):
+    """
+    Sammenligner listene for én lokasjon med listene for alle, med 20
+    lokasjoner, og sjekker at spørringene bruker indeksene som starter
+    med lokasjon.
+    """
+
+    ANTALL_LOKASJONER = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(4000 * BENCH_SKALA),
+            antall_brukere=int(400 * BENCH_SKALA),
+            antall_utlan=int(6000 * BENCH_SKALA),
+            antall_lokasjoner=cls.ANTALL_LOKASJONER,
+        )
+        cls.lokasjon = Lokasjon.objects.filter(navn__startswith='Utleie ').first()
+
+    def maal(self, navn):
+        url = reverse(navn)
+        self.client.get(url)
+        tider = []
+        for _ in range(BENCH_GJENTAK):
+            with stille(), CaptureQueriesContext(connection) as fanget:
+                start = time.perf_counter()
+                respons = self.client.get(url)
+                tider.append((time.perf_counter() - start) * 1000)
+            self.assertEqual(respons.status_code, 200)
+        return {
+            'sporringer': len(fanget.captured_queries),
+            'p50_ms': round(persentil(tider, 50), 3),
+            'p95_ms': round(persentil(tider, 95), 3),
+        }
+
+    def sporringsplan(self, queryset):
+        sql, parametre = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametre)
+            return ' '.join(str(rad[-1]) for rad in cursor.fetchall())
+
+    def test_visninger_per_lokasjon(self):
+        visninger = ('skiutlan:hjem', 'skiutlan:ski_item_liste', 'skiutlan:utlan_liste')
+        alle = {navn: self.maal(navn) for navn in visninger}
+        self.client.post(reverse('skiutlan:velg_lokasjon'), {'lokasjon': self.lokasjon.id})
+        en = {navn: self.maal(navn) for navn in visninger}
+
+        planer = {
+            'aktive_utlan': self.sporringsplan(Utlan.objects.aktive().filter(lokasjon=self.lokasjon)),
+            'nylige_utlan': self.sporringsplan(
+                Utlan.objects.filter(lokasjon=self.lokasjon).order_by('-utlant_dato')[:5]),
+            'ski_items': self.sporringsplan(
+                SkiItem.objects.filter(lokasjon=self.lokasjon, type_ski='alpinski')),
+        }
+        lagre_benchmark('lokasjoner', {
+            'datasett': self.datasett,
+            'lokasjoner': self.ANTALL_LOKASJONER,
+            'alle_lokasjoner': alle,
+            'en_lokasjon': en,
+            'planer': planer,
+        })
+
+        for navn in visninger:
+            with self.subTest(visning=navn):
+                self.assertLessEqual(en[navn]['sporringer'], alle[navn]['sporringer'])
+        self.assertIn('utlan_lok_aktiv_retur_idx', planer['aktive_utlan'])
+        self.assertIn('utlan_lok_dato_idx', planer['nylige_utlan'])
+        self.assertIn('skiitem_lok_type_idx', planer['ski_items'])
+
+
+# ============================================================================
+# TILGJENGELIGHET FREMOVER I TID
+# ============================================================================
+
+class PrognoseTest(TestCase):
+    """Tidslinjen fra sweep-line-beregningen mot én telling per tidspunkt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(600 * BENCH_SKALA),
+            antall_brukere=int(200 * BENCH_SKALA),
+            antall_utlan=int(2000 * BENCH_SKALA),
+        )
+        # Spre de planlagte returene utover de neste dagene
+        na = timezone.now()
+        for indeks, utlan in enumerate(Utlan.objects.aktive().filter(planlagt_retur__gte=na)):
+            Utlan.objects.filter(id=utlan.id).update(planlagt_retur=na + timedelta(hours=7 * indeks + 1))
+        cls.utvalg = {'type_ski': 'alpinski', 'storrelse_fra': 60, 'storrelse_til': 180}
+
+    def tell(self, tidspunkt, type_ski, storrelse_fra, storrelse_til):
+        """Ledige ved tidspunkt, talt direkte i databasen."""
+        items = SkiItem.objects.filter(type_ski=type_ski, storrelse__range=(storrelse_fra, storrelse_til))
+        na = timezone.now()
+        opptatt = Utlan.objects.aktive().filter(ski_item__in=items).filter(
+            Q(planlagt_retur__lt=na) | Q(planlagt_retur__gt=tidspunkt))
+        return items.count() - opptatt.count()
+
+    def test_tidslinje_stemmer_med_telling(self):
+        fra = timezone.now() + timedelta(minutes=1)
+        til = fra + timedelta(days=14)
+        with self.assertNumQueries(2):
+            linje = prognose.tidslinje(fra, til, **self.utvalg)
+
+        self.assertGreater(len(linje['punkter']), 5)
+        self.assertGreater(linje['forsinket'], 0)
+        tidspunkter = [fra + timedelta(hours=5 * i) for i in range(14 * 24 // 5)]
+        for tidspunkt in tidspunkter:
+            self.assertEqual(prognose.ledige_ved(linje['punkter'], tidspunkt),
+                             self.tell(tidspunkt, **self.utvalg), tidspunkt)
+
+    def test_api(self):
+        lordag = timezone.localtime() + timedelta(days=3)
+        respons = self.client.get(reverse('skiutlan:api_tilgjengelighet'), {
+            **self.utvalg, 'tidspunkt': lordag.replace(tzinfo=None).isoformat()})
+        self.assertEqual(respons.status_code, 200)
+        data = respons.json()
+        self.assertEqual(data['ledige'], self.tell(lordag, **self.utvalg))
+        # Uten fra starter tidslinjen nå, med alle aktive utlån utlånt
+        self.assertEqual(data['tidslinje'][0]['ledige'], data['totalt'] - data['utlant'])
+
+        for parametre in ({'fra': 'i morgen'}, {'fra': '2030-01-02', 'til': '2030-01-01'}, {'type_ski': 'kjelke'}):
+            with self.subTest(parametre=parametre):
+                self.assertEqual(self.client.get(reverse('skiutlan:api_tilgjengelighet'), parametre).status_code, 400)
+
+    def test_rapporter_viser_14_dager(self):
+        respons = self.client.get(reverse('skiutlan:rapporter'), {'storrelse_fra': 60, 'storrelse_til': 180})
+        rader = dict(respons.context['prognose']['rader'])
+        self.assertEqual(len(respons.context['prognose']['datoer']), 14)
+        klokka = [
+            max(timezone.now(), timezone.make_aware(datetime.combine(dato, prognose.APNINGSTID)))
+            for dato in respons.context['prognose']['datoer']
+        ]
+        self.assertEqual(rader['Alpinski'], [self.tell(t, **self.utvalg) for t in klokka])
+
+    def test_benchmark_mot_telling_per_tidspunkt(self):
+        fra = timezone.now()
+        tidspunkter = [fra + timedelta(hours=i) for i in range(14 * 24)]
+
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as sveip_fanget:
+            linje = prognose.tidslinje(fra, tidspunkter[-1], **self.utvalg)
+            sveip = [prognose.ledige_ved(linje['punkter'], t) for t in tidspunkter]
+        sveip_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        with CaptureQueriesContext(connection) as telling_fanget:
+            telling = [self.tell(t, **self.utvalg) for t in tidspunkter]
+        telling_ms = (time.perf_counter() - start) * 1000
+
+        lagre_benchmark('prognose', {
+            'datasett': self.datasett,
+            'tidspunkter': len(tidspunkter),
+            'sveip': {'ms': round(sveip_ms, 3), 'sporringer': len(sveip_fanget.captured_queries)},
+            'telling_per_tidspunkt': {'ms': round(telling_ms, 3), 'sporringer': len(telling_fanget.captured_queries)},
+        })
+        self.assertEqual(sveip, telling)
+        self.assertEqual(len(sveip_fanget.captured_queries), 2)
+        self.assertLess(sveip_ms, telling_ms)
+
+
+# ============================================================================
+# STATISTIKK-API (CACHE MED MYK UTLØPSTID OG SINGLE-FLIGHT)
+# ============================================================================
+
+class BeregnetCacheTest(SimpleTestCase):
+    """hurtigbuffer.hent_beregnet med mange samtidige forespørsler."""
+
+    ANTALL_TRADER = 100
+
+    def setUp(self):
+        cache.clear()
+        self.beregninger = 0
+        self.teller_las = threading.Lock()
+
+    def treg_beregning(self, sekunder=0.05):
+        def beregn():
+            with self.teller_las:
+                self.beregninger += 1
+                nummer = self.beregninger
+            time.sleep(sekunder)
+            return {'beregning': nummer}
+        return beregn
+
+    def samtidig(self, beregn, myk_ttl=60):
+        """Kaller hent_beregnet fra ANTALL_TRADER tråder samtidig. Returnerer (verdier, latenser i ms)."""
+        start = threading.Barrier(self.ANTALL_TRADER)
+        verdier, latenser = [], []
+
+        def poll():
+            start.wait()
+            for_kall = time.perf_counter()
+            verdi = hurtigbuffer.hent_beregnet('test:statistikk', beregn, ttl=600, myk_ttl=myk_ttl)
+            latenser.append((time.perf_counter() - for_kall) * 1000)
+            verdier.append(verdi)
+
+        trader = [threading.Thread(target=poll) for _ in range(self.ANTALL_TRADER)]
+        for trad in trader:
+            trad.start()
+        for trad in trader:
+            trad.join()
+        return verdier, latenser
+
+    def test_kald_cache_beregnes_en_gang(self):
+        verdier, _ = self.samtidig(self.treg_beregning())
+        self.assertEqual(self.beregninger, 1)
+        self.assertEqual(verdier, [{'beregning': 1}] * self.ANTALL_TRADER)
+
+    def test_foreldet_verdi_serveres_mens_en_beregner(self):
+        hurtigbuffer.hent_beregnet('test:statistikk', self.treg_beregning(0), ttl=600, myk_ttl=0)
+        verdier, latenser = self.samtidig(self.treg_beregning(0.2), myk_ttl=0)
+
+        self.assertEqual(self.beregninger, 2)
+        self.assertEqual(verdier.count({'beregning': 2}), 1)
+        # De andre får den gamle verdien uten å vente på beregningen
+        self.assertEqual(verdier.count({'beregning': 1}), self.ANTALL_TRADER - 1)
+        self.assertLess(sorted(latenser)[-2], 200)
+
+    def test_feil_i_beregningen_slipper_laasen(self):
+        def feiler():
+            raise RuntimeError('database nede')
+
+        with self.assertRaises(RuntimeError):
+            hurtigbuffer.hent_beregnet('test:statistikk', feiler, ttl=600, myk_ttl=60)
+        self.assertEqual(hurtigbuffer.hent_beregnet('test:statistikk', lambda: 'ok', ttl=600, myk_ttl=60), 'ok')
+
+    def test_utlopt_laas_slippes_ikke_fra_en_annen(self):
+        las = hurtigbuffer._las_nokkel('test:statistikk')
+
+        def treg():
+            # Låsen utløp under beregningen, og en annen prosess tok den
+            cache.set(las, 'annen', timeout=30)
+            return 'ny'
+
+        self.assertEqual(hurtigbuffer.hent_beregnet('test:statistikk', treg, ttl=600, myk_ttl=60), 'ny')
+        self.assertEqual(cache.get(las), 'annen')
+
+    def test_benchmark(self):
+        resultat = {}
+        for navn, myk_ttl in (('kald', 60), ('foreldet', 0)):
+            cache.clear()
+            self.beregninger = 0
+            if navn == 'foreldet':
+                hurtigbuffer.hent_beregnet('test:statistikk', self.treg_beregning(0), ttl=600, myk_ttl=0)
+                self.beregninger = 0
+            _, latenser = self.samtidig(self.treg_beregning(), myk_ttl=myk_ttl)
+            resultat[navn] = {
+                'beregninger': self.beregninger,
+                'p50_ms': round(persentil(latenser, 50), 3),
+                'p95_ms': round(persentil(latenser, 95), 3),
+                'maks_ms': round(max(latenser), 3),
+            }
+        lagre_benchmark('statistikk_cache', {'trader': self.ANTALL_TRADER, 'beregning_ms': 50, **resultat})
+        self.assertEqual(resultat['kald']['beregninger'], 1)
+        self.assertEqual(resultat['foreldet']['beregninger'], 1)
+
+
+class StatistikkApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bruker = Bruker.objects.create(fornavn='Stat', etternavn='Kunde', telefon='+4797000000')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=testlokasjon(), navn=f'Statski {i}', type_ski=type_ski, storrelse=150)
+            for i, type_ski in enumerate(['alpinski', 'alpinski', 'langrenn'])
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tall_og_cache(self):
+        tjenester.lan_ut(self.items[0].id, self.bruker.id, timezone.now() - timedelta(hours=1))
+        tjenester.lan_ut(self.items[2].id, self.bruker.id, timezone.now() + timedelta(days=1))
+        tjenester.returner([self.items[2].id])
+
+        url = reverse('skiutlan:api_statistikk')
+        with self.assertNumQueries(3):
+            data = self.client.get(url).json()
+        self.assertEqual((data['ski_items'], data['ledige']), (3, 2))
+        self.assertEqual((data['aktive'], data['forsinket']), (1, 1))
+        self.assertEqual((data['utlant_idag'], data['returnert_idag']), (2, 1))
+        self.assertEqual(data['per_type']['alpinski'], {'totalt': 2, 'ledige': 1})
+        self.assertEqual(data['per_type']['snowboard'], {'totalt': 0, 'ledige': 0})
+
+        # Innenfor SKIUTLAN_STATISTIKK_SEKUNDER svares det fra cachen
+        tjenester.returner([self.items[0].id])
+        with self.assertNumQueries(0):
+            respons = self.client.get(url)
+        self.assertEqual(respons.json()['aktive'], 1)
+        self.assertIn(f'max-age={settings.SKIUTLAN_STATISTIKK_SEKUNDER}', respons['Cache-Control'])
+
+        with override_settings(SKIUTLAN_STATISTIKK_SEKUNDER=0):
+            self.assertEqual(self.client.get(url).json()['aktive'], 0)
+
+    def test_lokasjon(self):
+        annen = Lokasjon.objects.create(navn='Tomt lager')
+        data = self.client.get(reverse('skiutlan:api_statistikk'), {'lokasjon': annen.id}).json()
+        self.assertEqual((data['lokasjon_id'], data['ski_items']), (annen.id, 0))
+        self.assertEqual(statistikk.hent()['ski_items'], 3)
+
+
+# ============================================================================
+# LAGREDE SØK
+# ============================================================================
+
+class LagretSokTest(TestCase):
+    """Treffene i lagrede søk skal alltid være de samme som å kjøre søket på nytt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sentrum = testlokasjon()
+        cls.fjellet = Lokasjon.objects.create(navn='Fjellet')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=cls.sentrum, navn=f'Fjellski {i}', type_ski=type_ski,
+                                   storrelse=150, tilstand='god')
+            for i, type_ski in enumerate(['alpinski', 'alpinski', 'langrenn', 'snowboard'])
+        ]
+        cls.ola = Bruker.objects.create(fornavn='Ola', etternavn='Nordmann', telefon='+4798000000')
+        cls.kari = Bruker.objects.create(fornavn='Kari', etternavn='Fjellstad', telefon='+4798000001')
+        cls.admin_bruker = get_user_model().objects.create_superuser('admin', 'a@example.com', 'passord')
+
+    def setUp(self):
+        cache.clear()
+
+    def lagre(self, **spesifikasjon):
+        return sok.lagre(' '.join(map(str, spesifikasjon.values())), spesifikasjon)[0]
+
+    def assertSomNyttSok(self, *sokene):
+        for lagret in sokene:
+            lagret.refresh_from_db()
+            spesifikasjon = lagret.spesifikasjon
+            typer = sok.treff_typer(spesifikasjon)
+            for navn, (modell, filter_, felt) in sok.TYPER.items():
+                forventet = (
+                    list(modell.objects.filter(filter_(spesifikasjon)).values_list('id', flat=True))
+                    if navn in typer else []
+                )
+                if navn == 'utlan' and navn in typer:
+                    # Som avansert_sok: også arkiverte utlån
+                    forventet += UtlanArkiv.objects.filter(filter_(spesifikasjon)).values_list('id', flat=True)
+                self.assertEqual(getattr(lagret, felt), sorted(forventet), f'{lagret.navn}: {felt}')
+
+    def test_normaliser(self):
+        spesifikasjon = sok.normaliser({
+            'sok_tekst': '  Ola   Nordmann ', 'ski_type': 'ukjent', 'tilstand': 'god',
+            'utlan_status': 'alle', 'dato_fra': '2026-13-01', 'dato_til': '2026-01-05',
+        }, lokasjon_id=3)
+        self.assertEqual(spesifikasjon, {
+            'sok_tekst': 'Ola Nordmann', 'tilstand': 'god', 'dato_til': '2026-01-05', 'lokasjon': 3})
+        self.assertEqual(sok.normaliser({}), {})
+
+        lagret, opprettet = sok.lagre('Første', {'tilstand': 'god', 'ski_type': 'alpinski'})
+        self.assertTrue(opprettet)
+        self.assertEqual(sok.lagre('Andre', {'ski_type': 'alpinski', 'tilstand': 'god'}), (lagret, False))
+        self.assertEqual(lagret.ski_item_ids, [self.items[0].id, self.items[1].id])
+
+    @override_settings(SKIUTLAN_ARKIV_ALDER_DAGER=365)
+    def test_arkiverte_utlan_er_fortsatt_treff(self):
+        na = timezone.now()
+        utlan = tjenester.lan_ut(self.items[0].id, self.ola.id, na + timedelta(days=1))
+        tjenester.returner([self.items[0].id])
+        Utlan.objects.filter(id=utlan.id).update(utlant_dato=na - timedelta(days=800),
+                                                 returnert_dato=na - timedelta(days=790))
+        sokene = [self.lagre(utlan_status='returnerte'), self.lagre(sok_tekst='Nordmann'),
+                  self.lagre(utlan_status='aktive')]
+        for_ = [len(s.utlan_ids) for s in sokene]
+        self.assertEqual(for_, [1, 1, 0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('arkiver_utlan', batch_storrelse=10, pause=0, stdout=io.StringIO())
+        self.assertTrue(UtlanArkiv.objects.filter(id=utlan.id).exists())
+        self.assertSomNyttSok(*sokene)
+        self.assertEqual([len(s.utlan_ids) for s in sokene], for_)
+        respons = self.client.get(reverse('skiutlan:lagret_sok_detalj', args=[sokene[0].id]))
+        self.assertContains(respons, reverse('skiutlan:utlan_detalj', args=[utlan.id]))
+
+        # Endringer på brukeren evalueres også mot arkivet
+        with self.captureOnCommitCallbacks(execute=True):
+            Bruker.objects.filter(id=self.ola.id).update(etternavn='Hansen')
+            Bruker.objects.get(id=self.ola.id).save()
+        self.assertSomNyttSok(*sokene)
+        self.assertEqual(LagretSok.objects.get(id=sokene[1].id).utlan_ids, [])
+
+    def test_etag_pa_detaljsider_folger_antall_treff(self):
+        url = reverse('skiutlan:bruker_detalj', args=[self.kari.id])
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Et nytt lagret søk, og deretter et utlån som blir forsinket uten at noe lagres
+        self.lagre(utlan_status='forsinket')
+        respons = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respons.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.lan_ut(self.items[0].id, self.ola.id, timezone.now() + timedelta(hours=1))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        senere = timezone.now() + timedelta(hours=2)
+        with mock.patch('django.utils.timezone.now', return_value=senere):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_gammel_meny_i_cachen_stopper_ikke_oppdateringen(self):
+        lagret = self.lagre(utlan_status='aktive')
+        # Som i en prosess som cachet menyen før søket ble lagret i en annen
+        cache.set(sok._CACHE_NOKKEL, [], timeout=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.lan_ut(self.items[0].id, self.ola.id, timezone.now() + timedelta(days=1))
+        self.assertSomNyttSok(lagret)
+        self.assertEqual(len(lagret.utlan_ids), 1)
+
+    def test_treff_folger_endringer(self):
+        sokene = [
+            self.lagre(sok_tekst='fjell'),
+            self.lagre(utlan_status='aktive'),
+            self.lagre(utlan_status='returnerte', ski_type='alpinski'),
+            self.lagre(ski_type='langrenn'),
+            self.lagre(sok_tekst='Nordmann', utlan_status='aktive'),
+            self.lagre(tilstand='god', lokasjon=self.sentrum.id),
+        ]
+        self.assertSomNyttSok(*sokene)
+        retur = timezone.now() + timedelta(days=1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            utlan = tjenester.lan_ut(self.items[0].id, self.ola.id, retur)
+            tjenester.lan_ut(self.items[2].id, self.kari.id, retur)
+        self.assertSomNyttSok(*sokene)
+        self.assertEqual(LagretSok.objects.get(id=sokene[4].id).utlan_ids, [utlan.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.returner([self.items[0].id])
+        self.assertSomNyttSok(*sokene)
+
+        # Navn og type på bruker og item treffer også utlånene deres
+        with self.captureOnCommitCallbacks(execute=True):
+            Bruker.objects.filter(id=self.kari.id).update(etternavn='Nordmann')
+            Bruker.objects.get(id=self.kari.id).save()
+            item = SkiItem.objects.get(id=self.items[2].id)
+            item.type_ski, item.navn = 'alpinski', 'Dalski'
+            item.save()
+        self.assertSomNyttSok(*sokene)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.returner([self.items[2].id])
+            tjenester.flytt_ski_items([self.items[1].id], self.fjellet.id)
+            SkiItem.objects.create(lokasjon=self.sentrum, navn='Fjellski ny', type_ski='langrenn', storrelse=190)
+            SkiItem.objects.get(id=self.items[3].id).delete()
+        self.assertSomNyttSok(*sokene)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Utlan.objects.filter(id=utlan.id).delete()
+        self.assertSomNyttSok(*sokene)
+
+    def test_forsinket_telles_etter_klokka(self):
+        na = timezone.now()
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.lan_ut(self.items[0].id, self.ola.id, na - timedelta(hours=1))
+        lagret = self.lagre(utlan_status='forsinket')
+        with self.captureOnCommitCallbacks(execute=True):
+            senere = tjenester.lan_ut(self.items[1].id, self.kari.id, na + timedelta(hours=2))
+
+        lagret.refresh_from_db()
+        self.assertEqual(len(lagret.utlan_ids), 2)
+        oppforing, = sok.meny()
+        self.assertEqual(sok.antall_treff(oppforing, na), 1)
+        self.assertEqual(sok.antall_treff(oppforing, na + timedelta(hours=3)), 2)
+        self.assertEqual(len(sok.forsinkede_utlan_ids(lagret, na + timedelta(hours=3))), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.returner_utlan([senere.id])
+        self.assertEqual(sok.antall_treff(sok.meny()[0], na + timedelta(hours=3)), 1)
+
+    def test_menyen_leses_fra_cachen(self):
+        self.lagre(sok_tekst='fjell')
+        sok.meny()
+        with self.assertNumQueries(0):
+            menyen = sok.context_processor(None)['lagrede_sok']()
+        self.assertEqual(menyen[0][1:], ('fjell', 5))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            LagretSok.objects.update(navn='Alt på fjellet')
+            LagretSok.objects.get().save()
+        self.assertEqual(sok.meny()[0]['navn'], 'Alt på fjellet')
+
+    def test_visninger(self):
+        self.client.force_login(self.admin_bruker)
+        with self.captureOnCommitCallbacks(execute=True):
+            respons = self.client.post(reverse('skiutlan:lagret_sok'),
+                                       {'navn': 'Alpint', 'ski_type': 'alpinski', 'sok_tekst': ''})
+        lagret = LagretSok.objects.get()
+        self.assertRedirects(respons, reverse('skiutlan:lagret_sok_detalj', args=[lagret.id]))
+        self.assertEqual(lagret.spesifikasjon, {'ski_type': 'alpinski'})
+
+        respons = self.client.get(reverse('skiutlan:lagret_sok_detalj', args=[lagret.id]))
+        self.assertContains(respons, 'Fjellski 0')
+        self.assertNotContains(respons, 'Fjellski 2')
+        self.assertContains(self.client.get(reverse('skiutlan:hjem')), 'Alpint')
+
+        # Uten filtre lagres ingenting
+        self.client.post(reverse('skiutlan:lagret_sok'), {'navn': 'Tomt'})
+        self.assertEqual(LagretSok.objects.count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('skiutlan:lagret_sok_slett', args=[lagret.id]))
+        self.assertFalse(LagretSok.objects.exists())
+        self.assertEqual(sok.meny(), [])
+
+
+class LagretSokBenchmarkTest(TestCase):
+    """Oppdatering av endrede rader mot å kjøre alle lagrede søk på nytt."""
+
+    ANTALL_SOK = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(2000 * BENCH_SKALA),
+            antall_brukere=int(1000 * BENCH_SKALA),
+            antall_utlan=int(6000 * BENCH_SKALA),
+        )
+        spesifikasjoner = [
+            {'utlan_status': 'aktive'}, {'utlan_status': 'forsinket'}, {'utlan_status': 'returnerte'},
+            {'sok_tekst': 'Testski 1'}, {'sok_tekst': 'Etternavn2'}, {'ski_type': 'alpinski'},
+            {'tilstand': 'slitt'}, {'utlan_status': 'aktive', 'ski_type': 'langrenn'},
+            {'sok_tekst': 'Fornavn1', 'utlan_status': 'aktive'}, {'tilstand': 'god', 'ski_type': 'snowboard'},
+        ]
+        cls.sokene = [sok.lagre(f'Søk {i}', s)[0] for i, s in enumerate(spesifikasjoner[:cls.ANTALL_SOK])]
+
+    def test_inkrementell_oppdatering(self):
+        utlan_ids = list(Utlan.objects.aktive().order_by('id').values_list('id', flat=True)[:BENCH_GJENTAK])
+        # Endringer registrert i tidligere tester (som ble rullet tilbake) tas
+        # med i første oppdatering etter commit; ta dem før målingene
+        with stille(), self.captureOnCommitCallbacks(execute=True):
+            sok.endret('utlan', utlan_ids[:1])
+            sokeindeks.endret('utlan', utlan_ids[:1])
+
+        inkrementell = []
+        sporringer = 0
+        for utlan_id in utlan_ids:
+            with stille(), CaptureQueriesContext(connection) as fanget:
+                start = time.perf_counter()
+                with self.captureOnCommitCallbacks(execute=True):
+                    tjenester.returner_utlan([utlan_id])
+                inkrementell.append((time.perf_counter() - start) * 1000)
+            sporringer = max(sporringer, len(fanget.captured_queries))
+
+        full = []
+        for _ in range(BENCH_GJENTAK):
+            start = time.perf_counter()
+            for lagret in self.sokene:
+                sok.beregn(lagret)
+            full.append((time.perf_counter() - start) * 1000)
+
+        lagre_benchmark('lagrede_sok', {
+            'datasett': self.datasett,
+            'lagrede_sok': len(self.sokene),
+            'retur_med_oppdatering': {'sporringer': sporringer,
+                                      'p50_ms': round(persentil(inkrementell, 50), 3),
+                                      'p95_ms': round(persentil(inkrementell, 95), 3)},
+            'alle_sok_pa_nytt': {'p50_ms': round(persentil(full, 50), 3),
+                                 'p95_ms': round(persentil(full, 95), 3)},
+        })
+        # Returen selv (med endringsloggen), søkeindeksen, så de lagrede søkene, én spørring
+        # for det endrede utlånet og lagring av søkene det påvirket, uansett datasettets størrelse
+        self.assertLessEqual(sporringer, 19)
+        self.assertLess(persentil(inkrementell, 50), persentil(full, 50))
+
+
+# ============================================================================
+# HURTIGSØK
+# ============================================================================
+
+class HurtigsokTest(TestCase):
+    """Søkeindeksen følger endringene, og treffene rangeres etter type."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sentrum = testlokasjon()
+        cls.fjellet = Lokasjon.objects.create(navn='Fjellet')
+        cls.ola = Bruker.objects.create(fornavn='Ola', etternavn='Nordmann', telefon='+4798000000',
+                                        epost='ola.skiløper@example.com')
+        cls.kari = Bruker.objects.create(fornavn='Kari', etternavn='Olsen', telefon='+4798000011')
+        cls.items = [
+            SkiItem.objects.create(lokasjon=lokasjon, navn=navn, type_ski='alpinski', storrelse=170)
+            for lokasjon, navn in [(cls.sentrum, 'Ola-ski'), (cls.sentrum, 'Rossignol Hero'),
+                                   (cls.fjellet, 'Olympia langrenn')]
+        ]
+        sokeindeks.bygg_alle()
+
+    def finn(self, sporring, **kwargs):
+        """Treffene som [(type, tittel)] i rekkefølgen de vises."""
+        return [(t['type'], t['tittel']) for _, treff in sokeindeks.finn(sporring, **kwargs)['grupper']
+                for t in treff]
+
+    def test_rangering(self):
+        # Telefonnummer i alle former treffer brukeren
+        for sporring in ('98000000', '+47 980 00 000', '4798000000'):
+            self.assertEqual(self.finn(sporring), [('bruker', 'Ola Nordmann')], sporring)
+        self.assertEqual(len(self.finn('980000')), 2)
+
+        # Etikettkoden og id-en går foran alt annet
+        kode = tjenester.ski_item_kode(self.items[1].id)
+        self.assertEqual(self.finn(kode)[0], ('ski_item', 'Rossignol Hero'))
+        self.assertEqual(self.finn(str(self.items[1].id))[0], ('ski_item', 'Rossignol Hero'))
+
+        # Hele ord før prefiks, og navn før resten
+        self.assertEqual(self.finn('ola'), [('bruker', 'Ola Nordmann'), ('ski_item', 'Ola-ski')])
+        # Gruppen med beste treff først
+        self.assertEqual(self.finn('ol'), [('bruker', 'Ola Nordmann'), ('bruker', 'Kari Olsen'),
+                                           ('ski_item', 'Ola-ski'), ('ski_item', 'Olympia langrenn')])
+        self.assertEqual(self.finn('skilø'), [('bruker', 'Ola Nordmann')])
+        self.assertEqual(self.finn('ola nord'), [('bruker', 'Ola Nordmann')])
+        self.assertEqual(self.finn('o'), [])
+
+        # Med valgt lokasjon vises bare den lokasjonens items; brukere alltid
+        self.assertEqual(self.finn('ol', lokasjon_id=self.fjellet.id),
+                         [('bruker', 'Ola Nordmann'), ('bruker', 'Kari Olsen'), ('ski_item', 'Olympia langrenn')])
+
+    def test_indeksen_folger_endringer(self):
+        retur = timezone.now() + timedelta(days=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            utlan = tjenester.lan_ut(self.items[1].id, self.kari.id, retur)
+        self.assertIn(('utlan', 'Rossignol Hero – Kari Olsen'), self.finn('rossignol'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            bruker = Bruker.objects.get(id=self.kari.id)
+            bruker.etternavn = 'Berg'
+            bruker.save()
+        self.assertEqual(self.finn('olsen'), [])
+        self.assertEqual(self.finn('kari berg'), [('bruker', 'Kari Berg'), ('utlan', 'Rossignol Hero – Kari Berg')])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.returner([self.items[1].id])
+            tjenester.flytt_ski_items([self.items[1].id], self.fjellet.id)
+            SkiItem.objects.create(lokasjon=self.sentrum, navn='Atomic Redster', type_ski='alpinski', storrelse=160)
+            SkiItem.objects.get(id=self.items[0].id).delete()
+        self.assertEqual(self.finn('rossignol', lokasjon_id=self.fjellet.id), [('ski_item', 'Rossignol Hero')])
+        self.assertEqual(self.finn('redster'), [('ski_item', 'Atomic Redster')])
+        self.assertNotIn(('ski_item', 'Ola-ski'), self.finn('ola'))
+        self.assertFalse(SokeOrd.objects.filter(type='utlan', objekt_id=utlan.id).exists())
+
+        # Det samme som å bygge indeksen på nytt
+        trinnvis = set(SokeOrd.objects.values_list('ord', 'vekt', 'type', 'objekt_id', 'lokasjon_id', 'tittel'))
+        call_command('bygg_sokeindeks', stdout=io.StringIO())
+        self.assertEqual(
+            trinnvis, set(SokeOrd.objects.values_list('ord', 'vekt', 'type', 'objekt_id', 'lokasjon_id', 'tittel')))
+
+    def test_visning(self):
+        respons = self.client.get(reverse('skiutlan:hurtig_sok'), {'q': 'ola'})
+        data = respons.json()
+        self.assertEqual([g['type'] for g in data['grupper']], ['bruker', 'ski_item'])
+        self.assertEqual(data['grupper'][0]['treff'][0]['url'], reverse('skiutlan:bruker_detalj', args=[self.ola.id]))
+        self.assertFalse(data['ufullstendig'])
+        self.assertIn('sok_tekst=ola', data['alle'])
+        self.assertContains(self.client.get(reverse('skiutlan:hjem')), 'data-hurtigsok=')
+
+
+class HurtigsokBenchmarkTest(TestCase):
+    """Latens for hurtigsøket på et stort datasett, og at fristen overholdes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(5000 * BENCH_SKALA),
+            antall_brukere=int(5000 * BENCH_SKALA),
+            antall_utlan=int(6000 * BENCH_SKALA),
+            antall_lokasjoner=4,
+        )
+        cls.lokasjon = Lokasjon.objects.get(navn='Utleie 01')
+
+    def test_latens(self):
+        sporringer = ['te', 'testski 12', 'fornavn4', 'etternavn 1', '+47 4000 1234', '4000',
+                      tjenester.ski_item_kode(SkiItem.objects.order_by('id').first().id), 'alp']
+        url = reverse('skiutlan:hurtig_sok')
+        resultat = {}
+        for lokasjon in (None, self.lokasjon.id):
+            if lokasjon:
+                self.client.cookies[lokasjoner.COOKIE_NAVN] = str(lokasjon)
+            tider = []
+            antall = 0
+            for _ in range(BENCH_GJENTAK):
+                for sporring in sporringer:
+                    with CaptureQueriesContext(connection) as fanget:
+                        start = time.perf_counter()
+                        data = self.client.get(url, {'q': sporring}).json()
+                        tider.append((time.perf_counter() - start) * 1000)
+                    self.assertLessEqual(len(fanget.captured_queries), 2, sporring)
+                    self.assertFalse(data['ufullstendig'], sporring)
+                    antall = max(antall, len(fanget.captured_queries))
+            resultat['en_lokasjon' if lokasjon else 'alle'] = {
+                'sporringer': antall,
+                'p50_ms': round(persentil(tider, 50), 3),
+                'p95_ms': round(persentil(tider, 95), 3),
+            }
+
+        sql, parametre = SokeOrd.objects.filter(ord__gte='te', ord__lt='te\U0010ffff').order_by('ord')[:200].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametre)
+            plan = ' '.join(str(rad[-1]) for rad in cursor.fetchall())
+
+        lagre_benchmark('hurtigsok', {
+            'datasett': self.datasett,
+            'sokeord': SokeOrd.objects.count(),
+            'budsjett_ms': settings.SKIUTLAN_HURTIGSOK_MS,
+            'plan': plan,
+            **resultat,
+        })
+        self.assertIn('sokeord_ord_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        for maaling in resultat.values():
+            self.assertLess(maaling['p95_ms'], settings.SKIUTLAN_HURTIGSOK_MS)
+
+    def test_fristen_avbryter_sporringen(self):
+        resultat = sokeindeks.finn('te', budsjett_ms=0)
+        self.assertEqual(resultat, {'grupper': [], 'ufullstendig': True})
+        # Tilkoblingen kan brukes videre, og uten frist kommer treffene
+        self.assertTrue(sokeindeks.finn('te')['grupper'])
+
+
+# ============================================================================
+# ETIKETTER (QR-KODE, CODE 128 OG CACHE PÅ DISK)
+# ============================================================================
+
+class EtikettTest(TestCase):
+    """Kodene mot kjente verdier, cachen på disk og etikettarkene."""
+
+    @classmethod
+    def setUpTestData(cls):
+        lokasjon = testlokasjon()
+        cls.items = [
+            SkiItem.objects.create(lokasjon=lokasjon, navn=f'Fischer {i}', type_ski='langrenn', storrelse=180 + i)
+            for i in range(30)
+        ]
+
+    def setUp(self):
+        katalog = tempfile.TemporaryDirectory()
+        self.addCleanup(katalog.cleanup)
+        self.katalog = Path(katalog.name)
+        innstillinger = override_settings(SKIUTLAN_ETIKETT_KATALOG=katalog.name)
+        innstillinger.enable()
+        self.addCleanup(innstillinger.disable)
+
+    def test_qr_mot_kjente_verdier(self):
+        # HELLO WORLD i versjon 1-M (eksempelet i ISO/IEC 18004 og Thonky)
+        versjon, data = strekkoder.dataord('HELLO WORLD')
+        self.assertEqual(versjon, 1)
+        self.assertEqual(data, [32, 91, 11, 120, 209, 114, 220, 77, 67, 64, 236, 17, 236, 17, 236, 17])
+        self.assertEqual(strekkoder.feilretting(data, 10), [196, 35, 39, 119, 235, 215, 231, 226, 93, 23])
+        self.assertEqual(strekkoder.formatbits(0), 0b101010000010010)
+        self.assertEqual(strekkoder.versjonsbits(7), 0b000111110010010100)
+
+        moduler = strekkoder.qr(tjenester.ski_item_kode(123))
+        self.assertEqual(len(moduler), 21)
+        # Finnermønsteret øverst til venstre
+        self.assertEqual(moduler[0][:7], [True] * 7)
+        self.assertEqual(moduler[1][:7], [True] + [False] * 5 + [True])
+        # Lengre tekst gir større versjon (100 byte får plass i 6-M)
+        self.assertEqual(len(strekkoder.qr('x' * 100)), 4 * 6 + 17)
+
+    def test_code128_mot_kjente_verdier(self):
+        self.assertEqual(len(set(strekkoder._CODE128)), 107)
+        for monster in strekkoder._CODE128:
+            self.assertEqual(sum(int(b) for b in monster), 13 if len(monster) == 7 else 11, monster)
+        # B for prefikset, C for sifrene (to per tegn), og sjekksiffer
+        self.assertEqual(strekkoder.code128_verdier('SKI-000123'), [104, 51, 43, 41, 13, 99, 0, 1, 23, 72])
+        self.assertEqual(etiketter.qr_kode('SKI-000123', 'png')[:8], b'\x89PNG\r\n\x1a\n')
+        self.assertTrue(etiketter.strekkode('SKI-000123').startswith(b'<svg'))
+
+    def test_etiketter_lages_bare_en_gang(self):
+        liste = [(tjenester.ski_item_kode(item.id), item.navn, 'Langrenn') for item in self.items]
+        self.assertEqual(etiketter.manglende(liste), list(range(30)))
+        sider = list(etiketter.ark(liste, per_ark=24))
+        self.assertEqual([len(side) for side in sider], [24, 6])
+        self.assertEqual(etiketter.manglende(liste), [])
+
+        filer = {sti: sti.stat().st_mtime_ns for sti in self.katalog.rglob('*.svg')}
+        self.assertEqual(len(filer), 30)
+        self.assertEqual(list(etiketter.ark(liste, per_ark=24)), sider)
+        self.assertEqual({sti: sti.stat().st_mtime_ns for sti in self.katalog.rglob('*.svg')}, filer)
+
+        # Nytt navn gir ny etikett; den gamle står urørt
+        liste[0] = (liste[0][0], 'Nytt navn & <mer>', 'Langrenn')
+        self.assertEqual(etiketter.manglende(liste), [0])
+        self.assertIn(b'Nytt navn &amp; &lt;mer&gt;', etiketter.etikett(*liste[0]))
+        self.assertEqual(len(list(self.katalog.rglob('*.svg'))), 31)
+
+    def test_prosesspool_gir_samme_ark(self):
+        liste = [(tjenester.ski_item_kode(i), f'Ski {i}', 'Alpinski 170 cm') for i in range(etiketter.PARALLELL_FRA)]
+        parallelt = list(etiketter.ark(liste, prosesser=2))
+        self.assertEqual(etiketter.manglende(liste), [])
+        for sti in self.katalog.rglob('*.svg'):
+            sti.unlink()
+        self.assertEqual(list(etiketter.ark(liste, prosesser=1)), parallelt)
+
+    def test_visninger(self):
+        item = self.items[0]
+        respons = self.client.get(reverse('skiutlan:qr_kode', args=[item.id]), {'format': 'png'})
+        self.assertEqual(respons['Content-Type'], 'image/png')
+        self.assertIn('max-age=', respons['Cache-Control'])
+        respons = self.client.get(reverse('skiutlan:qr_kode', args=[item.id]), {'type': 'code128'})
+        self.assertEqual(respons['Content-Type'], 'image/svg+xml')
+        self.assertEqual(self.client.get(reverse('skiutlan:qr_kode', args=[item.id]), {'format': 'gif'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('skiutlan:qr_kode', args=[999999])).status_code, 404)
+
+        respons = self.client.get(reverse('skiutlan:ski_item_qr', args=[item.id]))
+        self.assertContains(respons, 'Fischer 0')
+        self.assertContains(respons, tjenester.ski_item_kode(item.id))
+        self.assertContains(self.client.get(reverse('skiutlan:ski_item_detalj', args=[item.id])),
+                            reverse('skiutlan:ski_item_qr', args=[item.id]))
+
+        with self.assertNumQueries(1):
+            respons = self.client.get(reverse('skiutlan:etikett_ark'), {'ids': f'{self.items[1].id},{self.items[2].id}'})
+        html = b''.join(respons.streaming_content).decode()
+        self.assertEqual(html.count('class="etikett"'), 2)
+        self.assertIn('Fischer 2', html)
+        self.assertNotIn('Fischer 3', html)
+        self.assertTrue(html.rstrip().endswith('</html>'))
+
+        html = b''.join(self.client.get(reverse('skiutlan:etikett_ark')).streaming_content).decode()
+        antall = SkiItem.objects.count()
+        self.assertEqual(html.count('class="etikett"'), antall)
+        self.assertEqual(html.count('<section class="ark">'), math.ceil(antall / etiketter.PER_ARK))
+
+
+class EtikettBenchmarkTest(TestCase):
+    """Utskrift av etiketter for et stort lager: første gang og på nytt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(2000 * BENCH_SKALA),
+            antall_brukere=10,
+            antall_utlan=0,
+        )
+
+    def test_utskrift_pa_nytt_genererer_ingenting(self):
+        with tempfile.TemporaryDirectory() as katalog, override_settings(SKIUTLAN_ETIKETT_KATALOG=katalog):
+            url = reverse('skiutlan:etikett_ark')
+            maalinger = {}
+            for runde in ('kald', 'varm'):
+                start = time.perf_counter()
+                respons = self.client.get(url)
+                manglet = len(list(Path(katalog).rglob('*.svg')))
+                storrelse = sum(len(del_) for del_ in respons.streaming_content)
+                maalinger[runde] = {
+                    'ms': round((time.perf_counter() - start) * 1000, 3),
+                    'genererte': len(list(Path(katalog).rglob('*.svg'))) - manglet,
+                    'bytes': storrelse,
+                }
+
+        lagre_benchmark('etiketter', {
+            'datasett': self.datasett,
+            'prosesser': settings.SKIUTLAN_ETIKETT_PROSESSER or os.cpu_count(),
+            **maalinger,
+        })
+        self.assertEqual(maalinger['kald']['genererte'], self.datasett['ski_items'])
+        self.assertEqual(maalinger['varm']['genererte'], 0)
+        self.assertEqual(maalinger['varm']['bytes'], maalinger['kald']['bytes'])
+        self.assertLess(maalinger['varm']['ms'] * 5, maalinger['kald']['ms'])
+
+
+# ============================================================================
+# BRUKERSTATISTIKK OG HISTORIKK MED KEYSET-PAGINERING
+# ============================================================================
+
+def _lag_historikk(bruker, items, antall, na):
+    """antall returnerte utlån for bruker, ett per time bakover fra na (to og to med samme tidspunkt)."""
+    utlan = Utlan.objects.bulk_create([
+        Utlan(bruker=bruker, ski_item=items[i % len(items)], lokasjon_id=items[i % len(items)].lokasjon_id,
+              planlagt_retur=na - timedelta(hours=i // 2) + timedelta(days=2),
+              returnert_dato=na - timedelta(hours=i // 2) + timedelta(days=1 + i % 3))
+        for i in range(antall)
+    ])
+    for i, u in enumerate(utlan):
+        u.utlant_dato = na - timedelta(hours=i // 2)
+    Utlan.objects.bulk_update(utlan, ['utlant_dato'])
+
+
+@override_settings(SKIUTLAN_ARKIV_ALDER_DAGER=365)
+class BrukerHistorikkTest(TestCase):
+    """Statistikk for én bruker og historikken side for side, også med arkiverte utlån."""
+
+    @classmethod
+    def setUpTestData(cls):
+        lokasjon = testlokasjon()
+        cls.items = [
+            SkiItem.objects.create(lokasjon=lokasjon, navn='Madshus', type_ski='langrenn', storrelse=190),
+            SkiItem.objects.create(lokasjon=lokasjon, navn='Atomic', type_ski='alpinski', storrelse=170),
+            SkiItem.objects.create(lokasjon=lokasjon, navn='Swix', type_ski='staver', storrelse=150),
+        ]
+        cls.bruker = Bruker.objects.create(fornavn='Trofast', etternavn='Kunde', telefon='+4791000001')
+        cls.ny = Bruker.objects.create(fornavn='Ny', etternavn='Kunde', telefon='+4791000002')
+        cls.na = timezone.now() - timedelta(days=20)
+        _lag_historikk(cls.bruker, cls.items, 45, cls.na)
+        # De eldste er gamle nok til å arkiveres
+        gamle = list(Utlan.objects.filter(bruker=cls.bruker).order_by('utlant_dato', 'id').values_list('id', flat=True)[:7])
+        Utlan.objects.filter(id__in=gamle).update(
+            utlant_dato=F('utlant_dato') - timedelta(days=500), planlagt_retur=F('planlagt_retur') - timedelta(days=500),
+            returnert_dato=F('returnert_dato') - timedelta(days=500))
+        call_command('arkiver_utlan', pause=0, stdout=io.StringIO())
+        cls.aktivt = tjenester.lan_ut(cls.items[0].id, cls.bruker.id, timezone.now() - timedelta(hours=1))
+
+    def test_sidene_dekker_hele_historikken_en_gang(self):
+        self.assertEqual(UtlanArkiv.objects.count(), 7)
+        forventet = [u.id for u in sorted(
+            arkiv.historikk(bruker_id=self.bruker.id, returnert_dato__isnull=False),
+            key=lambda u: (u.utlant_dato, u.id), reverse=True)]
+        self.assertEqual(len(forventet), 45)
+
+        sett = []
+        etter = None
+        sider = 0
+        while True:
+            side, etter = arkiv.historikk_side(10, etter, bruker_id=self.bruker.id, returnert_dato__isnull=False)
+            sett += [u.id for u in side]
+            sider += 1
+            if etter is None:
+                break
+        self.assertEqual(sett, forventet)
+        self.assertEqual(sider, 5)
+        self.assertEqual(arkiv.historikk_side(10, 'tull', bruker_id=self.bruker.id)[0][0].id, self.aktivt.id)
+
+    def test_visning_blar_gjennom_historikken(self):
+        url = reverse('skiutlan:bruker_detalj', args=[self.bruker.id])
+        respons = self.client.get(url)
+        self.assertEqual(len(respons.context['utlan_historie']), views.HISTORIKK_PER_SIDE)
+        self.assertNotContains(respons, '>Nyeste<')
+
+        antall = []
+        while respons.context['neste_side']:
+            antall.append(len(respons.context['utlan_historie']))
+            with CaptureQueriesContext(connection) as fanget:
+                respons = self.client.get(url, {'etter': respons.context['neste_side']})
+            self.assertLessEqual(len(fanget.captured_queries), SPORRINGSBUDSJETT['skiutlan:bruker_detalj'])
+            self.assertContains(respons, '>Nyeste<')
+        antall.append(len(respons.context['utlan_historie']))
+        self.assertEqual(antall, [20, 20, 5])
+        self.assertNotContains(respons, 'Eldre utlån')
+
+    def test_statistikk(self):
+        tall = statistikk.for_bruker(self.bruker.id)
+        self.assertEqual(tall['antall'], 46)
+        self.assertEqual(tall['aktive'], 1)
+        # Utlån i (1, 2, 3) dager etter tur; det aktive er forsinket
+        self.assertEqual(tall['forsinket'], 15 + 1)
+        varigheter = [1 + i % 3 for i in range(45)]
+        self.assertAlmostEqual(tall['snitt_dager'], round(sum(varigheter) / 45, 1))
+        self.assertEqual([(t['type_ski'], t['antall']) for t in tall['favoritter']],
+                         [('langrenn', 16), ('alpinski', 15), ('staver', 15)])
+
+        self.assertEqual(statistikk.for_bruker(self.ny.id), {
+            'antall': 0, 'aktive': 0, 'forsinket': 0, 'snitt_lanetid': None, 'snitt_dager': None, 'favoritter': []})
+
+        url = reverse('skiutlan:bruker_statistikk', args=[self.bruker.id])
+        self.client.get(url)  # Fyller lokasjonslisten og objektcachen
+        with self.assertNumQueries(2):
+            respons = self.client.get(url)
+        self.assertContains(respons, 'Langrenn')
+        self.assertContains(self.client.get(reverse('skiutlan:bruker_detalj', args=[self.bruker.id])),
+                            reverse('skiutlan:bruker_statistikk', args=[self.bruker.id]))
+
+
+class BrukerHistorikkBenchmarkTest(TestCase):
+    """Siste side i historikken til en bruker med mange utlån skal koste det samme som den første."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(
+            antall_items=int(500 * BENCH_SKALA),
+            antall_brukere=int(200 * BENCH_SKALA),
+            antall_utlan=int(5000 * BENCH_SKALA),
+        )
+        cls.bruker = Bruker.objects.create(fornavn='Stamkunde', etternavn='Hansen', telefon='+4791000003')
+        _lag_historikk(cls.bruker, list(SkiItem.objects.order_by('id')[:50]), int(1000 * BENCH_SKALA), timezone.now())
+
+    def test_forste_og_siste_side(self):
+        url = reverse('skiutlan:bruker_detalj', args=[self.bruker.id])
+        markorer = [None]
+        while True:
+            _, neste = arkiv.historikk_side(views.HISTORIKK_PER_SIDE, markorer[-1], bruker_id=self.bruker.id,
+                                      returnert_dato__isnull=False)
+            if neste is None:
+                break
+            markorer.append(neste)
+
+        resultat = {}
+        for navn, markor in (('forste', markorer[0]), ('siste', markorer[-1])):
+            parametre = {'etter': markor} if markor else {}
+            tider = []
+            for _ in range(BENCH_GJENTAK):
+                start = time.perf_counter()
+                self.client.get(url, parametre)
+                tider.append((time.perf_counter() - start) * 1000)
+            resultat[navn] = {'p50_ms': round(persentil(tider, 50), 3), 'p95_ms': round(persentil(tider, 95), 3)}
+
+        side = Utlan.objects.filter(bruker_id=self.bruker.id, returnert_dato__isnull=False)
+        dato, id_ = arkiv.les_markor(markorer[-1])
+        sql, parametre = (side.filter(Q(utlant_dato__lte=dato) & ~Q(utlant_dato=dato, id__gte=id_))
+                          .order_by('-utlant_dato', '-id')[:views.HISTORIKK_PER_SIDE + 1].query.sql_with_params())
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametre)
+            plan = ' '.join(str(rad[-1]) for rad in cursor.fetchall())
+
+        start = time.perf_counter()
+        for _ in range(BENCH_GJENTAK):
+            tall = statistikk.for_bruker(self.bruker.id)
+        statistikk_ms = (time.perf_counter() - start) * 1000 / BENCH_GJENTAK
+
+        lagre_benchmark('brukerhistorikk', {
+            'datasett': self.datasett,
+            'utlan_for_bruker': tall['antall'],
+            'sider': len(markorer),
+            'plan': plan,
+            'statistikk_ms': round(statistikk_ms, 3),
+            **resultat,
+        })
+        self.assertIn('utlan_bruker_dato_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertLess(resultat['siste']['p50_ms'], resultat['forste']['p50_ms'] * 2 + 5)
+
+
+# ============================================================================
+# MEST POPULÆRE (TOPP K PER TYPE MED VINDUSFUNKSJONER)
+# ============================================================================
+
+@override_settings(SKIUTLAN_ARKIV_ALDER_DAGER=30)
+class PopulaereTest(TestCase):
+    """Rangering per type, like plasser, lokasjon, arkiv og CSV."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sentrum = testlokasjon()
+        cls.fjellet = Lokasjon.objects.create(navn='Fjellet')
+        cls.bruker = Bruker.objects.create(fornavn='Populær', etternavn='Kunde', telefon='+4792000001')
+        lag = lambda navn, type_ski, storrelse, lokasjon=cls.sentrum: SkiItem.objects.create(
+            lokasjon=lokasjon, navn=navn, type_ski=type_ski, storrelse=storrelse)
+        cls.a = lag('Atomic', 'alpinski', 170)
+        cls.b = lag('Blizzard', 'alpinski', 160)
+        cls.c = lag('Coloss', 'alpinski', 170)
+        cls.d = lag('Dynastar', 'alpinski', 150, cls.fjellet)
+        cls.m = lag('Madshus', 'langrenn', 190)
+
+        cls.fra, cls.til = populaere.sesong(date(2026, 1, 15))
+        midt = timezone.make_aware(datetime(2026, 1, 10, 12))
+        utlan = []
+        for item, antall in ((cls.a, 4), (cls.b, 2), (cls.c, 2), (cls.d, 5), (cls.m, 1)):
+            utlan += [(item, midt + timedelta(hours=i)) for i in range(antall)]
+        # Utenfor sesongen
+        utlan += [(cls.b, timezone.make_aware(datetime(2025, 9, 30, 23)))] * 10
+        lagret = Utlan.objects.bulk_create([
+            Utlan(bruker=cls.bruker, ski_item=item, lokasjon_id=item.lokasjon_id,
+                  planlagt_retur=tid + timedelta(days=1), returnert_dato=tid + timedelta(days=1))
+            for item, tid in utlan
+        ])
+        for u, (_, tid) in zip(lagret, utlan):
+            u.utlant_dato = tid
+        Utlan.objects.bulk_update(lagret, ['utlant_dato'])
+
+    def rangering(self, typer, liste='items'):
+        return {t['type_ski']: [(r['plass'], r.get('navn') or r['storrelse'], r['antall']) for r in t[liste]]
+                for t in typer}
+
+    def test_topp_k_per_type(self):
+        self.assertEqual(self.fra, date(2025, 10, 1))
+        typer = populaere.topp(self.fra, self.til, k=2)
+        self.assertEqual([t['type_ski'] for t in typer], ['alpinski', 'langrenn'])
+        # Lik plass ved likt antall, og neste plass hopper over (RANK)
+        self.assertEqual(self.rangering(typer), {
+            'alpinski': [(1, 'Dynastar', 5), (2, 'Atomic', 4)],
+            'langrenn': [(1, 'Madshus', 1)],
+        })
+        self.assertEqual(self.rangering(populaere.topp(self.fra, self.til, k=3))['alpinski'],
+                         [(1, 'Dynastar', 5), (2, 'Atomic', 4), (3, 'Blizzard', 2), (3, 'Coloss', 2)])
+        self.assertEqual(self.rangering(typer, 'storrelser')['alpinski'], [(1, 170, 6), (2, 150, 5)])
+
+        # Bare én lokasjon
+        self.assertEqual(self.rangering(populaere.topp(self.fra, self.til, k=1, lokasjon_id=self.sentrum.id)),
+                         {'alpinski': [(1, 'Atomic', 4)], 'langrenn': [(1, 'Madshus', 1)]})
+
+    def test_arkiverte_utlan_telles_med(self):
+        call_command('arkiver_utlan', pause=0, stdout=io.StringIO())
+        self.assertEqual(Utlan.objects.count(), 0)
+        typer = populaere.topp(self.fra, self.til, k=1)
+        self.assertEqual(self.rangering(typer)['alpinski'], [(1, 'Dynastar', 5)])
+        self.assertEqual(self.rangering(populaere.topp(date(2025, 9, 1), self.til, k=1))['alpinski'],
+                         [(1, 'Blizzard', 12)])
+
+    def test_visning_og_csv(self):
+        url = reverse('skiutlan:rapport_populaere')
+        parametre = {'fra': '2025-10-01', 'til': '2026-09-30', 'k': '1'}
+        respons = self.client.get(url, parametre)
+        self.assertContains(respons, 'Dynastar')
+        self.assertNotContains(respons, 'Blizzard')
+        self.assertContains(respons, 'format=csv')
+
+        # Umulige datoer gir sesongen i stedet for en feil
+        respons = self.client.get(url, {'fra': '2025-02-30', 'til': '2025-13-01'})
+        self.assertEqual(respons.status_code, 200)
+        fra, til = populaere.sesong()
+        self.assertEqual((respons.context['fra'], respons.context['til']), (fra, til - timedelta(days=1)))
+
+        respons = self.client.get(url, {**parametre, 'format': 'csv'})
+        self.assertEqual(respons['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment;', respons['Content-Disposition'])
+        linjer = respons.content.decode('utf-8-sig').splitlines()
+        self.assertEqual(linjer[0], 'Type;Liste;Plass;Navn;Størrelse;Utlån')
+        self.assertEqual(linjer[1:], [
+            'Alpinski;Item;1;Dynastar;150 cm;5',
+            'Alpinski;Størrelse;1;;170 cm;6',
+            'Langrennsski;Item;1;Madshus;190 cm;1',
+            'Langrennsski;Størrelse;1;;190 cm;1',
+        ])
+
+
+def _seed_mange_utlan(antall, item_ids, bruker_id, lokasjon_id, dager):
+    """
+    antall returnerte utlån fordelt på item_ids og de siste dager dagene,
+    laget i SQLite med en rekursiv CTE (bulk_create blir for tregt for
+    millioner av rader). Går utenom signalene, som bulk_create.
+    """
+    tabell = connection.ops.quote_name(Utlan._meta.db_table)
+    na = timezone.now().strftime('%Y-%m-%d %H:%M:%S')
+    tid = "strftime('%%Y-%%m-%%d %%H:%%M:%%f', dag + {})"
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < %s),
+            rader AS (
+                SELECT json_extract(%s, '$[' || ((i * 7919 + (i * i) % 104729) % %s) || ']') AS item,
+                       julianday(%s) - (i % (%s * 1440)) / 1440.0 AS dag
+                FROM n
+            )
+            INSERT INTO {tabell} (bruker_id, ski_item_id, lokasjon_id, utlant_dato, planlagt_retur, returnert_dato, oppdatert)
+            SELECT %s, item, %s, {tid.format(0)}, {tid.format(3)}, {tid.format(2)}, {tid.format(2)} FROM rader
+        """, [antall, json.dumps(item_ids), len(item_ids), na, dager, bruker_id, lokasjon_id])
+
+
+class PopulaereBenchmarkTest(TestCase):
+    """Topp K per type over en million utlån."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(antall_items=int(2000 * BENCH_SKALA), antall_brukere=10, antall_utlan=0)
+        item_ids = list(SkiItem.objects.values_list('id', flat=True))
+        cls.antall_utlan = int(1_000_000 * BENCH_SKALA)
+        _seed_mange_utlan(cls.antall_utlan, item_ids, Bruker.objects.values_list('id', flat=True).first(),
+                          testlokasjon().id, dager=720)
+
+    def test_latens(self):
+        self.assertEqual(Utlan.objects.count(), self.antall_utlan)
+        idag = timezone.localdate()
+        perioder = {
+            'sesong': populaere.sesong(),
+            'ett_ar': (idag - timedelta(days=365), idag + timedelta(days=1)),
+        }
+        resultat = {}
+        for navn, (fra, til) in perioder.items():
+            tider = []
+            for _ in range(BENCH_GJENTAK):
+                with CaptureQueriesContext(connection) as fanget:
+                    start = time.perf_counter()
+                    typer = populaere.topp(fra, til, k=10)
+                    tider.append((time.perf_counter() - start) * 1000)
+                self.assertEqual(len(fanget.captured_queries), 1)
+            self.assertTrue(all(len(t['items']) >= 10 for t in typer))
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {fanget.captured_queries[0]["sql"]}')
+                plan = ' '.join(str(rad[-1]) for rad in cursor.fetchall())
+            self.assertIn('COVERING INDEX utlan_dato_item_idx', plan)
+            resultat[navn] = {
+                'rader': sum(len(t['items']) + len(t['storrelser']) for t in typer),
+                'plan': plan,
+                'p50_ms': round(persentil(tider, 50), 3),
+                'p95_ms': round(persentil(tider, 95), 3),
+            }
+
+        start = time.perf_counter()
+        respons = self.client.get(reverse('skiutlan:rapport_populaere'), {'k': 10, 'format': 'csv'})
+        csv_ms = (time.perf_counter() - start) * 1000
+        self.assertEqual(respons.status_code, 200)
+
+        lagre_benchmark('populaere', {
+            'datasett': {**self.datasett, 'utlan': self.antall_utlan},
+            'csv_ms': round(csv_ms, 3),
+            **resultat,
+        })
+
+
+# ============================================================================
+# DIREKTEOPPDATERING AV DASHBORDET (SERVER-SENT EVENTS)
+# ============================================================================
+
+def _melding(chunk):
+    """Dataene i en SSE-melding fra hjem_direkte."""
+    tekst = chunk.decode() if isinstance(chunk, bytes) else chunk
+    linje = next(l for l in tekst.splitlines() if l.startswith('data: '))
+    return json.loads(linje[len('data: '):])
+
+
+class DirekteTest(TestCase):
+    """Hel oversikt først, deretter bare endringer, og én beregning for alle skjermene."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lokasjon = testlokasjon()
+        cls.bruker = Bruker.objects.create(fornavn='Direkte', etternavn='Kunde', telefon='+4793000001')
+        cls.items = [SkiItem.objects.create(lokasjon=cls.lokasjon, navn=f'Direkteski {i}', type_ski='alpinski',
+                                            storrelse=170) for i in range(3)]
+        na = timezone.now()
+        cls.forsinket = tjenester.lan_ut(cls.items[0].id, cls.bruker.id, na + timedelta(days=1))
+        Utlan.objects.filter(id=cls.forsinket.id).update(
+            utlant_dato=na - timedelta(days=5), planlagt_retur=na - timedelta(days=2))
+
+    def test_oversikt_og_delta(self):
+        oversikt = direkte.oversikt(self.lokasjon.id)
+        self.assertEqual(
+            {k: oversikt[k] for k in ('totalt_ski_items', 'ledige_items', 'aktive_utlan', 'antall_forsinket')},
+            {'totalt_ski_items': 3, 'ledige_items': 2, 'aktive_utlan': 1, 'antall_forsinket': 1})
+        self.assertEqual([(u['id'], u['navn'], u['bruker'], u['dager']) for u in oversikt['forsinket']],
+                         [(self.forsinket.id, 'Direkteski 0', 'Direkte Kunde', 2)])
+        # Ingen utlån har neste forfall, så oversikten gjelder til midnatt
+        self.assertEqual(timezone.localtime(oversikt['_gyldig_til']).time(), datetime.min.time())
+
+        self.assertNotIn('_gyldig_til', direkte.delta(None, oversikt))
+        self.assertEqual(direkte.delta(oversikt, oversikt), {})
+        self.assertEqual(direkte.delta(oversikt, {**oversikt, 'aktive_utlan': 2, 'ledige_items': 1}),
+                         {'aktive_utlan': 2, 'ledige_items': 1})
+
+    def test_wsgi_svarer_med_hel_oversikt_og_retry(self):
+        respons = self.client.get(reverse('skiutlan:hjem_direkte'))
+        self.assertEqual(respons['Content-Type'], 'text/event-stream')
+        tekst = respons.content.decode()
+        self.assertTrue(tekst.startswith(f'retry: {settings.SKIUTLAN_DIREKTE_SEKUNDER * 1000}\n'))
+        self.assertIn('event: oversikt\n', tekst)
+        self.assertEqual(_melding(tekst)['aktive_utlan'], 1)
+
+    def test_hjem_har_direkteklient(self):
+        respons = self.client.get(reverse('skiutlan:hjem'))
+        self.assertContains(respons, f'data-direkte="{reverse("skiutlan:hjem_direkte")}"')
+        self.assertContains(respons, 'data-felt="antall_forsinket"')
+        self.assertContains(respons, 'new EventSource')
+
+    def lan_ut(self, item):
+        with self.captureOnCommitCallbacks(execute=True):
+            tjenester.lan_ut(item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+
+    async def test_strom_sender_bare_endringer(self):
+        respons = await self.async_client.get(reverse('skiutlan:hjem_direkte'))
+        self.assertEqual(respons['Content-Type'], 'text/event-stream')
+        self.assertEqual(respons['Cache-Control'], 'no-cache')
+        self.assertTrue(respons.streaming)
+        # Selve strømmen testes direkte, så den kan lukkes (som når skjermen kobler fra)
+        del respons
+
+        strommer = [direkte.strom(self.lokasjon.id) for _ in range(3)]
+        forste = [_melding(await anext(s)) for s in strommer]
+        self.assertEqual(forste[0]['aktive_utlan'], 1)
+        self.assertEqual(len(forste[0]['forsinket']), 1)
+        sentral = direkte.sentral()
+        # Tre skjermer, én beregning
+        self.assertEqual(sentral.beregninger, 1)
+
+        await sync_to_async(self.lan_ut)(self.items[1])
+        endringer = [_melding(await asyncio.wait_for(anext(s), 5)) for s in strommer]
+        self.assertEqual(endringer, [{'ledige_items': 1, 'aktive_utlan': 2}] * 3)
+        self.assertEqual(sentral.beregninger, 2)
+
+        for s in strommer:
+            await s.aclose()
+        self.assertEqual(sentral.abonnenter, {})
+        await asyncio.wait_for(sentral.oppgave, 5)
+
+    @override_settings(SKIUTLAN_DIREKTE_SEKUNDER=0.05)
+    async def test_endringer_fra_andre_prosesser_fanges_opp(self):
+        strom = direkte.strom(self.lokasjon.id)
+        await anext(strom)
+        # Som en WSGI-arbeider: endringen vekker ikke sentralen, men
+        # fingeravtrykket (hendelsesloggen og tellerne) endres
+        await sync_to_async(tjenester.lan_ut)(self.items[2].id, self.bruker.id, timezone.now() + timedelta(days=1))
+        self.assertEqual(_melding(await asyncio.wait_for(anext(strom), 5)), {'ledige_items': 1, 'aktive_utlan': 2})
+        await strom.aclose()
+
+
+class DirekteBenchmarkTest(TestCase):
+    """Spørringer for N skjermer: N fulle sidevisninger mot én strøm."""
+
+    SKJERMER = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(antall_items=int(300 * BENCH_SKALA), antall_brukere=50, antall_utlan=1500)
+
+    def _hjem(self):
+        self.client.get(reverse('skiutlan:hjem'))
+        with CaptureQueriesContext(connection) as fanget:
+            start = time.perf_counter()
+            for _ in range(self.SKJERMER):
+                self.client.get(reverse('skiutlan:hjem'))
+            return len(fanget.captured_queries), (time.perf_counter() - start) * 1000
+
+    async def test_sporringer_per_oppdatering(self):
+        hjem_sporringer, hjem_ms = await sync_to_async(self._hjem)()
+        item = await SkiItem.objects.exclude(utlan__returnert_dato__isnull=True).afirst()
+        bruker = await Bruker.objects.afirst()
+
+        strommer = [direkte.strom(None) for _ in range(self.SKJERMER)]
+        for s in strommer:
+            await anext(s)
+        sentral = direkte.sentral()
+        self.assertEqual(sentral.beregninger, 1)
+        # Forbindelsen hører til tråden sync_to_async kjører i, ikke event loopen
+        fanget = CaptureQueriesContext(connection)
+        await sync_to_async(fanget.__enter__)()
+        start = time.perf_counter()
+        lan_ut = await sync_to_async(self._lan_ut)(item.id, bruker.id)
+        for s in strommer:
+            self.assertEqual(_melding(await asyncio.wait_for(anext(s), 5))['aktive_utlan'],
+                             self.datasett['aktive_utlan'] + 1)
+        strom_ms = (time.perf_counter() - start) * 1000
+        await sync_to_async(fanget.__exit__)(None, None, None)
+        for s in strommer:
+            await s.aclose()
+        # Fingeravtrykket og én ny oversikt, uansett antall skjermer
+        strom_sporringer = await sync_to_async(lambda: len(fanget.captured_queries))() - lan_ut
+        self.assertEqual(sentral.beregninger, 2)
+        self.assertLessEqual(strom_sporringer, 5)
+        self.assertLess(strom_sporringer * 10, hjem_sporringer)
+
+        lagre_benchmark('direkte', {
+            'datasett': self.datasett,
+            'skjermer': self.SKJERMER,
+            'hjem_sporringer': hjem_sporringer,
+            'hjem_ms': round(hjem_ms, 3),
+            'strom_sporringer': strom_sporringer,
+            'strom_ms': round(strom_ms, 3),
+        })
+
+    def _lan_ut(self, item_id, bruker_id):
+        """Låner ut item og returnerer antall spørringer det kostet."""
+        with CaptureQueriesContext(connection) as fanget:
+            with self.captureOnCommitCallbacks(execute=True):
+                tjenester.lan_ut(item_id, bruker_id, timezone.now() + timedelta(days=1))
+        return len(fanget.captured_queries)
+
+
+# ============================================================================
+# OBJEKTCACHE (READ-THROUGH ETTER PRIMÆRNØKKEL)
+# ============================================================================
+
+class ObjektCacheTest(TestCase):
+    """Treff, ugyldiggjøring ved lagring og UPDATE, fersk lesing og statistikk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lokasjon = testlokasjon()
+        cls.annen = Lokasjon.objects.create(navn='Annet lager')
+        cls.bruker = Bruker.objects.create(fornavn='Cachet', etternavn='Kunde', telefon='+4794000001')
+        cls.item = SkiItem.objects.create(lokasjon=cls.lokasjon, navn='Cacheski', type_ski='alpinski', storrelse=170)
+
+    def setUp(self):
+        cache.clear()
+        hurtigbuffer.nullstill_objekt_statistikk()
+
+    def test_treff_etter_forste_oppslag(self):
+        with self.assertNumQueries(1):
+            item = hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+        with self.assertNumQueries(0):
+            igjen = hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+        self.assertEqual((igjen.id, igjen.navn), (item.id, 'Cacheski'))
+        # En kopi, så endringer i ett view ikke lekker til neste
+        self.assertIsNot(igjen, item)
+        with self.assertRaises(SkiItem.DoesNotExist):
+            hurtigbuffer.hent_objekt(SkiItem, 999999)
+
+        self.assertEqual(hurtigbuffer.objekt_statistikk(), {
+            'skiutlan.skiitem': {'treff': 1, 'bom': 2, 'forbi': 0, 'treffrate': 0.333},
+        })
+
+    def test_lagring_og_sletting_gjor_objektet_ugyldig(self):
+        hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+        item = SkiItem.objects.get(id=self.item.id)
+        item.navn = 'Nytt navn'
+        item.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(hurtigbuffer.hent_objekt(SkiItem, self.item.id).navn, 'Nytt navn')
+
+        item.delete()
+        with self.assertRaises(SkiItem.DoesNotExist):
+            hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+
+    def test_update_i_tjenester_gjor_objektene_ugyldige(self):
+        hurtigbuffer.hent_objekt(Bruker, self.bruker.id)
+        utlan = tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        self.assertEqual(hurtigbuffer.hent_objekt(Bruker, self.bruker.id).antall_aktive_utlan, 1)
+
+        self.assertIsNone(hurtigbuffer.hent_objekt(Utlan, utlan.id).returnert_dato)
+        tjenester.returner([self.item.id])
+        self.assertIsNotNone(hurtigbuffer.hent_objekt(Utlan, utlan.id).returnert_dato)
+        self.assertEqual(hurtigbuffer.hent_objekt(Bruker, self.bruker.id).antall_aktive_utlan, 0)
+
+        hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+        tjenester.flytt_ski_items([self.item.id], self.annen.id)
+        self.assertEqual(hurtigbuffer.hent_objekt(SkiItem, self.item.id).lokasjon_id, self.annen.id)
+
+    def test_gammel_rad_lest_for_commit_brukes_ikke(self):
+        hurtigbuffer.hent_objekt(SkiItem, self.item.id)
+        navnerom = hurtigbuffer._objekt_navnerom(SkiItem)
+        with self.captureOnCommitCallbacks(execute=True):
+            SkiItem.objects.filter(id=self.item.id).update(navn='Lagret')
+            item = SkiItem.objects.get(id=self.item.id)
+            item.save()
+            # En annen forespørsel leser den gamle raden før commit og lagrer
+            # den under den nye versjonen
+            versjon = hurtigbuffer.hent_versjoner(navnerom, [self.item.id])[self.item.id]
+            gammel = SkiItem(id=self.item.id, lokasjon=self.lokasjon, navn='Gammel', type_ski='alpinski',
+                             storrelse=170)
+            cache.set(hurtigbuffer._objekt_nokkel(navnerom, self.item.id), (versjon, gammel))
+            self.assertEqual(hurtigbuffer.hent_objekt(SkiItem, self.item.id).navn, 'Gammel')
+        self.assertEqual(hurtigbuffer.hent_objekt(SkiItem, self.item.id).navn, 'Lagret')
+
+    def test_fersk_lesing_gar_forbi_cachen(self):
+        hurtigbuffer.hent_objekt(Bruker, self.bruker.id)
+        Bruker.objects.filter(id=self.bruker.id).update(fornavn='Utenom')
+        self.assertEqual(hurtigbuffer.hent_objekt(Bruker, self.bruker.id).fornavn, 'Cachet')
+        with self.assertNumQueries(1):
+            self.assertEqual(hurtigbuffer.hent_objekt(Bruker, self.bruker.id, fersk=True).fornavn, 'Utenom')
+        with transaction.atomic(), hurtigbuffer.ferske_objekter():
+            with self.assertNumQueries(1):
+                self.assertEqual(hurtigbuffer.hent_objekt(Bruker, self.bruker.id).fornavn, 'Utenom')
+        self.assertEqual(hurtigbuffer.objekt_statistikk()['skiutlan.bruker']['forbi'], 2)
+
+    def test_visningene_bruker_cachen(self):
+        url = reverse('skiutlan:ski_item_rediger', args=[self.item.id])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(url), 'Cacheski')
+        # Lagring leser raden på nytt, så en gammel kopi aldri skrives tilbake
+        SkiItem.objects.filter(id=self.item.id).update(lokasjon=self.annen)
+        respons = self.client.post(url, {
+            'navn': 'Redigert', 'type_ski': 'alpinski', 'storrelse': 170, 'tilstand': 'god',
+            'lokasjon': self.annen.id,
+        })
+        self.assertEqual(respons.status_code, 302)
+        self.assertEqual(hurtigbuffer.hent_objekt(SkiItem, self.item.id).navn, 'Redigert')
+
+        self.assertEqual(self.client.get(reverse('skiutlan:bruker_detalj', args=[999999])).status_code, 404)
+        svar = self.client.get(reverse('skiutlan:api_objektcache')).json()
+        self.assertEqual(svar['skiutlan.skiitem']['forbi'], 1)
+        self.assertGreater(svar['skiutlan.skiitem']['treffrate'], 0)
+
+
+class ObjektCacheBenchmarkTest(TestCase):
+    """Oppslag etter primærnøkkel med og uten objektcachen."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(antall_items=int(300 * BENCH_SKALA), antall_brukere=50, antall_utlan=0)
+
+    def test_latens_og_treffrate(self):
+        ids = list(SkiItem.objects.values_list('id', flat=True))
+        cache.clear()
+        hurtigbuffer.nullstill_objekt_statistikk()
+
+        resultat = {}
+        for navn, fersk in (('database', True), ('kald', False), ('varm', False)):
+            with CaptureQueriesContext(connection) as fanget:
+                start = time.perf_counter()
+                for item_id in ids:
+                    hurtigbuffer.hent_objekt(SkiItem, item_id, fersk=fersk)
+                ms = (time.perf_counter() - start) * 1000
+            resultat[navn] = {'sporringer': len(fanget.captured_queries), 'us_per_oppslag': round(ms * 1000 / len(ids), 3)}
+        self.assertEqual(resultat['varm']['sporringer'], 0)
+        self.assertEqual(resultat['kald']['sporringer'], len(ids))
+
+        # Utlånsflyten ved skranken: skjema, POST og redirect til detaljsiden
+        item = SkiItem.objects.first()
+        bruker = Bruker.objects.first()
+        hurtigbuffer.nullstill_objekt_statistikk()
+        with stille():
+            self.client.get(reverse('skiutlan:utlan_opprett_for_item', args=[item.id]))
+            self.client.post(reverse('skiutlan:utlan_opprett_for_item', args=[item.id]), {
+                'bruker': bruker.id,
+                'planlagt_retur': (timezone.localtime() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M'),
+            })
+            self.client.get(reverse('skiutlan:bruker_detalj', args=[bruker.id]))
+            self.client.get(reverse('skiutlan:bruker_detalj', args=[bruker.id]))
+        flyt = hurtigbuffer.objekt_statistikk()
+
+        lagre_benchmark('objektcache', {
+            'datasett': self.datasett,
+            'oppslag': len(ids),
+            **resultat,
+            'utlansflyt': flyt,
+        })
+
+
+# ============================================================================
+# IDEMPOTENTE UTLÅN OG RETURER
+# ============================================================================
+
+class IdempotensTest(TestCase):
+    """Samme nøkkel gir samme svar uten at utlånet eller returen gjøres på nytt."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lokasjon = testlokasjon()
+        cls.bruker = Bruker.objects.create(fornavn='Kiosk', etternavn='Kunde', telefon='+4795000001')
+        cls.item = SkiItem.objects.create(lokasjon=cls.lokasjon, navn='Kioskski', type_ski='alpinski', storrelse=170)
+        # Samme innhold i hvert forsøk, også over et minuttskifte
+        cls.planlagt_retur = (timezone.localtime() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+
+    def lan_ut(self, nokkel, **ekstra):
+        return self.client.post(reverse('skiutlan:utlan_opprett_for_item', args=[self.item.id]), {
+            'bruker': self.bruker.id,
+            'planlagt_retur': self.planlagt_retur,
+        }, headers={'Idempotency-Key': nokkel}, **ekstra)
+
+    def test_gjentatt_utlan_gir_lagret_svar(self):
+        forste = self.lan_ut('utlan-1')
+        self.assertEqual(forste.status_code, 302)
+        self.assertEqual(Utlan.objects.filter(ski_item=self.item).count(), 1)
+
+        # Bare oppslaget på nøkkelen, før viewet validerer noe
+        with self.assertNumQueries(1):
+            igjen = self.lan_ut('utlan-1')
+        self.assertEqual((igjen.status_code, igjen['Location']), (302, forste['Location']))
+        self.assertEqual(igjen['Idempotent-Replayed'], 'true')
+        self.assertEqual(Utlan.objects.filter(ski_item=self.item).count(), 1)
+        self.assertEqual(UtlanHendelse.objects.filter(type='utlant').count(), 1)
+
+        # Uten nøkkel (eller med en ny) kjøres viewet, som før
+        self.assertNotIn('Idempotent-Replayed', self.lan_ut('utlan-2'))
+        self.assertEqual(Utlan.objects.filter(ski_item=self.item).count(), 1)
+
+    def test_retur_med_nokkel_fra_skjemaet(self):
+        utlan = tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        url = reverse('skiutlan:utlan_marker_returnert', args=[utlan.id])
+        nokkel = re.search(r'name="idempotens_nokkel" value="(\w+)"', self.client.get(url).content.decode())[1]
+
+        self.assertEqual(self.client.post(url, {'idempotens_nokkel': nokkel}).status_code, 302)
+        with self.assertNumQueries(1):
+            self.client.post(url, {'idempotens_nokkel': nokkel})
+        self.assertEqual(UtlanHendelse.objects.filter(type='returnert').count(), 1)
+
+    def test_api_svar_gjentas_likt(self):
+        tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        url = reverse('skiutlan:api_skann_retur')
+        data = {'kode': tjenester.ski_item_kode(self.item.id)}
+        forste = self.client.post(url, data, headers={'Idempotency-Key': 'skann-1'})
+        igjen = self.client.post(url, data, headers={'Idempotency-Key': 'skann-1'})
+        self.assertEqual(forste.json()['status'], 'returnert')
+        self.assertEqual((igjen.status_code, igjen.json()), (forste.status_code, forste.json()))
+        self.assertEqual(igjen['Content-Type'], 'application/json')
+        # En ny nøkkel kjører returen på nytt, og itemet er ikke lenger utlånt
+        self.assertNotEqual(self.client.post(url, data, headers={'Idempotency-Key': 'skann-2'}).json()['status'],
+                            'returnert')
+
+    def test_avviste_nokler(self):
+        self.lan_ut('delt')
+        respons = self.client.post(reverse('skiutlan:api_skann_retur'), {'kode': 'SKI-1'},
+                                   headers={'Idempotency-Key': 'delt'})
+        self.assertEqual(respons.status_code, 422)
+        self.assertEqual(self.lan_ut('x' * 101).status_code, 400)
+
+        # Første forsøk kjører fortsatt
+        tjenester.returner([self.item.id])
+        self.lan_ut('pagar')
+        IdempotensNokkel.objects.filter(nokkel='pagar').update(status=None)
+        respons = self.lan_ut('pagar')
+        self.assertEqual((respons.status_code, respons['Retry-After']), (409, '1'))
+        self.assertEqual(Utlan.objects.count(), 2)
+
+    def test_samme_nokkel_med_annet_innhold_avvises(self):
+        annet = SkiItem.objects.create(lokasjon=self.lokasjon, navn='Annen ski', type_ski='alpinski', storrelse=160)
+        for item in (self.item, annet):
+            tjenester.lan_ut(item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        url = reverse('skiutlan:api_skann_retur')
+        forste = self.client.post(url, {'kode': tjenester.ski_item_kode(self.item.id)},
+                                  headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(forste.json()['status'], 'returnert')
+        respons = self.client.post(url, {'kode': tjenester.ski_item_kode(annet.id)}, headers={'Idempotency-Key': 'k1'})
+        self.assertEqual(respons.status_code, 422)
+        self.assertNotIn('Idempotent-Replayed', respons)
+        self.assertTrue(Utlan.objects.aktive().filter(ski_item=annet).exists())
+
+        # JSON sammenlignes etter innholdet, ikke formateringen
+        url = reverse('skiutlan:api_innsjekk')
+        koder = [tjenester.ski_item_kode(annet.id)]
+        self.client.post(url, json.dumps({'koder': koder}), content_type='application/json',
+                         headers={'Idempotency-Key': 'k2'})
+        igjen = self.client.post(url, json.dumps({'koder': koder}, indent=2), content_type='application/json',
+                                 headers={'Idempotency-Key': 'k2'})
+        self.assertEqual(igjen['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.client.post(url, json.dumps({'koder': []}), content_type='application/json',
+                                          headers={'Idempotency-Key': 'k2'}).status_code, 422)
+
+    def test_utlopte_nokler_ignoreres_og_ryddes(self):
+        self.lan_ut('gammel')
+        IdempotensNokkel.objects.update(utloper=timezone.now() - timedelta(seconds=1))
+        tjenester.returner([self.item.id])
+        # Utløpt nøkkel: utlånet gjøres på nytt
+        self.assertNotIn('Idempotent-Replayed', self.lan_ut('gammel'))
+        self.assertEqual(Utlan.objects.filter(returnert_dato__isnull=True).count(), 1)
+
+        IdempotensNokkel.objects.create(nokkel='utlopt', sti='/', utloper=timezone.now() - timedelta(hours=1))
+        ut = io.StringIO()
+        call_command('rydd_idempotensnokler', stdout=ut)
+        self.assertIn('Slettet 1 ', ut.getvalue())
+        self.assertEqual(list(IdempotensNokkel.objects.values_list('nokkel', flat=True)), ['gammel'])
+
+
+class IdempotensBenchmarkTest(TestCase):
+    """Kiosker som sender hvert utlån flere ganger: første forsøk mot gjentakelsene."""
+
+    FORSOK = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(antall_items=int(200 * BENCH_SKALA), antall_brukere=200, antall_utlan=0)
+
+    def test_gjentatte_forsok(self):
+        items = list(SkiItem.objects.order_by('id').values_list('id', flat=True)[:100])
+        brukere = list(Bruker.objects.order_by('id').values_list('id', flat=True)[:100])
+        retur = (timezone.localtime() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M')
+        self.client.get(reverse('skiutlan:hjem'))
+
+        forste, gjentatt = [], []
+        sporringer = {'forste': 0, 'gjentatt': 0}
+        with stille():
+            for item_id, bruker_id in zip(items, brukere):
+                for forsok in range(self.FORSOK):
+                    with CaptureQueriesContext(connection) as fanget:
+                        start = time.perf_counter()
+                        respons = self.client.post(
+                            reverse('skiutlan:utlan_opprett_for_item', args=[item_id]),
+                            {'bruker': bruker_id, 'planlagt_retur': retur},
+                            headers={'Idempotency-Key': f'kiosk-{item_id}'})
+                        ms = (time.perf_counter() - start) * 1000
+                    self.assertEqual(respons.status_code, 302)
+                    (gjentatt if forsok else forste).append(ms)
+                    sporringer['gjentatt' if forsok else 'forste'] += len(fanget.captured_queries)
+        self.assertEqual(Utlan.objects.count(), len(items))
+        self.assertEqual(sporringer['gjentatt'], len(items) * (self.FORSOK - 1))
+
+        lagre_benchmark('idempotens', {
+            'datasett': self.datasett,
+            'utlan': len(items),
+            'forsok_per_utlan': self.FORSOK,
+            'sporringer_forste': round(sporringer['forste'] / len(items), 2),
+            'sporringer_gjentatt': round(sporringer['gjentatt'] / (len(items) * (self.FORSOK - 1)), 2),
+            'forste_p50_ms': round(persentil(forste, 50), 3),
+            'gjentatt_p50_ms': round(persentil(gjentatt, 50), 3),
+            'gjentatt_p95_ms': round(persentil(gjentatt, 95), 3),
+        })
+
+
+# ============================================================================
+# ENDRINGSSTRØM FOR KIOSKENE
+# ============================================================================
+
+class EndringerTest(TestCase):
+    """Opprettet, endret og slettet i sekvensrekkefølge, med gravsteiner og markører."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lokasjon = testlokasjon()
+        cls.annen = Lokasjon.objects.create(navn='Kioskens andre lager')
+        cls.bruker = Bruker.objects.create(fornavn='Synk', etternavn='Kunde', telefon='+4796000001')
+        cls.item = SkiItem.objects.create(lokasjon=cls.lokasjon, navn='Synkski', type_ski='alpinski', storrelse=170)
+
+    def synk(self, etter='', **parametre):
+        respons = self.client.get(reverse('skiutlan:api_endringer'), {'etter': etter, **parametre})
+        self.assertEqual(respons.status_code, 200)
+        return respons.json()
+
+    def test_opprettet_endret_og_slettet(self):
+        forste = self.synk()
+        self.assertEqual([(e['type'], e['id'], e['slettet']) for e in forste['endringer']],
+                         [('bruker', self.bruker.id, False), ('ski_item', self.item.id, False)])
+        self.assertEqual(forste['endringer'][1]['data']['navn'], 'Synkski')
+        self.assertFalse(forste['flere'])
+        # Ingenting nytt
+        self.assertEqual(self.synk(forste['markor'])['endringer'], [])
+
+        self.item.navn = 'Nytt navn'
+        self.item.save()
+        self.item.navn = 'Enda nyere'
+        self.item.save()
+        andre = self.synk(forste['markor'])
+        # Bare én gang, med gjeldende innhold
+        self.assertEqual([(e['type'], e['data']['navn']) for e in andre['endringer']], [('ski_item', 'Enda nyere')])
+        self.assertGreater(andre['endringer'][0]['sekvens'], forste['endringer'][-1]['sekvens'])
+
+        bruker_id = self.bruker.id
+        self.bruker.delete()
+        tredje = self.synk(andre['markor'])
+        self.assertEqual(tredje['endringer'], [
+            {'type': 'bruker', 'id': bruker_id, 'sekvens': tredje['endringer'][0]['sekvens'], 'slettet': True,
+             'data': None},
+        ])
+
+    def test_update_i_tjenester_kommer_med(self):
+        markor = self.synk()['markor']
+        utlan = tjenester.lan_ut(self.item.id, self.bruker.id, timezone.now() + timedelta(days=1))
+        tjenester.returner([self.item.id])
+        tjenester.flytt_ski_items([self.item.id], self.annen.id)
+
+        endret = {(e['type'], e['id']): e['data'] for e in self.synk(markor)['endringer']}
+        self.assertIsNotNone(endret['utlan', utlan.id]['returnert_dato'])
+        self.assertEqual(endret['ski_item', self.item.id]['lokasjon_id'], self.annen.id)
+        # Telleren for aktive utlån er ikke med, så brukeren er ikke endret
+        self.assertNotIn(('bruker', self.bruker.id), endret)
+
+    def test_sider_komprimering_og_ugyldig_markor(self):
+        for i in range(3):
+            Bruker.objects.create(fornavn=f'Side{i}', etternavn='Kunde', telefon=f'+479600001{i}')
+        self.item.save()
+        side = self.synk(antall=2)
+        self.assertTrue(side['flere'])
+        alle = side['endringer']
+        while side['flere']:
+            side = self.synk(side['markor'], antall=2)
+            alle += side['endringer']
+        # Et objekt kan komme igjen på en senere side når det er endret etter den forrige
+        self.assertEqual(len(alle), 6)
+        self.assertEqual(sorted(e['sekvens'] for e in alle), [e['sekvens'] for e in alle])
+
+        self.assertEqual(Endring.objects.count(), 6)
+        ut = io.StringIO()
+        call_command('komprimer_endringer', stdout=ut)
+        self.assertIn('Slettet 1 ', ut.getvalue())
+        self.assertEqual([(e['type'], e['id']) for e in self.synk()['endringer']],
+                         [('bruker', self.bruker.id), *[('bruker', e['id']) for e in alle[2:5]],
+                          ('ski_item', self.item.id)])
+
+        respons = self.client.get(reverse('skiutlan:api_endringer'), {'etter': 'ugyldig'})
+        self.assertEqual(respons.status_code, 400)
+        epoke = endringer.gjeldende_epoke()
+        self.assertEqual(endringer.les_markor(endringer.markor(123456, epoke), epoke), 123456)
+        self.assertIsNone(endringer.les_markor(endringer.markor(123456, epoke), endringer.ny_epoke()))
+
+    def test_gamle_gravsteiner_slettes_og_eldre_markorer_avvises(self):
+        foran = self.synk()['markor']
+        bruker_id = self.bruker.id
+        self.bruker.delete()
+        Endring.objects.filter(slettet=True).update(registrert=timezone.now() - timedelta(days=31))
+        etter = self.synk(foran)['markor']
+        self.item.save()
+
+        ut = io.StringIO()
+        call_command('komprimer_endringer', stdout=ut)
+        self.assertIn('og 1 gamle gravsteiner', ut.getvalue())
+        self.assertFalse(Endring.objects.filter(objekt_id=bruker_id, type='bruker').exists())
+        # Kiosken som ikke har sett gravsteinen, må begynne på nytt; den som har det, fortsetter
+        respons = self.client.get(reverse('skiutlan:api_endringer'), {'etter': foran})
+        self.assertEqual(respons.status_code, 400)
+        self.assertEqual([(e['type'], e['id']) for e in self.synk(etter)['endringer']], [('ski_item', self.item.id)])
+
+
+class EndringerKioskTest(TestCase):
+    """50 kiosker med lokal kopi som synkroniserer mens databasen endres."""
+
+    KIOSKER = 50
+    RUNDER = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.datasett = seed_datasett(antall_items=int(300 * BENCH_SKALA), antall_brukere=int(200 * BENCH_SKALA),
+                                     antall_utlan=int(1000 * BENCH_SKALA))
+        # Datasettet er lagt inn med bulk_create, utenom signalene
+        endringer.fyll()
+        cls.lokasjoner = [testlokasjon().id, Lokasjon.objects.create(navn='Kioskfjellet').id]
+
+    def synk(self, kiosk):
+        """Henter endringene etter kioskens markør inn i den lokale kopien."""
+        sider = 0
+        while True:
+            respons = self.client.get(reverse('skiutlan:api_endringer'), {'etter': kiosk['markor'], 'antall': 200})
+            svar = respons.json()
+            kiosk['bytes'] += len(respons.content)
+            sider += 1
+            for e in svar['endringer']:
+                if e['slettet']:
+                    kiosk['kopi'].pop((e['type'], e['id']), None)
+                else:
+                    kiosk['kopi'][e['type'], e['id']] = e['data']
+            kiosk['markor'] = svar['markor']
+            if not svar['flere']:
+                return sider
+
+    def fasit(self):
+        rader = {}
+        for type_, modell in endringer.MODELLER.items():
+            for rad in modell.objects.values(*endringer.FELT[type_]):
+                rader[type_, rad['id']] = rad
+        # Samme form som kioskene får over JSON
+        return {nokkel: json.loads(json.dumps(rad, cls=DjangoJSONEncoder)) for nokkel, rad in rader.items()}
+
+    def endre(self, tilfeldig):
+        """Én tilfeldig endring, som ved skranken eller i administrasjonen."""
+        valg = tilfeldig.randrange(6)
+        na = timezone.now()
+        if valg == 0:
+            item_id = tilfeldig.choice(list(SkiItem.objects.values_list('id', flat=True)))
+            bruker_id = tilfeldig.choice(list(Bruker.objects.filter(
+                antall_aktive_utlan__lt=Bruker.MAKS_AKTIVE_UTLAN).values_list('id', flat=True)))
+            try:
+                tjenester.lan_ut(item_id, bruker_id, na + timedelta(days=tilfeldig.randint(1, 7)))
+            except tjenester.UtlanFeil:
+                pass
+        elif valg == 1:
+            aktive = list(Utlan.objects.aktive().values_list('ski_item_id', flat=True)[:20])
+            tjenester.returner(tilfeldig.sample(aktive, min(len(aktive), 3)))
+        elif valg == 2:
+            item = SkiItem.objects.order_by('?').first()
+            item.tilstand = tilfeldig.choice(['utmerket', 'god', 'slitt'])
+            item.save()
+        elif valg == 3:
+            nummer = Bruker.objects.count()
+            Bruker.objects.create(fornavn='Ny', etternavn=f'Kunde{nummer}', telefon=f'+4798{nummer:06d}')
+        elif valg == 4:
+            item = SkiItem.objects.exclude(utlan__returnert_dato__isnull=True).order_by('?').first()
+            with transaction.atomic():
+                tjenester.forbered_sletting(*item.utlan_set.all())
+                item.delete()
+        else:
+            ledige = SkiItem.objects.exclude(utlan__returnert_dato__isnull=True).values_list('id', flat=True)[:5]
+            tjenester.flytt_ski_items(list(ledige), tilfeldig.choice(self.lokasjoner))
+
+    def test_kiosker_holder_kopien_i_synk(self):
+        tilfeldig = random.Random(2026)
+        kiosker = [{'markor': '', 'kopi': {}, 'bytes': 0} for _ in range(self.KIOSKER)]
+
+        # Første synkronisering laster ned alt
+        start = time.perf_counter()
+        for kiosk in kiosker:
+            self.synk(kiosk)
+        full_ms = (time.perf_counter() - start) * 1000 / self.KIOSKER
+        full_bytes = kiosker[0]['bytes']
+        self.assertEqual(kiosker[0]['kopi'], self.fasit())
+
+        for kiosk in kiosker:
+            kiosk['bytes'] = 0
+        synker = []
+        sporringer = 0
+        with stille():
+            for _ in range(self.RUNDER):
+                for _ in range(tilfeldig.randint(1, 5)):
+                    self.endre(tilfeldig)
+                # Noen kiosker er offline en stund og tar igjen flere runder på en gang
+                for kiosk in tilfeldig.sample(kiosker, self.KIOSKER // 3):
+                    with CaptureQueriesContext(connection) as fanget:
+                        start = time.perf_counter()
+                        self.synk(kiosk)
+                        synker.append((time.perf_counter() - start) * 1000)
+                    sporringer = max(sporringer, len(fanget.captured_queries))
+
+        fasit = self.fasit()
+        for kiosk in kiosker:
+            self.synk(kiosk)
+            self.assertEqual(kiosk['kopi'], fasit)
+        # Epoken, loggen og én spørring per type, uansett hvor mye som har endret seg
+        self.assertLessEqual(sporringer, 5)
+        delta_bytes = sum(k['bytes'] for k in kiosker) / len(synker + kiosker)
+        self.assertLess(delta_bytes * 10, full_bytes)
+
+        lagre_benchmark('endringer', {
+            'datasett': self.datasett,
+            'kiosker': self.KIOSKER,
+            'runder': self.RUNDER,
+            'full_synk': {'bytes': full_bytes, 'ms': round(full_ms, 3)},
+            'delta_synk': {'antall': len(synker), 'bytes_snitt': round(delta_bytes),
+                           'sporringer_maks': sporringer,
+                           'p50_ms': round(persentil(synker, 50), 3), 'p95_ms': round(persentil(synker, 95), 3)},
+            'logg_rader': Endring.objects.count(),
+        })
@@ -0,0 +1,292 @@
+"""
+Utlån og retur som kan kalles samtidig fra flere skranker.
+
+Reglen "maks ett aktivt utlån per ski-item" håndheves av databasen
+(unique_active_loan_per_item i Utlan.Meta), ikke av en sjekk i Python før
+lagring. Et utlån er derfor én INSERT: lykkes den, er itemet vårt; feiler
+den på constrainten, har en annen skranke kommet først. Ekstra spørringer
+gjøres bare når noe har gått galt, for å lage en forståelig feilmelding.
+
+Grensen på antall aktive utlån per bruker håndheves på samme måte: telleren
+Bruker.antall_aktive_utlan økes med en betinget UPDATE (... WHERE
+antall_aktive_utlan < maks) i samme transaksjon som utlånet, så to samtidige
+utlån til samme bruker kan ikke begge slippe gjennom på siste ledige plass.
+
+Retur ved skanning er tilsvarende én betinget UPDATE (... WHERE
+returnert_dato IS NULL RETURNING *), uansett hvor mange items som skannes.
+
+Hver lokasjon har egne tellere (antall items og aktive utlån) som oppdateres
+i samme transaksjoner, så et utlån på ett sted bare skriver til sin egen rad.
+"""
+
+import re
+from collections import Counter
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, Exists, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import direkte, endringer, hendelser, hurtigbuffer, sok, sokeindeks
+from .models import Bruker, Lokasjon, SkiItem, Utlan
+
+
+# Koden som står på etiketten til et ski-item, f.eks. SKI-000123
+KODE_PREFIKS = 'SKI-'
+_KODE_MONSTER = re.compile(r'^(?:SKI-?)?0*(\d{1,18})$', re.IGNORECASE)
+
+
+class UtlanFeil(Exception):
+    """Et utlån kunne ikke gjennomføres. Meldingen kan vises til brukeren."""
+
+
+class AlleredeUtlant(UtlanFeil):
+    """Ski-itemet har allerede et aktivt utlån."""
+
+    def __init__(self, utlan):
+        self.utlan = utlan
+        super().__init__(
+            f'{utlan.ski_item.navn} er allerede lånt ut til '
+            f'{utlan.bruker.fornavn} {utlan.bruker.etternavn}!')
+
+
+class GrenseNadd(UtlanFeil):
+    """Brukeren har allerede maks antall aktive utlån."""
+
+    def __init__(self):
+        super().__init__(
+            f'Brukeren har allerede {Bruker.MAKS_AKTIVE_UTLAN} aktive utlån. '
+            f'Maksimalt antall utlån er {Bruker.MAKS_AKTIVE_UTLAN} per bruker.')
+
+
+def lan_ut(ski_item_id, bruker_id, planlagt_retur):
+    """
+    Oppretter et utlån og registrerer hendelsen i samme transaksjon.
+
+    Kaster AlleredeUtlant hvis itemet er utlånt, GrenseNadd hvis brukeren har
+    nådd maks antall utlån, og UtlanFeil hvis brukeren eller itemet ikke finnes.
+    """
+    # Id-ene kommer ofte rett fra skjemaet
+    try:
+        ski_item_id = int(ski_item_id)
+    except (ValueError, TypeError):
+        raise UtlanFeil('Fant ikke ski-itemet.') from None
+    try:
+        bruker_id = int(bruker_id)
+    except (ValueError, TypeError):
+        raise UtlanFeil('Fant ikke brukeren.') from None
+    try:
+        with transaction.atomic():
+            lokasjon_id = SkiItem.objects.filter(id=ski_item_id).values_list('lokasjon_id', flat=True).first()
+            if lokasjon_id is None:
+                raise UtlanFeil('Fant ikke ski-itemet.')
+            plass = Bruker.objects.filter(
+                id=bruker_id, antall_aktive_utlan__lt=Bruker.MAKS_AKTIVE_UTLAN,
+            ).update(antall_aktive_utlan=F('antall_aktive_utlan') + 1)
+            if not plass:
+                if Bruker.objects.filter(id=bruker_id).exists():
+                    raise GrenseNadd()
+                raise UtlanFeil('Fant ikke brukeren.')
+            hurtigbuffer.glem_objekter(Bruker, [bruker_id])
+            utlan = Utlan.objects.create(
+                ski_item_id=ski_item_id, bruker_id=bruker_id, lokasjon_id=lokasjon_id,
+                planlagt_retur=planlagt_retur)
+            hendelser.registrer('utlant', utlan)
+            Lokasjon.objects.filter(id=lokasjon_id).update(antall_aktive_utlan=F('antall_aktive_utlan') + 1)
+    except IntegrityError:
+        # SQLite sjekker fremmednøkler ved commit, så feilen kan også komme
+        # av at itemet ble slettet i mellomtiden. Finn ut hva som skjedde.
+        eksisterende = (
+            Utlan.objects.filter(ski_item_id=ski_item_id, returnert_dato__isnull=True)
+            .select_related('bruker', 'ski_item').first()
+        )
+        if eksisterende is not None:
+            raise AlleredeUtlant(eksisterende) from None
+        if not SkiItem.objects.filter(id=ski_item_id).exists():
+            raise UtlanFeil('Fant ikke ski-itemet.') from None
+        raise
+    return utlan
+
+
+def ski_item_kode(item_id):
+    """Koden som skrives ut på etiketten til et ski-item."""
+    return f'{KODE_PREFIKS}{item_id:06d}'
+
+
+def tolk_kode(kode):
+    """
+    Gjør en skannet kode om til ski-item-id. Godtar både etikettkoden
+    (SKI-000123) og en ren id (123). Returnerer None for ugyldige koder.
+    """
+    treff = _KODE_MONSTER.match(str(kode).strip())
+    return int(treff.group(1)) if treff else None
+
+
+def _returner(kolonne, ids):
+    """Avslutter aktive utlån der kolonne er en av ids. Returnerer utlånene."""
+    ids = list(dict.fromkeys(ids))
+    if not ids:
+        return []
+
+    tabell = connection.ops.quote_name(Utlan._meta.db_table)
+    plassholdere = ', '.join(['%s'] * len(ids))
+    na = connection.ops.adapt_datetimefield_value(timezone.now())
+    sql = (
+        f'UPDATE {tabell} SET returnert_dato = %s, oppdatert = %s '
+        f'WHERE returnert_dato IS NULL AND {kolonne} IN ({plassholdere}) '
+        f'RETURNING *'
+    )
+
+    # Ingen egen savepoint når kalleren allerede har en transaksjon
+    with transaction.atomic(savepoint=False):
+        # raw() konverterer kolonnene til Python-verdier akkurat som en SELECT
+        returnert = list(Utlan.objects.raw(sql, [na, na, *ids]))
+        hendelser.registrer('returnert', *returnert)
+        endringer.registrer('utlan', [u.id for u in returnert])
+        juster_aktive_utlan(Counter(u.bruker_id for u in returnert), fortegn=-1)
+        juster_lokasjoner(Counter(u.lokasjon_id for u in returnert), fortegn=-1)
+
+    # UPDATE sender ingen signaler, så cachede rader må ugyldiggjøres her
+    hurtigbuffer.bump_versjoner('ski_item', [u.ski_item_id for u in returnert])
+    hurtigbuffer.bump_versjoner('bruker', [u.bruker_id for u in returnert])
+    hurtigbuffer.glem_objekter(Utlan, [u.id for u in returnert])
+    sok.endret('utlan', [u.id for u in returnert])
+    sokeindeks.endret('utlan', [u.id for u in returnert])
+    direkte.endret()
+    return returnert
+
+
+def returner(ski_item_ids):
+    """
+    Avslutter de aktive utlånene for ski-itemene med én betinget UPDATE.
+
+    Returnerer {ski_item_id: utlån} for itemene som faktisk var utlånt;
+    items som ikke var utlånt (eller ikke finnes) er ikke med.
+    """
+    return {u.ski_item_id: u for u in _returner('ski_item_id', ski_item_ids)}
+
+
+def returner_utlan(utlan_ids):
+    """Som returner(), men for gitte utlån. Returnerer {utlan_id: utlån}."""
+    return {u.id: u for u in _returner('id', utlan_ids)}
+
+
+def forbered_sletting(*utlan):
+    """
+    Kalles i samme transaksjon, rett før utlånene slettes (direkte eller via
+    CASCADE): registrerer 'slettet'-hendelser og trekker aktive utlån fra
+    tellerne til brukerne og lokasjonene.
+    """
+    hendelser.registrer('slettet', *utlan)
+    aktive = [u for u in utlan if u.returnert_dato is None]
+    juster_aktive_utlan(Counter(u.bruker_id for u in aktive), fortegn=-1)
+    juster_lokasjoner(Counter(u.lokasjon_id for u in aktive), fortegn=-1)
+
+
+def _juster(modell, felt, antall_per_id, fortegn):
+    """Endrer felt med fortegn * antall for hver rad, i én UPDATE."""
+    antall_per_id = {pk: n for pk, n in antall_per_id.items() if n}
+    if not antall_per_id:
+        return
+    endring = Case(
+        *[When(id=pk, then=Value(fortegn * n)) for pk, n in antall_per_id.items()],
+        output_field=IntegerField(),
+    )
+    modell.objects.filter(id__in=antall_per_id).update(**{felt: F(felt) + endring})
+    hurtigbuffer.glem_objekter(modell, antall_per_id)
+
+
+def juster_aktive_utlan(antall_per_bruker, fortegn=1):
+    """
+    Endrer Bruker.antall_aktive_utlan med fortegn * antall for hver bruker,
+    i én UPDATE. Brukes der utlån avsluttes, slettes eller flyttes; grensen
+    sjekkes ikke her (det gjør bare lan_ut()).
+    """
+    _juster(Bruker, 'antall_aktive_utlan', antall_per_bruker, fortegn)
+
+
+def juster_lokasjoner(antall_per_lokasjon, fortegn=1, felt='antall_aktive_utlan'):
+    """Som juster_aktive_utlan(), for en av tellerne på Lokasjon."""
+    _juster(Lokasjon, felt, antall_per_lokasjon, fortegn)
+
+
+class FlyttFeil(Exception):
+    """Ski-items kunne ikke flyttes. Meldingen kan vises til brukeren."""
+
+
+def flytt_ski_items(ski_item_ids, til_lokasjon_id):
+    """
+    Flytter ski-items til en annen lokasjon og oppdaterer tellerne på begge
+    sider, i én transaksjon. Items som er utlånt, må leveres tilbake først;
+    da kaster funksjonen FlyttFeil uten å flytte noe.
+
+    Returnerer antall items som ble flyttet (items som allerede står på
+    til_lokasjon_id telles ikke).
+    """
+    if not Lokasjon.objects.filter(id=til_lokasjon_id).exists():
+        raise FlyttFeil('Fant ikke lokasjonen.')
+    with transaction.atomic():
+        items = SkiItem.objects.filter(id__in=ski_item_ids).exclude(lokasjon_id=til_lokasjon_id)
+        utlant = list(items.filter(
+            Exists(Utlan.objects.filter(ski_item=OuterRef('pk'), returnert_dato__isnull=True)),
+        ).values_list('navn', flat=True))
+        if utlant:
+            raise FlyttFeil(f'Kan ikke flytte utlånt utstyr: {", ".join(utlant)}.')
+        rader = list(items.values_list('id', 'lokasjon_id'))
+        # oppdatert endres også, slik at cachede listerader lages på nytt
+        flyttet = SkiItem.objects.filter(id__in=[item_id for item_id, _ in rader]).update(
+            lokasjon_id=til_lokasjon_id, oppdatert=timezone.now())
+        hurtigbuffer.glem_objekter(SkiItem, [item_id for item_id, _ in rader])
+        endringer.registrer('ski_item', [item_id for item_id, _ in rader])
+        juster_lokasjoner(Counter(lokasjon_id for _, lokasjon_id in rader), fortegn=-1, felt='antall_ski_items')
+        juster_lokasjoner({til_lokasjon_id: flyttet}, felt='antall_ski_items')
+        sok.endret('ski_items', [item_id for item_id, _ in rader])
+        sokeindeks.endret('ski_items', [item_id for item_id, _ in rader])
+        direkte.endret()
+    return flyttet
+
+
+def _antall(queryset, felt):
+    """Subquery som teller radene i queryset per verdi av felt (mot OuterRef('pk'))."""
+    return Coalesce(Subquery(
+        queryset.filter(**{felt: OuterRef('pk')}).values(felt).annotate(antall=Count('id')).values('antall')
+    ), 0)
+
+
+def _avstem(modell, felt, faktisk, rett):
+    avvik = {
+        pk: (lagret, riktig)
+        for pk, lagret, riktig in modell.objects.annotate(riktig=faktisk)
+        .exclude(**{felt: F('riktig')}).values_list('id', felt, 'riktig')
+    }
+    if rett and avvik:
+        with transaction.atomic():
+            for pk, (_, riktig) in avvik.items():
+                modell.objects.filter(id=pk).update(**{felt: riktig})
+            hurtigbuffer.glem_objekter(modell, avvik)
+    return avvik
+
+
+def avstem_aktive_utlan(rett=True):
+    """
+    Sammenligner Bruker.antall_aktive_utlan med faktisk antall aktive utlån.
+
+    Returnerer {bruker_id: (lagret, faktisk)} for brukerne som avviker, og
+    retter dem hvis rett er sann.
+    """
+    return _avstem(Bruker, 'antall_aktive_utlan',
+                   _antall(Utlan.objects.filter(returnert_dato__isnull=True), 'bruker'), rett)
+
+
+def avstem_lokasjoner(rett=True):
+    """
+    Som avstem_aktive_utlan(), for tellerne på Lokasjon. Returnerer
+    {felt: {lokasjon_id: (lagret, faktisk)}} for tellerne som avviker.
+    """
+    avvik = {
+        'antall_ski_items': _avstem(Lokasjon, 'antall_ski_items', _antall(SkiItem.objects.all(), 'lokasjon'), rett),
+        'antall_aktive_utlan': _avstem(
+            Lokasjon, 'antall_aktive_utlan',
+            _antall(Utlan.objects.filter(returnert_dato__isnull=True), 'lokasjon'), rett),
+    }
+    return {felt: rader for felt, rader in avvik.items() if rader}
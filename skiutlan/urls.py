@@ -10,6 +10,8 @@ urlpatterns = [
     # HJEMSIDE / DASHBOARD
     # ========================================================================
     path('', views.hjem, name='hjem'),
+    # Direkteoppdatering av dashbordet (Server-Sent Events, se skiutlan/direkte.py)
+    path('direkte/', views.hjem_direkte, name='hjem_direkte'),
 
     # ========================================================================
     # SKI-ITEM URLs (CRUD operasjoner)
@@ -24,10 +26,14 @@ urlpatterns = [
     path('ski-items/<int:item_id>/rediger/',
          views.ski_item_rediger, name='ski_item_rediger'),
     path('ski-items/<int:item_id>/slett/', views.ski_item_slett, name='ski_item_slett'),
+    path('ski-items/<int:item_id>/flytt/', views.ski_item_flytt, name='ski_item_flytt'),
+
+    # Etiketter med QR-kode og strekkode (se skiutlan/etiketter.py)
+    path('ski-items/etiketter/', views.etikett_ark, name='etikett_ark'),
+    path('ski/<int:item_id>/qr/', views.ski_item_qr_kode, name='ski_item_qr'),
 
     # TODO for gruppen: Legg til flere ski-item URLs
     # path('ski/<int:item_id>/historikk/', views.ski_item_historikk, name='ski_item_historikk'),
-    # path('ski/<int:item_id>/qr/', views.ski_item_qr_kode, name='ski_item_qr'),
 
     # ========================================================================
     # BRUKER URLs (CRUD operasjoner)
@@ -46,9 +52,10 @@ urlpatterns = [
     path('brukere/<int:bruker_id>/slett/',
          views.bruker_slett, name='bruker_slett'),
 
+    path('brukere/<int:bruker_id>/statistikk/', views.bruker_statistikk, name='bruker_statistikk'),
+
     # TODO for gruppen: Legg til bruker-spesifikke URLs
     # path('brukere/<int:bruker_id>/utlan/', views.bruker_utlan_liste, name='bruker_utlan'),
-    # path('brukere/<int:bruker_id>/statistikk/', views.bruker_statistikk, name='bruker_statistikk'),
 
     # ========================================================================
     # UTLÅN URLs (CRUD operasjoner)
@@ -81,22 +88,35 @@ urlpatterns = [
 
     path('sok/', views.avansert_sok, name='avansert_sok'),
 
+    # Lagrede søk med treff som holdes oppdatert (se skiutlan/sok.py)
+    path('sok/lagret/', views.lagret_sok, name='lagret_sok'),
+    path('sok/lagret/<int:sok_id>/', views.lagret_sok_detalj, name='lagret_sok_detalj'),
+    path('sok/lagret/<int:sok_id>/oppdater/', views.lagret_sok_oppdater, name='lagret_sok_oppdater'),
+    path('sok/lagret/<int:sok_id>/slett/', views.lagret_sok_slett, name='lagret_sok_slett'),
+
+    # Søkeboksen i menyen (se skiutlan/sokeindeks.py)
+    path('sok/hurtig/', views.hurtig_sok, name='hurtig_sok'),
+
     # TODO for gruppen: Legg til spesialiserte søk
-    # path('sok/hurtig/', views.hurtig_sok, name='hurtig_sok'),
-    # path('sok/lagret/', views.lagret_sok, name='lagret_sok'),
 
     # ========================================================================
     # RAPPORTER og STATISTIKK
     # ========================================================================
 
     path('rapporter/', views.rapporter, name='rapporter'),
+    path('rapporter/populaere/', views.rapport_populaere, name='rapport_populaere'),
 
     # TODO for gruppen: Legg til spesifikke rapporter
-    # path('rapporter/populaere/', views.rapport_populaere_items, name='rapport_populaere'),
     # path('rapporter/brukere/', views.rapport_bruker_aktivitet, name='rapport_brukere'),
     # path('rapporter/utlan/', views.rapport_utlan_statistikk, name='rapport_utlan'),
     # path('rapporter/eksport/', views.rapport_eksport, name='rapport_eksport'),
 
+    # ========================================================================
+    # LOKASJON
+    # ========================================================================
+
+    path('lokasjon/velg/', views.velg_lokasjon, name='velg_lokasjon'),
+
     # ========================================================================
     # API ENDPOINTS (for AJAX og eksterne kall)
     # ========================================================================
@@ -108,9 +128,24 @@ urlpatterns = [
 
     path('api/brukere/sok/', views.api_sok_brukere, name='api_sok_brukere'),
 
+    # Hvor mange items av en type/størrelse som er ledige fremover i tid
+    path('api/tilgjengelighet/', views.api_tilgjengelighet, name='api_tilgjengelighet'),
+
+    # Retur med strekkode-/QR-leser: én kode, eller mange i én transaksjon
+    path('api/skann/retur/', views.api_skann_retur, name='api_skann_retur'),
+    path('api/skann/innsjekk/', views.api_innsjekk, name='api_innsjekk'),
+
+    # Endringsstrøm for kioskenes lokale kopi (se skiutlan/endringer.py)
+    path('api/endringer/', views.api_endringer, name='api_endringer'),
+
+    # Nøkkeltall for veggskjermer (cachet, se skiutlan/statistikk.py)
+    path('api/statistikk/', views.api_statistikk, name='api_statistikk'),
+
+    # Treffraten til objektcachen i prosessen som svarer (se skiutlan/hurtigbuffer.py)
+    path('api/objektcache/', views.api_objektcache, name='api_objektcache'),
+
     # TODO for gruppen: Legg til flere API endpoints
     # path('api/utlan/aktive/', views.api_utlan_aktive, name='api_utlan_aktive'),
-    # path('api/statistikk/', views.api_statistikk, name='api_statistikk'),
     # path('api/validering/telefon/', views.api_valider_telefon, name='api_valider_telefon'),
 
     # ========================================================================
@@ -121,7 +156,7 @@ urlpatterns = [
     # path('export/ski/', views.eksporter_ski_liste, name='eksporter_ski'),
     # path('import/ski/', views.importer_ski_data, name='importer_ski'),
     # path('backup/', views.backup_data, name='backup_data'),
-    # path('qr/<int:item_id>/', views.generer_qr_kode, name='qr_kode'),
+    path('qr/<int:item_id>/', views.generer_qr_kode, name='qr_kode'),
 ]
 
 # TODO for gruppen: Vurder å organisere URLs i include-strukturer
@@ -0,0 +1,129 @@
+"""
+Betinget GET (ETag/Last-Modified) for detaljsidene.
+
+Kiosk-skjermene laster detaljsidene på nytt med jevne mellomrom. I stedet
+for å rendre hele templaten hver gang beregnes billige validatorer med én
+spørring før viewet kjøres, og svaret blir 304 Not Modified hvis klienten
+allerede har siste versjon.
+
+Menyen i base.html avhenger også av forespørselen: lokasjonen som er valgt
+(cookie) og CSRF-tokenet i skjemaene. De tas med i ETag-en, slik at en
+side fra før lokasjonen ble byttet eller tokenet ble fornyet, ikke brukes.
+Det samme gjelder antall treff i de lagrede søkene, som endres når treffene
+endres og, for søk etter forsinkede utlån, med klokka; de leses fra cachen.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Min, Q
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from . import lokasjoner, sok
+from .models import SkiItem, Bruker, Utlan
+
+
+def _validatorer(*deler, sist_endret):
+    """Lager (etag, sist_endret) av verdiene som påvirker siden."""
+    nokkel = '|'.join(str(del_) for del_ in deler)
+    etag = 'W/"%s"' % hashlib.md5(nokkel.encode(), usedforsecurity=False).hexdigest()
+    return etag, sist_endret
+
+
+def _nyeste(*tidspunkter):
+    return max(t for t in tidspunkter if t is not None)
+
+
+def _for_foresporselen(request):
+    """Det i menyen som avhenger av forespørselen og ikke av objektet."""
+    return [
+        lokasjoner.alle(),
+        lokasjoner.aktiv_lokasjon_id(request),
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        sok.i_menyen(),
+    ]
+
+
+def ski_item_validatorer(item_id):
+    rad = SkiItem.objects.filter(id=item_id).annotate(
+        antall_utlan=Count('utlan'),
+        siste_utlan=Max('utlan__oppdatert'),
+        siste_bruker=Max('utlan__bruker__oppdatert'),
+        aktiv_retur=Min('utlan__planlagt_retur', filter=Q(utlan__returnert_dato__isnull=True)),
+    ).values_list('oppdatert', 'antall_utlan', 'siste_utlan', 'siste_bruker', 'aktiv_retur').first()
+    if rad is None:
+        return None
+    oppdatert, antall, siste_utlan, siste_bruker, aktiv_retur = rad
+    # Statusen går fra "Utlånt" til "Forsinket" uten at noe lagres
+    forsinket = aktiv_retur is not None and aktiv_retur < timezone.now()
+    return _validatorer('ski_item', item_id, oppdatert, antall, siste_utlan, siste_bruker, forsinket,
+                        sist_endret=_nyeste(oppdatert, siste_utlan, siste_bruker))
+
+
+def bruker_validatorer(bruker_id):
+    rad = Bruker.objects.filter(id=bruker_id).annotate(
+        antall_utlan=Count('utlan'),
+        siste_utlan=Max('utlan__oppdatert'),
+        siste_item=Max('utlan__ski_item__oppdatert'),
+    ).values_list('oppdatert', 'antall_utlan', 'siste_utlan', 'siste_item').first()
+    if rad is None:
+        return None
+    oppdatert, antall, siste_utlan, siste_item = rad
+    return _validatorer('bruker', bruker_id, oppdatert, antall, siste_utlan, siste_item,
+                        sist_endret=_nyeste(oppdatert, siste_utlan, siste_item))
+
+
+def utlan_validatorer(utlan_id):
+    rad = Utlan.objects.filter(id=utlan_id).values_list(
+        'oppdatert', 'bruker__oppdatert', 'ski_item__oppdatert', 'planlagt_retur', 'returnert_dato',
+    ).first()
+    if rad is None:
+        return None
+    oppdatert, bruker_oppdatert, item_oppdatert, planlagt_retur, returnert_dato = rad
+    na_minutt = None
+    forsinket = False
+    if returnert_dato is None:
+        # "Varighet så langt" endrer seg hvert minutt mens utlånet er aktivt
+        na = timezone.now()
+        na_minutt = na.replace(second=0, microsecond=0)
+        forsinket = planlagt_retur < na
+    return _validatorer('utlan', utlan_id, oppdatert, bruker_oppdatert, item_oppdatert, forsinket, na_minutt,
+                        sist_endret=_nyeste(oppdatert, bruker_oppdatert, item_oppdatert, na_minutt))
+
+
+def betinget_get(validator_func, parameter):
+    """
+    Decorator som svarer 304 når klientens ETag/Last-Modified er gjeldende.
+
+    validator_func(objekt_id) returnerer (etag, sist_endret) eller None hvis
+    objektet ikke finnes (da kjøres viewet, som svarer 404).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            # Ventende meldinger må vises, så siden kan ikke tas fra klientens cache
+            if request.method not in ('GET', 'HEAD') or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+
+            validatorer = validator_func(kwargs[parameter])
+            if validatorer is None:
+                return view(request, *args, **kwargs)
+            etag, sist_endret = validatorer
+            etag, sist_endret = _validatorer(etag, *_for_foresporselen(request), sist_endret=sist_endret)
+            sist_endret = int(sist_endret.timestamp())
+
+            respons = get_conditional_response(request, etag=etag, last_modified=sist_endret)
+            if respons is None:
+                respons = view(request, *args, **kwargs)
+            if respons.status_code in (200, 304):
+                respons.headers.setdefault('ETag', etag)
+                respons.headers.setdefault('Last-Modified', http_date(sist_endret))
+                # Klienten skal alltid spørre serveren før den bruker kopien sin
+                respons.headers.setdefault('Cache-Control', 'no-cache')
+            return respons
+        return wrapper
+    return decorator
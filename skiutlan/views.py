@@ -1,38 +1,138 @@
+import csv
+import json
 import re
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.contrib import messages
-from django.db.models import Q
+from django.utils.cache import patch_cache_control
+from django.utils.http import url_has_allowed_host_and_scheme, urlencode
+from django.views.decorators.http import require_POST
+from django.db import transaction
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.db.models import Q, OuterRef, Subquery
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from datetime import datetime, date, timedelta
 
-from .models import SkiItem, Bruker, Utlan
+from . import direkte, endringer, etiketter, hurtigbuffer, idempotens, lokasjoner, populaere, prognose, sok, sokeindeks, statistikk, tjenester
+from .arkiv import historikk, historikk_side, trenger_arkiv
+from .validatorer import betinget_get, ski_item_validatorer, bruker_validatorer, utlan_validatorer
+from .models import LagretSok, Lokasjon, SkiItem, Bruker, Utlan, UtlanArkiv
 from .forms import SkiItemForm, BrukerForm, UtlanForm, SokForm
 
 
+# ============================================================================
+# HJELPEFUNKSJONER FOR FRAGMENT-CACHING
+# ============================================================================
+
+def _med_utlan_status(ski_items):
+    """
+    Setter utlan_status og radversjon på hvert item for cachede listerader.
+
+    Forventer at querysetet er annotert med aktiv_retur (planlagt retur for
+    det aktive utlånet), slik at statusen ikke krever én spørring per rad.
+    """
+    ski_items = list(ski_items)
+    versjoner = hurtigbuffer.hent_versjoner('ski_item', [item.id for item in ski_items])
+    na = timezone.now()
+    for item in ski_items:
+        if item.aktiv_retur is None:
+            item.utlan_status = 'ledig'
+        elif item.aktiv_retur < na:
+            item.utlan_status = 'forsinket'
+        else:
+            item.utlan_status = 'utlant'
+        item.radversjon = versjoner[item.id]
+    return ski_items
+
+
+def _med_radversjoner(utlan):
+    """Setter radversjon på hvert utlån ut fra versjonene til item og bruker."""
+    utlan = list(utlan)
+    item_versjoner = hurtigbuffer.hent_versjoner('ski_item', {u.ski_item_id for u in utlan})
+    bruker_versjoner = hurtigbuffer.hent_versjoner('bruker', {u.bruker_id for u in utlan})
+    for u in utlan:
+        u.radversjon = f'{item_versjoner[u.ski_item_id]}.{bruker_versjoner[u.bruker_id]}'
+    return utlan
+
+
+def _hent_eller_404(modell, pk, fersk=False):
+    """
+    Som get_object_or_404(modell, id=pk), men via objektcachen. fersk=True
+    der objektet skal lagres eller slettes, så en gammel kopi aldri skrives.
+    """
+    try:
+        return hurtigbuffer.hent_objekt(modell, pk, fersk=fersk)
+    except (modell.DoesNotExist, ValueError):
+        raise Http404(f'Fant ingen {modell._meta.verbose_name} med id {pk}.')
+
+
 # ============================================================================
 # HJEMSIDE / DASHBOARD VIEWS
 # ============================================================================
 
+def _for_lokasjon(request, queryset):
+    """Begrenser items eller utlån til lokasjonen skranken har valgt."""
+    lokasjon_id = lokasjoner.aktiv_lokasjon_id(request)
+    if lokasjon_id is None:
+        return queryset
+    return queryset.filter(lokasjon_id=lokasjon_id)
+
+
 def hjem(request):
+    na = timezone.now()
+    utlan = _for_lokasjon(request, Utlan.objects.all())
+    tall = direkte.tellere(lokasjoner.aktiv_lokasjon_id(request), na)
     context = {
-        'totalt_ski_items': SkiItem.objects.count(),
-        'ledige_items': SkiItem.objects.exclude(id__in=Utlan.objects.filter(returnert_dato__isnull=True).values_list('ski_item_id', flat=True)).count(),
-        'aktive_utlan': Utlan.objects.filter(returnert_dato__isnull=True).count(),
-        'forsinket_utlan': Utlan.objects.filter(returnert_dato__isnull=True, planlagt_retur__lt=timezone.now())[:5],
-        'nylige_utlan': Utlan.objects.order_by('-utlant_dato')[:5],
+        'totalt_ski_items': tall['totalt_ski_items'],
+        'ledige_items': tall['ledige_items'],
+        'aktive_utlan': tall['aktive_utlan'],
+        'antall_forsinket': tall['antall_forsinket'],
+        'forsinket_utlan': _med_radversjoner(
+            utlan.forsinket(na=na).mest_forsinket_forst().med_tidsberegninger(na)
+            .select_related('bruker', 'ski_item')[:direkte.ANTALL_FORSINKET]),
+        'nylige_utlan': _med_radversjoner(
+            utlan.select_related('bruker', 'ski_item').order_by('-utlant_dato')[:5]),
     }
 
     return render(request, 'skiutlan/hjem.html', context)
 
 
+async def hjem_direkte(request):
+    """
+    Server-Sent Events for dashbordet: først hele oversikten, deretter bare
+    feltene som endres (se direkte.py). Under WSGI én oversikt og retry:.
+    """
+    lokasjon_id = await sync_to_async(lokasjoner.aktiv_lokasjon_id)(request)
+
+    if not isinstance(request, ASGIRequest):
+        oversikt = await sync_to_async(direkte.hent_bufret)(lokasjon_id)
+        return HttpResponse(direkte.retry() + direkte.hendelse(direkte.delta(None, oversikt)),
+                            content_type='text/event-stream')
+
+    respons = StreamingHttpResponse(direkte.strom(lokasjon_id), content_type='text/event-stream')
+    respons['Cache-Control'] = 'no-cache'
+    # Ikke la en nginx foran bufre strømmen
+    respons['X-Accel-Buffering'] = 'no'
+    return respons
+
+
 # ============================================================================
 # SKI-ITEM VIEWS (CRUD operasjoner)
 # ============================================================================
 
 def ski_item_liste(request):
-    # Hent alle ski-items (standard)
-    ski_items = SkiItem.objects.all()
+    # Hent ski-items på valgt lokasjon, med planlagt retur for et aktivt utlån
+    ski_items = _for_lokasjon(request, SkiItem.objects.all()).annotate(
+        aktiv_retur=Subquery(
+            Utlan.objects.filter(ski_item=OuterRef('pk'), returnert_dato__isnull=True)
+            .values('planlagt_retur')[:1]
+        )
+    )
 
     sok_tekst = request.GET.get('sok', '')
     if sok_tekst:
@@ -54,7 +154,7 @@ def ski_item_liste(request):
         ski_items = ski_items.exclude(id__in=utlante_item_ids)
 
     context = {
-        'ski_items': ski_items,
+        'ski_items': _med_utlan_status(ski_items),
         'sok_tekst': sok_tekst,
         'type_filter': type_filter,
         'tilstand_filter': tilstand_filter,
@@ -65,9 +165,10 @@ def ski_item_liste(request):
     return render(request, 'skiutlan/ski_item_liste.html', context)
 
 
+@betinget_get(ski_item_validatorer, 'item_id')
 def ski_item_detalj(request, item_id):
-    ski_item = get_object_or_404(SkiItem, id=item_id)
-    utlan_historikk = ski_item.utlan_set.all().order_by('-utlant_dato')
+    ski_item = get_object_or_404(SkiItem.objects.select_related('lokasjon'), id=item_id)
+    utlan_historikk = historikk(ski_item_id=ski_item.id)
     er_ledig = ski_item.er_ledig
 
     context = {
@@ -91,7 +192,7 @@ def ski_item_opprett(request):
             except Exception as e:
                 messages.error(request, f'Feil ved lagring: {e}')
     else:
-        form = SkiItemForm()
+        form = SkiItemForm(initial={'lokasjon': lokasjoner.aktiv_lokasjon_id(request)})
 
     context = {
         'form': form,
@@ -102,7 +203,7 @@ def ski_item_opprett(request):
 
 
 def ski_item_rediger(request, item_id):
-    ski_item = get_object_or_404(SkiItem, id=item_id)
+    ski_item = _hent_eller_404(SkiItem, item_id, fersk=request.method == 'POST')
 
     if request.method == 'POST':
         form = SkiItemForm(request.POST, instance=ski_item)
@@ -126,7 +227,7 @@ def ski_item_rediger(request, item_id):
 
 
 def ski_item_slett(request, item_id):
-    ski_item = get_object_or_404(SkiItem, id=item_id)
+    ski_item = _hent_eller_404(SkiItem, item_id, fersk=request.method == 'POST')
     aktive_utlan = Utlan.objects.filter(
         ski_item=ski_item, returnert_dato__isnull=True)
     if aktive_utlan.exists():
@@ -135,7 +236,9 @@ def ski_item_slett(request, item_id):
 
     if request.method == 'POST':
         navn = ski_item.navn
-        ski_item.delete()
+        with transaction.atomic():
+            tjenester.forbered_sletting(*ski_item.utlan_set.all())
+            ski_item.delete()
         messages.success(request, f'Ski-item "{navn}" ble slettet!')
         return redirect('skiutlan:ski_item_liste')
 
@@ -147,6 +250,27 @@ def ski_item_slett(request, item_id):
     return render(request, 'skiutlan/ski_item_slett_bekreft.html', context)
 
 
+@require_POST
+def ski_item_flytt(request, item_id):
+    ski_item = _hent_eller_404(SkiItem, item_id)
+    try:
+        til = Lokasjon.objects.get(id=request.POST.get('lokasjon'))
+    except (Lokasjon.DoesNotExist, ValueError):
+        messages.error(request, 'Velg en lokasjon.')
+        return redirect('skiutlan:ski_item_detalj', item_id=item_id)
+
+    try:
+        flyttet = tjenester.flytt_ski_items([ski_item.id], til.id)
+    except tjenester.FlyttFeil as e:
+        messages.error(request, str(e))
+    else:
+        if flyttet:
+            messages.success(request, f'"{ski_item.navn}" er flyttet til {til.navn}.')
+        else:
+            messages.info(request, f'"{ski_item.navn}" står allerede på {til.navn}.')
+    return redirect('skiutlan:ski_item_detalj', item_id=item_id)
+
+
 # ============================================================================
 # BRUKER VIEWS (CRUD operasjoner)
 # ============================================================================
@@ -170,22 +294,41 @@ def bruker_liste(request):
     return render(request, 'skiutlan/bruker_liste.html', context)
 
 
+# Returnerte utlån per side i historikken på bruker_detalj
+HISTORIKK_PER_SIDE = 20
+
+
+@betinget_get(bruker_validatorer, 'bruker_id')
 def bruker_detalj(request, bruker_id):
-    bruker = get_object_or_404(Bruker, id=bruker_id)
-    alle_utlan = Utlan.objects.filter(bruker=bruker).order_by('-utlant_dato')
-    aktive_utlan = alle_utlan.filter(returnert_dato__isnull=True)
-    utlan_historie = alle_utlan.filter(returnert_dato__isnull=False)
+    bruker = _hent_eller_404(Bruker, bruker_id)
+    aktive_utlan = (Utlan.objects.filter(bruker=bruker, returnert_dato__isnull=True)
+                    .select_related('ski_item').order_by('-utlant_dato'))
+    # ?etter=<markør> blar videre bakover i historikken (keyset-paginering)
+    etter = request.GET.get('etter', '')
+    utlan_historie, neste_side = historikk_side(
+        HISTORIKK_PER_SIDE, etter, bruker_id=bruker.id, returnert_dato__isnull=False)
 
     context = {
         'bruker': bruker,
         'aktive_utlan': aktive_utlan,
         'utlan_historie': utlan_historie,
-        'antall_aktive': aktive_utlan.count()
+        'neste_side': neste_side,
+        'eldre_side': bool(etter),
+        'antall_aktive': bruker.antall_aktive_utlan,
     }
 
     return render(request, 'skiutlan/bruker_detalj.html', context)
 
 
+def bruker_statistikk(request, bruker_id):
+    bruker = _hent_eller_404(Bruker, bruker_id)
+    context = {
+        'bruker': bruker,
+        'statistikk': statistikk.for_bruker(bruker.id),
+    }
+    return render(request, 'skiutlan/bruker_statistikk.html', context)
+
+
 def bruker_opprett(request):
     if request.method == 'POST':
         form = BrukerForm(request.POST)
@@ -207,7 +350,7 @@ def bruker_opprett(request):
 
 
 def bruker_rediger(request, bruker_id):
-    bruker = get_object_or_404(Bruker, id=bruker_id)
+    bruker = _hent_eller_404(Bruker, bruker_id, fersk=request.method == 'POST')
 
     if request.method == 'POST':
         form = BrukerForm(request.POST, instance=bruker)
@@ -231,7 +374,7 @@ def bruker_rediger(request, bruker_id):
 
 
 def bruker_slett(request, bruker_id):
-    bruker = get_object_or_404(Bruker, id=bruker_id)
+    bruker = _hent_eller_404(Bruker, bruker_id, fersk=request.method == 'POST')
 
     # sjekk om brukeren har aktive utlån
     aktive_utlan = Utlan.objects.filter(
@@ -242,7 +385,9 @@ def bruker_slett(request, bruker_id):
 
     if request.method == 'POST':
         navn = bruker.fullt_navn
-        bruker.delete()
+        with transaction.atomic():
+            tjenester.forbered_sletting(*bruker.utlan_set.all())
+            bruker.delete()
         messages.success(request, f'Bruker "{navn}" ble slettet!')
         return redirect('skiutlan:bruker_liste')
 
@@ -257,18 +402,40 @@ def bruker_slett(request, bruker_id):
 # UTLÅN VIEWS (CRUD operasjoner)
 # ============================================================================
 
+def _sorter_utlan(utlan, sortering, bare_aktive):
+    """Sorterer på feltene fra Utlan.objects.med_tidsberegninger()."""
+    if sortering == 'forsinket':
+        if bare_aktive:
+            # Samme rekkefølge, men lest direkte fra utlan_aktiv_retur_idx
+            return utlan.order_by('planlagt_retur')
+        return utlan.order_by('-forsinket', 'planlagt_retur')
+    if sortering == 'varighet':
+        return utlan.order_by('-lanetid', '-utlant_dato')
+    return utlan.order_by('-utlant_dato')
+
+
 def utlan_liste(request):
-    utlan = Utlan.objects.all().order_by('-utlant_dato')
-    print(f"DEBUG utlan_liste: Totalt {utlan.count()} utlån i databasen")
+    na = timezone.now()
+    utlan = _for_lokasjon(request, Utlan.objects.med_tidsberegninger(na)).select_related('bruker', 'ski_item')
 
     # Filtrering
     status_filter = request.GET.get('status', '')
     if status_filter == 'aktive':
-        utlan = utlan.filter(returnert_dato__isnull=True)
+        utlan = utlan.aktive()
     elif status_filter == 'returnerte':
         utlan = utlan.filter(returnert_dato__isnull=False)
     elif status_filter == 'forsinket':
-        utlan = utlan.filter(returnert_dato__isnull=True, planlagt_retur__lt=timezone.now())
+        utlan = utlan.forsinket(na=na)
+
+    try:
+        minst_dager = max(0, int(request.GET.get('dager_forsinket', '')))
+    except ValueError:
+        minst_dager = None
+    if minst_dager is not None:
+        utlan = utlan.forsinket(minst_dager, na=na)
+
+    sortering = request.GET.get('sorter', '')
+    utlan = _sorter_utlan(utlan, sortering, status_filter in ('aktive', 'forsinket') or minst_dager is not None)
 
     # Søk
     sok_tekst = request.GET.get('sok', '')
@@ -279,21 +446,24 @@ def utlan_liste(request):
             Q(ski_item__navn__icontains=sok_tekst)
         )
 
-    print(f"DEBUG utlan_liste: Etter filtrering {utlan.count()} utlån")
-    for u in utlan:
-        print(f"  - {u}")
-
     context = {
-        'utlan': utlan,
+        'utlan': _med_radversjoner(utlan),
         'sok_tekst': sok_tekst,
         'status_filter': status_filter,
+        'sortering': sortering,
+        'dager_forsinket': '' if minst_dager is None else minst_dager,
     }
 
     return render(request, 'skiutlan/utlan_liste.html', context)
 
 
+@betinget_get(utlan_validatorer, 'utlan_id')
 def utlan_detalj(request, utlan_id):
-    utlan = get_object_or_404(Utlan, id=utlan_id)
+    try:
+        utlan = hurtigbuffer.hent_objekt(Utlan, utlan_id)
+    except Utlan.DoesNotExist:
+        # Gamle utlån kan være flyttet til arkivet
+        utlan = get_object_or_404(UtlanArkiv, id=utlan_id)
 
     context = {
         'utlan': utlan,
@@ -302,99 +472,58 @@ def utlan_detalj(request, utlan_id):
     return render(request, 'skiutlan/utlan_detalj.html', context)
 
 
+@idempotens.idempotent
 def utlan_opprett(request):
     if request.method == 'POST':
-        form = UtlanForm(request.POST)
+        form = UtlanForm(request.POST, lokasjon_id=lokasjoner.aktiv_lokasjon_id(request))
         if form.is_valid():
+            data = form.cleaned_data
             try:
-                utlan = form.save()
+                utlan = tjenester.lan_ut(data['ski_item'].id, data['bruker'].id, data['planlagt_retur'])
                 messages.success(request, 'Utlån opprettet!')
                 return redirect('skiutlan:utlan_detalj', utlan_id=utlan.id)
-            except Exception as e:
-                messages.error(request, f'Feil ved lagring: {e}')
+            except tjenester.UtlanFeil as e:
+                messages.error(request, str(e))
     else:
-        form = UtlanForm()
+        form = UtlanForm(lokasjon_id=lokasjoner.aktiv_lokasjon_id(request))
 
     context = {
         'form': form,
-        'action': 'Opprett nytt utlån'
+        'action': 'Opprett nytt utlån',
+        'idempotens_nokkel': idempotens.ny_nokkel(),
     }
 
     return render(request, 'skiutlan/utlan_form.html', context)
 
 
+@idempotens.idempotent
 def utlan_opprett_for_item(request, item_id):
-    ski_item = get_object_or_404(SkiItem, id=item_id)
+    ski_item = _hent_eller_404(SkiItem, item_id)
 
     if request.method == 'POST':
-        try:
-            # Hent data direkte fra POST uten form-validering
-            bruker_id = request.POST.get('bruker')
-            planlagt_retur = request.POST.get('planlagt_retur')
-
-            print(f"DEBUG POST data: bruker_id={bruker_id}, planlagt_retur={planlagt_retur}, ski_item_id={ski_item.id}")
-
-            if not bruker_id or not planlagt_retur:
-                messages.error(request, 'Alle felt må fylles ut.')
-                return redirect('skiutlan:ski_item_detalj', item_id=ski_item.id)
-
-            bruker = Bruker.objects.get(id=bruker_id)
-            print(f"DEBUG: Bruker funnet: {bruker}")
-
-            # Konverter dato-string til datetime.date
-            from datetime import datetime
-            planlagt_retur_datetime = datetime.strptime(planlagt_retur, '%Y-%m-%dT%H:%M')
-            print(f"DEBUG: Dato konvertert til: {planlagt_retur_datetime}")
+        bruker_id = request.POST.get('bruker')
+        planlagt_retur = request.POST.get('planlagt_retur')
+        if not bruker_id or not planlagt_retur:
+            messages.error(request, 'Alle felt må fylles ut.')
+            return redirect('skiutlan:ski_item_detalj', item_id=ski_item.id)
 
-            # Sjekk om ski_item allerede er utlånt
-            eksisterende_utlan = Utlan.objects.filter(ski_item=ski_item, returnert_dato__isnull=True)
-            if eksisterende_utlan.exists():
-                existing = eksisterende_utlan.first()
-                messages.error(request, f'{ski_item.navn} er allerede lånt ut til {existing.bruker.fornavn} {existing.bruker.etternavn}!')
-                return redirect('skiutlan:ski_item_detalj', item_id=ski_item.id)
+        try:
+            planlagt_retur = timezone.make_aware(datetime.strptime(planlagt_retur, '%Y-%m-%dT%H:%M'))
+        except ValueError:
+            messages.error(request, 'Ugyldig returdato.')
+            return redirect('skiutlan:ski_item_detalj', item_id=ski_item.id)
 
-            # Lag utlån direkte
-            print(f"DEBUG: Lager utlån med bruker={bruker}, ski_item={ski_item}, planlagt_retur={planlagt_retur_datetime}")
-
-            from django.db import transaction
-            with transaction.atomic():
-                utlan = Utlan(
-                    bruker=bruker,
-                    ski_item=ski_item,
-                    planlagt_retur=planlagt_retur_datetime
-                )
-
-                # Eksplisitt sett utlant_dato
-                from django.utils import timezone
-                utlan.utlant_dato = timezone.now()
-
-                print(f"DEBUG: Før save - alle felter: bruker={utlan.bruker}, ski_item={utlan.ski_item}, planlagt_retur={utlan.planlagt_retur}, utlant_dato={utlan.utlant_dato}")
-
-                try:
-                    utlan.save()
-                    print(f"DEBUG: Save() fullført - ID: {utlan.id}")
-                except Exception as save_error:
-                    print(f"DEBUG: Save() feilet: {save_error}")
-                    raise
-
-                if utlan.id:
-                    # Test at den faktisk er i databasen
-                    test_utlan = Utlan.objects.filter(id=utlan.id).first()
-                    print(f"DEBUG: Test query fra DB: {test_utlan}")
-                else:
-                    print(f"DEBUG: Utlån ble 'lagret' men har ingen ID - dette er et database-problem")
-
-            print(f"DEBUG: Final utlån objekt: {utlan}")
-            messages.success(request, f'Utlån opprettet! {ski_item.navn} er nå lånt ut til {bruker.fornavn}.')
-            return redirect('skiutlan:utlan_liste')
-
-        except Exception as e:
-            import traceback
-            print(f"DEBUG: Exception occurred: {e}")
-            print(f"DEBUG: Traceback: {traceback.format_exc()}")
-            messages.error(request, f'Feil ved lagring: {e}')
+        # Ingen sjekk på forhånd: databasen avviser et nytt utlån hvis itemet
+        # allerede er utlånt, også når to skranker låner ut samtidig.
+        try:
+            tjenester.lan_ut(ski_item.id, bruker_id, planlagt_retur)
+        except tjenester.UtlanFeil as e:
+            messages.error(request, str(e))
             return redirect('skiutlan:ski_item_detalj', item_id=ski_item.id)
 
+        messages.success(request, f'Utlån opprettet! {ski_item.navn} er nå lånt ut.')
+        return redirect('skiutlan:utlan_liste')
+
     # Lag form og inkluder ski_item i queryset
     form = UtlanForm()
     # Sørg for at ski_item er i queryset
@@ -404,27 +533,33 @@ def utlan_opprett_for_item(request, item_id):
     context = {
         'form': form,
         'ski_item': ski_item,
-        'action': f'Lån ut {ski_item.navn}'
+        'action': f'Lån ut {ski_item.navn}',
+        'idempotens_nokkel': idempotens.ny_nokkel(),
     }
 
     return render(request, 'skiutlan/utlan_form.html', context)
 
 
+@idempotens.idempotent
 def utlan_marker_returnert(request, utlan_id):
-    utlan = get_object_or_404(Utlan, id=utlan_id)
+    # Returen er en betinget UPDATE, så en gammel kopi her gjør ingen skade
+    utlan = _hent_eller_404(Utlan, utlan_id)
 
     if utlan.returnert_dato:
         messages.warning(request, 'Utlån er allerede returnert!')
         return redirect('skiutlan:utlan_detalj', utlan_id=utlan_id)
 
     if request.method == 'POST':
-        utlan.returnert_dato = timezone.now()
-        utlan.save()
-        messages.success(request, 'Utlån markert som returnert!')
+        if tjenester.returner_utlan([utlan.id]):
+            messages.success(request, 'Utlån markert som returnert!')
+        else:
+            # Returnert fra en annen skranke i mellomtiden
+            messages.warning(request, 'Utlån er allerede returnert!')
         return redirect('skiutlan:utlan_detalj', utlan_id=utlan_id)
 
     context = {
         'utlan': utlan,
+        'idempotens_nokkel': idempotens.ny_nokkel(),
     }
 
     return render(request, 'skiutlan/utlan_returner_bekreft.html', context)
@@ -446,58 +581,53 @@ def avansert_sok(request):
     brukere = []
     utlan = []
 
+    # Filtrene lages i sok.py, slik at lagrede søk gir det samme
+    spesifikasjon = sok.normaliser(request.GET)
+    har_sokt = bool(spesifikasjon)
+
     #bare om det er noe som blir søkt
-    if any([sok_tekst, ski_type, tilstand, utlan_status, dato_fra, dato_til]):
+    if har_sokt:
+        lokasjon_id = lokasjoner.aktiv_lokasjon_id(request)
+        if lokasjon_id is not None:
+            spesifikasjon['lokasjon'] = lokasjon_id
 
         # søk i ski-items
-        ski_items_qs = SkiItem.objects.all()
-        if sok_tekst:
-            ski_items_qs = ski_items_qs.filter(
-                Q(navn__icontains=sok_tekst) |
-                Q(type_ski__icontains=sok_tekst)
-            )
-        if ski_type:
-            ski_items_qs = ski_items_qs.filter(type_ski=ski_type)
-        if tilstand:
-            ski_items_qs = ski_items_qs.filter(tilstand=tilstand)
-        ski_items = ski_items_qs[:20]
-
-        
+        ski_items = SkiItem.objects.filter(sok.ski_item_filter(spesifikasjon))[:20]
+
         # søk i brukere
-        if sok_tekst:
-            brukere = Bruker.objects.filter(
-                Q(fornavn__icontains=sok_tekst) |
-                Q(etternavn__icontains=sok_tekst) |
-                Q(telefon__icontains=sok_tekst) | 
-                Q(epost__icontains=sok_tekst)
-            )[:20]
-
-        # søk i utlan
-        utlan_qs = Utlan.objects.all()
-        if sok_tekst:
-            utlan_qs = utlan_qs.filter(
-                Q(bruker__fornavn__icontains=sok_tekst) |
-                Q(bruker__etternavn__icontains=sok_tekst) |
-                Q(ski_item__navn__icontains=sok_tekst)
-            )
+        if 'sok_tekst' in spesifikasjon:
+            brukere = Bruker.objects.filter(sok.bruker_filter(spesifikasjon))[:20]
+
+        # søk i utlan (tekst-, type- og datofiltrene gjelder også arkivet)
+        utlan_filter = sok.utlan_filter(spesifikasjon)
+        dato_fra_obj = date.fromisoformat(spesifikasjon['dato_fra']) if 'dato_fra' in spesifikasjon else None
+
+        na = timezone.now()
+        utlan_qs = Utlan.objects.filter(utlan_filter).med_tidsberegninger(na)
         if utlan_status == 'aktive':
-            utlan_qs = utlan_qs.filter(returnert_dato__isnull=True)
+            utlan_qs = utlan_qs.aktive()
         elif utlan_status == 'returnerte':
             utlan_qs = utlan_qs.filter(returnert_dato__isnull=False)
         elif utlan_status == 'forsinket':
-            utlan_qs = utlan_qs.filter(returnert_dato__isnull=True, planlagt_retur__lt=timezone.now())
-
-        # Dato filtrering
-        if dato_fra:
-            from datetime import datetime
-            dato_fra_obj = datetime.strptime(dato_fra, '%Y-%m-%d').date()
-            utlan_qs = utlan_qs.filter(utlant_dato__date__gte=dato_fra_obj)
-        if dato_til:
-            from datetime import datetime
-            dato_til_obj = datetime.strptime(dato_til, '%Y-%m-%d').date()
-            utlan_qs = utlan_qs.filter(utlant_dato__date__lte=dato_til_obj)
-
-        utlan = utlan_qs.order_by('returnert_dato', '-utlant_dato')[:20]
+            utlan_qs = utlan_qs.forsinket(na=na)
+
+        sortering = ('returnert_dato', '-utlant_dato')
+        if utlan_status == 'forsinket':
+            # Mest forsinket først
+            utlan_qs = utlan_qs.order_by('planlagt_retur')
+        else:
+            utlan_qs = utlan_qs.order_by(*sortering)
+        utlan = list(utlan_qs.select_related('bruker', 'ski_item')[:20])
+
+        # Arkivet har bare returnerte utlån eldre enn arkivgrensen
+        if utlan_status in ('', 'returnerte') and trenger_arkiv(dato_fra_obj):
+            arkivert = UtlanArkiv.objects.filter(utlan_filter).select_related('bruker', 'ski_item')
+            utlan += list(arkivert.order_by(*sortering)[:20])
+            # Samme rekkefølge som sortering gir i databasen (aktive først)
+            utlan.sort(key=lambda u: (u.returnert_dato is not None,
+                                      u.returnert_dato.timestamp() if u.returnert_dato else 0,
+                                      -u.utlant_dato.timestamp()))
+            utlan = utlan[:20]
 
 
     context = {
@@ -512,36 +642,220 @@ def avansert_sok(request):
         'dato_fra': dato_fra,
         'dato_til': dato_til,
 
-        'har_sokt': any([sok_tekst, ski_type, tilstand, utlan_status, dato_fra, dato_til]),
+        'har_sokt': har_sokt,
         'totale_resultater': len(ski_items) + len(brukere) + len(utlan)
     }
 
     return render(request, 'skiutlan/avansert_sok.html', context)
 
 
+# ============================================================================
+# LAGREDE SØK (treffene holdes oppdatert av sok.py)
+# ============================================================================
+
+LAGRET_SOK_VIS = 50
+
+
+def lagret_sok(request):
+    """Lagrede søk med antall treff. POST lagrer søket fra avansert_sok."""
+    if request.method == 'POST':
+        spesifikasjon = sok.normaliser(request.POST, lokasjoner.aktiv_lokasjon_id(request))
+        navn = request.POST.get('navn', '').strip()[:100]
+        if not spesifikasjon.keys() - {'lokasjon'} or not navn:
+            messages.error(request, 'Gi søket et navn og minst ett filter.')
+            return redirect('skiutlan:avansert_sok')
+        lagret, opprettet = sok.lagre(navn, spesifikasjon)
+        if opprettet:
+            messages.success(request, f'Søket "{navn}" er lagret.')
+        else:
+            messages.info(request, f'Søket er allerede lagret som "{lagret.navn}".')
+        return redirect('skiutlan:lagret_sok_detalj', sok_id=lagret.id)
+
+    na = timezone.now()
+    context = {
+        'sokene': [{**s, 'antall': sok.antall_treff(s, na)} for s in sok.meny()],
+    }
+    return render(request, 'skiutlan/lagret_sok_liste.html', context)
+
+
+def lagret_sok_detalj(request, sok_id):
+    lagret = get_object_or_404(LagretSok, id=sok_id)
+    spesifikasjon = lagret.spesifikasjon
+
+    if spesifikasjon.get('utlan_status') == 'forsinket':
+        utlan_ids = sok.forsinkede_utlan_ids(lagret)
+        utlan = list(Utlan.objects.filter(id__in=utlan_ids[:LAGRET_SOK_VIS]).order_by('planlagt_retur')
+                     .select_related('bruker', 'ski_item')) if utlan_ids else []
+    else:
+        utlan_ids = lagret.utlan_ids
+        utlan = []
+        if utlan_ids:
+            vis_ids = utlan_ids[-LAGRET_SOK_VIS:]
+            utlan = list(Utlan.objects.filter(id__in=vis_ids).select_related('bruker', 'ski_item'))
+            if len(utlan) < len(vis_ids):
+                # Resten er flyttet til arkivet
+                utlan += UtlanArkiv.objects.filter(id__in=vis_ids).select_related('bruker', 'ski_item')
+            utlan.sort(key=lambda u: u.utlant_dato, reverse=True)
+
+    context = {
+        'lagret': lagret,
+        'ski_items': SkiItem.objects.filter(id__in=lagret.ski_item_ids[:LAGRET_SOK_VIS]) if lagret.ski_item_ids else [],
+        'brukere': Bruker.objects.filter(id__in=lagret.bruker_ids[:LAGRET_SOK_VIS]) if lagret.bruker_ids else [],
+        'utlan': utlan,
+        'antall_ski_items': len(lagret.ski_item_ids),
+        'antall_brukere': len(lagret.bruker_ids),
+        'antall_utlan': len(utlan_ids),
+        'vis': LAGRET_SOK_VIS,
+        # Lenke til det samme søket i avansert_sok (lokasjonen velges i menyen)
+        'sok_parametre': urlencode({k: v for k, v in spesifikasjon.items() if k != 'lokasjon'}),
+        'lokasjon': dict(lokasjoner.alle()).get(spesifikasjon.get('lokasjon')),
+    }
+    return render(request, 'skiutlan/lagret_sok_detalj.html', context)
+
+
+@require_POST
+def lagret_sok_oppdater(request, sok_id):
+    """Kjører hele søket på nytt (treffene holdes ellers oppdatert fortløpende)."""
+    lagret = get_object_or_404(LagretSok, id=sok_id)
+    sok.beregn(lagret)
+    messages.success(request, f'Søket "{lagret.navn}" er kjørt på nytt.')
+    return redirect('skiutlan:lagret_sok_detalj', sok_id=lagret.id)
+
+
+@require_POST
+def lagret_sok_slett(request, sok_id):
+    lagret = get_object_or_404(LagretSok, id=sok_id)
+    lagret.delete()
+    messages.success(request, f'Søket "{lagret.navn}" er slettet.')
+    return redirect('skiutlan:lagret_sok')
+
+
+# Treffene i hurtigsøket: (overskrift, URL-navn) per type i indeksen
+HURTIG_SOK_TYPER = {
+    'ski_item': ('Ski-utstyr', 'skiutlan:ski_item_detalj'),
+    'bruker': ('Brukere', 'skiutlan:bruker_detalj'),
+    'utlan': ('Aktive utlån', 'skiutlan:utlan_detalj'),
+}
+
+
+def hurtig_sok(request):
+    """Søkeboksen i menyen: treff i items, brukere og aktive utlån, gruppert, som JSON."""
+    sporring = request.GET.get('q', '')[:100]
+    resultat = sokeindeks.finn(sporring, lokasjon_id=lokasjoner.aktiv_lokasjon_id(request),
+                               budsjett_ms=settings.SKIUTLAN_HURTIGSOK_MS)
+    grupper = []
+    for type_, treff in resultat['grupper']:
+        overskrift, url_navn = HURTIG_SOK_TYPER[type_]
+        grupper.append({
+            'type': type_,
+            'overskrift': overskrift,
+            'treff': [{**t, 'url': reverse(url_navn, args=[t['id']])} for t in treff],
+        })
+    return JsonResponse({
+        'q': sporring,
+        'grupper': grupper,
+        'ufullstendig': resultat['ufullstendig'],
+        # Lenke til avansert søk for alle treffene
+        'alle': f"{reverse('skiutlan:avansert_sok')}?{urlencode({'sok_tekst': sporring})}",
+    })
 
 
 def rapporter(request):
+    utlan = _for_lokasjon(request, Utlan.objects.all())
     context = {
-        'totalt_ski_items': SkiItem.objects.count(),
+        'totalt_ski_items': _for_lokasjon(request, SkiItem.objects.all()).count(),
         'totalt_brukere': Bruker.objects.count(),
-        'aktive_utlan': Utlan.objects.filter(returnert_dato__isnull=True).count(),
-        'forsinket_utlan': Utlan.objects.filter(
+        'aktive_utlan': utlan.filter(returnert_dato__isnull=True).count(),
+        'forsinket_utlan': utlan.filter(
             returnert_dato__isnull=True,
             planlagt_retur__lt=timezone.now()
         ).count(),
     }
 
+    # Ledige items per type ved åpningstid de neste 14 dagene
+    storrelse_fra = _heltall(request.GET.get('storrelse_fra'))
+    storrelse_til = _heltall(request.GET.get('storrelse_til'))
+    datoer, ledige = prognose.daglig_prognose(
+        dager=14, storrelse_fra=storrelse_fra, storrelse_til=storrelse_til,
+        lokasjon_id=lokasjoner.aktiv_lokasjon_id(request))
+    context['prognose'] = {
+        'datoer': datoer,
+        'klokkeslett': prognose.APNINGSTID,
+        'storrelse_fra': storrelse_fra,
+        'storrelse_til': storrelse_til,
+        'rader': [(navn, ledige[verdi]) for verdi, navn in SkiItem.SKI_TYPES if verdi in ledige],
+    }
+
     return render(request, 'skiutlan/rapporter.html', context)
 
 
+def rapport_populaere(request):
+    """
+    De mest utlånte items og størrelsene per type i sesongen (eller
+    ?fra=...&til=..., til er inklusiv), med ?k plasser per type.
+    ?format=csv gir det samme som regneark.
+    """
+    fra, til = populaere.sesong()
+    # Ugyldige datoer, også umulige som 2025-02-30, gir sesongen
+    fra = _dato(request.GET.get('fra')) or fra
+    til = _dato(request.GET.get('til')) or til - timedelta(days=1)
+    k = min(max(_heltall(request.GET.get('k')) or populaere.STANDARD_K, 1), populaere.MAKS_K)
+    typer = populaere.topp(fra, til + timedelta(days=1), k, lokasjoner.aktiv_lokasjon_id(request))
+
+    if request.GET.get('format') == 'csv':
+        respons = HttpResponse(content_type='text/csv; charset=utf-8')
+        respons['Content-Disposition'] = f'attachment; filename="populaere_{fra}_{til}.csv"'
+        # BOM og semikolon, slik at norsk Excel åpner filen riktig
+        respons.write('\ufeff')
+        skriver = csv.writer(respons, delimiter=';')
+        skriver.writerow(['Type', 'Liste', 'Plass', 'Navn', 'Størrelse', 'Utlån'])
+        for type_ in typer:
+            for item in type_['items']:
+                skriver.writerow([type_['navn'], 'Item', item['plass'], item['navn'],
+                                  f"{item['storrelse']} {type_['enhet']}", item['antall']])
+            for storrelse in type_['storrelser']:
+                skriver.writerow([type_['navn'], 'Størrelse', storrelse['plass'], '',
+                                  f"{storrelse['storrelse']} {type_['enhet']}", storrelse['antall']])
+        return respons
+
+    context = {
+        'typer': typer,
+        'fra': fra,
+        'til': til,
+        'k': k,
+        'csv_parametre': urlencode({'fra': fra.isoformat(), 'til': til.isoformat(), 'k': k, 'format': 'csv'}),
+    }
+    return render(request, 'skiutlan/rapport_populaere.html', context)
+
+
+# ============================================================================
+# LOKASJON
+# ============================================================================
+
+@require_POST
+def velg_lokasjon(request):
+    """Velger lokasjonen skranken jobber på (tom verdi gir alle lokasjoner)."""
+    try:
+        lokasjon_id = int(request.POST.get('lokasjon', ''))
+    except ValueError:
+        lokasjon_id = None
+
+    neste = request.POST.get('neste', '')
+    if not url_has_allowed_host_and_scheme(neste, allowed_hosts={request.get_host()},
+                                           require_https=request.is_secure()):
+        neste = 'skiutlan:hjem'
+    respons = redirect(neste)
+    lokasjoner.velg(respons, lokasjon_id)
+    return respons
+
+
 # ============================================================================
 # API ENDPOINTS (for AJAX kall)
 # ============================================================================
 
 def api_ski_item_tilgjengelighet(request, item_id):
     try:
-        ski_item = get_object_or_404(SkiItem, id=item_id)
+        ski_item = _hent_eller_404(SkiItem, item_id)
         return JsonResponse({
             'ledig': not Utlan.objects.filter(ski_item=ski_item, returnert_dato__isnull=True).exists(),
             'navn': ski_item.navn
@@ -550,6 +864,97 @@ def api_ski_item_tilgjengelighet(request, item_id):
         return JsonResponse({'error': str(e)}, status=400)
 
 
+def _heltall(verdi):
+    try:
+        return int(verdi)
+    except (TypeError, ValueError):
+        return None
+
+
+def _dato(verdi):
+    try:
+        return parse_date(verdi or '')
+    except ValueError:
+        return None
+
+
+def _tidspunkt(verdi):
+    """Tolker en ISO-dato eller -tid fra en query-parameter. Datoer gir midnatt lokal tid."""
+    tidspunkt = parse_datetime(verdi)
+    if tidspunkt is None:
+        dato = parse_date(verdi)
+        if dato is None:
+            raise ValueError(verdi)
+        tidspunkt = datetime.combine(dato, datetime.min.time())
+    if timezone.is_naive(tidspunkt):
+        tidspunkt = timezone.make_aware(tidspunkt)
+    return tidspunkt
+
+
+def api_tilgjengelighet(request):
+    """
+    Tidslinje for antall ledige items av en type og i et størrelsesintervall.
+
+    GET type_ski, storrelse_fra, storrelse_til (cm), fra og til (ISO-dato
+    eller -tid, standard nå og 14 dager frem), og eventuelt tidspunkt for å
+    få antall ledige akkurat da. Gjelder valgt lokasjon.
+    """
+    na = timezone.now()
+    try:
+        fra = _tidspunkt(request.GET['fra']) if request.GET.get('fra') else na
+        til = _tidspunkt(request.GET['til']) if request.GET.get('til') else fra + timedelta(days=14)
+        tidspunkt = _tidspunkt(request.GET['tidspunkt']) if request.GET.get('tidspunkt') else None
+    except ValueError as e:
+        return JsonResponse({'error': f'Ugyldig tidspunkt: {e}'}, status=400)
+    if til < fra:
+        return JsonResponse({'error': 'til må være etter fra.'}, status=400)
+    if tidspunkt is not None:
+        fra, til = min(fra, tidspunkt), max(til, tidspunkt)
+
+    type_ski = request.GET.get('type_ski') or None
+    if type_ski is not None and type_ski not in dict(SkiItem.SKI_TYPES):
+        return JsonResponse({'error': f'Ukjent type_ski: {type_ski}'}, status=400)
+
+    linje = prognose.tidslinje(
+        fra, til, type_ski=type_ski,
+        storrelse_fra=_heltall(request.GET.get('storrelse_fra')),
+        storrelse_til=_heltall(request.GET.get('storrelse_til')),
+        lokasjon_id=lokasjoner.aktiv_lokasjon_id(request))
+    svar = {
+        'fra': fra.isoformat(),
+        'til': til.isoformat(),
+        'totalt': linje['totalt'],
+        'utlant': linje['utlant'],
+        'forsinket': linje['forsinket'],
+        'tidslinje': [{'fra': t.isoformat(), 'ledige': ledige} for t, ledige in linje['punkter']],
+    }
+    if tidspunkt is not None:
+        svar['tidspunkt'] = tidspunkt.isoformat()
+        svar['ledige'] = prognose.ledige_ved(linje['punkter'], tidspunkt)
+    return JsonResponse(svar)
+
+
+def api_statistikk(request):
+    """
+    Nøkkeltall for veggskjermer: antall items, ledige per type, aktive og
+    forsinkede utlån og dagens utlån og returer. Fra cachen, så tallene kan
+    være opptil SKIUTLAN_STATISTIKK_SEKUNDER gamle.
+
+    Gjelder ?lokasjon=<id>, ellers valgt lokasjon.
+    """
+    lokasjon_id = _heltall(request.GET.get('lokasjon'))
+    if lokasjon_id is None or lokasjon_id not in dict(lokasjoner.alle()):
+        lokasjon_id = lokasjoner.aktiv_lokasjon_id(request)
+    respons = JsonResponse(statistikk.hent(lokasjon_id))
+    patch_cache_control(respons, max_age=settings.SKIUTLAN_STATISTIKK_SEKUNDER)
+    return respons
+
+
+def api_objektcache(request):
+    """Treff, bom og treffrate per modell i objektcachen, for denne prosessen."""
+    return JsonResponse(hurtigbuffer.objekt_statistikk())
+
+
 def api_sok_brukere(request):
     sok_tekst = request.GET.get('q', '')
     if sok_tekst:
@@ -571,3 +976,164 @@ def api_sok_brukere(request):
         return JsonResponse({'results': results})
 
     return JsonResponse({'results': []})
+
+
+# ============================================================================
+# SKANNING (retur med strekkode-/QR-leser)
+# ============================================================================
+
+def _skannede_koder(request):
+    """Kodene i en innsjekk: JSON {"koder": [...]} eller skjemafeltet koder (én per linje)."""
+    if request.content_type == 'application/json':
+        try:
+            koder = json.loads(request.body).get('koder', [])
+        except (ValueError, AttributeError):
+            return None
+        return koder if isinstance(koder, list) else None
+    return request.POST.get('koder', '').split()
+
+
+def _returner_koder(koder):
+    """
+    Returnerer items for en liste skannede koder i én transaksjon.
+
+    Gir ett resultat per kode, i samme rekkefølge. status er 'returnert',
+    'ikke_utlant', 'ukjent' (ingen ski-item med koden) eller 'ugyldig'.
+    """
+    ids = [tjenester.tolk_kode(kode) for kode in koder]
+    with transaction.atomic():
+        returnert = tjenester.returner([i for i in ids if i is not None])
+        # Bare koder som ikke ga retur trenger et ekstra oppslag
+        ukjente = {i for i in ids if i is not None and i not in returnert}
+        finnes = set(SkiItem.objects.filter(id__in=ukjente).values_list('id', flat=True)) if ukjente else set()
+
+    na = timezone.now()
+    resultater = []
+    sett = set()
+    for kode, item_id in zip(koder, ids):
+        resultat = {'kode': kode, 'ski_item_id': item_id}
+        if item_id is None:
+            resultat['status'] = 'ugyldig'
+        elif item_id in returnert and item_id not in sett:
+            utlan = returnert[item_id]
+            resultat.update(status='returnert', utlan_id=utlan.id, forsinket=utlan.planlagt_retur < na)
+        elif item_id in returnert or item_id in finnes:
+            # Samme kode skannet to ganger i samme innsjekk gir bare én retur
+            resultat['status'] = 'ikke_utlant'
+        else:
+            resultat['status'] = 'ukjent'
+        if item_id is not None:
+            sett.add(item_id)
+        resultater.append(resultat)
+    return resultater
+
+
+SKANN_HTTP_STATUS = {'returnert': 200, 'ikke_utlant': 409, 'ukjent': 404, 'ugyldig': 400}
+
+
+@require_POST
+@idempotens.idempotent
+def api_skann_retur(request):
+    """Returnerer itemet med den skannede koden (POST kode=SKI-000123)."""
+    resultat = _returner_koder([request.POST.get('kode', '')])[0]
+    return JsonResponse(resultat, status=SKANN_HTTP_STATUS[resultat['status']])
+
+
+@require_POST
+@idempotens.idempotent
+def api_innsjekk(request):
+    """Masseinnsjekk av en liste skannede koder, med ett resultat per kode."""
+    koder = _skannede_koder(request)
+    if koder is None:
+        return JsonResponse({'error': 'Forventet {"koder": [...]}.'}, status=400)
+    resultater = _returner_koder(koder)
+    return JsonResponse({
+        'returnert': sum(1 for r in resultater if r['status'] == 'returnert'),
+        'resultater': resultater,
+    })
+
+
+def api_endringer(request):
+    """
+    Endringsstrømmen for kioskene (se endringer.py): ski-items, brukere og
+    utlån endret etter ?etter=<markør>, opptil ?antall per svar. Uten
+    markør begynner strømmen fra starten. Kiosken spør igjen med markøren
+    fra svaret så lenge flere er sann, og begynner på nytt uten markør når
+    den får 400 (f.eks. etter at databasen er gjenopprettet).
+    """
+    epoke = endringer.gjeldende_epoke()
+    etter = endringer.les_markor(request.GET.get('etter', ''), epoke)
+    if etter is None:
+        return JsonResponse({'error': 'Ugyldig markør. Synkroniser på nytt uten etter.'}, status=400)
+    antall = min(max(_heltall(request.GET.get('antall')) or endringer.STANDARD_ANTALL, 1), endringer.MAKS_ANTALL)
+    liste, markor, flere = endringer.hent(etter, antall, epoke)
+    return JsonResponse({'endringer': liste, 'markor': markor, 'flere': flere})
+
+
+# ============================================================================
+# ETIKETTER (QR-kode og strekkode, se etiketter.py)
+# ============================================================================
+
+# Kodene for et item endres aldri, så nettleseren kan beholde dem lenge
+KODE_MAKS_ALDER = 60 * 60 * 24 * 30
+
+
+def _undertekst(type_ski, storrelse):
+    enhet = 'EU' if type_ski == 'stovler' else 'cm'
+    return f'{dict(SkiItem.SKI_TYPES).get(type_ski, type_ski)} {storrelse} {enhet}'
+
+
+def generer_qr_kode(request, item_id):
+    """QR-koden (eller ?type=code128) for etikettkoden til et item, som SVG eller ?format=png."""
+    format_ = request.GET.get('format', 'svg')
+    if format_ not in etiketter.FORMATER:
+        return HttpResponse('Ukjent format.', status=400)
+    if not SkiItem.objects.filter(id=item_id).exists():
+        raise Http404('Ski-item finnes ikke.')
+
+    kode = tjenester.ski_item_kode(item_id)
+    lag = etiketter.strekkode if request.GET.get('type') == 'code128' else etiketter.qr_kode
+    respons = HttpResponse(lag(kode, format_), content_type=etiketter.FORMATER[format_])
+    patch_cache_control(respons, max_age=KODE_MAKS_ALDER)
+    return respons
+
+
+def ski_item_qr_kode(request, item_id):
+    """Etiketten til ett item (70 x 37 mm SVG) med QR-kode, navn, type og strekkode."""
+    rad = SkiItem.objects.filter(id=item_id).values_list('navn', 'type_ski', 'storrelse').first()
+    if rad is None:
+        raise Http404('Ski-item finnes ikke.')
+    navn, type_ski, storrelse = rad
+    svg = etiketter.etikett(tjenester.ski_item_kode(item_id), navn, _undertekst(type_ski, storrelse))
+    return HttpResponse(svg, content_type='image/svg+xml')
+
+
+def etikett_ark(request):
+    """
+    Utskriftsvennlige etikettark (A4, 3 x 8 etiketter) for items på valgt
+    lokasjon, eventuelt bare ?type=... eller ?ids=1,2,3. Siden strømmes ark
+    for ark, så utskrift av tusenvis av items starter med en gang; etiketter
+    som ikke er laget før genereres i parallell (etiketter.ark()).
+    """
+    ski_items = _for_lokasjon(request, SkiItem.objects.all())
+    type_filter = request.GET.get('type', '')
+    if type_filter:
+        ski_items = ski_items.filter(type_ski=type_filter)
+    ids = [i for i in map(_heltall, request.GET.get('ids', '').split(',')) if i is not None]
+    if ids:
+        ski_items = ski_items.filter(id__in=ids)
+
+    # Hentes før strømmingen starter, så databasen ikke holdes mens arkene lages
+    liste = [
+        (tjenester.ski_item_kode(item_id), navn, _undertekst(type_ski, storrelse))
+        for item_id, navn, type_ski, storrelse
+        in ski_items.values_list('id', 'navn', 'type_ski', 'storrelse')
+    ]
+
+    def innhold():
+        yield render_to_string('skiutlan/etikett_ark.html', {'delen': 'start', 'antall': len(liste)})
+        for side in etiketter.ark(liste):
+            yield '<section class="ark">' + ''.join(f'<div class="etikett">{svg}</div>' for svg in side) + '</section>\n'
+        yield render_to_string('skiutlan/etikett_ark.html', {'delen': 'slutt'})
+
+    return StreamingHttpResponse(innhold(), content_type='text/html; charset=utf-8')
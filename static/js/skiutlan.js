@@ -0,0 +1,109 @@
+/*
+ * Felles JavaScript for skiutlån-systemet (lastes fra base.html).
+ */
+
+// TODO for gruppen: Legg til custom JavaScript funksjoner
+
+// Eksempel: Automatisk skjul success meldinger etter 5 sekunder
+document.addEventListener('DOMContentLoaded', function() {
+    setTimeout(function() {
+        var alerts = document.querySelectorAll('.alert-success');
+        alerts.forEach(function(alert) {
+            var bsAlert = new bootstrap.Alert(alert);
+            bsAlert.close();
+        });
+    }, 5000);
+});
+
+// Hurtigsøket i menyen (skjemaet med data-hurtigsok, se skiutlan/sokeindeks.py).
+// Søker når brukeren har sluttet å skrive en liten stund, og avbryter
+// forrige forespørsel, så gamle svar aldri overskriver nye.
+document.addEventListener('DOMContentLoaded', function() {
+    var skjema = document.querySelector('form[data-hurtigsok]');
+    if (!skjema) {
+        return;
+    }
+    var felt = skjema.querySelector('input[type=search]');
+    var meny = skjema.querySelector('.dropdown-menu');
+    var VENT_MS = 200;
+    var tidtaker = null;
+    var pagaende = null;
+
+    function skjul() {
+        meny.classList.remove('show');
+    }
+
+    function element(tag, klasse, tekst) {
+        var el = document.createElement(tag);
+        if (klasse) {
+            el.className = klasse;
+        }
+        if (tekst) {
+            el.textContent = tekst;
+        }
+        return el;
+    }
+
+    function vis(svar) {
+        meny.replaceChildren();
+        svar.grupper.forEach(function(gruppe) {
+            meny.appendChild(element('h6', 'dropdown-header', gruppe.overskrift));
+            gruppe.treff.forEach(function(treff) {
+                var lenke = element('a', 'dropdown-item');
+                lenke.href = treff.url;
+                lenke.appendChild(element('div', '', treff.tittel));
+                lenke.appendChild(element('small', 'text-muted', treff.undertittel));
+                meny.appendChild(lenke);
+            });
+        });
+        if (!svar.grupper.length) {
+            meny.appendChild(element('span', 'dropdown-item-text text-muted', 'Ingen treff'));
+        }
+        if (svar.ufullstendig) {
+            meny.appendChild(element('span', 'dropdown-item-text small text-warning', 'Søket ble avbrutt, prøv et lengre søk'));
+        }
+        meny.appendChild(element('div', 'dropdown-divider'));
+        var alle = element('a', 'dropdown-item small', 'Avansert søk etter «' + svar.q + '»');
+        alle.href = svar.alle;
+        meny.appendChild(alle);
+        meny.classList.add('show');
+    }
+
+    function sok() {
+        var q = felt.value.trim();
+        if (pagaende) {
+            pagaende.abort();
+        }
+        if (q.length < 2) {
+            skjul();
+            return;
+        }
+        pagaende = new AbortController();
+        fetch(skjema.dataset.hurtigsok + '?' + new URLSearchParams({q: q}), {signal: pagaende.signal})
+            .then(function(respons) { return respons.json(); })
+            .then(vis)
+            .catch(function(feil) {
+                if (feil.name !== 'AbortError') {
+                    skjul();
+                }
+            });
+    }
+
+    felt.addEventListener('input', function() {
+        clearTimeout(tidtaker);
+        tidtaker = setTimeout(sok, VENT_MS);
+    });
+    felt.addEventListener('keydown', function(hendelse) {
+        if (hendelse.key === 'Escape') {
+            skjul();
+        }
+    });
+    document.addEventListener('click', function(hendelse) {
+        if (!skjema.contains(hendelse.target)) {
+            skjul();
+        }
+    });
+});
+
+// TODO: Legg til AJAX funksjoner for dynamisk oppdatering
+// TODO: Legg til form validering på klient-side